@@ -1,56 +1,205 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Blueprint, Response, jsonify, request, has_request_context
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required , get_jwt , decode_token , get_jwt_identity
-from sqlalchemy import create_engine, DateTime, Column
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import DateTime, Column
 from sqlalchemy.exc import SQLAlchemyError
 from dotenv import load_dotenv
 try:
-    from .models import Base, Role, User, UserProfile, Course, Module, RoleType, Enroll  # Relative import
+    from . import services  # Relative import
 except ImportError:
-    from models import Base, Role, User, UserProfile, Course, Module, RoleType, Enroll  # Direct import for terminal
+    import services  # Direct import for terminal
+try:
+    from .db import Session, session, on_engine_created, route_reads, read_replica, warm_pool, init_app as init_db
+except ImportError:
+    from db import Session, session, on_engine_created, route_reads, read_replica, warm_pool, init_app as init_db
+try:
+    from .replicas import ReplicaPool, StickyReads
+except ImportError:
+    from replicas import ReplicaPool, StickyReads
+try:
+    from .pagination import InvalidCursor, decode_cursor, page_size
+except ImportError:
+    from pagination import InvalidCursor, decode_cursor, page_size
+try:
+    from .search import search_index
+except ImportError:
+    from search import search_index
+try:
+    from .roles import RoleRegistry
+except ImportError:
+    from roles import RoleRegistry
+try:
+    from .cache import CourseCache
+except ImportError:
+    from cache import CourseCache
+try:
+    from .passwords import HashPoolBusy, hash_password, hash_passwords, check_password, needs_rehash, warm_up as warm_up_hashing
+except ImportError:
+    from passwords import HashPoolBusy, hash_password, hash_passwords, check_password, needs_rehash, warm_up as warm_up_hashing
+try:
+    from .etags import EntityValidators
+except ImportError:
+    from etags import EntityValidators
+try:
+    from .jobs import JobQueue
+except ImportError:
+    from jobs import JobQueue
+try:
+    from .certificates import CertificatesBusy, issue_certificates, stats as certificate_stats
+except ImportError:
+    from certificates import CertificatesBusy, issue_certificates, stats as certificate_stats
+try:
+    from .events import CourseEvents
+except ImportError:
+    from events import CourseEvents
+try:
+    from .exports import EXPORT_FORMATS, export_chunks
+except ImportError:
+    from exports import EXPORT_FORMATS, export_chunks
+try:
+    from .ratelimit import RateLimited, RateLimiter
+except ImportError:
+    from ratelimit import RateLimited, RateLimiter
+try:
+    from .revocation import RevocationFilter
+except ImportError:
+    from revocation import RevocationFilter
+try:
+    from .token_registry import TokenRegistry
+except ImportError:
+    from token_registry import TokenRegistry
+try:
+    from .media import MediaSigner, create_storage
+except ImportError:
+    from media import MediaSigner, create_storage
+try:
+    from .metrics import METRICS_ENABLED, PROMETHEUS_CONTENT_TYPE, registry as metrics_registry, authorized as metrics_authorized, instrument_engine, instrument_redis, init_app as init_metrics
+except ImportError:
+    from metrics import METRICS_ENABLED, PROMETHEUS_CONTENT_TYPE, registry as metrics_registry, authorized as metrics_authorized, instrument_engine, instrument_redis, init_app as init_metrics
+try:
+    from .progress import ProgressAccessCache, ProgressRecorder, ProgressFlusher, heartbeat_event, PROGRESS_FLUSH_IN_PROCESS
+except ImportError:
+    from progress import ProgressAccessCache, ProgressRecorder, ProgressFlusher, heartbeat_event, PROGRESS_FLUSH_IN_PROCESS
 
 from datetime import timedelta , datetime , timezone
-import bcrypt
 import os
 import redis
 import hashlib
+import threading
+import time
 
 
 ######################################################## INITIALIZATION #######################################################################
 # Load environment variables from .env file
 load_dotenv()
 
-# Initialize Redis
+JWT_ACCESS_TOKEN_EXPIRES = timedelta(days=60)
+
+# Connections GET /ready opens in the pool before the instance takes traffic
+DB_POOL_WARM = int(os.getenv("DB_POOL_WARM", 4))
+
+# Initialize Redis (redis-py connects on the first command, not here)
 redis_client = redis.StrictRedis(host='localhost', port=6379, db=0, decode_responses=True)
 
-# Initialize Flask app
-app = Flask(__name__)
+# Per request database/Redis/bcrypt numbers for GET /metrics (see metrics.py), the engine is instrumented when it
+# is created (on first use, see db.py)
+if METRICS_ENABLED:
+    instrument_redis(redis_client)
+    on_engine_created(instrument_engine)
+
+# roles rows (RoleType <-> id) kept in memory, so routes don't query or join the roles table (see roles.py)
+role_registry = RoleRegistry(redis_client, Session)
+
+# Read-through cache for course catalog and course content (versioned keys per course)
+course_cache = CourseCache(redis_client)
+
+# ETag / Last-Modified per course and user, so clients that poll can revalidate with a 304 (see etags.py)
+entity_validators = EntityValidators(redis_client)
+
+# Local copy of the revoked token ids, kept in sync over Redis pub/sub
+revocation_filter = RevocationFilter(redis_client)
+
+# Progress heartbeats go to a Redis stream, the flusher writes them to the database in batches (see progress.py)
+progress_recorder = ProgressRecorder(redis_client)
+progress_flusher = ProgressFlusher(redis_client, Session)
+progress_access = ProgressAccessCache()
+
+# Token buckets per device and account for login/register, so bcrypt CPU can't be taken by one client (see ratelimit.py)
+rate_limiter = RateLimiter(redis_client)
+
+# Active token per device, lives as long as the access tokens do
+token_registry = TokenRegistry(redis_client, revocation_filter, JWT_ACCESS_TOKEN_EXPIRES)
+
+# Module videos: signed URLs (HMAC, short lived) served from the media storage (see media.py)
+media_signer = MediaSigner(os.getenv("MEDIA_SIGNING_KEY") or os.getenv("JWT_SECRET_KEY"))
+media_storage = create_storage()
+
+# Tokens to open a course event stream from a browser (see events.py), own key so they can't be used as media signatures
+signing_key = os.getenv("MEDIA_SIGNING_KEY") or os.getenv("JWT_SECRET_KEY")
+stream_signer = MediaSigner(signing_key + ":course-events" if signing_key else None)
+
+# The counters the cache, revocation filter and progress flusher already keep, next to the request timings
+metrics_registry.register_collector("course_cache", course_cache.stats)
+metrics_registry.register_collector("revocation_filter", revocation_filter.stats)
+metrics_registry.register_collector("progress_flusher", progress_flusher.stats)
+metrics_registry.register_collector("rate_limiter", rate_limiter.stats)
+
+# Search without PostgreSQL: the in-memory index of each process is rebuilt when another one changed courses (see search.py)
+search_index.share(redis_client)
+metrics_registry.register_collector("search_index", search_index.stats)
 
-# PostgreSQL database configuration (loaded from .env file)
-ADMIN_INVITE_CODE = os.getenv("ADMIN_INVITE_CODE", "secret_code") 
+# Read replicas (SQLALCHEMY_REPLICA_URIS) for GET requests, a user that just wrote reads from the primary (see replicas.py)
+replica_pool = ReplicaPool()
+sticky_reads = StickyReads(redis_client)
+metrics_registry.register_collector("replicas", replica_pool.stats)
 
-app.config['JWT_SECRET_KEY'] = os.getenv("JWT_SECRET_KEY")
-app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(days=60)
+# Slow side effects (notifications) are queued in Redis and run by `python api/jobs.py` workers (see jobs.py)
+job_queue = JobQueue(redis_client)
+metrics_registry.register_collector("jobs", job_queue.stats)
 
-# Initialize JWT manager
-jwt = JWTManager(app)
+# Course completion certificates, rendered in a process pool and kept in the media storage (see certificates.py)
+metrics_registry.register_collector("certificates", certificate_stats)
 
-# Create SQLAlchemy engine and session
-engine = create_engine(os.getenv("SQLALCHEMY_DATABASE_URI"), echo=True)
-Session = sessionmaker(bind=engine)
-session = Session()
+# Course updates published for the event streams (GET /courses/<id>/events is served by asgi.py, see events.py)
+course_events = CourseEvents(redis_client)
+metrics_registry.register_collector("course_events", course_events.stats)
 
-# Create database tables if they don't exist
-Base.metadata.create_all(engine)
+# JWT manager, attached to the app in create_app()
+jwt = JWTManager()
+
+# Every route is on this blueprint, create_app() registers it on the app
+bp = Blueprint('api', __name__)
+
+
+def create_app(config=None):
+    # Application factory, e.g: gunicorn "api.api:create_app()"
+    # Nothing here connects to the database or Redis: the engine and the connections are created on first use and
+    # GET /ready warms them. Tables are created by create_db.py, not by the app.
+    app = Flask(__name__)
+    app.config['JWT_SECRET_KEY'] = os.getenv("JWT_SECRET_KEY")
+    app.config['JWT_ACCESS_TOKEN_EXPIRES'] = JWT_ACCESS_TOKEN_EXPIRES
+    # The identity (sub) is a dict {"user_name", "role"}: with PyJWT >= 2.10 Flask-JWT-Extended >= 4.7.1 rejects a sub
+    # that is not a string unless this is off (older versions don't check it and ignore the setting)
+    app.config['JWT_VERIFY_SUB'] = False
+    app.config.update(config or {})
+
+    jwt.init_app(app)
+
+    # Open a scoped session per request and release it on teardown (engine and pool are configured in db.py)
+    init_db(app)
+
+    # Request timings per route (see metrics.py)
+    init_metrics(app)
+
+    app.register_blueprint(bp)
+    return app
 
 
 @jwt.token_in_blocklist_loader
 def check_if_token_in_blocklist(jwt_header, jwt_payload):
     jti = jwt_payload['jti']
-    user_name = jwt_payload['sub']['user_name']  # Extract user_name from the JWT payload
 
-    # Check if the jti is in the Redis set for this user
-    return redis_client.sismember(f"revoked_tokens:{user_name}", jti)
+    # Check the local revocation filter, it only asks Redis when it is not in sync
+    return revocation_filter.is_revoked(jti)
 
 @jwt.revoked_token_loader
 def revoked_token_response(jwt_header, jwt_payload):
@@ -60,6 +209,23 @@ def revoked_token_response(jwt_header, jwt_payload):
 def expired_token_response(jwt_header, jwt_payload):
     return jsonify({"message": "Your session has expired. Please log in again."}), 401
 
+@bp.app_errorhandler(HashPoolBusy)
+def hash_pool_busy_response(error):
+    # Shed load fast instead of queueing more bcrypt work
+    return jsonify({"message": "Server is busy, please try again shortly."}), 503, {"Retry-After": "1"}
+
+@bp.app_errorhandler(CertificatesBusy)
+def certificates_busy_response(error):
+    return jsonify({"message": "Server is busy, please try again shortly."}), 503, {"Retry-After": "5"}
+
+@bp.app_errorhandler(RateLimited)
+def rate_limited_response(error):
+    return jsonify({"message": "Too many attempts, please try again later."}), 429, error.headers()
+
+@bp.app_errorhandler(InvalidCursor)
+def invalid_cursor_response(error):
+    return jsonify({"message": "Invalid cursor, use the next_cursor value from the previous page."}), 400
+
 
 def generate_device_fingerprint():
     # Get the user's IP address from the request headers
@@ -77,555 +243,500 @@ def generate_device_fingerprint():
     return fingerprint_hash
 
 
-def revoke_token_for_fingerprint(user_name, fingerprint):
-    old_token_jti = redis_client.get(f"active_token:{user_name}:{fingerprint}")
-    if old_token_jti:
-        # Add the old token jti to the user's set of revoked tokens
-        redis_client.sadd(f"revoked_tokens:{user_name}", old_token_jti)
-        # Optionally, set a TTL on the set (or individual entries) to clean it up after token expiration
-        redis_client.expire(f"revoked_tokens:{user_name}", timedelta(hours=1))
+def current_user_name():
+    # User name of the request's token, None when the route does not take a token
+    try:
+        return (get_jwt_identity() or {}).get('user_name')
+    except RuntimeError:
+        return None
+
 
-        # Remove the old active token reference
-        redis_client.delete(f"active_token:{user_name}:{fingerprint}")
+def read_replica_engine():
+    # Asked by the request session on its first SELECT (see db.py): a replica for GET requests, None for the primary
+    if not replica_pool or not has_request_context() or request.method not in ('GET', 'HEAD'):
+        return None
+    user_name = current_user_name()
+    if user_name and sticky_reads.is_sticky(user_name):
+        replica_pool.sticky_read()
+        return None
+    replica = replica_pool.pick()
+    return replica.engine if replica is not None else None
+
+
+route_reads(read_replica_engine)
+
+
+@bp.after_request
+def remember_writes(response):
+    # The user of a request that wrote to the database reads from the primary for the next few seconds
+    if replica_pool and session.registry.has() and session.info.get('wrote'):
+        user_name = current_user_name()
+        if user_name:
+            sticky_reads.mark(user_name)
+    return response
+
+
+def revoke_current_token():
+    # Revoke the token and remove the active token reference of this device (one Redis round trip)
+    jwt_data = get_jwt()
+    token_registry.deactivate(jwt_data['sub'].get('user_name'), generate_device_fingerprint(), jwt_data['jti'], jwt_data['exp'])
+
+
+def respond(reply):
+    # The Redis side of a service's reply (see services.py), after its commit
+    for course_id in reply.courses:
+        course_cache.invalidate_course(course_id)
+    if reply.catalog:
+        course_cache.invalidate_catalog()
+    validators = [('course', course_id) for course_id in reply.courses] + reply.entities
+    if validators:
+        entity_validators.bump(*validators)
+    if reply.event:
+        event_type, course_id, fields = reply.event
+        course_events.publish(event_type, course_id, **fields)
+    if reply.revoke_token:
+        revoke_current_token()
+    if reply.job:
+        job_type, payload, queue, owner = reply.job
+        job_id = job_queue.enqueue(job_type, payload, queue, owner=owner)
+        if job_id is None and reply.job_unavailable:
+            return jsonify({"message": reply.job_unavailable}), 503
+        reply.body["job_id"] = job_id
+    return jsonify(reply.body), reply.status, reply.headers
+
+
+def conditional(kind, key, load):
+    # Unchanged since the client's copy: 304 without touching the cache or the database (see etags.py)
+    validator = entity_validators.current(kind, key)
+    if validator is not None and validator.matches(request):
+        return "", 304, validator.headers()
+    response, status = load()
+    # A copy read from a replica gets no validator: it can be behind the primary and the client would keep it (304)
+    # until the next write
+    if validator is None or status != 200 or read_replica(session):
+        return jsonify(response), status
+    return jsonify(response), status, validator.headers()
 
 
 ###############################################################################################################################################
 ########################################################### AUTHENTICATION ####################################################################
 # Route to register a new user
-@app.route('/auth/register', methods=['POST'])
+@bp.route('/auth/register', methods=['POST'])
 def register():
     data = request.get_json()
 
-    required_fields = {'user_name', 'email', 'password', 'role', 'first_name', 'last_name'}
-    optional_fields = {'bio', 'profile_picture', 'additional_info', 'invite_code'}
-    all_valid_fields = required_fields.union(optional_fields)
-
-    # Check for unexpected fields in the incoming data
-    for key in data.keys():
-        if key not in all_valid_fields:
-            return jsonify({"message": f"Unexpected field: {key}"}), 400
-
-    # Check if all required fields are provided
-    for field in required_fields:
-        if field not in data or not data[field]:
-            return jsonify({"message": f"{field} is required!"}), 400
+    # Admission control before any database or bcrypt work (429 with Retry-After when over the budget)
+    rate_limiter.admit('register', generate_device_fingerprint(), (data or {}).get('email'))
 
-    # Check if the user already exists
-    user_name = data.get('email').strip()
-    email = data.get('email').strip()
-    if session.query(User).filter_by(user_name=user_name).first() or session.query(User).filter_by(email=email).first():
-        return jsonify({"message": "User already exists!"}), 400
+    error, role_id = services.check_registration(session, data, role_registry.current())
+    if error:
+        return respond(error)
 
-    # Validate and convert the role string to the RoleType enum
-    try:
-        role_type = RoleType(data['role'].lower())
-    except ValueError:
-        return jsonify({"message": "Invalid role provided. Choose from 'admin', 'instructor', or 'student'."}), 400
-    role = session.query(Role).filter_by(role_name=role_type).first()
-    
-    # Check if the current user is trying to register as an admin
-    if role_type == RoleType.ADMIN:
-        if 'invite_code' not in data or data['invite_code'] != ADMIN_INVITE_CODE:
-            return jsonify({"message": "Invalid or missing admin invite code!"}), 403
-
-    # Hash the password using bcrypt
-    hashed_password = bcrypt.hashpw(data['password'].encode('utf-8'), bcrypt.gensalt())
-    
-    # Start a transaction to ensure atomic operations
-    try:
-        # Create a new user
-        new_user = User(
-            user_name=data['user_name'].strip(),
-            email=data['email'].strip(),
-            password_hash=hashed_password.decode('utf-8'),
-            role_id=role.id
-        )
-
-        # Add the new user to the session
-        session.add(new_user)
-        session.commit()  # This will generate new_user.id
-
-        # Now create the profile and link it to the user
-        new_profile = UserProfile(
-            user_id=new_user.id,  # Link to the created user
-            first_name=data['first_name'].strip(),
-            last_name=data['last_name'].strip(),
-            bio=data.get('bio', '').strip(),  # Optional field, use default empty string
-            profile_picture=data.get('profile_picture', ''),  # Optional
-            additional_info=data.get('additional_info', '')  # Optional
-        )
-
-        # Add the new profile to the session
-        session.add(new_profile)
-        session.commit()
+    # Hash the password using bcrypt (runs in the hashing pool)
+    hashed_password = hash_password(data['password'])
+    return respond(services.create_user(session, data, role_id, hashed_password))
 
-        return jsonify({"message": "User and profile created successfully!"}), 201
-
-    except SQLAlchemyError as e:
-        session.rollback()  # Rollback the transaction on error
-        return jsonify({"message": "Error occurred while creating user or profile", "error": str(e)}), 500
+# Route to register a list of users at once (admin only)
+@bp.route('/auth/register/bulk', methods=['POST'])
+@jwt_required()
+def bulk_register_users():
+    error, plan = services.plan_user_import(session, get_jwt_identity(), request.get_json())
+    if error:
+        return respond(error)
+    hashed_passwords = hash_passwords(plan['passwords'])
+    return respond(services.queue_user_import(get_jwt_identity(), plan, hashed_passwords))
 
 # Route to login the user
-@app.route('/auth/login', methods=['POST'])
+@bp.route('/auth/login', methods=['POST'])
 def login():
     data = request.get_json()
 
-    # Find the user by name
-    user = session.query(User).filter_by(user_name=data['user_name']).first()
+    # Admission control per device and per account before the bcrypt check (429 with Retry-After)
+    device_fingerprint = generate_device_fingerprint()
+    rate_limiter.admit('login', device_fingerprint, (data or {}).get('user_name'))
+
+    user = services.login_user(session, data['user_name'])
 
     # Check if the user exists and the password matches
-    if not user or not bcrypt.checkpw(data['password'].encode('utf-8'), user.password_hash.encode('utf-8')):
+    if not user or not check_password(data['password'], user.password_hash):
         return jsonify({"message": "Invalid credentials"}), 401
 
-    # Generate the device fingerprint based on IP and User-Agent
-    device_fingerprint = generate_device_fingerprint()
-
-    # Revoke the previous token for this user on this specific device (if any)
-    revoke_token_for_fingerprint(user.user_name, device_fingerprint)
+    # Upgrade hashes made with an older (lower) work factor while we have the plain password
+    if needs_rehash(user.password_hash):
+        try:
+            services.store_password_hash(session, user.id, hash_password(data['password']))
+        except HashPoolBusy:
+            pass
 
     # Create a new access token
-    access_token = create_access_token(identity={'user_name': user.user_name, 'role': user.role.role_name.value})
+    access_token = create_access_token(identity={'user_name': user.user_name, 'role': role_registry.current().name_of(user.role_id)})
     decoded_token = decode_token(access_token)
     jti = decoded_token['jti']  # Extract the JTI from the decoded token
 
-    # Store the new JTI in Redis as the active token for this device
-    redis_client.set(f"active_token:{user.user_name}:{device_fingerprint}", jti)
+    # Store the new JTI as the active token for this device and revoke the previous one (one Redis round trip)
+    token_registry.activate(user.user_name, device_fingerprint, jti, decoded_token['exp'])
 
     return jsonify(access_token=access_token), 200
 
-# Protected route that requires a valid JWT token
 
-
-@app.route('/auth/logout', methods=['POST'])
+@bp.route('/auth/logout', methods=['POST'])
 @jwt_required()
 def logout():
-    # Get the current token's jti (unique identifier)
-    jti = get_jwt()['jti']
-    identity = get_jwt_identity()
-    user_name = identity.get("user_name")
-
-    # Add the token's jti to the user's revoked set
-    redis_client.sadd(f"revoked_tokens:{user_name}", jti)
-
-    # Generate the device fingerprint and remove the active token reference
-    device_fingerprint = generate_device_fingerprint()
-    redis_client.delete(f"active_token:{user_name}:{device_fingerprint}")
-
+    revoke_current_token()
     return jsonify(message="Successfully logged out"), 200
 
-@app.route('/auth/role', methods=['GET'])
+@bp.route('/auth/role', methods=['GET'])
 @jwt_required()
 def role():
-    jwt_data = get_jwt()  # Get the JWT token payload
-    user_role_name = jwt_data['sub']['role']  # Access the 'role' from the 'identity' (stored in 'sub')
-
-    # Query to get all roles from the database
-    roles = session.query(Role).all()
-    # List of role names
-    role_names = [role.role_name.value for role in roles]
-    # Query to find the full user role object (based on the name from JWT)
-    user_role = session.query(Role).filter_by(role_name=RoleType(user_role_name)).first()
+    return respond(services.role_info(get_jwt_identity(), role_registry.current()))
 
-    # Construct the response
-    response = {
-        "message": f"You have access to the protected route with role: {user_role.role_name.value}",
-        "roles_list": role_names,
-        "user_role": {"id": user_role.id, "name": user_role.role_name.value}
-    }
-    # Return the response as JSON
-    return jsonify(response)
 
-
-@app.route('/auth/profile', methods=['GET'])
+@bp.route('/auth/profile', methods=['GET'])
 @jwt_required()
 def profile():
-    jwt_data = get_jwt()  # Get the JWT token payload
-    user_name = jwt_data['sub']['user_name']  # Access the 'user_name' from the 'identity' (stored in 'sub')
-    
-    # Query to get user profile and user data using a join
-    user_data_table = (
-        session.query(UserProfile, User)
-        .join(User, UserProfile.user_id == User.id)
-        .filter(User.user_name == user_name)
-        .first()
-    )
-
-    if not user_data_table:
-        return jsonify({"message": "User profile not found"}), 404
-
-    user_profile, user = user_data_table  # Unpack the tuple into UserProfile and User
-    response = {
-        "message": "You have access to your user profile information.",
-        "user_profile": {
-            "user_id": user.id,
-            "user_name": user_name,
-            "user_role": user.role.role_name.value, 
-            "email": user.email,
-            "bio": user_profile.bio,
-            "first_name": user_profile.first_name,
-            "last_name": user_profile.last_name
-        }
-    }
-
-    # Return the response as JSON
-    return jsonify(response), 200
+    user_name = get_jwt_identity()['user_name']
+    return conditional('profile', user_name, lambda: services.user_profile(session, user_name, role_registry.current()))
 
 ###############################################################################################################################################
 ############################################################## USERS ##########################################################################
 
-@app.route('/users', methods=['GET'])
+@bp.route('/users', methods=['GET'])
 @jwt_required()  # Ensure the user is authenticated
 def get_users():
-    # Check if the current user is an Admin
-    current_user_role = get_jwt_identity()['role']
-    if current_user_role.lower() != 'admin':
-        return jsonify({"message": "You do not have access to this resource"}), 403
-    
-    # Get the 'limit' query parameter from the request (default to 10 if not provided)
-    limit = request.args.get('limit', default=10, type=int)
-    
-    # Get users from the database with the specified limit
-    users = session.query(User).limit(limit).all()
-    
-    # Convert users to a list of dictionaries
-    user_list = [{"id": user.id, "role": user.role_id, "name": user.user_name, "email": user.email} for user in users]
-    
-    return jsonify(user_list)
-
-
-@app.route('/users/<int:id>', methods=['GET'])
+    return respond(services.list_users(session, get_jwt_identity(), request.args))
+
+
+@bp.route('/users/<int:id>', methods=['GET'])
 @jwt_required()
 def get_user_profile(id):
-    # Query to get all roles from the database
-    user_data_table = session.query(UserProfile, User).join(User, UserProfile.user_id == User.id).filter_by(id=id).first()
-
-    if user_data_table:
-        user_profile, user = user_data_table  # Unpack the tuple into UserProfile and User
-        return jsonify({
-            "user_id":user_profile.user_id, 
-            "user_name":user.user_name, 
-            "email":user.email,
-            "bio":user_profile.bio,
-            "first_name":user_profile.first_name,
-            "last_name":user_profile.last_name,
-            "user_role": user.role.role_name.value,
-        })
-    else:
-        return jsonify({"message": "User not found"}), 404
-
-
-@app.route('/users/<int:id>/role', methods=['PUT'])
+    return conditional('user', id, lambda: services.user_details(session, id, role_registry.current()))
+
+
+@bp.route('/users/<int:id>/role', methods=['PUT'])
 @jwt_required()
 def update_user_role(id):
-    user_name = get_jwt_identity()['user_name']
-    current_user_role = get_jwt_identity()['role']
-    user = session.query(User).filter_by(id=id).first()
-    data = request.get_json()
-    role_check = session.query(Role).filter_by(role_name=RoleType(data.get('role').lower())).first()
-    if not role_check:
-        return jsonify({"message": "Role does not exist!"}), 400
-    
-    new_role = data.get('role') 
-    if user:
-
-        if user.user_name != user_name and current_user_role.lower() != 'admin':
-            return jsonify({"message": "You do not have permission to change roles for other users"}), 403
-        
-
-        if user.user_name == user_name and new_role.lower() == "admin" and current_user_role.lower() != 'admin':
-            if 'invite_code' not in data or data['invite_code'] != ADMIN_INVITE_CODE:
-                return jsonify({"message": "You do not have permission to change your role to admin"}), 403
-            
-        user.role_id = session.query(Role).filter_by(role_name=RoleType(data.get('role').lower())).first().id  # Assume the role is stored as a simple field in User table
-        session.commit()
-        if user.user_name == user_name:
-            logout()
-            return jsonify({"message": "Your role updated successfully - Please login again"})
-        return jsonify({"message": "The user role updated successfully"})
-    else:
-        return jsonify({"message": "User not found"}), 404
+    return respond(services.update_user_role(session, get_jwt_identity(), id, request.get_json(), role_registry.current()))
 
 
-
-@app.route('/users/<int:id>', methods=['PUT'])
+@bp.route('/users/<int:id>', methods=['PUT'])
 @jwt_required()
 def update_user_profile(id):
-    user_profile = session.query(UserProfile).filter_by(user_id=id).first()
-    jwt_data = get_jwt()
-    user_name = jwt_data['sub']['user_name']
-    user_role = jwt_data['sub']['role']
-    user = session.query(User).filter_by(user_name=user_name).first()
-    if user.id != user_profile.user_id and user_role.lower() != 'admin':
-        return jsonify({"message": "You do not have permission to change roles"}), 403
-    if not user_profile:
-        return jsonify({"message": "User profile not found"}), 404
+    return respond(services.update_user_profile(session, get_jwt_identity(), id, request.get_json()))
 
-    data = request.get_json()
 
-    # Check 'first_name' if provided and ensure it's not empty
-    if 'first_name' in data:
-        if data['first_name'].strip() == "":
-            return jsonify({"message": "First name cannot be empty"}), 400
-        user_profile.first_name = data['first_name'].strip()
-
-    # Check 'last_name' if provided and ensure it's not empty
-    if 'last_name' in data:
-        if data['last_name'].strip() == "":
-            return jsonify({"message": "Last name cannot be empty"}), 400
-        user_profile.last_name = data['last_name'].strip()
-
-    # Update 'bio' if provided; allow it to be empty if needed
-    if 'bio' in data:
-        user_profile.bio = data['bio'].strip()
-
-    session.commit()
-    return jsonify({"message": "Profile updated successfully"}), 200
-
-
-
-@app.route('/users/<int:id>', methods=['DELETE'])
+@bp.route('/users/<int:id>', methods=['DELETE'])
 @jwt_required()
 def delete_user(id):
-    current_user = get_jwt_identity()
-    user_role = current_user['role']
-    user_id = session.query(User).filter_by(user_name=current_user['user_name']).first().id
-    if user_role.lower() != 'admin' and user_id != id:
-        return jsonify({"message": "You do not have permission to delete users"}), 403
-
-    user = session.query(User).filter_by(id=id).first()
-    if user:
-        logout()
-        session.delete(user)
-        session.commit()
-        return jsonify({"message": "User deleted successfully"}), 200
-    else:
-        return jsonify({"message": "User not found"}), 404
+    return respond(services.delete_user(session, get_jwt_identity(), id))
 
 ###############################################################################################################################################
 ############################################################## COURSES ########################################################################
 
-@app.route('/courses', methods=['POST'])
+@bp.route('/courses', methods=['POST'])
 @jwt_required()
 def create_course():
-    current_user = get_jwt_identity()
-    user_role = current_user['role']
-    user_id = session.query(User).filter_by(user_name=current_user['user_name']).first().id
-    # Ensure only instructors can create courses
-    if user_role != 'instructor' and user_role != 'admin':
-        return jsonify({"message": "Only instructors can create courses."}), 403
-    data = request.get_json()
-    title = data.get('title').strip()
-    description = data.get('description', '')
-    if not title:
-        return jsonify({"message": "Title is required."}), 400
-    # Check if the course already exists
-    if session.query(Course).filter_by(title=title).first():
-        return jsonify({"message": "Title alread exists for a different course, use a different name!"}), 400
-    new_course = Course(
-        title=title,
-        description=description,
-        course_instructor_id=user_id
-    )
-    session.add(new_course)
-    session.commit()
-    return jsonify({"message": "Course created successfully!", "course_id": new_course.id}), 201
-
-@app.route('/courses', methods=['GET'])
-def list_courses():
-    # Get the 'limit' query parameter from the request (default to 10 if not provided)
-    limit = request.args.get('limit', default=10, type=int)
-    courses = session.query(Course).limit(limit).all()
-    course_list = [{"id": course.id, "title": course.title, "description": course.description} for course in courses]
-    return jsonify({"courses": course_list}), 200
+    return respond(services.create_course(session, get_jwt_identity(), request.get_json()))
 
-@app.route('/courses/<int:id>', methods=['GET'])
+@bp.route('/courses', methods=['GET'])
+def list_courses():
+    # Get the 'limit' and 'cursor' query parameters from the request (default to 10 if not provided)
+    limit = page_size(request.args.get('limit', type=int))
+    cursor = decode_cursor(request.args.get('cursor'))
+    response, status = course_cache.get_or_load(lambda: course_cache.catalog_key('list', cursor or 0, limit),
+                                                lambda: services.list_courses(session, limit, cursor))
+    return jsonify(response), status
+
+@bp.route('/courses/search', methods=['GET'])
+def search_courses():
+    return respond(services.search_courses(session, request.args))
+
+@bp.route('/courses/<int:id>', methods=['GET'])
 @jwt_required()
 def get_course_details(id):
-    course = session.query(Course).filter_by(id=id).first()
-    if not course:
-        return jsonify({"message": "Course not found."}), 404
-    modules = [{"id": module.id, "title": module.title, "content": module.content} for module in course.modules]
-    response = {
-        "id": course.id,
-        "title": course.title,
-        "description": course.description,
-        "modules": modules
-    }
-    return jsonify(response), 200
-
-@app.route('/courses/<int:id>', methods=['PUT'])
+    return conditional('course', id, lambda: course_cache.get_or_load(
+        lambda: course_cache.course_key(id, 'detail'), lambda: services.course_detail(session, id)))
+
+@bp.route('/courses/<int:id>', methods=['PUT'])
 @jwt_required()
 def update_course(id):
-    current_user = get_jwt_identity()
-    user_role = current_user['role']
-    # Get the course to update
-    course = session.query(Course).filter_by(id=id).first()
-    if not course:
-        return jsonify({"message": "Course not found."}), 404
-    # Ensure only the instructor who created the course or an admin can update it
-    if course.instructor.user_name != current_user['user_name'] and user_role != 'admin':
-        return jsonify({"message": "You do not have permission to update this course."}), 403
-    data = request.get_json()
-    title = data.get('title').strip()
-    if 'title' in data:
-        if data['title'].strip() == "":
-            return jsonify({"message": "Title can not be empty"}), 400
-        current_title = session.query(Course).filter_by(title=data['title']).first()
-        if current_title and current_title.id != id:
-            return jsonify({"message": "Title alread exists in a different Course, use a different name!"}), 400
-        course.title = title
-    else:
-        course.title = course.title
-    course.description = data.get('description', course.description)
-    session.commit()
-    return jsonify({"message": "Course updated successfully."}), 200
-
-@app.route('/courses/<int:id>', methods=['DELETE'])
+    return respond(services.update_course(session, get_jwt_identity(), id, request.get_json()))
+
+@bp.route('/courses/<int:id>', methods=['DELETE'])
 @jwt_required()
 def delete_course(id):
-    current_user = get_jwt_identity()
-    user_role = current_user['role']
-    course = session.query(Course).filter_by(id=id).first()
-    if not course:
-        return jsonify({"message": "Course not found."}), 404
-    # Ensure only the instructor who created the course or an admin can delete it
-    if course.instructor.user_name != current_user['user_name'] and user_role != 'admin':
-        return jsonify({"message": "You do not have permission to delete this course."}), 403
-    session.delete(course)
-    session.commit()
-    return jsonify({"message": "Course deleted successfully."}), 200
+    return respond(services.delete_course(session, get_jwt_identity(), id))
 
 ###############################################################################################################################################
 ############################################################## MODULE #########################################################################
 
-@app.route('/courses/<int:id>/modules', methods=['POST'])
+@bp.route('/courses/<int:id>/modules', methods=['POST'])
 @jwt_required()
 def add_module_to_course(id):
-    current_user = get_jwt_identity()
-    user_role = current_user['role']
-    if user_role != 'instructor' and user_role != 'admin':
-        return jsonify({"message": "Only instructors can add modules."}), 403
-    course = session.query(Course).filter_by(id=id).first()
-    if not course:
-        return jsonify({"message": "Course not found."}), 404
-    if course.instructor.user_name != current_user['user_name'] and user_role != 'admin':
-        return jsonify({"message": "You are not the instructor of this course."}), 403
-    data = request.get_json()
-    title = data.get('title').strip()
-    content = data.get('content', '')
-    if not title:
-        return jsonify({"message": "Module title is required."}), 400
-    if session.query(Module).filter_by(title=data['title'], course_id=id).first():
-        return jsonify({"message": "Title alread exists for a different module, use a different name!"}), 400
-    if data['title'] == '':
-        return jsonify({"message": "Title cannot be empty!"}), 400
-    new_module = Module(
-        course_id=course.id,
-        title=title,
-        content=content
-    )
-    session.add(new_module)
-    session.commit()
-    return jsonify({"message": "Module added successfully!", "module_id": new_module.id}), 201
-
-@app.route('/courses/<int:id>/modules', methods=['GET'])
+    return respond(services.add_module(session, get_jwt_identity(), id, request.get_json()))
+
+@bp.route('/courses/<int:id>/modules', methods=['GET'])
 @jwt_required()
 def get_modules(id):
-    limit = request.args.get('limit', default=10, type=int)
-    course = session.query(Course).filter_by(id=id).first()
-    if not course:
-        return jsonify({"message": "Course not found."}), 404
-    # Retrieve the module and ensure it belongs to the specified course
-    if not course.modules:
-        return jsonify({"message": "Module not found in the specified course."}), 404
-    module_data = [{"id": module.id, "title": module.title, "content": module.content} for module in course.modules[:limit]]
-    return jsonify({"modules": module_data}), 200
-
-@app.route('/courses/<int:id>/modules/<int:moduleId>', methods=['GET'])
+    limit = page_size(request.args.get('limit', type=int))
+    cursor = decode_cursor(request.args.get('cursor'))
+    return conditional('course', id, lambda: course_cache.get_or_load(
+        lambda: course_cache.course_key(id, 'modules', cursor or 0, limit), lambda: services.list_modules(session, id, limit, cursor)))
+
+@bp.route('/courses/<int:id>/modules/<int:moduleId>', methods=['GET'])
 @jwt_required()
 def get_module(id, moduleId):
-    # Ensure the course exists
-    module = session.query(Module).filter_by(id=moduleId, course_id=id).first()
-    if not module:
-        return jsonify({"message": "Module not found. make sure module id and course id exist"}), 404
-    
-    response = {
-        "id": module.id,
-        "title": module.title,
-        "content": module.content,
-        "course_id": module.course_id,
-    }
-    # Return the response with a 200 status code
-    return jsonify(response), 200
-
-@app.route('/courses/<int:id>/modules/<int:moduleId>', methods=['PUT'])
+    # Modules share the validator of their course (any module change bumps it)
+    return conditional('course', id, lambda: course_cache.get_or_load(
+        lambda: course_cache.course_key(id, 'module', moduleId), lambda: services.module_detail(session, id, moduleId)))
+
+@bp.route('/courses/<int:id>/modules/<int:moduleId>', methods=['PUT'])
 @jwt_required()
 def update_module(id, moduleId):
-    current_user = get_jwt_identity()
-    user_role = current_user['role']
-    module = session.query(Module).filter_by(id=moduleId, course_id=id).first()
-    if not module:
-        return jsonify({"message": "Module not found."}), 404
-    if module.course.instructor.user_name != current_user['user_name'] and user_role != 'admin':
-        return jsonify({"message": "You do not have permission to delete this module."}), 403
-    data = request.get_json()
-    title = data.get('title').strip()
-    if 'title' in data:
-        if data['title'].strip() == "":
-            return jsonify({"message": "Title can not be empty"}), 400
-        current_title = session.query(Module).filter_by(title=data['title'], course_id=id).first()
-        if current_title and current_title.id != moduleId:
-            return jsonify({"message": "Title alread exists in a different Module, use a different name!"}), 400
-        module.title = title
-    else:
-        module.title = module.title
-    module.content = data.get('content', module.content)
-    session.commit()
-    return jsonify({"message": "Module updated successfully."}), 200
-
-
-@app.route('/courses/<int:id>/modules/<int:moduleId>', methods=['DELETE'])
+    return respond(services.update_module(session, get_jwt_identity(), id, moduleId, request.get_json()))
+
+
+@bp.route('/courses/<int:id>/modules/<int:moduleId>', methods=['DELETE'])
 @jwt_required()
 def delete_module_from_course(id, moduleId):
-    current_user = get_jwt_identity()
-    user_role = current_user['role']
-    module = session.query(Module).filter_by(id=moduleId, course_id=id).first()
-    if not module:
-        return jsonify({"message": "Module not found."}), 404
-    course = session.query(Course).filter_by(id=id).first()
-    # Ensure only the instructor of the course or an admin can delete the module
-    if course.instructor.user_name != current_user['user_name'] and user_role != 'admin':
-        return jsonify({"message": "You do not have permission to delete this module."}), 403
-    session.delete(module)
-    session.commit()
-    return jsonify({"message": "Module deleted successfully."}), 200
+    return respond(services.delete_module(session, get_jwt_identity(), id, moduleId))
 
 ###############################################################################################################################################
 ############################################################## ENROLL #########################################################################
 
 
-@app.route('/courses/<int:id>/enroll', methods=['POST'])
+@bp.route('/courses/<int:id>/enroll', methods=['POST'])
 @jwt_required()
 def enroll_to_course(id):
-    current_user = get_jwt_identity()
-    user_name = current_user['user_name']
-    user_role = current_user['role']
-    user_id = session.query(User).filter_by(user_name=user_name).first().id
-    if user_role != 'student':
-        return jsonify({"message": "Only student can enroll."}), 403
-    course = session.query(Course).filter_by(id=id).first()
-    if not course:
-        return jsonify({"message": "Course not found."}), 404
-    
-    new_enroll = Enroll(
-        course_id=course.id,
-        user_id=user_id
-    )
-    session.add(new_enroll)
-    session.commit()
-    return jsonify({"message": "Enrolled to course successfuly!", "course id": id, "user": user_name}), 201
+    return respond(services.enroll(session, get_jwt_identity(), id))
+
+
+@bp.route('/courses/<int:id>/enroll/bulk', methods=['POST'])
+@jwt_required()
+def bulk_enroll_to_course(id):
+    return respond(services.enroll_cohort(session, get_jwt_identity(), id, request.get_json(), role_registry.current()))
+
+
+# Enrollment and module counts of a course for the instructor dashboard, read from the counters in stats.py
+@bp.route('/courses/<int:id>/stats', methods=['GET'])
+@jwt_required()
+def get_course_stats(id):
+    return respond(services.enrollment_stats(session, get_jwt_identity(), id))
+
+
+###############################################################################################################################################
+############################################################## VIDEO ##########################################################################
+
+@bp.route('/courses/<int:id>/modules/<int:moduleId>/video', methods=['PUT'])
+@jwt_required()
+def set_module_video(id, moduleId):
+    # The file itself is uploaded to the media storage (MEDIA_ROOT folder or S3 bucket), here it is attached to the module
+    error, module, video_key = services.video_module(session, get_jwt_identity(), id, moduleId, request.get_json(silent=True))
+    if error:
+        return respond(error)
+    return respond(services.attach_video(session, module, video_key, media_storage.exists(video_key)))
+
+
+@bp.route('/courses/<int:id>/modules/<int:moduleId>/video', methods=['GET'])
+@jwt_required()
+def get_module_video(id, moduleId):
+    return respond(services.module_video_url(session, get_jwt_identity(), id, moduleId, media_signer))
+
+
+@bp.route('/media/<path:media_key>', methods=['GET'])
+def stream_media(media_key):
+    # No JWT and no database here: the signature says who may watch and until when
+    expires = request.args.get('expires')
+    if not media_signer.verify(media_key, expires, request.args.get('sig')):
+        return jsonify({"message": "Invalid or expired media URL."}), 403
+    return media_storage.response(request, media_key, max(0, int(expires) - int(datetime.now(timezone.utc).timestamp())))
+
+
+###############################################################################################################################################
+############################################################## PROGRESS #######################################################################
+
+@bp.route('/courses/<int:id>/modules/<int:moduleId>/progress', methods=['POST'])
+@jwt_required()
+def record_progress(id, moduleId):
+    user_name = get_jwt_identity()['user_name']
+    # Enrollment is checked once and then remembered, a heartbeat is only one XADD
+    user_id = progress_access.get(user_name, id, moduleId)
+    if user_id is None:
+        user_id = services.progress_user(session, user_name, id, moduleId)
+        if user_id is None:
+            return jsonify({"message": "Module not found or you are not enrolled to this course."}), 404
+        progress_access.put(user_name, id, moduleId, user_id)
+    event, error = heartbeat_event(user_id, id, moduleId, request.get_json(silent=True))
+    if error:
+        return jsonify({"message": error}), 400
+
+    progress_recorder.record(event)
+    if PROGRESS_FLUSH_IN_PROCESS:
+        progress_flusher.start()
+    return jsonify({"message": "Progress recorded."}), 202
+
+
+@bp.route('/courses/<int:id>/progress', methods=['GET'])
+@jwt_required()
+def get_course_progress(id):
+    return respond(services.course_progress(session, get_jwt_identity()['user_name'], id))
+
+
+###############################################################################################################################################
+############################################################## QUIZZES ########################################################################
+
+# Multiple choice quizzes of a module, graded for the whole cohort in one NumPy pass (see quiz.py)
+@bp.route('/courses/<int:id>/modules/<int:moduleId>/quizzes', methods=['POST'])
+@jwt_required()
+def create_module_quiz(id, moduleId):
+    return respond(services.add_quiz(session, get_jwt_identity(), id, moduleId, request.get_json(silent=True)))
+
+
+@bp.route('/courses/<int:id>/modules/<int:moduleId>/quizzes/<int:quizId>', methods=['GET'])
+@jwt_required()
+def get_module_quiz(id, moduleId, quizId):
+    return respond(services.quiz_for(session, get_jwt_identity(), id, moduleId, quizId))
+
+
+@bp.route('/courses/<int:id>/modules/<int:moduleId>/quizzes/<int:quizId>/submissions/bulk', methods=['POST'])
+@jwt_required()
+def bulk_submit_quiz(id, moduleId, quizId):
+    return respond(services.submit_quiz(session, get_jwt_identity(), id, moduleId, quizId, request.get_json(silent=True)))
+
+
+@bp.route('/courses/<int:id>/modules/<int:moduleId>/quizzes/<int:quizId>/results/<int:user_id>', methods=['GET'])
+@jwt_required()
+def get_quiz_result(id, moduleId, quizId, user_id):
+    return respond(services.quiz_result(session, get_jwt_identity(), id, moduleId, quizId, user_id))
+
+
+###############################################################################################################################################
+############################################################## CERTIFICATES ###################################################################
+
+# Completion certificate of the current student (every module of the course completed). It is rendered the first
+# time and then served from the media storage, asking again returns the same PDF with a new signed URL.
+@bp.route('/courses/<int:id>/certificate', methods=['POST'])
+@jwt_required()
+def issue_course_certificate(id):
+    error, user_id = services.certificate_student(session, get_jwt_identity())
+    if error:
+        return respond(error)
+    certificates, summary = issue_certificates(session, media_storage, id, user_id)
+    if certificates:
+        session.commit()
+    return respond(services.certificate_reply(id, certificates, summary, media_signer))
+
+
+# Certificates of every student that completed the course, issued by a job worker (GET /jobs/<job_id> has the counts
+# and the render throughput when it is done)
+@bp.route('/courses/<int:id>/certificates/batch', methods=['POST'])
+@jwt_required()
+def issue_cohort_certificates(id):
+    return respond(services.cohort_certificates(session, get_jwt_identity(), id))
+
+
+###############################################################################################################################################
+############################################################## EVENTS #########################################################################
+
+# Stream token for GET /courses/<id>/events (served by asgi.py), EventSource can't send the Authorization header
+@bp.route('/courses/<int:id>/events/token', methods=['POST'])
+@jwt_required()
+def course_event_stream_token(id):
+    return respond(services.event_stream_token(session, get_jwt_identity(), id, get_jwt(), stream_signer))
+
+
+###############################################################################################################################################
+############################################################## JOBS ###########################################################################
+
+# Status of a background job (e.g. the job_id returned by register and enroll), for the user that queued it or an admin
+@bp.route('/jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def get_job(job_id):
+    return respond(services.job_reply(get_jwt_identity(), job_queue.get(job_id)))
+
+
+###############################################################################################################################################
+############################################################## EXPORTS ########################################################################
+
+# Stream a whole table as NDJSON (default) or CSV, e.g. GET /admin/export/enrollments?format=csv&course_id=3
+# Rows are read and sent in batches (see exports.py), use this instead of GET /users with a large limit for reports.
+@bp.route('/admin/export/<name>', methods=['GET'])
+@jwt_required()
+def export(name):
+    error, format, columns, statement = services.export_request(get_jwt_identity(), name, request.args)
+    if error:
+        return respond(error)
+
+    def generate():
+        # Own session: the request session is removed when the request ends, before the body is streamed
+        with Session() as export_session:
+            yield from export_chunks(export_session, format, columns, statement)
+
+    return Response(generate(), mimetype=EXPORT_FORMATS[format], headers=services.export_headers(name, format))
+
+
+
+###############################################################################################################################################
+############################################################## HEALTH #########################################################################
+
+# Liveness: the process answers (no database or Redis calls)
+@bp.route('/health', methods=['GET'])
+def health():
+    return jsonify({"status": "ok"}), 200
+
+
+warmed = threading.Event()
+
+# Readiness: the database and Redis answer. The first successful call also warms what the first requests would
+# otherwise wait for: DB_POOL_WARM pool connections, the bcrypt worker processes, the revocation filter sync and the
+# progress flusher. Point the load balancer / readiness probe here so a new worker only gets traffic when it's warm.
+@bp.route('/ready', methods=['GET'])
+def ready():
+    start = time.perf_counter()
+    warm = not warmed.is_set()
+    checks = {}
+    try:
+        warm_pool(DB_POOL_WARM if warm else 1)
+        role_registry.current()
+        checks["database"] = "ok"
+    except (SQLAlchemyError, RuntimeError) as e:
+        checks["database"] = f"error: {type(e).__name__}"
+    try:
+        redis_client.ping()
+        checks["redis"] = "ok"
+    except redis.RedisError as e:
+        checks["redis"] = f"error: {type(e).__name__}"
+
+    is_ready = all(check == "ok" for check in checks.values())
+    if is_ready and warm:
+        warm_up_hashing()
+        revocation_filter.start()
+        replica_pool.start()
+        if PROGRESS_FLUSH_IN_PROCESS:
+            progress_flusher.start()
+        warmed.set()
+    return jsonify({
+        "status": "ready" if is_ready else "not ready",
+        "checks": checks,
+        # Not needed to be ready, reads go to the primary while no replica is healthy
+        **({"replicas": replica_pool.status()} if replica_pool else {}),
+        "warmed": warm and is_ready,
+        "ms": round((time.perf_counter() - start) * 1000, 1),
+    }), 200 if is_ready else 503
+
+
+###############################################################################################################################################
+############################################################## METRICS ########################################################################
+
+# Prometheus scrape endpoint (text format), see metrics.py
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    if not METRICS_ENABLED:
+        return jsonify({"message": "Metrics are disabled"}), 404
+    if not metrics_authorized(request.headers.get('Authorization')):
+        return jsonify({"message": "Unauthorized"}), 401
+    return metrics_registry.render(), 200, {"Content-Type": PROMETHEUS_CONTENT_TYPE}
 
 
 # Start the Flask application
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    create_app().run(debug=True, host='0.0.0.0', port=5000, threaded=True)
@@ -0,0 +1,888 @@
+from quart import Quart, jsonify, request, g, redirect, send_file
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.exc import SQLAlchemyError
+from dotenv import load_dotenv
+try:
+    from . import services  # Relative import
+except ImportError:
+    import services  # Direct import for terminal
+try:
+    from .db import DATABASE_URI, Session as SyncSession, LazySession, engine_options, async_database_uri, env_bool, read_replica
+except ImportError:
+    from db import DATABASE_URI, Session as SyncSession, LazySession, engine_options, async_database_uri, env_bool, read_replica
+try:
+    from .replicas import ReplicaPool, AsyncStickyReads
+except ImportError:
+    from replicas import ReplicaPool, AsyncStickyReads
+try:
+    from .pagination import InvalidCursor, decode_cursor, page_size
+except ImportError:
+    from pagination import InvalidCursor, decode_cursor, page_size
+try:
+    from .search import search_index
+except ImportError:
+    from search import search_index
+try:
+    from .roles import AsyncRoleRegistry
+except ImportError:
+    from roles import AsyncRoleRegistry
+try:
+    from .cache import AsyncCourseCache
+except ImportError:
+    from cache import AsyncCourseCache
+try:
+    from .passwords import HashPoolBusy, hash_password_async, hash_passwords, check_password_async, needs_rehash, warm_up as warm_up_hashing
+except ImportError:
+    from passwords import HashPoolBusy, hash_password_async, hash_passwords, check_password_async, needs_rehash, warm_up as warm_up_hashing
+try:
+    from .etags import AsyncEntityValidators
+except ImportError:
+    from etags import AsyncEntityValidators
+try:
+    from .jobs import AsyncJobQueue
+except ImportError:
+    from jobs import AsyncJobQueue
+try:
+    from .certificates import CertificatesBusy, issue_certificates_async, stats as certificate_stats
+except ImportError:
+    from certificates import CertificatesBusy, issue_certificates_async, stats as certificate_stats
+try:
+    from .events import AsyncCourseEvents, EventHub, read_stream_token
+except ImportError:
+    from events import AsyncCourseEvents, EventHub, read_stream_token
+try:
+    from .exports import EXPORT_FORMATS, export_chunks_async
+except ImportError:
+    from exports import EXPORT_FORMATS, export_chunks_async
+try:
+    from .ratelimit import RateLimited, AsyncRateLimiter
+except ImportError:
+    from ratelimit import RateLimited, AsyncRateLimiter
+try:
+    from .revocation import RevocationFilter, REVOKED_JTIS_KEY
+except ImportError:
+    from revocation import RevocationFilter, REVOKED_JTIS_KEY
+try:
+    from .token_registry import AsyncTokenRegistry
+except ImportError:
+    from token_registry import AsyncTokenRegistry
+try:
+    from .media import MediaSigner, LocalStorage, create_storage, content_type
+except ImportError:
+    from media import MediaSigner, LocalStorage, create_storage, content_type
+try:
+    from .metrics import METRICS_ENABLED, PROMETHEUS_CONTENT_TYPE, registry as metrics_registry, authorized as metrics_authorized, instrument_engine, instrument_redis, init_async_app as init_metrics
+except ImportError:
+    from metrics import METRICS_ENABLED, PROMETHEUS_CONTENT_TYPE, registry as metrics_registry, authorized as metrics_authorized, instrument_engine, instrument_redis, init_async_app as init_metrics
+try:
+    from .progress import ProgressAccessCache, AsyncProgressRecorder, ProgressFlusher, heartbeat_event, PROGRESS_FLUSH_IN_PROCESS
+except ImportError:
+    from progress import ProgressAccessCache, AsyncProgressRecorder, ProgressFlusher, heartbeat_event, PROGRESS_FLUSH_IN_PROCESS
+
+from datetime import timedelta , datetime , timezone
+from functools import wraps
+import asyncio
+import os
+import time
+import uuid
+import hashlib
+import jwt as pyjwt
+import redis
+import redis.asyncio as aioredis
+
+
+######################################################## ASYNC SERVING MODE ####################################################################
+# The same API as api.py (same routes, same responses, same Redis keys and JWT tokens) on asyncio:
+# async SQLAlchemy for the database and redis.asyncio for Redis, so one process can keep thousands of clients
+# waiting on I/O without a thread for each one. Both modes can run side by side against the same database/Redis.
+# The route bodies are the services of services.py (shared with api.py), the routes here only read the request and
+# do the Redis side of the reply with the asyncio clients.
+# Run it with an ASGI server, e.g: hypercorn api.asgi:app --bind 0.0.0.0:5000
+
+######################################################## INITIALIZATION #######################################################################
+# Load environment variables from .env file
+load_dotenv()
+
+# Initialize Redis (asyncio client for the routes, the revocation filter listens with its own thread)
+redis_client = aioredis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
+
+# Read-through cache for course catalog and course content (same keys as api.py)
+course_cache = AsyncCourseCache(redis_client)
+
+# ETag / Last-Modified per course and user (same keys as api.py, see etags.py)
+entity_validators = AsyncEntityValidators(redis_client)
+
+# Local copy of the revoked token ids, kept in sync over Redis pub/sub
+revocation_filter = RevocationFilter(redis.StrictRedis(host='localhost', port=6379, db=0, decode_responses=True))
+
+# Progress heartbeats go to a Redis stream (same stream as api.py), the flusher thread writes them in batches
+progress_recorder = AsyncProgressRecorder(redis_client)
+progress_flusher = ProgressFlusher(redis.StrictRedis(host='localhost', port=6379, db=0, decode_responses=True), SyncSession)
+progress_access = ProgressAccessCache()
+
+# Initialize Quart app
+app = Quart(__name__)
+
+JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
+JWT_ACCESS_TOKEN_EXPIRES = timedelta(days=60)
+
+# Module videos: same signed URLs as api.py (see media.py)
+media_signer = MediaSigner(os.getenv("MEDIA_SIGNING_KEY") or JWT_SECRET_KEY)
+media_storage = create_storage()
+
+# Same stream tokens as api.py (see events.py)
+signing_key = os.getenv("MEDIA_SIGNING_KEY") or JWT_SECRET_KEY
+stream_signer = MediaSigner(signing_key + ":course-events" if signing_key else None)
+
+# Same token buckets as api.py (see ratelimit.py)
+rate_limiter = AsyncRateLimiter(redis_client)
+
+# Active token per device, lives as long as the access tokens do
+token_registry = AsyncTokenRegistry(redis_client, revocation_filter, JWT_ACCESS_TOKEN_EXPIRES)
+
+# Async SQLAlchemy engine (same pool settings as db.py), created on first use like the one in db.py so importing
+# this module does not need a database. Tables are created by create_db.py, not by the app.
+engine = None
+# The sync session class of db.py, so SELECTs can go to a read replica (read_bind, see replicas.py)
+Session = async_sessionmaker(expire_on_commit=False, sync_session_class=LazySession)
+
+# Connections GET /ready opens in the pool before the instance takes traffic
+DB_POOL_WARM = int(os.getenv("DB_POOL_WARM", 4))
+
+
+def get_engine():
+    # Only called from the event loop thread, so no lock is needed
+    global engine
+    if engine is None:
+        if not DATABASE_URI:
+            raise RuntimeError("SQLALCHEMY_DATABASE_URI is not set")
+        engine = create_async_engine(async_database_uri(DATABASE_URI), echo=env_bool("DB_ECHO", False), **engine_options(DATABASE_URI))
+        if METRICS_ENABLED:
+            # The engine events are on the sync engine
+            instrument_engine(engine.sync_engine)
+    return engine
+
+
+# Per request database/Redis/bcrypt numbers for GET /metrics (see metrics.py)
+if METRICS_ENABLED:
+    instrument_redis(redis_client)
+init_metrics(app)
+metrics_registry.register_collector("course_cache", course_cache.stats)
+metrics_registry.register_collector("revocation_filter", revocation_filter.stats)
+metrics_registry.register_collector("progress_flusher", progress_flusher.stats)
+metrics_registry.register_collector("rate_limiter", rate_limiter.stats)
+
+# Same search index versions as api.py (see search.py), search_rows runs in run_sync so it gets a sync client
+search_index.share(redis.StrictRedis(host='localhost', port=6379, db=0, decode_responses=True))
+metrics_registry.register_collector("search_index", search_index.stats)
+
+# Read replicas like in api.py: the pool's sync engines run the health checks, the reads use async engines
+replica_pool = ReplicaPool()
+sticky_reads = AsyncStickyReads(redis_client)
+replica_engines = {}
+metrics_registry.register_collector("replicas", replica_pool.stats)
+
+# Same job queue as api.py (see jobs.py)
+job_queue = AsyncJobQueue(redis_client)
+metrics_registry.register_collector("jobs", job_queue.stats)
+
+# Same certificates as api.py (see certificates.py)
+metrics_registry.register_collector("certificates", certificate_stats)
+
+# Course updates: published like in api.py, the hub fans them out to the event streams of this process (see events.py)
+course_events = AsyncCourseEvents(redis_client)
+event_hub = EventHub(redis_client)
+metrics_registry.register_collector("course_events", course_events.stats)
+metrics_registry.register_collector("event_streams", event_hub.stats)
+
+
+def get_session():
+    # One session per request, only opened the first time a route uses it. read_bind is the replica jwt_required
+    # picked for a GET request (None: everything on the primary)
+    if 'db_session' not in g:
+        g.db_session = Session(bind=get_engine(), info={'read_bind': g.get('read_bind')})
+    return g.db_session
+
+
+def replica_engine(replica):
+    # Async engine of a replica, created on first use like get_engine()
+    replica_async_engine = replica_engines.get(replica.url)
+    if replica_async_engine is None:
+        replica_async_engine = create_async_engine(async_database_uri(replica.url), **engine_options(replica.url))
+        replica_pool.watch(replica_async_engine.sync_engine, replica)
+        if METRICS_ENABLED:
+            instrument_engine(replica_async_engine.sync_engine)
+        replica_engines[replica.url] = replica_async_engine
+    return replica_async_engine
+
+
+async def read_replica_engine(user_name):
+    # Same choice as read_replica_engine in api.py, made before the route runs: here the sessions are created
+    # synchronously, so the Redis check can't wait for the first SELECT
+    if not replica_pool or request.method not in ('GET', 'HEAD'):
+        return None
+    if user_name and await sticky_reads.is_sticky(user_name):
+        replica_pool.sticky_read()
+        return None
+    replica = replica_pool.pick()
+    return replica_engine(replica).sync_engine if replica is not None else None
+
+
+# roles rows kept in memory like in api.py (see roles.py), loaded with their own session
+role_registry = AsyncRoleRegistry(redis_client, lambda: Session(bind=get_engine()))
+
+
+async def warm_pool(size):
+    # Same as db.warm_pool: `size` connections open at the same time, then back to the pool
+    connections = []
+    try:
+        for _ in range(size):
+            connection = await get_engine().connect()
+            connections.append(connection)
+            await connection.execute(text("SELECT 1"))
+    finally:
+        for connection in connections:
+            await connection.close()
+
+
+@app.after_request
+async def remember_writes(response):
+    # The user of a request that wrote to the database reads from the primary for the next few seconds
+    db_session = g.get('db_session')
+    if replica_pool and db_session is not None and db_session.info.get('wrote') and 'jwt' in g:
+        await sticky_reads.mark(g.jwt['sub'].get('user_name'))
+    return response
+
+
+@app.teardown_appcontext
+async def remove_session(exception=None):
+    db_session = g.pop('db_session', None)
+    if db_session is not None:
+        if exception is not None:
+            await db_session.rollback()
+        await db_session.close()
+
+
+@app.after_serving
+async def stop_event_streams():
+    # Open event streams would keep the server from shutting down
+    await event_hub.stop()
+
+
+@app.errorhandler(HashPoolBusy)
+async def hash_pool_busy_response(error):
+    # Shed load fast instead of queueing more bcrypt work
+    return jsonify({"message": "Server is busy, please try again shortly."}), 503, {"Retry-After": "1"}
+
+@app.errorhandler(CertificatesBusy)
+async def certificates_busy_response(error):
+    return jsonify({"message": "Server is busy, please try again shortly."}), 503, {"Retry-After": "5"}
+
+@app.errorhandler(RateLimited)
+async def rate_limited_response(error):
+    return jsonify({"message": "Too many attempts, please try again later."}), 429, error.headers()
+
+@app.errorhandler(InvalidCursor)
+async def invalid_cursor_response(error):
+    return jsonify({"message": "Invalid cursor, use the next_cursor value from the previous page."}), 400
+
+
+######################################################## JWT ###################################################################################
+# Tokens are the same HS256 tokens flask_jwt_extended creates, so a token from one mode works in the other
+
+def create_access_token(identity):
+    now = datetime.now(timezone.utc)
+    payload = {
+        "fresh": False,
+        "iat": now,
+        "jti": str(uuid.uuid4()),
+        "type": "access",
+        "sub": identity,
+        "nbf": now,
+        "exp": now + JWT_ACCESS_TOKEN_EXPIRES,
+    }
+    return pyjwt.encode(payload, JWT_SECRET_KEY, algorithm="HS256"), payload['jti'], int(payload['exp'].timestamp())
+
+
+async def is_token_revoked(jti):
+    # Check the local revocation filter, it only asks Redis when it is not in sync
+    revoked = revocation_filter.check_local(jti)
+    if revoked is None:
+        return await redis_client.zscore(REVOKED_JTIS_KEY, jti) is not None
+    return revoked
+
+
+async def authenticate():
+    # Checks the Bearer token of the request and sets g.jwt, returns the error response or None
+    auth_header = request.headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return jsonify({"msg": "Missing Authorization Header"}), 401
+    try:
+        # sub is the identity dict like in api.py, PyJWT >= 2.10 would reject it without verify_sub off
+        payload = pyjwt.decode(auth_header[len('Bearer '):], JWT_SECRET_KEY, algorithms=["HS256"], options={"verify_sub": False})
+    except pyjwt.ExpiredSignatureError:
+        return jsonify({"message": "Your session has expired. Please log in again."}), 401
+    except pyjwt.InvalidTokenError as e:
+        return jsonify({"msg": str(e)}), 422
+    if payload.get('type') != 'access':
+        return jsonify({"msg": "Only non-refresh tokens are allowed"}), 422
+    if await is_token_revoked(payload['jti']):
+        return jsonify({"message": "Your token has been revoked. Please login again."}), 401
+    g.jwt = payload
+    if replica_pool:
+        g.read_bind = await read_replica_engine((payload.get('sub') or {}).get('user_name'))
+    return None
+
+
+def jwt_required():
+    def decorator(fn):
+        @wraps(fn)
+        async def wrapper(*args, **kwargs):
+            error = await authenticate()
+            if error is not None:
+                return error
+            return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def get_jwt():
+    return g.jwt
+
+
+def get_jwt_identity():
+    return g.jwt['sub']
+
+
+def generate_device_fingerprint():
+    # Same fingerprint as api.py: sha256 of IP and User-Agent
+    fingerprint_data = f"{request.remote_addr}:{request.headers.get('User-Agent')}"
+    return hashlib.sha256(fingerprint_data.encode()).hexdigest()
+
+
+async def revoke_current_token():
+    jti = get_jwt()['jti']
+    expires_at = get_jwt()['exp']
+    user_name = get_jwt_identity().get("user_name")
+    await token_registry.deactivate(user_name, generate_device_fingerprint(), jti, expires_at)
+
+
+def run(service, *args):
+    # A service of services.py on the request session: the same sync code as api.py, run by SQLAlchemy with the async
+    # driver (AsyncSession.run_sync), so the event loop keeps serving while it waits on the database
+    return get_session().run_sync(service, *args)
+
+
+async def respond(reply):
+    # The Redis side of a service's reply (see services.py), after its commit. Same steps as respond in api.py
+    for course_id in reply.courses:
+        await course_cache.invalidate_course(course_id)
+    if reply.catalog:
+        await course_cache.invalidate_catalog()
+    validators = [('course', course_id) for course_id in reply.courses] + reply.entities
+    if validators:
+        await entity_validators.bump(*validators)
+    if reply.event:
+        event_type, course_id, fields = reply.event
+        await course_events.publish(event_type, course_id, **fields)
+    if reply.revoke_token:
+        await revoke_current_token()
+    if reply.job:
+        job_type, payload, queue, owner = reply.job
+        job_id = await job_queue.enqueue(job_type, payload, queue, owner=owner)
+        if job_id is None and reply.job_unavailable:
+            return jsonify({"message": reply.job_unavailable}), 503
+        reply.body["job_id"] = job_id
+    return jsonify(reply.body), reply.status, reply.headers
+
+
+async def conditional(kind, key, load):
+    # Unchanged since the client's copy: 304 without touching the cache or the database (see etags.py)
+    validator = await entity_validators.current(kind, key)
+    if validator is not None and validator.matches(request):
+        return "", 304, validator.headers()
+    response, status = await load()
+    # A copy read from a replica gets no validator: it can be behind the primary and the client would keep it (304)
+    # until the next write
+    db_session = g.get('db_session')  # None: served from the course cache
+    if validator is None or status != 200 or (db_session is not None and read_replica(db_session)):
+        return jsonify(response), status
+    return jsonify(response), status, validator.headers()
+
+
+###############################################################################################################################################
+########################################################### AUTHENTICATION ####################################################################
+@app.route('/auth/register', methods=['POST'])
+async def register():
+    data = await request.get_json()
+
+    await rate_limiter.admit('register', generate_device_fingerprint(), (data or {}).get('email'))
+
+    error, role_id = await run(services.check_registration, data, await role_registry.current())
+    if error:
+        return await respond(error)
+
+    # Hash the password using bcrypt (runs in the hashing pool, the event loop keeps serving)
+    hashed_password = await hash_password_async(data['password'])
+    return await respond(await run(services.create_user, data, role_id, hashed_password))
+
+
+@app.route('/auth/register/bulk', methods=['POST'])
+@jwt_required()
+async def bulk_register_users():
+    error, plan = await run(services.plan_user_import, get_jwt_identity(), await request.get_json())
+    if error:
+        return await respond(error)
+    # hash_passwords waits on the hashing pool, run it in a thread so the event loop keeps serving
+    hashed_passwords = await asyncio.to_thread(hash_passwords, plan['passwords'])
+    return await respond(services.queue_user_import(get_jwt_identity(), plan, hashed_passwords))
+
+
+@app.route('/auth/login', methods=['POST'])
+async def login():
+    data = await request.get_json()
+
+    device_fingerprint = generate_device_fingerprint()
+    await rate_limiter.admit('login', device_fingerprint, (data or {}).get('user_name'))
+
+    user = await run(services.login_user, data['user_name'])
+
+    # Check if the user exists and the password matches
+    if not user or not await check_password_async(data['password'], user.password_hash):
+        return jsonify({"message": "Invalid credentials"}), 401
+
+    # Upgrade hashes made with an older (lower) work factor while we have the plain password
+    if needs_rehash(user.password_hash):
+        try:
+            await run(services.store_password_hash, user.id, await hash_password_async(data['password']))
+        except HashPoolBusy:
+            pass
+
+    # Create a new access token and make it the active token of this device
+    access_token, jti, expires_at = create_access_token(identity={'user_name': user.user_name, 'role': (await role_registry.current()).name_of(user.role_id)})
+    await token_registry.activate(user.user_name, device_fingerprint, jti, expires_at)
+
+    return jsonify(access_token=access_token), 200
+
+
+@app.route('/auth/logout', methods=['POST'])
+@jwt_required()
+async def logout():
+    await revoke_current_token()
+    return jsonify(message="Successfully logged out"), 200
+
+
+@app.route('/auth/role', methods=['GET'])
+@jwt_required()
+async def role():
+    return await respond(services.role_info(get_jwt_identity(), await role_registry.current()))
+
+
+@app.route('/auth/profile', methods=['GET'])
+@jwt_required()
+async def profile():
+    user_name = get_jwt_identity()['user_name']
+    roles = await role_registry.current()
+    return await conditional('profile', user_name, lambda: run(services.user_profile, user_name, roles))
+
+###############################################################################################################################################
+############################################################## USERS ##########################################################################
+
+@app.route('/users', methods=['GET'])
+@jwt_required()
+async def get_users():
+    return await respond(await run(services.list_users, get_jwt_identity(), request.args))
+
+
+@app.route('/users/<int:id>', methods=['GET'])
+@jwt_required()
+async def get_user_profile(id):
+    roles = await role_registry.current()
+    return await conditional('user', id, lambda: run(services.user_details, id, roles))
+
+
+@app.route('/users/<int:id>/role', methods=['PUT'])
+@jwt_required()
+async def update_user_role(id):
+    data = await request.get_json()
+    return await respond(await run(services.update_user_role, get_jwt_identity(), id, data, await role_registry.current()))
+
+
+@app.route('/users/<int:id>', methods=['PUT'])
+@jwt_required()
+async def update_user_profile(id):
+    return await respond(await run(services.update_user_profile, get_jwt_identity(), id, await request.get_json()))
+
+
+@app.route('/users/<int:id>', methods=['DELETE'])
+@jwt_required()
+async def delete_user(id):
+    return await respond(await run(services.delete_user, get_jwt_identity(), id))
+
+###############################################################################################################################################
+############################################################## COURSES ########################################################################
+
+@app.route('/courses', methods=['POST'])
+@jwt_required()
+async def create_course():
+    return await respond(await run(services.create_course, get_jwt_identity(), await request.get_json()))
+
+
+@app.route('/courses', methods=['GET'])
+async def list_courses():
+    limit = page_size(request.args.get('limit', type=int))
+    cursor = decode_cursor(request.args.get('cursor'))
+    response, status = await course_cache.get_or_load(lambda: course_cache.catalog_key('list', cursor or 0, limit),
+                                                      lambda: run(services.list_courses, limit, cursor))
+    return jsonify(response), status
+
+
+@app.route('/courses/search', methods=['GET'])
+async def search_courses():
+    return await respond(await run(services.search_courses, request.args))
+
+
+@app.route('/courses/<int:id>', methods=['GET'])
+@jwt_required()
+async def get_course_details(id):
+    return await conditional('course', id, lambda: course_cache.get_or_load(
+        lambda: course_cache.course_key(id, 'detail'), lambda: run(services.course_detail, id)))
+
+
+@app.route('/courses/<int:id>', methods=['PUT'])
+@jwt_required()
+async def update_course(id):
+    return await respond(await run(services.update_course, get_jwt_identity(), id, await request.get_json()))
+
+
+@app.route('/courses/<int:id>', methods=['DELETE'])
+@jwt_required()
+async def delete_course(id):
+    return await respond(await run(services.delete_course, get_jwt_identity(), id))
+
+###############################################################################################################################################
+############################################################## MODULE #########################################################################
+
+@app.route('/courses/<int:id>/modules', methods=['POST'])
+@jwt_required()
+async def add_module_to_course(id):
+    return await respond(await run(services.add_module, get_jwt_identity(), id, await request.get_json()))
+
+
+@app.route('/courses/<int:id>/modules', methods=['GET'])
+@jwt_required()
+async def get_modules(id):
+    limit = page_size(request.args.get('limit', type=int))
+    cursor = decode_cursor(request.args.get('cursor'))
+    return await conditional('course', id, lambda: course_cache.get_or_load(
+        lambda: course_cache.course_key(id, 'modules', cursor or 0, limit), lambda: run(services.list_modules, id, limit, cursor)))
+
+
+@app.route('/courses/<int:id>/modules/<int:moduleId>', methods=['GET'])
+@jwt_required()
+async def get_module(id, moduleId):
+    # Modules share the validator of their course (any module change bumps it)
+    return await conditional('course', id, lambda: course_cache.get_or_load(
+        lambda: course_cache.course_key(id, 'module', moduleId), lambda: run(services.module_detail, id, moduleId)))
+
+
+@app.route('/courses/<int:id>/modules/<int:moduleId>', methods=['PUT'])
+@jwt_required()
+async def update_module(id, moduleId):
+    return await respond(await run(services.update_module, get_jwt_identity(), id, moduleId, await request.get_json()))
+
+
+@app.route('/courses/<int:id>/modules/<int:moduleId>', methods=['DELETE'])
+@jwt_required()
+async def delete_module_from_course(id, moduleId):
+    return await respond(await run(services.delete_module, get_jwt_identity(), id, moduleId))
+
+###############################################################################################################################################
+############################################################## ENROLL #########################################################################
+
+@app.route('/courses/<int:id>/enroll', methods=['POST'])
+@jwt_required()
+async def enroll_to_course(id):
+    return await respond(await run(services.enroll, get_jwt_identity(), id))
+
+
+@app.route('/courses/<int:id>/enroll/bulk', methods=['POST'])
+@jwt_required()
+async def bulk_enroll_to_course(id):
+    data = await request.get_json()
+    return await respond(await run(services.enroll_cohort, get_jwt_identity(), id, data, await role_registry.current()))
+
+
+@app.route('/courses/<int:id>/stats', methods=['GET'])
+@jwt_required()
+async def get_course_stats(id):
+    return await respond(await run(services.enrollment_stats, get_jwt_identity(), id))
+
+
+###############################################################################################################################################
+############################################################## VIDEO ##########################################################################
+
+@app.route('/courses/<int:id>/modules/<int:moduleId>/video', methods=['PUT'])
+@jwt_required()
+async def set_module_video(id, moduleId):
+    data = await request.get_json(silent=True)
+    error, module, video_key = await run(services.video_module, get_jwt_identity(), id, moduleId, data)
+    if error:
+        return await respond(error)
+    exists = await asyncio.to_thread(media_storage.exists, video_key)
+    return await respond(await run(services.attach_video, module, video_key, exists))
+
+
+@app.route('/courses/<int:id>/modules/<int:moduleId>/video', methods=['GET'])
+@jwt_required()
+async def get_module_video(id, moduleId):
+    return await respond(await run(services.module_video_url, get_jwt_identity(), id, moduleId, media_signer))
+
+
+@app.route('/media/<path:media_key>', methods=['GET'])
+async def stream_media(media_key):
+    expires = request.args.get('expires')
+    if not media_signer.verify(media_key, expires, request.args.get('sig')):
+        return jsonify({"message": "Invalid or expired media URL."}), 403
+    max_age = max(0, int(expires) - int(datetime.now(timezone.utc).timestamp()))
+    if not isinstance(media_storage, LocalStorage):
+        return redirect(await asyncio.to_thread(media_storage.presigned_url, media_key, max_age))
+    if not media_storage.exists(media_key):
+        return jsonify({"message": "Not found."}), 404
+    if media_storage.accel_redirect:
+        return "", 200, {"X-Accel-Redirect": media_storage.accel_path(media_key), "Accept-Ranges": "bytes",
+                         "Cache-Control": f"private, max-age={max_age}", "Content-Type": content_type(media_key)}
+    # ASGI servers have no sendfile, Quart reads the range in chunks (use MEDIA_ACCEL_REDIRECT with nginx in front)
+    response = await send_file(media_storage.path(media_key), mimetype=content_type(media_key), conditional=True)
+    response.headers["Cache-Control"] = f"private, max-age={max_age}"
+    # Like api.py, players only seek when the full response says ranges are supported
+    response.headers["Accept-Ranges"] = "bytes"
+    return response
+
+
+###############################################################################################################################################
+############################################################## PROGRESS #######################################################################
+
+@app.route('/courses/<int:id>/modules/<int:moduleId>/progress', methods=['POST'])
+@jwt_required()
+async def record_progress(id, moduleId):
+    user_name = get_jwt_identity()['user_name']
+    user_id = progress_access.get(user_name, id, moduleId)
+    if user_id is None:
+        user_id = await run(services.progress_user, user_name, id, moduleId)
+        if user_id is None:
+            return jsonify({"message": "Module not found or you are not enrolled to this course."}), 404
+        progress_access.put(user_name, id, moduleId, user_id)
+    event, error = heartbeat_event(user_id, id, moduleId, await request.get_json(silent=True))
+    if error:
+        return jsonify({"message": error}), 400
+
+    await progress_recorder.record(event)
+    if PROGRESS_FLUSH_IN_PROCESS:
+        progress_flusher.start()
+    return jsonify({"message": "Progress recorded."}), 202
+
+
+@app.route('/courses/<int:id>/progress', methods=['GET'])
+@jwt_required()
+async def get_course_progress(id):
+    return await respond(await run(services.course_progress, get_jwt_identity()['user_name'], id))
+
+
+###############################################################################################################################################
+############################################################## QUIZZES ########################################################################
+
+@app.route('/courses/<int:id>/modules/<int:moduleId>/quizzes', methods=['POST'])
+@jwt_required()
+async def create_module_quiz(id, moduleId):
+    data = await request.get_json(silent=True)
+    return await respond(await run(services.add_quiz, get_jwt_identity(), id, moduleId, data))
+
+
+@app.route('/courses/<int:id>/modules/<int:moduleId>/quizzes/<int:quizId>', methods=['GET'])
+@jwt_required()
+async def get_module_quiz(id, moduleId, quizId):
+    return await respond(await run(services.quiz_for, get_jwt_identity(), id, moduleId, quizId))
+
+
+@app.route('/courses/<int:id>/modules/<int:moduleId>/quizzes/<int:quizId>/submissions/bulk', methods=['POST'])
+@jwt_required()
+async def bulk_submit_quiz(id, moduleId, quizId):
+    data = await request.get_json(silent=True)
+    return await respond(await run(services.submit_quiz, get_jwt_identity(), id, moduleId, quizId, data))
+
+
+@app.route('/courses/<int:id>/modules/<int:moduleId>/quizzes/<int:quizId>/results/<int:user_id>', methods=['GET'])
+@jwt_required()
+async def get_quiz_result(id, moduleId, quizId, user_id):
+    return await respond(await run(services.quiz_result, get_jwt_identity(), id, moduleId, quizId, user_id))
+
+
+###############################################################################################################################################
+############################################################## CERTIFICATES ###################################################################
+
+@app.route('/courses/<int:id>/certificate', methods=['POST'])
+@jwt_required()
+async def issue_course_certificate(id):
+    error, user_id = await run(services.certificate_student, get_jwt_identity())
+    if error:
+        return await respond(error)
+    session = get_session()
+    certificates, summary = await issue_certificates_async(session, media_storage, id, user_id)
+    if certificates:
+        await session.commit()
+    return await respond(services.certificate_reply(id, certificates, summary, media_signer))
+
+
+@app.route('/courses/<int:id>/certificates/batch', methods=['POST'])
+@jwt_required()
+async def issue_cohort_certificates(id):
+    return await respond(await run(services.cohort_certificates, get_jwt_identity(), id))
+
+
+###############################################################################################################################################
+############################################################## JOBS ###########################################################################
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+@jwt_required()
+async def get_job(job_id):
+    return await respond(services.job_reply(get_jwt_identity(), await job_queue.get(job_id)))
+
+
+###############################################################################################################################################
+############################################################## EVENTS #########################################################################
+
+# Server-Sent Events of a course (module added / changed, course changed) for its instructor, admins and enrolled
+# students, fanned out from Redis pub/sub by the event hub (see events.py). Only served in async mode.
+# Opened with the Authorization header or, from a browser's EventSource, with ?token= from the route below.
+@app.route('/courses/<int:id>/events', methods=['GET'])
+async def course_event_stream(id):
+    token = request.args.get('token')
+    if token:
+        claims = read_stream_token(stream_signer, token, id)
+        if claims is None:
+            return jsonify({"message": "Invalid or expired stream token."}), 401
+        if await is_token_revoked(claims['jti']):
+            return jsonify({"message": "Your token has been revoked. Please login again."}), 401
+        identity, jti, expires = claims['sub'], claims['jti'], claims['exp']
+    else:
+        error = await authenticate()
+        if error is not None:
+            return error
+        identity, jti, expires = get_jwt_identity(), get_jwt()['jti'], get_jwt()['exp']
+    error = await run(services.course_stream_access, identity, id)
+    if error:
+        return await respond(error)
+
+    async def check():
+        # Every EVENTS_RECHECK seconds: logged out, or no longer allowed on the course (own session, see below)
+        if await is_token_revoked(jti):
+            return "revoked"
+        async with Session(bind=get_engine()) as check_session:
+            error = await check_session.run_sync(services.course_stream_access, identity, id)
+        return "forbidden" if error else None
+
+    subscriber = await event_hub.subscribe(id)
+    # The request session is closed by the teardown before the body is streamed, an open stream holds no connection
+    body = event_hub.stream(subscriber, resume=bool(request.headers.get('Last-Event-ID')), expires=expires, check=check)
+    response = app.response_class(body, mimetype='text/event-stream', headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"})
+    # Open until the client leaves or the stream ends, not RESPONSE_TIMEOUT
+    response.timeout = None
+    return response
+
+
+# Stream token for EventSource, same as api.py
+@app.route('/courses/<int:id>/events/token', methods=['POST'])
+@jwt_required()
+async def course_event_stream_token(id):
+    return await respond(await run(services.event_stream_token, get_jwt_identity(), id, get_jwt(), stream_signer))
+
+
+###############################################################################################################################################
+############################################################## EXPORTS ########################################################################
+
+# Same export as api.py, rows come from an async server side cursor (see exports.py)
+@app.route('/admin/export/<name>', methods=['GET'])
+@jwt_required()
+async def export(name):
+    error, format, columns, statement = services.export_request(get_jwt_identity(), name, request.args)
+    if error:
+        return await respond(error)
+
+    async def generate():
+        # Own session, g.db_session is closed by the teardown before the body is streamed
+        async with Session(bind=get_engine()) as export_session:
+            async for chunk in export_chunks_async(export_session, format, columns, statement):
+                yield chunk.encode('utf-8')
+
+    response = app.response_class(generate(), mimetype=EXPORT_FORMATS[format], headers=services.export_headers(name, format))
+    # No RESPONSE_TIMEOUT for the body, a large export takes longer than the default 60 seconds
+    response.timeout = None
+    return response
+
+
+
+###############################################################################################################################################
+############################################################## HEALTH #########################################################################
+
+# Liveness: the process answers (no database or Redis calls)
+@app.route('/health', methods=['GET'])
+async def health():
+    return jsonify({"status": "ok"}), 200
+
+
+warmed = asyncio.Event()
+
+# Readiness, same as api.py: the first successful call also warms the pool, the bcrypt workers, the revocation
+# filter and the progress flusher
+@app.route('/ready', methods=['GET'])
+async def ready():
+    start = time.perf_counter()
+    warm = not warmed.is_set()
+    checks = {}
+    try:
+        await warm_pool(DB_POOL_WARM if warm else 1)
+        await role_registry.current()
+        checks["database"] = "ok"
+    except (SQLAlchemyError, RuntimeError, OSError) as e:
+        checks["database"] = f"error: {type(e).__name__}"
+    try:
+        await redis_client.ping()
+        checks["redis"] = "ok"
+    except redis.RedisError as e:
+        checks["redis"] = f"error: {type(e).__name__}"
+
+    is_ready = all(check == "ok" for check in checks.values())
+    if is_ready and warm:
+        await asyncio.to_thread(warm_up_hashing)
+        revocation_filter.start()
+        replica_pool.start()
+        if PROGRESS_FLUSH_IN_PROCESS:
+            progress_flusher.start()
+        warmed.set()
+    return jsonify({
+        "status": "ready" if is_ready else "not ready",
+        "checks": checks,
+        **({"replicas": replica_pool.status()} if replica_pool else {}),
+        "warmed": warm and is_ready,
+        "ms": round((time.perf_counter() - start) * 1000, 1),
+    }), 200 if is_ready else 503
+
+
+###############################################################################################################################################
+############################################################## METRICS ########################################################################
+
+# Prometheus scrape endpoint (text format), see metrics.py
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    if not METRICS_ENABLED:
+        return jsonify({"message": "Metrics are disabled"}), 404
+    if not metrics_authorized(request.headers.get('Authorization')):
+        return jsonify({"message": "Unauthorized"}), 401
+    return metrics_registry.render(), 200, {"Content-Type": PROMETHEUS_CONTENT_TYPE}
+
+
+# Start the Quart application (hypercorn under the hood)
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=5000)
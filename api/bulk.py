@@ -0,0 +1,256 @@
+import os
+from sqlalchemy import select, or_
+from sqlalchemy.dialects import postgresql, sqlite
+try:
+    from .models import User, UserProfile, Enroll, RoleType
+    from .roles import load_roles
+    from .db import Session
+except ImportError:
+    from models import User, UserProfile, Enroll, RoleType
+    from roles import load_roles
+    from db import Session
+
+
+######################################################## BULK OPERATIONS #######################################################################
+# Set based versions of enroll/register for whole cohorts: one multi-row INSERT ... ON CONFLICT DO NOTHING per chunk
+# instead of a lookup + insert + commit per row. Every input row gets a result so the caller knows what happened.
+#
+# Bulk register: the route checks the rows and hashes the passwords of the users that will be created (on the bcrypt
+# pool, see passwords.py), then queues a job (see jobs.py) with the password hashes. A worker creates the users and
+# the report is the job result (GET /jobs/<id>). Plain passwords are never written to Redis, the job hash only has
+# bcrypt hashes and the worker removes the payload once the job finished. At cost 12 one hash is about 0.25s, so
+# 1000 rows on 4 hash workers keep the request about a minute.
+#
+# .env settings:
+# BULK_REGISTER_MAX_ROWS=1000    users per bulk register request
+
+BULK_CHUNK_SIZE = 1000
+BULK_MAX_ROWS = 10000
+BULK_REGISTER_MAX_ROWS = int(os.getenv("BULK_REGISTER_MAX_ROWS", 1000))
+BULK_REGISTER_JOB = "users.bulk_register"
+
+REGISTER_REQUIRED_FIELDS = ('user_name', 'email', 'password', 'role', 'first_name', 'last_name')
+REGISTER_OPTIONAL_FIELDS = ('bio', 'profile_picture', 'additional_info')
+
+
+def insert_ignore(session, table):
+    # INSERT ... ON CONFLICT DO NOTHING for the database behind the session (PostgreSQL or SQLite)
+    dialect = session.get_bind().dialect.name
+    insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+    return insert(table)
+
+
+def chunks(rows, size=BULK_CHUNK_SIZE):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def bulk_enroll(session, course_id, user_ids, roles=None):
+    # Returns one result per requested id: enrolled / already_enrolled / not_found / not_student / duplicate_in_request
+    # roles: the role registry's Roles (loaded from the database when not given)
+    student_role_id = (roles or load_roles(session)).id_of(RoleType.STUDENT)
+    results = {}
+    unique_ids = []
+    for user_id in user_ids:
+        if user_id in results:
+            continue
+        results[user_id] = None
+        unique_ids.append(user_id)
+
+    students = set()
+    for chunk in chunks(unique_ids):
+        rows = session.execute(select(User.id, User.role_id).where(User.id.in_(chunk))).all()
+        for row in rows:
+            if row.role_id == student_role_id:
+                students.add(row.id)
+            else:
+                results[row.id] = "not_student"
+
+    to_enroll = [user_id for user_id in unique_ids if user_id in students]
+    for chunk in chunks(to_enroll):
+        statement = (
+            insert_ignore(session, Enroll.__table__)
+            .values([{"course_id": course_id, "user_id": user_id} for user_id in chunk])
+            .on_conflict_do_nothing(index_elements=['course_id', 'user_id'])
+            .returning(Enroll.__table__.c.user_id)
+        )
+        inserted = set(session.execute(statement).scalars())
+        for user_id in chunk:
+            results[user_id] = "enrolled" if user_id in inserted else "already_enrolled"
+
+    for user_id in unique_ids:
+        if results[user_id] is None:
+            results[user_id] = "not_found"
+
+    seen = set()
+    report = []
+    for user_id in user_ids:
+        report.append({"user_id": user_id, "status": "duplicate_in_request" if user_id in seen else results[user_id]})
+        seen.add(user_id)
+    return report
+
+
+def validate_register_row(row):
+    # Same rules as /auth/register, returns an error message or None
+    if not isinstance(row, dict):
+        return "Row must be an object"
+    for key in row.keys():
+        if key not in REGISTER_REQUIRED_FIELDS and key not in REGISTER_OPTIONAL_FIELDS:
+            return f"Unexpected field: {key}"
+    for field in REGISTER_REQUIRED_FIELDS:
+        if field not in row or not row[field]:
+            return f"{field} is required!"
+    # Every field is text (they are stripped / lowercased below), a number or list here would fail the whole request
+    for field, value in row.items():
+        if not isinstance(value, str):
+            return f"{field} must be a string!"
+    try:
+        RoleType(row['role'].lower())
+    except ValueError:
+        return "Invalid role provided. Choose from 'admin', 'instructor', or 'student'."
+    return None
+
+
+def plan_bulk_register(session, rows):
+    # rows are already validated. Finds which rows can be created, so only their passwords need to be hashed.
+    # Returns (results, new_rows): results has already_exists / duplicate_in_request for the skipped rows
+    results = [None] * len(rows)
+
+    # Users that already exist (same rule as register: user_name or email taken). Names and emails are kept apart, a
+    # user_name that is someone else's email is not taken
+    existing_names, existing_emails = set(), set()
+    for chunk in chunks(rows):
+        names = [row['user_name'].strip() for row in chunk]
+        emails = [row['email'].strip() for row in chunk]
+        for user_name, email in session.execute(
+            select(User.user_name, User.email).where(or_(User.user_name.in_(names), User.email.in_(emails)))
+        ):
+            existing_names.add(user_name)
+            existing_emails.add(email)
+
+    seen_names, seen_emails = set(), set()
+    new_rows = []
+    for index, row in enumerate(rows):
+        user_name, email = row['user_name'].strip(), row['email'].strip()
+        if user_name in existing_names or email in existing_emails:
+            results[index] = "already_exists"
+        elif user_name in seen_names or email in seen_emails:
+            results[index] = "duplicate_in_request"
+        else:
+            new_rows.append(index)
+        seen_names.add(user_name)
+        seen_emails.add(email)
+    return results, new_rows
+
+
+def bulk_register(session, rows, results, new_rows, hashed_passwords, roles=None):
+    # Inserts users and profiles for new_rows (hashed_passwords[i] belongs to new_rows[i]) and fills in results
+    roles = roles or load_roles(session)
+    password_hashes = dict(zip(new_rows, hashed_passwords))
+
+    for chunk in chunks(new_rows):
+        statement = (
+            insert_ignore(session, User.__table__)
+            .values([{
+                "user_name": rows[index]['user_name'].strip(),
+                "email": rows[index]['email'].strip(),
+                "password_hash": password_hashes[index],
+                "role_id": roles.id_of(RoleType(rows[index]['role'].lower())),
+            } for index in chunk])
+            # No conflict target: a user_name or an email registered in the meantime only skips that row
+            .on_conflict_do_nothing()
+            .returning(User.__table__.c.id, User.__table__.c.user_name, User.__table__.c.email)
+        )
+        user_ids = {(user_name, email): user_id for user_id, user_name, email in session.execute(statement)}
+
+        profiles = []
+        for index in chunk:
+            row = rows[index]
+            user_id = user_ids.get((row['user_name'].strip(), row['email'].strip()))
+            if user_id is None:
+                # Someone registered the same user_name or email in the meantime
+                results[index] = "already_exists"
+                continue
+            results[index] = "created"
+            profiles.append({
+                "user_id": user_id,
+                "first_name": row['first_name'].strip(),
+                "last_name": row['last_name'].strip(),
+                "bio": row.get('bio', '').strip(),
+                "profile_picture": row.get('profile_picture', ''),
+                "additional_info": row.get('additional_info', ''),
+            })
+        if profiles:
+            session.execute(UserProfile.__table__.insert(), profiles)
+    return results
+
+
+def parse_bulk_user_ids(data):
+    # Body of the bulk enroll route: {"user_ids": [1, 2, 3]}, returns (user_ids, error message)
+    user_ids = (data or {}).get('user_ids')
+    if not isinstance(user_ids, list) or not user_ids:
+        return None, "user_ids must be a non empty list."
+    if any(not isinstance(user_id, int) or isinstance(user_id, bool) for user_id in user_ids):
+        return None, "user_ids must contain only user ids (integers)."
+    if len(user_ids) > BULK_MAX_ROWS:
+        return None, f"At most {BULK_MAX_ROWS} users per request."
+    return user_ids, None
+
+
+def parse_bulk_users(data):
+    # Body of the bulk register route: {"users": [{...register fields...}, ...]}
+    # Returns (users, errors per row, indexes of the valid rows, error message)
+    users = (data or {}).get('users')
+    if not isinstance(users, list) or not users:
+        return None, None, None, "users must be a non empty list."
+    if len(users) > BULK_REGISTER_MAX_ROWS:
+        return None, None, None, f"At most {BULK_REGISTER_MAX_ROWS} users per request."
+    errors = [validate_register_row(row) for row in users]
+    valid = [index for index, error in enumerate(errors) if error is None]
+    return users, errors, valid, None
+
+
+def bulk_register_report(users, errors, valid, results):
+    # One entry per input row, in the same order as the request
+    statuses = dict(zip(valid, results))
+    report = []
+    for index, row in enumerate(users):
+        entry = {"index": index, "email": row.get('email') if isinstance(row, dict) else None}
+        if errors[index] is not None:
+            entry.update(status="invalid", message=errors[index])
+        else:
+            entry["status"] = statuses[index]
+        report.append(entry)
+    return report
+
+
+def bulk_register_job(users, errors, valid, rows, results, new_rows, hashed_passwords):
+    # Payload of the bulk register job: the report so far (the rows to create are "queued") and the rows to create
+    # with their index in the request and their password hash instead of the password
+    report = bulk_register_report(users, errors, valid, results)
+    queued = []
+    for index, password_hash in zip(new_rows, hashed_passwords):
+        row = {field: value for field, value in rows[index].items() if field != 'password'}
+        queued.append({**row, "index": valid[index], "password_hash": password_hash})
+        report[valid[index]]["status"] = "queued"
+    return {"report": report, "rows": queued}
+
+
+def register_users(payload):
+    # Job handler of bulk register (payload from bulk_register_job). Safe to run twice: users created by a first run
+    # are "already_exists" in the second one
+    report, rows = payload['report'], payload['rows']
+    with Session() as session:
+        # Checked again, users may have registered since the request
+        results, new_rows = plan_bulk_register(session, rows)
+        bulk_register(session, rows, results, new_rows, [rows[index]['password_hash'] for index in new_rows])
+        session.commit()
+    for row, status in zip(rows, results):
+        report[row['index']]["status"] = status
+    created = sum(1 for entry in report if entry['status'] == 'created')
+    return {"message": f"{created} users created.", "results": report}
+
+
+BULK_HANDLERS = {
+    BULK_REGISTER_JOB: register_users,
+}
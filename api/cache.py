@@ -0,0 +1,176 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import redis
+
+
+######################################################## COURSE CACHE ##########################################################################
+# Read-through cache for the course catalog and course content.
+# Every course has a version counter in Redis and the cache keys include it, so a write only needs to INCR the
+# version and the old entries are never read again (they expire by TTL). The catalog list has its own version.
+
+CACHE_TTL = int(os.getenv("CACHE_TTL", 300))
+CACHE_LOCK_TIMEOUT = float(os.getenv("CACHE_LOCK_TIMEOUT", 5))
+CACHE_LOCK_WAIT = float(os.getenv("CACHE_LOCK_WAIT", 0.05))
+
+
+class CourseCache:
+    def __init__(self, redis_client, ttl=CACHE_TTL, lock_timeout=CACHE_LOCK_TIMEOUT, lock_wait=CACHE_LOCK_WAIT):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self.lock_wait = lock_wait
+        self._stats = {"hits": 0, "misses": 0, "lock_waits": 0, "errors": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def _version(self, version_key):
+        return int(self.redis.get(version_key) or 0)
+
+    def catalog_key(self, *parts):
+        version = self._version("cache:catalog:version")
+        return ":".join(["cache:catalog", f"v{version}", *map(str, parts)])
+
+    def course_key(self, course_id, *parts):
+        version = self._version(f"cache:course:{course_id}:version")
+        return ":".join([f"cache:course:{course_id}", f"v{version}", *map(str, parts)])
+
+    def invalidate_catalog(self):
+        self._safe(self.redis.incr, "cache:catalog:version")
+
+    def invalidate_course(self, course_id):
+        self._safe(self.redis.incr, f"cache:course:{course_id}:version")
+
+    def get_or_load(self, key_func, loader):
+        # key_func builds the versioned key, loader returns (payload, status) and only 200 responses are stored
+        try:
+            key = key_func()
+            cached = self.redis.get(key)
+        except redis.RedisError:
+            # Redis is down, serve from the database
+            self._count("errors")
+            return loader()
+
+        if cached is not None:
+            self._count("hits")
+            return json.loads(cached), 200
+
+        self._count("misses")
+        # Single flight: only the request holding the lock loads from the database, the others wait for it
+        lock_key = f"lock:{key}"
+        try:
+            acquired = self.redis.set(lock_key, 1, nx=True, ex=max(1, int(self.lock_timeout)))
+            if not acquired:
+                self._count("lock_waits")
+                cached = self._wait_for(key, lock_key)
+                if cached is not None:
+                    return json.loads(cached), 200
+        except redis.RedisError:
+            self._count("errors")
+            return loader()
+        if not acquired:
+            # The lock holder failed or is too slow, load it ourselves
+            return loader()
+
+        try:
+            payload, status = loader()
+            if status == 200:
+                self._safe(self.redis.set, key, json.dumps(payload), ex=self.ttl)
+            return payload, status
+        finally:
+            self._safe(self.redis.delete, lock_key)
+
+    def _wait_for(self, key, lock_key):
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline:
+            time.sleep(self.lock_wait)
+            cached = self.redis.get(key)
+            if cached is not None or not self.redis.exists(lock_key):
+                return cached
+        return None
+
+    def _safe(self, command, *args, **kwargs):
+        try:
+            return command(*args, **kwargs)
+        except redis.RedisError:
+            self._count("errors")
+
+
+class AsyncCourseCache(CourseCache):
+    # Same cache (same keys) on a redis.asyncio client, used by the ASGI app (asgi.py)
+
+    async def _version(self, version_key):
+        return int(await self.redis.get(version_key) or 0)
+
+    async def catalog_key(self, *parts):
+        version = await self._version("cache:catalog:version")
+        return ":".join(["cache:catalog", f"v{version}", *map(str, parts)])
+
+    async def course_key(self, course_id, *parts):
+        version = await self._version(f"cache:course:{course_id}:version")
+        return ":".join([f"cache:course:{course_id}", f"v{version}", *map(str, parts)])
+
+    async def invalidate_catalog(self):
+        await self._safe(self.redis.incr, "cache:catalog:version")
+
+    async def invalidate_course(self, course_id):
+        await self._safe(self.redis.incr, f"cache:course:{course_id}:version")
+
+    async def get_or_load(self, key_func, loader):
+        try:
+            key = await key_func()
+            cached = await self.redis.get(key)
+        except redis.RedisError:
+            self._count("errors")
+            return await loader()
+
+        if cached is not None:
+            self._count("hits")
+            return json.loads(cached), 200
+
+        self._count("misses")
+        lock_key = f"lock:{key}"
+        try:
+            acquired = await self.redis.set(lock_key, 1, nx=True, ex=max(1, int(self.lock_timeout)))
+            if not acquired:
+                self._count("lock_waits")
+                cached = await self._wait_for(key, lock_key)
+                if cached is not None:
+                    return json.loads(cached), 200
+        except redis.RedisError:
+            self._count("errors")
+            return await loader()
+        if not acquired:
+            return await loader()
+
+        try:
+            payload, status = await loader()
+            if status == 200:
+                await self._safe(self.redis.set, key, json.dumps(payload), ex=self.ttl)
+            return payload, status
+        finally:
+            await self._safe(self.redis.delete, lock_key)
+
+    async def _wait_for(self, key, lock_key):
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.lock_wait)
+            cached = await self.redis.get(key)
+            if cached is not None or not await self.redis.exists(lock_key):
+                return cached
+        return None
+
+    async def _safe(self, command, *args, **kwargs):
+        try:
+            return await command(*args, **kwargs)
+        except redis.RedisError:
+            self._count("errors")
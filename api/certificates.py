@@ -0,0 +1,426 @@
+import argparse
+import asyncio
+import hashlib
+import logging
+import math
+import multiprocessing
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
+from sqlalchemy import select, update, func
+try:
+    from .models import User, UserProfile, Course, Module, Enroll, ModuleProgress, Certificate
+    from .bulk import insert_ignore, chunks
+    from .db import Session
+except ImportError:
+    from models import User, UserProfile, Course, Module, Enroll, ModuleProgress, Certificate
+    from bulk import insert_ignore, chunks
+    from db import Session
+
+
+######################################################## CERTIFICATES ##########################################################################
+# Course completion certificates (PDF) for students that completed every module of a course (module_progress).
+#
+# - Content addressed: a certificate is stored in the media storage as certificates/<key[:2]>/<key>.pdf where the key is
+#   sha256("<user_id>:<course_id>:<template version>"). Rendering only depends on the certificates row (the issue
+#   date is the date of the first issue), so asking again is a cache hit: the file exists and nothing is rendered.
+#   Changing render_certificate() means bumping CERTIFICATE_TEMPLATE_VERSION, every certificate then gets a new key
+#   and is rendered again the next time it is asked for.
+# - Rendering (a hand written PDF, no dependency) runs in a process pool like bcrypt (passwords.py), so a request
+#   does not hold the web worker's CPU and a batch uses all cores.
+# - The PDF is downloaded from a signed /media URL like the module videos, with the same caching headers. The key can
+#   be computed by anyone, the URL signature is what gives access.
+# - Batch mode: POST /courses/<id>/certificates/batch queues a job (jobs.py), the job worker issues the certificates
+#   of everyone that completed the course and reports the throughput in the job result. Same thing from a shell:
+#   python api/certificates.py --course 3
+#
+# .env settings:
+# CERT_WORKERS=4         processes rendering certificates (0 renders inline)
+# CERT_TIMEOUT=30        seconds a request waits for its certificate
+# CERT_BATCH_CHUNK=16    certificates sent to a pool process at a time in batch mode
+
+CERT_WORKERS = int(os.getenv("CERT_WORKERS", os.cpu_count() or 1))
+CERT_TIMEOUT = float(os.getenv("CERT_TIMEOUT", 30))
+CERT_BATCH_CHUNK = int(os.getenv("CERT_BATCH_CHUNK", 16))
+
+# Bump when the rendered PDF changes
+CERTIFICATE_TEMPLATE_VERSION = 1
+
+COURSE_CERTIFICATES_JOB = "certificates.course"
+
+logger = logging.getLogger(__name__)
+
+
+class CertificatesBusy(Exception):
+    # The pool did not render in CERT_TIMEOUT seconds
+    pass
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {"rendered": 0, "cache_hits": 0, "render_seconds": 0.0}
+
+
+def stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _count(rendered, cache_hits, seconds):
+    with _stats_lock:
+        _stats["rendered"] += rendered
+        _stats["cache_hits"] += cache_hits
+        _stats["render_seconds"] += seconds
+
+
+def certificate_key(user_id, course_id, template_version=None):
+    template_version = CERTIFICATE_TEMPLATE_VERSION if template_version is None else template_version
+    return hashlib.sha256(f"{user_id}:{course_id}:{template_version}".encode()).hexdigest()
+
+
+def certificate_media_key(key):
+    return f"certificates/{key[:2]}/{key}.pdf"
+
+
+######################################################## RENDERING #############################################################################
+# A4 landscape, the PDF standard fonts (no font files), text centered with the Helvetica widths (1/1000 em, ASCII
+# 32-126, other characters count as 556). A guilloche ring drawn from the key sits behind the text.
+
+PAGE_WIDTH, PAGE_HEIGHT = 842, 595
+TEXT_MAX_WIDTH = 700
+
+_HELVETICA_WIDTHS = (
+    "278 278 355 556 556 889 667 191 333 333 389 584 278 333 278 278 556 556 556 556 556 556 556 556 556 556 278 278 "
+    "584 584 584 556 1015 667 667 722 722 667 611 778 722 278 500 667 556 833 722 778 667 778 722 667 611 722 667 944 "
+    "667 667 611 278 278 278 469 556 333 556 556 500 556 556 278 556 556 222 222 500 222 833 556 556 556 556 333 500 "
+    "278 556 500 722 500 500 500 334 260 334 584"
+)
+_HELVETICA_BOLD_WIDTHS = (
+    "278 333 474 556 556 889 722 238 333 333 389 584 278 333 278 278 556 556 556 556 556 556 556 556 556 556 333 333 "
+    "584 584 584 611 975 722 722 722 722 667 611 778 722 278 556 722 611 833 722 778 667 778 722 667 611 722 667 944 "
+    "667 667 611 333 278 333 584 556 333 556 611 556 611 556 333 611 611 278 278 556 278 889 611 611 611 611 389 556 "
+    "333 611 556 778 556 556 500 389 280 389 584"
+)
+_WIDTHS = {
+    "F1": dict(zip(range(32, 127), map(int, _HELVETICA_WIDTHS.split()))),
+    "F2": dict(zip(range(32, 127), map(int, _HELVETICA_BOLD_WIDTHS.split()))),
+}
+
+
+def _encode(text):
+    # WinAnsiEncoding (cp1252), characters it does not have become "?"
+    return text.encode('cp1252', errors='replace')
+
+
+def _text_width(data, font, size):
+    widths = _WIDTHS[font]
+    return sum(widths.get(byte, 556) for byte in data) * size / 1000
+
+
+def _pdf_string(data):
+    return b"(" + data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+def _centered_text(text, font, size, y, min_size=10):
+    # Long names and titles are made smaller until they fit TEXT_MAX_WIDTH
+    data = _encode(text)
+    width = _text_width(data, font, size)
+    if width > TEXT_MAX_WIDTH:
+        size = max(min_size, size * TEXT_MAX_WIDTH / width)
+        width = _text_width(data, font, size)
+    x = (PAGE_WIDTH - width) / 2
+    return b"BT /%s %.2f Tf %.2f %.2f Td %s Tj ET\n" % (font.encode(), size, x, y, _pdf_string(data))
+
+
+def _guilloche(key):
+    # Wavy rings around the page center, the wave count and phases come from the key so every certificate has its
+    # own pattern
+    seed = bytes.fromhex(key[:16])
+    waves = 18 + seed[0] % 12
+    lines = []
+    for ring in range(8):
+        radius = 150 + ring * 9
+        amplitude = 10 + seed[1 + ring % 7] % 8
+        phase = seed[ring % 8] / 255 * math.tau
+        points = []
+        for step in range(721):
+            t = step / 720 * math.tau
+            r = radius + amplitude * math.cos(waves * t + phase)
+            points.append(b"%.2f %.2f" % (PAGE_WIDTH / 2 + r * 1.6 * math.cos(t), PAGE_HEIGHT / 2 + r * math.sin(t)))
+        lines.append(points[0] + b" m " + b" l ".join(points[1:]) + b" l S\n")
+    return b"".join(lines)
+
+
+def _content(fields):
+    return b"".join([
+        # frame and pattern
+        b"q 0.15 0.25 0.45 RG 4 w 20 20 802 555 re S 1 w 30 30 782 535 re S Q\n",
+        b"q 0.86 0.90 0.96 RG 0.4 w\n", _guilloche(fields["key"]), b"Q\n",
+        b"0.12 0.16 0.28 rg\n",
+        _centered_text("CERTIFICATE OF COMPLETION", "F2", 34, 480),
+        _centered_text("This certifies that", "F1", 16, 420),
+        _centered_text(fields["student"], "F2", 30, 370),
+        _centered_text("has completed the course", "F1", 16, 325),
+        _centered_text(fields["course"], "F2", 24, 275),
+        _centered_text(f"Instructor: {fields['instructor']}", "F1", 14, 220),
+        _centered_text(f"Issued on {fields['issued_on']}  ·  Certificate {fields['key'][:16]}", "F1", 10, 60),
+    ])
+
+
+def render_certificate(fields):
+    # fields: {"key", "student", "course", "instructor", "issued_on" (YYYY-MM-DD)} -> PDF bytes. The same fields
+    # always give the same bytes (no current time anywhere), runs in the pool processes
+    content = zlib.compress(_content(fields), 6)
+    issued = fields["issued_on"].replace('-', '')
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Resources << /Font << /F1 4 0 R /F2 5 0 R >> >> "
+        b"/Contents 6 0 R >>" % (PAGE_WIDTH, PAGE_HEIGHT),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>",
+        b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(content) + content + b"\nendstream",
+        b"<< /Title %s /Producer (Studyo certificates v%d) /CreationDate (D:%s000000Z) >>" % (
+            _pdf_string(_encode(f"{fields['course']} - {fields['student']}")), CERTIFICATE_TEMPLATE_VERSION, issued.encode()),
+    ]
+    pdf = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    file_id = fields["key"][:32].encode()
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R /Info 7 0 R /ID [<%s> <%s>] >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1, file_id, file_id, xref)
+    return bytes(pdf)
+
+
+def _render_chunk(chunk):
+    return [render_certificate(fields) for fields in chunk]
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # spawn so the workers don't inherit the web server threads and open connections
+                _executor = ProcessPoolExecutor(max_workers=CERT_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _executor
+
+
+def _replace_executor(broken):
+    # A worker process that died (e.g. killed for memory) breaks the pool for good, the next render starts a new one
+    global _executor
+    with _executor_lock:
+        if _executor is broken:
+            logger.warning("A certificate worker process died, starting a new pool")
+            _executor = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def render_certificates(certificates, workers=None):
+    # PDFs of the certificates in the same order. One certificate is one pool task, a batch is sent in chunks of
+    # CERT_BATCH_CHUNK (fewer round trips to the processes). Tried once more on a new pool when the pool broke.
+    workers = CERT_WORKERS if workers is None else workers
+    if not certificates:
+        return []
+    if workers <= 0:
+        return _render_chunk(certificates)
+    for attempt in range(2):
+        executor = _get_executor()
+        try:
+            futures = [executor.submit(_render_chunk, chunk) for chunk in chunks(certificates, CERT_BATCH_CHUNK)]
+            return [pdf for future in futures for pdf in future.result(timeout=CERT_TIMEOUT)]
+        except FutureTimeoutError:
+            raise CertificatesBusy()
+        except BrokenProcessPool:
+            _replace_executor(executor)
+    raise CertificatesBusy()
+
+
+async def render_certificates_async(certificates):
+    # Same as render_certificates, the event loop keeps serving other requests while the pool works (asgi.py)
+    if not certificates:
+        return []
+    if CERT_WORKERS <= 0:
+        return await asyncio.to_thread(_render_chunk, certificates)
+    for attempt in range(2):
+        executor = _get_executor()
+        try:
+            futures = [asyncio.wrap_future(executor.submit(_render_chunk, chunk)) for chunk in chunks(certificates, CERT_BATCH_CHUNK)]
+            results = await asyncio.wait_for(asyncio.gather(*futures), CERT_TIMEOUT)
+            return [pdf for chunk in results for pdf in chunk]
+        except asyncio.TimeoutError:
+            raise CertificatesBusy()
+        except BrokenProcessPool:
+            _replace_executor(executor)
+    raise CertificatesBusy()
+
+
+######################################################## ISSUING ###############################################################################
+
+def _completed_statement(course_id, user_id=None):
+    # Enrollments of the course whose student completed every module (modules still in the course only), with the
+    # certificate row when there is one
+    module_count = select(func.count(Module.id)).where(Module.course_id == course_id).scalar_subquery()
+    completed = (
+        select(ModuleProgress.user_id, func.count(ModuleProgress.id).label('modules_done'))
+        .join(Module, Module.id == ModuleProgress.module_id)
+        .where(ModuleProgress.course_id == course_id, Module.course_id == course_id, ModuleProgress.completed.is_(True))
+        .group_by(ModuleProgress.user_id)
+        .subquery()
+    )
+    statement = (
+        select(Enroll.id, Enroll.user_id, User.user_name, UserProfile.first_name, UserProfile.last_name,
+               Certificate.id.label('certificate_id'), Certificate.template_version, Certificate.issued_at)
+        .join(User, User.id == Enroll.user_id)
+        .join(completed, completed.c.user_id == Enroll.user_id)
+        .outerjoin(UserProfile, UserProfile.user_id == Enroll.user_id)
+        .outerjoin(Certificate, Certificate.enroll_id == Enroll.id)
+        .where(Enroll.course_id == course_id, completed.c.modules_done >= module_count)
+        .order_by(Enroll.id)
+    )
+    if user_id is not None:
+        statement = statement.where(Enroll.user_id == user_id)
+    return statement
+
+
+def _display_name(first_name, last_name, user_name):
+    name = f"{first_name or ''} {last_name or ''}".strip()
+    return name or user_name
+
+
+def plan_certificates(session, course_id, user_id=None):
+    # Certificate fields (see render_certificate) for every student that completed the course (or only user_id),
+    # and how many certificates rows were created. New rows are inserted (ON CONFLICT DO NOTHING, a batch and the
+    # student can ask at the same time) and rows of an older template get the new key, the caller commits.
+    course = session.execute(
+        select(Course.title, User.user_name, UserProfile.first_name, UserProfile.last_name)
+        .join(User, User.id == Course.course_instructor_id)
+        .outerjoin(UserProfile, UserProfile.user_id == User.id)
+        .where(Course.id == course_id)
+    ).first()
+    if course is None:
+        return None, 0
+    statement = _completed_statement(course_id, user_id)
+    rows = session.execute(statement).all()
+
+    now = datetime.now(timezone.utc)
+    new_rows = [{
+        "enroll_id": row.id,
+        "course_id": course_id,
+        "user_id": row.user_id,
+        "template_version": CERTIFICATE_TEMPLATE_VERSION,
+        "certificate_key": certificate_key(row.user_id, course_id),
+        "issued_at": now,
+    } for row in rows if row.certificate_id is None]
+    outdated = [{
+        "id": row.certificate_id,
+        "template_version": CERTIFICATE_TEMPLATE_VERSION,
+        "certificate_key": certificate_key(row.user_id, course_id),
+    } for row in rows if row.certificate_id is not None and row.template_version != CERTIFICATE_TEMPLATE_VERSION]
+    for chunk in chunks(new_rows):
+        session.execute(insert_ignore(session, Certificate.__table__).on_conflict_do_nothing(index_elements=['enroll_id']), chunk)
+    if outdated:
+        session.execute(update(Certificate), outdated)
+    if new_rows:
+        # issued_at of the rows another request inserted first
+        rows = session.execute(statement).all()
+
+    instructor = _display_name(course.first_name, course.last_name, course.user_name)
+    certificates = [{
+        "key": certificate_key(row.user_id, course_id),
+        "user_id": row.user_id,
+        "student": _display_name(row.first_name, row.last_name, row.user_name),
+        "course": course.title,
+        "instructor": instructor,
+        "issued_on": (row.issued_at or now).strftime('%Y-%m-%d'),
+    } for row in rows]
+    return certificates, len(new_rows)
+
+
+def missing_certificates(storage, certificates):
+    # The certificates whose file is not in the media storage yet (the others are cache hits)
+    return [fields for fields in certificates if not storage.exists(certificate_media_key(fields["key"]))]
+
+
+def save_certificates(storage, certificates, pdfs):
+    for fields, pdf in zip(certificates, pdfs):
+        storage.save(certificate_media_key(fields["key"]), pdf)
+
+
+def certificate_summary(certificates, issued, rendered, seconds):
+    return {
+        "completed": len(certificates),
+        "issued": issued,
+        "rendered": rendered,
+        "cached": len(certificates) - rendered,
+        "render_seconds": round(seconds, 3),
+        "certificates_per_s": round(rendered / seconds, 1) if rendered and seconds else None,
+    }
+
+
+def issue_certificates(session, storage, course_id, user_id=None, workers=None):
+    # Plans, renders the missing files and stores them: (certificates, summary), None when the course does not
+    # exist. The files are stored before the caller commits the rows.
+    certificates, issued = plan_certificates(session, course_id, user_id)
+    if certificates is None:
+        return None, None
+    missing = missing_certificates(storage, certificates)
+    start = time.perf_counter()
+    save_certificates(storage, missing, render_certificates(missing, workers))
+    seconds = time.perf_counter() - start
+    _count(len(missing), len(certificates) - len(missing), seconds)
+    return certificates, certificate_summary(certificates, issued, len(missing), seconds)
+
+
+async def issue_certificates_async(session, storage, course_id, user_id=None):
+    # Same as issue_certificates on an AsyncSession (asgi.py), storage calls in a thread
+    certificates, issued = await session.run_sync(plan_certificates, course_id, user_id)
+    if certificates is None:
+        return None, None
+    missing = await asyncio.to_thread(missing_certificates, storage, certificates)
+    start = time.perf_counter()
+    pdfs = await render_certificates_async(missing)
+    await asyncio.to_thread(save_certificates, storage, missing, pdfs)
+    seconds = time.perf_counter() - start
+    _count(len(missing), len(certificates) - len(missing), seconds)
+    return certificates, certificate_summary(certificates, issued, len(missing), seconds)
+
+
+def issue_course_certificates(payload, workers=None):
+    # Job handler (jobs.py) for the batch route: payload {"course_id"}, the summary is the job result
+    try:
+        from .media import create_storage
+    except ImportError:
+        from media import create_storage
+    with Session() as session:
+        certificates, summary = issue_certificates(session, create_storage(), payload['course_id'], workers=workers)
+        if certificates is None:
+            return {"skipped": "course deleted"}
+        session.commit()
+    logger.info("Certificates of course %s: %s", payload['course_id'], summary)
+    return summary
+
+
+CERTIFICATE_HANDLERS = {
+    COURSE_CERTIFICATES_JOB: issue_course_certificates,
+}
+
+
+# Batch issue from a shell: python api/certificates.py --course 3 [--workers 8]
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Issue the certificates of a course")
+    parser.add_argument('--course', type=int, required=True)
+    parser.add_argument('--workers', type=int, default=CERT_WORKERS, help="render processes (0 renders inline)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    print(issue_course_certificates({"course_id": args.course}, workers=args.workers))
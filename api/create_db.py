@@ -5,12 +5,21 @@ from sqlalchemy.inspection import inspect
 from sqlalchemy.dialects.postgresql import ENUM
 from dotenv import load_dotenv
 import os
+import redis
 
 # Import models and RoleType
 try:
-    from .models import Base, Role, User, UserProfile, Course, Module, RoleType, Enroll  # Relative import
+    from .models import Base, Role, User, UserProfile, Course, Module, RoleType, Enroll, SEARCH_DDL  # Relative import
+    from .stats import reconcile_course_stats
+    from .roles import bump_roles_version
+    from .token_registry import migrate_legacy_tokens
+    from .api import JWT_ACCESS_TOKEN_EXPIRES
 except ImportError:
-    from models import Base, Role, User, UserProfile, Course, Module, RoleType, Enroll  # Direct import for terminal
+    from models import Base, Role, User, UserProfile, Course, Module, RoleType, Enroll, SEARCH_DDL  # Direct import for terminal
+    from stats import reconcile_course_stats
+    from roles import bump_roles_version
+    from token_registry import migrate_legacy_tokens
+    from api import JWT_ACCESS_TOKEN_EXPIRES
 
 # Load the .env file
 load_dotenv()
@@ -42,9 +51,40 @@ def create_db():
     Base.metadata.create_all(engine, checkfirst=True)
     print("Tables created where necessary.")
 
+    # create_all does not add new columns to tables that already exist either
+    with engine.begin() as connection:
+        connection.execute(text("ALTER TABLE modules ADD COLUMN IF NOT EXISTS video_key VARCHAR"))
+        # Full text search columns and GIN indexes (adding a generated column rewrites the table once)
+        for statements in SEARCH_DDL.values():
+            for statement in statements:
+                connection.execute(text(statement))
+    print("Columns added where necessary.")
+
+    # create_all does not add new indexes to tables that already exist, so create missing indexes here.
+    # Duplicate enrollments made before the unique enroll index existed are removed first (the oldest row is kept).
+    with engine.begin() as connection:
+        connection.execute(text(
+            "DELETE FROM enrolls a USING enrolls b "
+            "WHERE a.id > b.id AND a.course_id = b.course_id AND a.user_id = b.user_id"
+        ))
+    # User names were only checked by register, not unique in the database. If some are taken twice already they have to
+    # be renamed by hand, the unique index is skipped until then.
+    with engine.connect() as connection:
+        duplicate_names = connection.execute(text(
+            "SELECT user_name FROM users GROUP BY user_name HAVING count(*) > 1"
+        )).scalars().all()
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name == 'ix_user_user_name' and duplicate_names:
+                print(f"User names taken more than once, unique index ix_user_user_name not created: {', '.join(duplicate_names)}")
+                continue
+            index.create(engine, checkfirst=True)
+    print("Indexes created where necessary.")
+
     # Create a new session
     Session = sessionmaker(bind=engine)
     session = Session()
+    redis_client = redis.StrictRedis(host='localhost', port=6379, db=0, decode_responses=True)
 
     # Check if roles already exist before adding them
     existing_roles = {role.role_name for role in session.query(Role).all()}
@@ -56,8 +96,19 @@ def create_db():
         session.add_all(roles_to_add)
         session.commit()
         print(f"Added missing roles: {', '.join([role.role_name.value for role in roles_to_add])}")
+        # Running API processes keep the roles in memory (see roles.py), tell them to load them again
+        bump_roles_version(redis_client)
     else:
         print("All default roles already exist.")
 
+    # Course counters for courses that existed before the course_stats table (see stats.py)
+    fixed = reconcile_course_stats(Session)
+    print(f"Course stats reconciled: {fixed}")
+
+    # Token keys of the layout before the sessions:<user_name> hashes, so tokens that were logged out (or replaced by a
+    # login on the same device) before the upgrade stay revoked (see token_registry.py)
+    revoked, active = migrate_legacy_tokens(redis_client, JWT_ACCESS_TOKEN_EXPIRES)
+    print(f"Old token keys migrated: {revoked} revoked tokens, {active} active tokens")
+
 if __name__ == "__main__":
     create_db()
@@ -0,0 +1,161 @@
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker, scoped_session, Session as OrmSession
+from dotenv import load_dotenv
+import os
+import threading
+
+
+######################################################## DATABASE ##############################################################################
+# Load environment variables from .env file
+load_dotenv()
+
+DATABASE_URI = os.getenv("SQLALCHEMY_DATABASE_URI")
+
+
+def env_bool(name, default):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def engine_options(url):
+    # Pool settings can be tuned from the .env file, e.g:
+    # DB_POOL_SIZE=10 DB_MAX_OVERFLOW=20 DB_POOL_PRE_PING=true DB_POOL_RECYCLE=1800 DB_POOL_TIMEOUT=30
+    options = {
+        "pool_pre_ping": env_bool("DB_POOL_PRE_PING", True),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", 1800)),
+    }
+    # SQLite (used for local runs) does not support a sized connection pool
+    if make_url(url).get_backend_name() != 'sqlite':
+        options["pool_size"] = int(os.getenv("DB_POOL_SIZE", 10))
+        options["max_overflow"] = int(os.getenv("DB_MAX_OVERFLOW", 20))
+        options["pool_timeout"] = int(os.getenv("DB_POOL_TIMEOUT", 30))
+    return options
+
+
+def async_database_uri(url):
+    # Same database through its asyncio driver (asyncpg for PostgreSQL, aiosqlite for SQLite), used by asgi.py
+    url = make_url(url)
+    drivers = {'postgresql': 'postgresql+asyncpg', 'sqlite': 'sqlite+aiosqlite'}
+    return url.set(drivername=drivers.get(url.get_backend_name(), url.drivername))
+
+
+# The engine is created on first use (the first session or get_engine() call), not on import, so importing the app
+# is fast and does not need a database. Schema changes only happen in create_db.py.
+_engine = None
+_engine_lock = threading.RLock()
+_engine_hooks = []
+_engines = []
+
+
+def on_engine_created(hook):
+    # hook(engine) runs once for every engine (the primary and the read replicas, see replicas.py) when it is created,
+    # right away for the ones that already exist, e.g. to add event listeners
+    with _engine_lock:
+        _engine_hooks.append(hook)
+        engines = list(_engines)
+    for engine in engines:
+        hook(engine)
+
+
+def create_db_engine(url):
+    # Engine with the pool settings above (DB_ECHO=true logs every statement, debugging only)
+    engine = create_engine(url, echo=env_bool("DB_ECHO", False), **engine_options(url))
+    with _engine_lock:
+        for hook in _engine_hooks:
+            hook(engine)
+        _engines.append(engine)
+    return engine
+
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                if not DATABASE_URI:
+                    raise RuntimeError("SQLALCHEMY_DATABASE_URI is not set")
+                _engine = create_db_engine(DATABASE_URI)
+    return _engine
+
+
+def warm_pool(size):
+    # Opens `size` connections at the same time and gives them back to the pool, so the first requests
+    # don't pay for the connection setup (TCP + TLS + auth)
+    engine = get_engine()
+    connections = []
+    try:
+        for _ in range(size):
+            connection = engine.connect()
+            connections.append(connection)
+            connection.execute(text("SELECT 1"))
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+# Read replicas: route_reads(router) makes sessions ask router() for an engine on their first SELECT (see replicas.py)
+_read_router = None
+
+
+def route_reads(router):
+    # router() returns a replica engine for the reads of the current session, or None for the primary
+    global _read_router
+    _read_router = router
+
+
+def read_bind(session, clause):
+    # Engine for this statement when it can go to a replica, None for the session's own bind (the primary).
+    # Only SELECTs (without FOR UPDATE) of a session that has not written yet go to a replica: the first flush or
+    # INSERT/UPDATE/DELETE moves the session to the primary for good, so a request always reads its own writes.
+    info = session.info
+    if info.get('wrote'):
+        return None
+    if session._flushing or getattr(clause, 'is_dml', False):
+        info['wrote'] = True
+        return None
+    if not getattr(clause, 'is_select', False) or getattr(clause, '_for_update_arg', None) is not None:
+        return None
+    if 'read_bind' not in info:
+        info['read_bind'] = _read_router() if _read_router is not None else None
+    return info['read_bind']
+
+
+def read_primary(session):
+    # The next reads of this session go to the primary. For what other users get too (the course cache is filled for
+    # everyone) a lagging replica would hand out an old copy under the new cache version until the next write
+    session.info['read_bind'] = None
+
+
+def read_replica(session):
+    # True when this session's reads went to a replica (its answers can be behind the primary)
+    return session.info.get('read_bind') is not None
+
+
+class LazySession(OrmSession):
+    # Sessions without an explicit bind use get_engine(), reads may go to a replica (read_bind)
+    def __init__(self, bind=None, **kwargs):
+        super().__init__(bind=bind if bind is not None else get_engine(), **kwargs)
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        replica = read_bind(self, clause)
+        if replica is not None:
+            return replica
+        return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+
+
+Session = sessionmaker(class_=LazySession)
+
+# One session per request (thread), it is only opened the first time a route uses it
+session = scoped_session(Session)
+
+
+def init_app(app):
+    # Release the request session when the request is done, rollback anything left open by a failed request
+    @app.teardown_appcontext
+    def remove_session(exception=None):
+        if exception is not None:
+            session.rollback()
+        session.remove()
@@ -0,0 +1,135 @@
+import os
+import time
+import redis
+from werkzeug.http import http_date
+
+
+######################################################## CONDITIONAL GET #######################################################################
+# Weak ETags + Last-Modified for course, module and profile reads, kept in Redis so a revalidation
+# (If-None-Match / If-Modified-Since) is answered with 304 after one Redis call, without a database read or a body.
+#
+# Every entity has a hash etag:<kind>:<id> with a version (v) and the time of the last write in microseconds (m).
+# Writes bump both after the commit (and after the course cache was invalidated, so a new ETag is never sent with a
+# body from the old cache entry). The ETag is W/"<v>-<m>": m keeps it unique even if Redis loses the key and the
+# version starts again. Reads of an entity without a hash create one first and only then load the body, so the body
+# is never older than the ETag sent with it.
+#
+# Kinds: course (course, its modules and module pages), user (GET /users/<id>), profile (GET /auth/profile, by name)
+#
+# .env settings:
+# ETAG_TTL=3600       seconds a validator is kept after its last write (it is created again on the next read)
+#
+# Last-Modified only has whole seconds, two writes in the same second would look the same. So Last-Modified is only
+# sent (and If-Modified-Since only answered with 304) once the second of the last write is over, until then the
+# ETag alone decides.
+#
+# Like the course cache, a write while Redis is down can't bump the validator: clients may get 304 for the old body
+# until the validator expires (at most ETAG_TTL).
+
+ETAG_TTL = int(os.getenv("ETAG_TTL", 3600))
+
+
+class Validator:
+    def __init__(self, version, modified):
+        self.etag = f"{version}-{modified}"
+        self.modified = modified / 1000000
+
+    def settled(self):
+        # True once no other write can fall into the same second as the last one (see above)
+        return int(self.modified) < int(time.time())
+
+    def matches(self, request):
+        # If-None-Match wins over If-Modified-Since (RFC 9110), weak comparison for GET
+        if request.if_none_match:
+            return request.if_none_match.contains_weak(self.etag)
+        if request.if_modified_since is not None and self.settled():
+            return int(self.modified) <= request.if_modified_since.timestamp()
+        return False
+
+    def headers(self):
+        # no-cache: clients may keep the body but must revalidate, private: not in shared caches (the routes need a JWT)
+        headers = {"ETag": f'W/"{self.etag}"', "Cache-Control": "private, no-cache"}
+        if self.settled():
+            headers["Last-Modified"] = http_date(self.modified)
+        return headers
+
+
+def _now():
+    return int(time.time() * 1000000)
+
+
+class EntityValidators:
+    def __init__(self, redis_client, ttl=ETAG_TTL):
+        self.redis = redis_client
+        self.ttl = ttl
+
+    def key(self, kind, id):
+        return f"etag:{kind}:{id}"
+
+    @staticmethod
+    def _validator(values):
+        if not values or 'v' not in values or 'm' not in values:
+            return None
+        return Validator(int(values['v']), int(values['m']))
+
+    def _seed(self, pipe, key):
+        pipe.hsetnx(key, 'v', 0)
+        pipe.hsetnx(key, 'm', _now())
+        pipe.expire(key, self.ttl)
+        pipe.hgetall(key)
+
+    def current(self, kind, id):
+        # None when Redis is down (the route just answers 200 without validators)
+        key = self.key(kind, id)
+        try:
+            validator = self._validator(self.redis.hgetall(key))
+            if validator is None:
+                pipe = self.redis.pipeline()
+                self._seed(pipe, key)
+                validator = self._validator(pipe.execute()[-1])
+            return validator
+        except redis.RedisError:
+            return None
+
+    def bump(self, *entities):
+        # entities: (kind, id) pairs changed by one write, bumped in one round trip
+        pipe = self.redis.pipeline()
+        modified = _now()
+        for kind, id in entities:
+            key = self.key(kind, id)
+            pipe.hincrby(key, 'v', 1)
+            pipe.hset(key, 'm', modified)
+            pipe.expire(key, self.ttl)
+        try:
+            pipe.execute()
+        except redis.RedisError:
+            pass  # same as the course cache, the write itself already succeeded
+
+
+class AsyncEntityValidators(EntityValidators):
+    # Same validators (same keys) on a redis.asyncio client, used by the ASGI app (asgi.py)
+
+    async def current(self, kind, id):
+        key = self.key(kind, id)
+        try:
+            validator = self._validator(await self.redis.hgetall(key))
+            if validator is None:
+                pipe = self.redis.pipeline()
+                self._seed(pipe, key)
+                validator = self._validator((await pipe.execute())[-1])
+            return validator
+        except redis.RedisError:
+            return None
+
+    async def bump(self, *entities):
+        pipe = self.redis.pipeline()
+        modified = _now()
+        for kind, id in entities:
+            key = self.key(kind, id)
+            pipe.hincrby(key, 'v', 1)
+            pipe.hset(key, 'm', modified)
+            pipe.expire(key, self.ttl)
+        try:
+            await pipe.execute()
+        except redis.RedisError:
+            pass
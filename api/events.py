@@ -0,0 +1,328 @@
+import asyncio
+import base64
+import binascii
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+import redis
+
+
+######################################################## COURSE EVENTS #########################################################################
+# Course updates pushed to the students of a course over Server-Sent Events, so clients don't have to poll
+# GET /courses/<id> and GET /courses/<id>/modules to notice a new module.
+#
+# 1. Adding or changing a module and changing a course publish an event on the Redis channel "course_events"
+#    (api.py and asgi.py, after the commit and the cache invalidation, so a refetch gets the new data):
+#    {"id", "type": "module_added" | "module_updated" | "course_updated", "course_id", "module_id", "title"}
+# 2. Every asgi.py process subscribes to the channel once (EventHub) and hands each event to its own connections of
+#    that course: GET /courses/<id>/events (text/event-stream, for the instructor, admins and enrolled students).
+#    The event is encoded once and the same bytes go to every connection.
+# 3. An idle connection is one small Subscriber (no thread, no queue until an event comes) and the task of the
+#    response, so one process can keep tens of thousands of them.
+# 4. Backpressure: the fan out never waits for a client. A connection whose client does not read (its events pile up
+#    while the server waits to send) is closed after EVENTS_QUEUE_LIMIT waiting events, the client reconnects.
+# 5. Pub/sub does not keep events. The first event of a connection is "connected" ("resync" when the client sends
+#    Last-Event-ID, i.e. it reconnected), after it the client (re)loads the course, cheap with If-None-Match (see
+#    etags.py). A process that lost Redis sends "resync" to all its connections when it is back.
+# 6. A comment line every EVENTS_KEEPALIVE seconds keeps proxies from closing idle connections, the retry hint is
+#    random (1-5s) so the clients of a restarted process don't all come back at the same moment.
+#
+# 7. Browsers' EventSource can't send an Authorization header: POST /courses/<id>/events/token (with the JWT, both
+#    apps) returns a short lived stream token signed like the media URLs (HMAC, see media.py) and the stream is
+#    opened with ?token=. The token holds the course, the identity and the jti of the access token it came from.
+# 8. An open stream ends with a "closed" event when its token (stream token or access token) expires, and when the
+#    check every EVENTS_RECHECK seconds finds the access token revoked (logout) or the user no longer allowed on the
+#    course (e.g. unenrolled). The client gets a new token and reconnects.
+#
+# Only asgi.py serves the stream (api.py would need a thread per connection), both apps publish: with api.py serving
+# the API, run asgi.py next to it for /courses/<id>/events (same Redis, same JWT tokens).
+#
+# .env settings:
+# EVENTS_QUEUE_LIMIT=64     events waiting for one connection before it is closed as too slow
+# EVENTS_KEEPALIVE=25       seconds between keepalive comments on an idle connection
+# EVENTS_TOKEN_TTL=300      seconds a stream token can be used to open (and keep) a stream
+# EVENTS_RECHECK=60         seconds between the revocation / access checks of an open stream
+
+EVENTS_CHANNEL = "course_events"
+EVENTS_QUEUE_LIMIT = int(os.getenv("EVENTS_QUEUE_LIMIT", 64))
+EVENTS_KEEPALIVE = float(os.getenv("EVENTS_KEEPALIVE", 25))
+EVENTS_TOKEN_TTL = int(os.getenv("EVENTS_TOKEN_TTL", 300))
+EVENTS_RECHECK = float(os.getenv("EVENTS_RECHECK", 60))
+EVENTS_RECONNECT_DELAY = 1
+EVENTS_SUBSCRIBE_TIMEOUT = 5
+
+MODULE_ADDED = "module_added"
+MODULE_UPDATED = "module_updated"
+COURSE_UPDATED = "course_updated"
+
+KEEPALIVE_FRAME = b": keepalive\n\n"
+
+logger = logging.getLogger(__name__)
+
+
+def course_event(event_type, course_id, **fields):
+    return {"id": uuid.uuid4().hex, "type": event_type, "course_id": course_id, **fields}
+
+
+def sse_frame(event, retry_ms=None):
+    # One Server-Sent Events message, the whole event as JSON in data
+    retry = f"retry: {retry_ms}\n" if retry_ms is not None else ""
+    return f"{retry}id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event, separators=(',', ':'))}\n\n".encode()
+
+
+def sign_stream_token(signer, course_id, identity, jti, not_after=None, now=None):
+    # Returns (token, expiry unix time). signer is a MediaSigner with its own key (a token is not a media signature),
+    # the token never outlives the access token it came from (not_after = its exp)
+    expires = int(now if now is not None else time.time()) + EVENTS_TOKEN_TTL
+    if not_after is not None:
+        expires = min(expires, int(not_after))
+    claims = json.dumps({"course_id": course_id, "sub": identity, "jti": jti, "exp": expires}, separators=(',', ':'))
+    claims = base64.urlsafe_b64encode(claims.encode()).decode('ascii').rstrip('=')
+    return f"{claims}.{signer.signature(claims, expires)}", expires
+
+
+def read_stream_token(signer, token, course_id):
+    # The claims of a valid, unexpired token of this course, None otherwise
+    claims_part, _, signature = (token or '').partition('.')
+    try:
+        claims = json.loads(base64.urlsafe_b64decode(claims_part + '=' * (-len(claims_part) % 4)))
+    except (binascii.Error, UnicodeError, ValueError):
+        return None
+    if not isinstance(claims, dict) or claims.get('course_id') != course_id:
+        return None
+    if not isinstance(claims.get('sub'), dict) or not claims.get('jti'):
+        return None
+    if not signer.verify(claims_part, claims.get('exp'), signature):
+        return None
+    return claims
+
+
+class CourseEvents:
+    # Publishes course events (api.py). A Redis error is logged, the write it announces already happened: connected
+    # clients miss the event and see the change on their next reload.
+    def __init__(self, redis_client):
+        self.redis = redis_client
+        self._lock = threading.Lock()
+        self._stats = {"published": 0, "publish_errors": 0}
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def publish(self, event_type, course_id, **fields):
+        try:
+            self.redis.publish(EVENTS_CHANNEL, json.dumps(course_event(event_type, course_id, **fields)))
+        except redis.RedisError as e:
+            logger.warning("Could not publish %s of course %s: %s", event_type, course_id, e)
+            self._count("publish_errors")
+            return
+        self._count("published")
+
+
+class AsyncCourseEvents(CourseEvents):
+    # Same channel on a redis.asyncio client (asgi.py)
+
+    async def publish(self, event_type, course_id, **fields):
+        try:
+            await self.redis.publish(EVENTS_CHANNEL, json.dumps(course_event(event_type, course_id, **fields)))
+        except redis.RedisError as e:
+            logger.warning("Could not publish %s of course %s: %s", event_type, course_id, e)
+            self._count("publish_errors")
+            return
+        self._count("published")
+
+
+class Subscriber:
+    # One open event stream. frames and waiter only exist while there is something to send / the stream waits.
+    __slots__ = ("course_id", "frames", "waiter", "closed")
+
+    def __init__(self, course_id):
+        self.course_id = course_id
+        self.frames = None
+        self.waiter = None
+        self.closed = False
+
+    def _wake(self):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    def push(self, frame, limit):
+        # False when the stream is closed or too far behind (it is closed then)
+        if self.closed:
+            return False
+        if self.frames is None:
+            self.frames = []
+        elif len(self.frames) >= limit:
+            self.close()
+            return False
+        self.frames.append(frame)
+        self._wake()
+        return True
+
+    def close(self):
+        self.closed = True
+        self.frames = None
+        self._wake()
+
+    async def next(self, timeout):
+        # The frames that came in (a list, empty when nothing came within timeout), None when the stream is closed
+        if not self.frames and not self.closed:
+            self.waiter = asyncio.get_running_loop().create_future()
+            try:
+                await asyncio.wait_for(self.waiter, timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self.waiter = None
+        if self.closed:
+            return None
+        frames, self.frames = self.frames or [], None
+        return frames
+
+
+class EventHub:
+    # The connections of this process per course and the pub/sub listener feeding them (asgi.py, one event loop)
+    def __init__(self, redis_client, queue_limit=EVENTS_QUEUE_LIMIT, keepalive=EVENTS_KEEPALIVE):
+        self.redis = redis_client
+        self.queue_limit = queue_limit
+        self.keepalive = keepalive
+        self.subscribers = {}  # course_id -> set of Subscriber
+        self.connections = 0
+        self._listening = asyncio.Event()
+        self._task = None
+        self._stats = {"events": 0, "delivered": 0, "slow_closed": 0, "resyncs": 0, "reconnects": 0, "closed": 0}
+
+    def stats(self):
+        return dict(self._stats, connections=self.connections, courses=len(self.subscribers), listening=self._listening.is_set())
+
+    def start(self):
+        # Started by the first connection, runs as long as the event loop
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.listen())
+
+    async def stop(self):
+        # Closes every stream (the server can shut down) and the listener, the next connection starts again
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for subscribers in list(self.subscribers.values()):
+            for subscriber in subscribers:
+                subscriber.close()
+        self.subscribers.clear()
+        self.connections = 0
+        self._listening = asyncio.Event()
+
+    async def subscribe(self, course_id):
+        # Waits (a few seconds at most) until the listener is subscribed, so no event published after the
+        # "connected" event is missed. Without Redis the stream still opens and gets "resync" when Redis is back.
+        self.start()
+        if not self._listening.is_set():
+            try:
+                await asyncio.wait_for(self._listening.wait(), EVENTS_SUBSCRIBE_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+        subscriber = Subscriber(course_id)
+        self.subscribers.setdefault(course_id, set()).add(subscriber)
+        self.connections += 1
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        subscribers = self.subscribers.get(subscriber.course_id)
+        if subscribers is None or subscriber not in subscribers:
+            return
+        subscribers.discard(subscriber)
+        self.connections -= 1
+        if not subscribers:
+            del self.subscribers[subscriber.course_id]
+
+    def _push(self, subscribers, frame):
+        slow = []
+        for subscriber in subscribers:
+            if subscriber.push(frame, self.queue_limit):
+                self._stats["delivered"] += 1
+            else:
+                slow.append(subscriber)
+        for subscriber in slow:
+            self._stats["slow_closed"] += 1
+            self.unsubscribe(subscriber)
+
+    def dispatch(self, event):
+        self._stats["events"] += 1
+        subscribers = self.subscribers.get(event.get('course_id'))
+        if subscribers:
+            self._push(subscribers, sse_frame(event))
+
+    def resync_all(self):
+        # Events may have been published while the listener was not subscribed
+        self._stats["resyncs"] += 1
+        for course_id, subscribers in list(self.subscribers.items()):
+            self._push(subscribers, sse_frame(course_event("resync", course_id)))
+
+    async def listen(self):
+        reconnect = False
+        while True:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(EVENTS_CHANNEL)
+                self._listening.set()
+                if reconnect:
+                    self._stats["reconnects"] += 1
+                    self.resync_all()
+                async for message in pubsub.listen():
+                    try:
+                        event = json.loads(message['data'])
+                    except (TypeError, ValueError):
+                        continue
+                    self.dispatch(event)
+            except (redis.RedisError, OSError) as e:
+                self._listening.clear()
+                logger.warning("Course events lost Redis: %s", e)
+                reconnect = True
+                await asyncio.sleep(EVENTS_RECONNECT_DELAY)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except (redis.RedisError, OSError):
+                    pass
+
+    async def stream(self, subscriber, resume=False, expires=None, check=None, check_every=EVENTS_RECHECK):
+        # Body of GET /courses/<id>/events: the connected/resync event, then the course events and keepalives until
+        # the client goes away (the server cancels the generator), the stream is closed as too slow, or it ends with
+        # a "closed" event: `expires` (unix time) passed or `check()` (async, a reason or None) found a reason
+        try:
+            first = course_event("resync" if resume else "connected", subscriber.course_id)
+            yield sse_frame(first, retry_ms=random.randint(1000, 5000))
+            next_check = time.monotonic() + check_every
+            while True:
+                timeout = self.keepalive
+                if expires is not None:
+                    timeout = min(timeout, max(0, expires - time.time()))
+                if check is not None:
+                    timeout = min(timeout, max(0, next_check - time.monotonic()))
+                frames = await subscriber.next(timeout)
+                if frames is None:
+                    break
+                if frames:
+                    yield b"".join(frames)
+                reason = None
+                if expires is not None and time.time() >= expires:
+                    reason = "expired"
+                elif check is not None and time.monotonic() >= next_check:
+                    reason = await check()
+                    next_check = time.monotonic() + check_every
+                if reason is not None:
+                    self._stats["closed"] += 1
+                    yield sse_frame(course_event("closed", subscriber.course_id, reason=reason))
+                    break
+                if not frames:
+                    yield KEEPALIVE_FRAME
+        finally:
+            self.unsubscribe(subscriber)
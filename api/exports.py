@@ -0,0 +1,105 @@
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from enum import Enum
+from sqlalchemy import select
+try:
+    from .models import Role, User, Course, Enroll
+except ImportError:
+    from models import Role, User, Course, Enroll
+
+
+######################################################## EXPORTS ###############################################################################
+# Admin reports of users, courses and enrollments streamed as NDJSON or CSV (GET /admin/export/<name>).
+#
+# Only the exported columns are selected (no ORM objects, no relationships) and the rows come from a server side
+# cursor (yield_per), EXPORT_BATCH_SIZE rows at a time. Each batch is encoded to one chunk and sent before the next
+# batch is fetched, so memory stays the same for 10k or 10M rows and the first bytes go out as soon as the first batch
+# (or the CSV header) is ready. The export uses its own session, opened and closed by the response generator: the
+# request is over before the body is sent, and a client that disconnects closes the generator (and the cursor).
+#
+# .env settings:
+# EXPORT_BATCH_SIZE=1000   rows fetched from the cursor and encoded per chunk
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+
+def export_statement(name, course_id=None):
+    # Returns (columns, statement) for an export name, None if there is no such export
+    if name == 'users':
+        statement = (
+            select(User.id, User.user_name, User.email, Role.role_name.label('role'), User.created_at)
+            .join(Role, User.role_id == Role.id)
+            .order_by(User.id)
+        )
+    elif name == 'courses':
+        statement = (
+            select(Course.id, Course.title, Course.course_instructor_id.label('instructor_id'), Course.created_at, Course.updated_at)
+            .order_by(Course.id)
+        )
+    elif name == 'enrollments':
+        statement = (
+            select(Enroll.id, Enroll.course_id, Course.title.label('course_title'), Enroll.user_id, User.user_name,
+                   Enroll.created_at.label('enrolled_at'))
+            .join(Course, Enroll.course_id == Course.id)
+            .join(User, Enroll.user_id == User.id)
+            .order_by(Enroll.id)
+        )
+        if course_id is not None:
+            statement = statement.where(Enroll.course_id == course_id)
+    else:
+        return None
+    return [column.name for column in statement.selected_columns], statement
+
+
+def _value(value):
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def header_chunk(format, columns):
+    if format != 'csv':
+        return ""
+    return encode_chunk(format, columns, [columns])
+
+
+def encode_chunk(format, columns, rows):
+    if format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerows([_value(value) for value in row] for row in rows)
+        return buffer.getvalue()
+    return "".join(
+        json.dumps(dict(zip(columns, map(_value, row))), separators=(',', ':'), ensure_ascii=False) + "\n"
+        for row in rows
+    )
+
+
+def export_chunks(session, format, columns, statement, batch_size=EXPORT_BATCH_SIZE):
+    # Generator of str chunks: the CSV header first, then one chunk per batch of rows
+    header = header_chunk(format, columns)
+    if header:
+        yield header
+    result = session.execute(statement.execution_options(yield_per=batch_size))
+    for rows in result.partitions():
+        yield encode_chunk(format, columns, rows)
+
+
+async def export_chunks_async(session, format, columns, statement, batch_size=EXPORT_BATCH_SIZE):
+    # Same for an AsyncSession (asgi.py), session.stream() keeps the cursor open on the server
+    header = header_chunk(format, columns)
+    if header:
+        yield header
+    result = await session.stream(statement.execution_options(yield_per=batch_size))
+    async for rows in result.partitions():
+        yield encode_chunk(format, columns, rows)
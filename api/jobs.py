@@ -0,0 +1,381 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import threading
+import time
+import uuid
+import redis
+
+
+######################################################## BACKGROUND JOBS #######################################################################
+# Slow side effects (notifications, course certificates, later video processing) run in worker processes, the
+# request only queues them.
+#
+# 1. A route calls job_queue.enqueue(type, payload): one MULTI with the job hash "jobs:<id>" (status "queued") and an
+#    entry in the Redis stream "jobs:stream:<queue>".
+# 2. Workers read the streams through the consumer group "job-workers". Reading an entry claims the job: it stays
+#    pending for that worker until it is acknowledged (XACK + XDEL) together with the new status.
+# 3. Visibility timeout: a job pending for more than JOB_VISIBILITY_TIMEOUT seconds (its worker died or hangs) is
+#    claimed by another worker (XAUTOCLAIM) and runs again, so jobs run at least once and handlers must be safe to
+#    run twice. A handler must finish within the timeout.
+# 4. A handler that raises is retried with exponential backoff (JOB_RETRY_BASE * 2^(attempt - 1) seconds, at most
+#    JOB_RETRY_MAX, with jitter): the job waits in the sorted set "jobs:delayed:<queue>" (score = when to run) and
+#    workers move it back to the stream when it is due. After JOB_MAX_ATTEMPTS attempts it is "failed".
+# 5. GET /jobs/<id> returns the status (queued, running, retrying, done, failed) to the user that queued the job
+#    and to admins. Job hashes are kept JOB_RESULT_TTL seconds after they finished, without their payload. A job that
+#    is never run expires JOB_RESULT_TTL seconds after it was queued, so no payload stays in Redis for good.
+#
+# Workers: python api/jobs.py --workers 4 [--queues notifications default] [--drain]
+# (a pool of worker processes, a worker that dies is started again; SIGTERM lets running jobs finish)
+#
+# .env settings:
+# JOB_VISIBILITY_TIMEOUT=300     seconds before the job of a silent worker is given to another one
+# JOB_MAX_ATTEMPTS=5
+# JOB_RETRY_BASE=5               seconds before the first retry, doubled for every next one
+# JOB_RETRY_MAX=3600
+# JOB_RESULT_TTL=604800          seconds finished jobs can be looked up
+# JOB_WORKERS=2                  worker processes started by the CLI (--workers)
+
+JOB_GROUP = "job-workers"
+JOB_QUEUES = ("notifications", "default")
+JOB_VISIBILITY_TIMEOUT = float(os.getenv("JOB_VISIBILITY_TIMEOUT", 300))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 5))
+JOB_RETRY_BASE = float(os.getenv("JOB_RETRY_BASE", 5))
+JOB_RETRY_MAX = float(os.getenv("JOB_RETRY_MAX", 3600))
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", 7 * 24 * 3600))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+JOB_READ_BLOCK_MS = 1000
+JOB_PROMOTE_BATCH = 100
+
+logger = logging.getLogger(__name__)
+
+# KEYS[1] = delayed sorted set, KEYS[2] = stream. ARGV[1] = now (ms), ARGV[2] = how many at most
+# Moves the due jobs back to the stream, ZREM first so two workers never move the same job
+PROMOTE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+local moved = 0
+for _, job_id in ipairs(due) do
+    if redis.call('ZREM', KEYS[1], job_id) == 1 then
+        redis.call('XADD', KEYS[2], '*', 'job_id', job_id)
+        moved = moved + 1
+    end
+end
+return moved
+"""
+
+
+def job_key(job_id):
+    return f"jobs:{job_id}"
+
+
+def stream_key(queue):
+    return f"jobs:stream:{queue}"
+
+
+def delayed_key(queue):
+    return f"jobs:delayed:{queue}"
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def _timestamp(ms=None):
+    seconds = (ms if ms is not None else _now_ms()) / 1000
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(seconds))
+
+
+def retry_delay(attempt, base=JOB_RETRY_BASE, maximum=JOB_RETRY_MAX):
+    # Seconds before the next attempt: base, 2*base, 4*base ... at most maximum, +-20% so retries of jobs that failed
+    # together don't all come back at the same moment
+    delay = min(maximum, base * 2 ** (attempt - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def job_status(fields):
+    # Job hash -> GET /jobs/<id> response (the payload is not shown)
+    if not fields:
+        return None
+    status = {
+        "job_id": fields.get('id'),
+        "type": fields.get('type'),
+        "queue": fields.get('queue'),
+        "status": fields.get('status'),
+        "attempts": int(fields.get('attempts', 0)),
+        "max_attempts": int(fields.get('max_attempts', 0)),
+        "created_at": fields.get('created_at'),
+        "updated_at": fields.get('updated_at'),
+    }
+    if fields.get('run_at'):
+        status["next_attempt_at"] = fields['run_at']
+    if fields.get('error'):
+        status["error"] = fields['error']
+    if fields.get('result'):
+        status["result"] = json.loads(fields['result'])
+    return status
+
+
+class JobQueue:
+    # The API side: queue jobs and read their status
+    def __init__(self, redis_client, max_attempts=JOB_MAX_ATTEMPTS, result_ttl=JOB_RESULT_TTL):
+        self.redis = redis_client
+        self.max_attempts = max_attempts
+        self.result_ttl = result_ttl
+        self._lock = threading.Lock()
+        self._stats = {"enqueued": 0, "enqueue_errors": 0}
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _enqueue_pipeline(self, job_type, payload, queue, owner):
+        job_id = uuid.uuid4().hex
+        now = _timestamp()
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hset(job_key(job_id), mapping={
+            "id": job_id,
+            "type": job_type,
+            "queue": queue,
+            "payload": json.dumps(payload, separators=(',', ':')),
+            "owner": owner or "",
+            "status": "queued",
+            "attempts": 0,
+            "max_attempts": self.max_attempts,
+            "created_at": now,
+            "updated_at": now,
+        })
+        pipe.expire(job_key(job_id), self.result_ttl)
+        pipe.xadd(stream_key(queue), {"job_id": job_id})
+        return job_id, pipe
+
+    def enqueue(self, job_type, payload, queue="default", owner=None):
+        # Returns the job id, None if Redis could not be reached (the request does not fail because of a side effect)
+        job_id, pipe = self._enqueue_pipeline(job_type, payload, queue, owner)
+        try:
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning("Could not queue %s job: %s", job_type, e)
+            self._count("enqueue_errors")
+            return None
+        self._count("enqueued")
+        return job_id
+
+    def get(self, job_id):
+        # The job hash (with its owner), None when there is no such job (or it expired)
+        return self.redis.hgetall(job_key(job_id)) or None
+
+
+class AsyncJobQueue(JobQueue):
+    # Same jobs on a redis.asyncio client (asgi.py)
+
+    async def enqueue(self, job_type, payload, queue="default", owner=None):
+        job_id, pipe = self._enqueue_pipeline(job_type, payload, queue, owner)
+        try:
+            await pipe.execute()
+        except redis.RedisError as e:
+            logger.warning("Could not queue %s job: %s", job_type, e)
+            self._count("enqueue_errors")
+            return None
+        self._count("enqueued")
+        return job_id
+
+    async def get(self, job_id):
+        return await self.redis.hgetall(job_key(job_id)) or None
+
+
+class Worker:
+    # Runs the jobs of some queues in this process, handlers: {job type: handler(payload) -> JSON result}
+    def __init__(self, redis_client, handlers, queues=JOB_QUEUES, visibility_timeout=JOB_VISIBILITY_TIMEOUT,
+                 result_ttl=JOB_RESULT_TTL):
+        self.redis = redis_client
+        self.handlers = handlers
+        self.queues = list(queues)
+        self.visibility_timeout = visibility_timeout
+        self.result_ttl = result_ttl
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+        self._promote = self.redis.register_script(PROMOTE_SCRIPT)
+        self._stopped = threading.Event()
+        self._groups_ready = False
+        self.stats = {"done": 0, "retried": 0, "failed": 0, "claimed": 0}
+
+    def stop(self):
+        self._stopped.set()
+
+    def _ensure_groups(self):
+        if self._groups_ready:
+            return
+        for queue in self.queues:
+            try:
+                self.redis.xgroup_create(stream_key(queue), JOB_GROUP, id='0', mkstream=True)
+            except redis.ResponseError as e:
+                if 'BUSYGROUP' not in str(e):
+                    raise
+        self._groups_ready = True
+
+    def promote_due(self):
+        now = _now_ms()
+        return sum(self._promote(keys=[delayed_key(queue), stream_key(queue)], args=[now, JOB_PROMOTE_BATCH])
+                   for queue in self.queues)
+
+    def _claim(self, queue):
+        # Jobs of workers that stopped (or hang) without acknowledging them
+        claimed = self.redis.xautoclaim(stream_key(queue), JOB_GROUP, self.consumer,
+                                        min_idle_time=int(self.visibility_timeout * 1000), start_id='0-0', count=1)
+        for entry_id, fields in claimed[1]:
+            if not fields:
+                # Deleted from the stream in the meantime, nothing to run
+                self.redis.xack(stream_key(queue), JOB_GROUP, entry_id)
+                continue
+            self.stats["claimed"] += 1
+            return entry_id, fields
+        return None
+
+    def next_job(self, block_ms=JOB_READ_BLOCK_MS):
+        # (queue, stream entry id, job id) or None when nothing came within block_ms (None: don't wait)
+        self._ensure_groups()
+        self.promote_due()
+        for queue in self.queues:
+            claimed = self._claim(queue)
+            if claimed:
+                return queue, claimed[0], claimed[1]['job_id']
+        response = self.redis.xreadgroup(JOB_GROUP, self.consumer, {stream_key(queue): '>' for queue in self.queues},
+                                         count=1, block=block_ms)
+        for stream, entries in response or []:
+            for entry_id, fields in entries:
+                return stream[len(stream_key('')):], entry_id, fields['job_id']
+        return None
+
+    def _finish(self, queue, entry_id, job_id, fields, delayed_until=None):
+        # New status, acknowledgement and (for retries) the delayed entry in one MULTI, so a job is never lost or
+        # queued twice between the two
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hset(job_key(job_id), mapping={**fields, "updated_at": _timestamp()})
+        if delayed_until is not None:
+            pipe.zadd(delayed_key(queue), {job_id: delayed_until})
+        else:
+            # Only the status and the result are kept, the payload can hold data nobody should read later
+            pipe.hdel(job_key(job_id), "payload")
+            pipe.expire(job_key(job_id), self.result_ttl)
+        pipe.xack(stream_key(queue), JOB_GROUP, entry_id)
+        pipe.xdel(stream_key(queue), entry_id)
+        pipe.execute()
+
+    def process(self, queue, entry_id, job_id):
+        job = self.redis.hgetall(job_key(job_id))
+        if not job or job.get('status') in ('done', 'failed'):
+            # Expired, or already finished by a worker that was claimed from while it was still running
+            self.redis.xack(stream_key(queue), JOB_GROUP, entry_id)
+            self.redis.xdel(stream_key(queue), entry_id)
+            return None
+        attempt = int(job.get('attempts', 0)) + 1
+        max_attempts = int(job.get('max_attempts') or JOB_MAX_ATTEMPTS)
+        self.redis.hset(job_key(job_id), mapping={"status": "running", "attempts": attempt, "worker": self.consumer,
+                                                  "run_at": "", "updated_at": _timestamp()})
+        handler = self.handlers.get(job['type'])
+        try:
+            if handler is None:
+                raise LookupError(f"No handler for job type {job['type']}")
+            result = handler(json.loads(job['payload']))
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if handler is None or attempt >= max_attempts:
+                logger.error("Job %s (%s) failed after %d attempts: %s", job_id, job['type'], attempt, error)
+                self._finish(queue, entry_id, job_id, {"status": "failed", "error": error})
+                self.stats["failed"] += 1
+                return "failed"
+            run_at = _now_ms() + int(retry_delay(attempt) * 1000)
+            logger.warning("Job %s (%s) attempt %d failed, retry at %s: %s", job_id, job['type'], attempt, _timestamp(run_at), error)
+            self._finish(queue, entry_id, job_id, {"status": "retrying", "error": error, "run_at": _timestamp(run_at)},
+                         delayed_until=run_at)
+            self.stats["retried"] += 1
+            return "retrying"
+        self._finish(queue, entry_id, job_id, {"status": "done", "error": "",
+                                               "result": json.dumps(result, separators=(',', ':'))})
+        self.stats["done"] += 1
+        return "done"
+
+    def run_once(self, block_ms=JOB_READ_BLOCK_MS):
+        # Runs one job, returns its new status (None when there was nothing to run)
+        job = self.next_job(block_ms)
+        if job is None:
+            return None
+        return self.process(*job)
+
+    def run(self, drain=False):
+        while not self._stopped.is_set():
+            try:
+                status = self.run_once(None if drain else JOB_READ_BLOCK_MS)
+            except redis.RedisError as e:
+                logger.warning("Job worker lost Redis: %s", e)
+                self._groups_ready = False
+                self._stopped.wait(1)
+                continue
+            if status is None and drain:
+                break
+
+
+def _worker_process(queues, drain):
+    # One pool process: its own Redis connection and database engine (nothing is shared across the fork)
+    try:
+        from .notifications import NOTIFICATION_HANDLERS
+        from .certificates import CERTIFICATE_HANDLERS
+        from .bulk import BULK_HANDLERS
+    except ImportError:
+        from notifications import NOTIFICATION_HANDLERS
+        from certificates import CERTIFICATE_HANDLERS
+        from bulk import BULK_HANDLERS
+    logging.basicConfig(level=logging.INFO)
+    worker = Worker(redis.StrictRedis(host='localhost', port=6379, db=0, decode_responses=True),
+                    {**NOTIFICATION_HANDLERS, **CERTIFICATE_HANDLERS, **BULK_HANDLERS}, queues)
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the pool stops its workers with SIGTERM
+    worker.run(drain)
+    logger.info("Job worker %s stopped: %s", worker.consumer, worker.stats)
+
+
+def run_pool(workers, queues, drain=False):
+    # Starts `workers` processes and starts a new one when one dies, until SIGTERM/SIGINT
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+    processes = {}
+    while not stopping.is_set():
+        for slot in range(workers):
+            process = processes.get(slot)
+            if process is not None and process.is_alive():
+                continue
+            if process is not None:
+                if drain:
+                    continue
+                logger.warning("Job worker %d exited with %s, starting a new one", slot, process.exitcode)
+            process = multiprocessing.Process(target=_worker_process, args=(queues, drain), name=f"job-worker-{slot}")
+            process.start()
+            processes[slot] = process
+        if drain and not any(process.is_alive() for process in processes.values()):
+            break
+        stopping.wait(1)
+    for process in processes.values():
+        if process.is_alive():
+            process.terminate()
+    for process in processes.values():
+        process.join()
+
+
+# Worker pool: python api/jobs.py --workers 4
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run background job workers")
+    parser.add_argument('--workers', type=int, default=JOB_WORKERS, help="worker processes")
+    parser.add_argument('--queues', nargs='+', default=list(JOB_QUEUES))
+    parser.add_argument('--drain', action='store_true', help="exit when the queues are empty (delayed retries are left)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    run_pool(args.workers, args.queues, args.drain)
@@ -0,0 +1,194 @@
+import hashlib
+import hmac
+import mimetypes
+import os
+import time
+from urllib.parse import quote, urlencode
+from werkzeug.security import safe_join
+from werkzeug.wrappers import Response
+from werkzeug.wsgi import wrap_file
+
+
+######################################################## VIDEO STREAMING #######################################################################
+# Module videos are served from signed URLs: GET /courses/<id>/modules/<moduleId>/video checks the enrollment once
+# and returns a /media/<key>?expires=...&sig=... URL. The media route only checks the HMAC and the expiry (no JWT,
+# no database), so a <video> tag can request as many Range chunks as it wants for the life of the URL.
+#
+# Storage backends:
+# - local: files under MEDIA_ROOT. Range requests are answered with the open file positioned at the start of the
+#   range and Content-Length set to the range length, so gunicorn sends it with sendfile(2) (the bytes never go
+#   through Python). Behind nginx set MEDIA_ACCEL_REDIRECT and nginx serves the file (and the ranges) itself.
+# - s3: any S3 compatible storage (needs boto3). The media route redirects to a presigned GET URL, S3 handles Range.
+#
+# .env settings:
+# MEDIA_BACKEND=local                local or s3
+# MEDIA_ROOT=media                   folder with the video files (local backend)
+# MEDIA_URL_TTL=300                  seconds a signed URL is valid
+# MEDIA_SIGNING_KEY=...              HMAC key for the URLs (defaults to JWT_SECRET_KEY)
+# MEDIA_ACCEL_REDIRECT=              e.g. /protected-media/ for an nginx internal location pointing at MEDIA_ROOT
+# MEDIA_S3_BUCKET=... MEDIA_S3_ENDPOINT=...   s3 backend (endpoint is optional, e.g. for MinIO)
+
+MEDIA_BACKEND = os.getenv("MEDIA_BACKEND", "local")
+MEDIA_ROOT = os.getenv("MEDIA_ROOT", "media")
+MEDIA_URL_TTL = int(os.getenv("MEDIA_URL_TTL", 300))
+MEDIA_ACCEL_REDIRECT = os.getenv("MEDIA_ACCEL_REDIRECT", "")
+
+
+class MediaSigner:
+    def __init__(self, key, ttl=MEDIA_URL_TTL):
+        self.key = key.encode() if isinstance(key, str) else key
+        self.ttl = ttl
+
+    def _check_key(self):
+        if not self.key:
+            raise RuntimeError("MEDIA_SIGNING_KEY (or JWT_SECRET_KEY) must be set to sign media URLs")
+
+    def signature(self, media_key, expires):
+        self._check_key()
+        message = f"{media_key}:{expires}".encode()
+        return hmac.new(self.key, message, hashlib.sha256).hexdigest()
+
+    def sign(self, media_key, now=None):
+        # Returns (path with query string, expiry unix time)
+        expires = int(now if now is not None else time.time()) + self.ttl
+        query = urlencode({"expires": expires, "sig": self.signature(media_key, expires)})
+        return f"/media/{quote(media_key)}?{query}", expires
+
+    def verify(self, media_key, expires, signature):
+        try:
+            expires = int(expires)
+        except (TypeError, ValueError):
+            return False
+        if expires < time.time() or not self.key:
+            return False
+        return hmac.compare_digest(self.signature(media_key, expires), signature or "")
+
+
+class RangeFile:
+    # Open file positioned at the start of a range that reads at most `length` bytes. Servers with sendfile support
+    # (gunicorn) use fileno() + the current offset + Content-Length, the others read it in blocks.
+    def __init__(self, f, start, length):
+        self.f = f
+        self.remaining = length
+        f.seek(start)
+
+    def fileno(self):
+        return self.f.fileno()
+
+    def seek(self, *args):
+        return self.f.seek(*args)
+
+    def tell(self):
+        return self.f.tell()
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b""
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+def content_type(media_key):
+    return mimetypes.guess_type(media_key)[0] or "application/octet-stream"
+
+
+class LocalStorage:
+    def __init__(self, root=MEDIA_ROOT, accel_redirect=MEDIA_ACCEL_REDIRECT):
+        self.root = os.path.abspath(root)
+        self.accel_redirect = accel_redirect
+
+    def path(self, media_key):
+        # None for keys that would leave the media folder (../ etc.)
+        return safe_join(self.root, media_key)
+
+    def exists(self, media_key):
+        path = self.path(media_key)
+        return path is not None and os.path.isfile(path)
+
+    def save(self, media_key, data):
+        # Written to a temporary file and renamed, so a reader never sees half a file (certificates.py)
+        path = self.path(media_key)
+        if path is None:
+            raise ValueError(f"Invalid media key {media_key}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, 'wb') as f:
+            f.write(data)
+        os.replace(temporary, path)
+
+    def accel_path(self, media_key):
+        return self.accel_redirect.rstrip('/') + '/' + media_key
+
+    def response(self, request, media_key, max_age):
+        path = self.path(media_key)
+        if path is None or not os.path.isfile(path):
+            return Response(status=404)
+        headers = {"Cache-Control": f"private, max-age={max_age}", "Accept-Ranges": "bytes"}
+
+        if self.accel_redirect:
+            # nginx serves the file (sendfile, ranges) from an internal location
+            headers["X-Accel-Redirect"] = self.accel_path(media_key)
+            return Response(status=200, headers=headers, content_type=content_type(media_key))
+
+        stat = os.stat(path)
+        size = stat.st_size
+        etag = f'"{int(stat.st_mtime)}-{size}"'
+        headers["ETag"] = etag
+        start, stop, status = 0, size, 200
+        # A single range is supported (what video players send), multiple ranges get the whole file
+        if request.range is not None and request.if_range.etag in (None, etag.strip('"')):
+            byte_range = request.range.range_for_length(size)
+            if byte_range is None:
+                if len(request.range.ranges) == 1:
+                    headers["Content-Range"] = f"bytes */{size}"
+                    return Response(status=416, headers=headers)
+            else:
+                start, stop = byte_range
+                status = 206
+                headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+
+        headers["Content-Length"] = str(stop - start)
+        body = RangeFile(open(path, 'rb'), start, stop - start)
+        # wrap_file hands the file to the server's wsgi.file_wrapper (sendfile in gunicorn)
+        return Response(wrap_file(request.environ, body), status=status, headers=headers, content_type=content_type(media_key),
+                        direct_passthrough=True)
+
+
+class S3Storage:
+    def __init__(self, bucket=None, endpoint_url=None):
+        import boto3  # Only needed for this backend
+        self.bucket = bucket or os.getenv("MEDIA_S3_BUCKET")
+        self.client = boto3.client("s3", endpoint_url=endpoint_url or os.getenv("MEDIA_S3_ENDPOINT") or None)
+
+    def exists(self, media_key):
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=media_key)
+            return True
+        except ClientError:
+            return False
+
+    def save(self, media_key, data):
+        self.client.put_object(Bucket=self.bucket, Key=media_key, Body=data, ContentType=content_type(media_key))
+
+    def presigned_url(self, media_key, max_age):
+        return self.client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": media_key}, ExpiresIn=max(1, max_age),
+        )
+
+    def response(self, request, media_key, max_age):
+        # The player follows the redirect and sends its Range requests to S3 directly
+        return Response(status=302, headers={"Location": self.presigned_url(media_key, max_age),
+                                             "Cache-Control": "no-store"})
+
+
+def create_storage(backend=MEDIA_BACKEND):
+    if backend == "s3":
+        return S3Storage()
+    return LocalStorage()
@@ -0,0 +1,340 @@
+import bisect
+import contextvars
+import hmac
+import inspect
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from sqlalchemy import event
+
+
+######################################################## METRICS ###############################################################################
+# Per request instrumentation: wall time, database time + statement count, Redis round trips and bcrypt time for every
+# route, served in the Prometheus text format on GET /metrics. Requests slower than SLOW_REQUEST_MS are logged with
+# the SQL they ran (slowest statements first, repeated statements counted so N+1 queries stand out).
+#
+# The numbers of a request live in a context variable set at the start of the request, so the engine events, the
+# Redis wrapper and the password helpers add to the right request in threads (api.py) and in asyncio tasks (asgi.py).
+# Work done outside a request (flusher thread, revocation listener) is not counted.
+# Every process keeps its own numbers: with several gunicorn workers each scrape sees the worker that answered it.
+#
+# .env settings:
+# METRICS_ENABLED=true        false removes the hooks (and /metrics returns 404)
+# METRICS_TOKEN=              when set GET /metrics needs "Authorization: Bearer <token>"
+# SLOW_REQUEST_MS=0           log requests slower than this with their SQL (0 = off)
+# DB_ECHO=false               log every statement through the engine (very slow, only for debugging, see db.py)
+
+# Parsed here instead of db.env_bool: passwords.py imports this module and its pool processes should not build an engine
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").strip().lower() in ('1', 'true', 'yes', 'on')
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", 0))
+SLOW_REQUEST_STATEMENTS = 200  # statements kept per request for the slow log
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+METRIC_PREFIX = "studyproj"
+WHITESPACE_RE = re.compile(r"\s+")
+
+# Seconds, the usual Prometheus client buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar("request_metrics", default=None)
+
+
+class RequestStats:
+    __slots__ = ("start", "db_seconds", "statements", "redis_calls", "redis_seconds", "hash_seconds", "queries")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.db_seconds = 0.0
+        self.statements = 0
+        self.redis_calls = 0
+        self.redis_seconds = 0.0
+        self.hash_seconds = 0.0
+        self.queries = [] if SLOW_REQUEST_MS > 0 else None
+
+
+@contextmanager
+def timed(field):
+    # Adds the time spent in the block to a RequestStats field, e.g. with timed("hash_seconds"): ...
+    stats = _current.get()
+    if stats is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        setattr(stats, field, getattr(stats, field) + time.perf_counter() - start)
+
+
+class RouteMetrics:
+    __slots__ = ("buckets", "count", "seconds", "db_seconds", "statements", "redis_calls", "redis_seconds", "hash_seconds")
+
+    def __init__(self, size):
+        self.buckets = [0] * size
+        self.count = 0
+        self.seconds = 0.0
+        self.db_seconds = 0.0
+        self.statements = 0
+        self.redis_calls = 0
+        self.redis_seconds = 0.0
+        self.hash_seconds = 0.0
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+
+class MetricsRegistry:
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._routes = {}    # (method, route) -> RouteMetrics
+        self._statuses = {}  # (method, route, status) -> requests
+        self._collectors = []
+
+    def register_collector(self, name, stats):
+        # stats() returns a dict of numbers (e.g. CourseCache.stats), shown as <prefix>_<name>_<key> gauges
+        self._collectors.append((name, stats))
+
+    def observe(self, method, route, status, stats, seconds):
+        bucket = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            entry = self._routes.get((method, route))
+            if entry is None:
+                entry = self._routes[(method, route)] = RouteMetrics(len(self.buckets) + 1)
+            entry.buckets[bucket] += 1
+            entry.count += 1
+            entry.seconds += seconds
+            entry.db_seconds += stats.db_seconds
+            entry.statements += stats.statements
+            entry.redis_calls += stats.redis_calls
+            entry.redis_seconds += stats.redis_seconds
+            entry.hash_seconds += stats.hash_seconds
+            key = (method, route, status)
+            self._statuses[key] = self._statuses.get(key, 0) + 1
+
+    def render(self):
+        with self._lock:
+            # Copies, so the formatting below does not hold the lock requests need
+            routes = sorted((key, [list(entry.buckets)] + [getattr(entry, name) for name in RouteMetrics.__slots__[1:]])
+                            for key, entry in self._routes.items())
+            statuses = sorted(self._statuses.items())
+        routes = [(key, dict(zip(RouteMetrics.__slots__, values))) for key, values in routes]
+
+        lines = []
+
+        def header(name, kind, text):
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} {kind}")
+
+        header("http_requests_total", "counter", "Requests by route and status code.")
+        for (method, route, status), count in statuses:
+            lines.append(f'{METRIC_PREFIX}_http_requests_total{{method="{method}",route="{_label(route)}",status="{status}"}} {count}')
+
+        header("http_request_duration_seconds", "histogram", "Wall time of the requests.")
+        for (method, route), entry in routes:
+            labels = f'method="{method}",route="{_label(route)}"'
+            cumulative = 0
+            for le, count in zip(self.buckets, entry["buckets"]):
+                cumulative += count
+                lines.append(f'{METRIC_PREFIX}_http_request_duration_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f'{METRIC_PREFIX}_http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {entry["count"]}')
+            lines.append(f'{METRIC_PREFIX}_http_request_duration_seconds_sum{{{labels}}} {_number(entry["seconds"])}')
+            lines.append(f'{METRIC_PREFIX}_http_request_duration_seconds_count{{{labels}}} {entry["count"]}')
+
+        # Totals per route, divide by the request count for the per request average
+        for name, text in (("db_seconds", "Time spent in database statements."),
+                           ("statements", "Database statements executed."),
+                           ("redis_calls", "Redis round trips (a pipeline is one)."),
+                           ("redis_seconds", "Time spent waiting for Redis."),
+                           ("hash_seconds", "Time spent waiting for bcrypt (pool queue included).")):
+            header(f"request_{name}_total", "counter", text)
+            for (method, route), entry in routes:
+                lines.append(f'{METRIC_PREFIX}_request_{name}_total{{method="{method}",route="{_label(route)}"}} '
+                             f'{_number(entry[name])}')
+
+        for collector, stats in self._collectors:
+            try:
+                values = stats()
+            except Exception as e:
+                logger.warning("Metrics collector %s failed: %s", collector, e)
+                continue
+            for key, value in sorted(values.items()):
+                if not isinstance(value, (int, float)):
+                    continue
+                name = f"{METRIC_PREFIX}_{collector}_{key}"
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def authorized(authorization_header):
+    if not METRICS_TOKEN:
+        return True
+    return hmac.compare_digest(authorization_header or "", f"Bearer {METRICS_TOKEN}")
+
+
+######################################################## HOOKS #################################################################################
+
+def instrument_engine(engine):
+    # Sync engine (for create_async_engine pass engine.sync_engine). Same start-time stack as the SQLAlchemy
+    # "profiling" recipe so nested/failed statements don't mix up their timings.
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if _current.get() is not None:
+            conn.info.setdefault("metrics_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        stats = _current.get()
+        starts = conn.info.get("metrics_start")
+        if stats is None or not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        stats.db_seconds += elapsed
+        stats.statements += 1
+        if stats.queries is not None and len(stats.queries) < SLOW_REQUEST_STATEMENTS:
+            stats.queries.append((statement, elapsed))
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("metrics_start"):
+            connection.info["metrics_start"].pop()
+
+    return engine
+
+
+def _timed_call(call):
+    # Wraps a Redis round trip (execute_command or a pipeline's execute), sync or asyncio
+    if inspect.iscoroutinefunction(call):
+        async def timed_call(*args, **kwargs):
+            stats = _current.get()
+            if stats is None:
+                return await call(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return await call(*args, **kwargs)
+            finally:
+                stats.redis_calls += 1
+                stats.redis_seconds += time.perf_counter() - start
+        return timed_call
+
+    def timed_call(*args, **kwargs):
+        stats = _current.get()
+        if stats is None:
+            return call(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return call(*args, **kwargs)
+        finally:
+            stats.redis_calls += 1
+            stats.redis_seconds += time.perf_counter() - start
+    return timed_call
+
+
+def instrument_redis(client):
+    # Counts the round trips of this client: every command (scripts included, they go through evalsha) and every
+    # pipeline execute. Only this instance is wrapped, other clients (pub/sub listeners, the flusher) are not.
+    client.execute_command = _timed_call(client.execute_command)
+    pipeline = client.pipeline
+
+    def timed_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        pipe.execute = _timed_call(pipe.execute)
+        return pipe
+
+    client.pipeline = timed_pipeline
+    return client
+
+
+def _slow_request(method, path, status, stats, seconds):
+    # Group identical statements so N+1 queries show up as one line "12x"
+    grouped = {}
+    for statement, elapsed in stats.queries:
+        entry = grouped.setdefault(statement, [0, 0.0])
+        entry[0] += 1
+        entry[1] += elapsed
+    slowest = sorted(grouped.items(), key=lambda item: item[1][1], reverse=True)[:5]
+    lines = [
+        f"Slow request {method} {path} {status}: {seconds * 1000:.1f} ms "
+        f"(db {stats.db_seconds * 1000:.1f} ms in {stats.statements} statements, "
+        f"redis {stats.redis_calls} calls {stats.redis_seconds * 1000:.1f} ms, hash {stats.hash_seconds * 1000:.1f} ms)"
+    ]
+    for statement, (count, elapsed) in slowest:
+        statement = WHITESPACE_RE.sub(' ', statement)[:500]
+        lines.append(f"  {count}x {elapsed * 1000:.1f} ms: {statement}")
+    logger.warning("\n".join(lines))
+
+
+def _finish(token, method, route, path, status):
+    stats = _current.get()
+    try:
+        _current.reset(token)
+    except ValueError:
+        _current.set(None)  # finished in another context than it started, just stop counting
+    if stats is None:
+        return
+    seconds = time.perf_counter() - stats.start
+    registry.observe(method, route, status, stats, seconds)
+    if SLOW_REQUEST_MS > 0 and seconds * 1000 >= SLOW_REQUEST_MS:
+        _slow_request(method, path, status, stats, seconds)
+
+
+def init_app(app):
+    # Flask: count from before_request to teardown_request. The route is the url rule ("/courses/<int:id>") so the
+    # number of series stays small, requests that match no rule are grouped as "unmatched".
+    if not METRICS_ENABLED:
+        return
+    from flask import g, request
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_token = _current.set(RequestStats())
+
+    @app.after_request
+    def request_metrics_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exception=None):
+        token = g.pop('metrics_token', None)
+        if token is not None:
+            route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            _finish(token, request.method, route, request.path, g.pop('metrics_status', 500))
+
+
+def init_async_app(app):
+    # Quart: same as init_app, the hooks are coroutines so they run in the request's task (and its context)
+    if not METRICS_ENABLED:
+        return
+    from quart import g, request
+
+    @app.before_request
+    async def start_request_metrics():
+        g.metrics_token = _current.set(RequestStats())
+
+    @app.after_request
+    async def request_metrics_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    async def finish_request_metrics(exception=None):
+        token = g.pop('metrics_token', None)
+        if token is not None:
+            route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            _finish(token, request.method, route, request.path, g.pop('metrics_status', 500))
@@ -1,5 +1,5 @@
 from datetime import datetime, timezone
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Index , Enum as SQLAlchemyEnum
+from sqlalchemy import Column, Integer, Float, Boolean, String, Text, LargeBinary, ForeignKey, Date, DateTime, Index , DDL, event, Enum as SQLAlchemyEnum
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from enum import Enum as PyEnum
@@ -24,18 +24,19 @@ class Role(Base):
     def __repr__(self):
         return f"<Role(id={self.id}, name={self.role_name})>"
 
+# Relationships are lazy by default, routes opt in to eager loading (joinedload/selectinload) only where the response needs it
 class User(Base, TimestampMixin):
     __tablename__ = 'users'
-    __table_args__ = (Index('ix_user_email', 'email'),)
+    __table_args__ = (Index('ix_user_email', 'email'), Index('ix_user_user_name', 'user_name', unique=True))
     id = Column(Integer, primary_key=True)
     user_name = Column(String, nullable=False)
     email = Column(String, unique=True, nullable=False)
     password_hash = Column(String, nullable=False)
     role_id = Column(Integer, ForeignKey('roles.id', ondelete='CASCADE'), nullable=False)
     role = relationship("Role", back_populates="users")
-    profile = relationship("UserProfile", back_populates="user", uselist=False, cascade="all, delete-orphan", lazy='joined')
-    courses = relationship("Course", back_populates="instructor" , cascade="all, delete-orphan", lazy='selectin')
-    enroll = relationship("Enroll", back_populates="userenroll" , cascade="all, delete-orphan", lazy='selectin')
+    profile = relationship("UserProfile", back_populates="user", uselist=False, cascade="all, delete-orphan", lazy='select')
+    courses = relationship("Course", back_populates="instructor" , cascade="all, delete-orphan", lazy='select')
+    enroll = relationship("Enroll", back_populates="userenroll" , cascade="all, delete-orphan", lazy='select')
     def __repr__(self):
         return f"<User(id={self.id}, username={self.user_name}, email={self.email})>"
 
@@ -61,31 +62,169 @@ class Course(Base, TimestampMixin):
     description = Column(Text, nullable=True)
     course_instructor_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     instructor = relationship("User", back_populates="courses")
-    modules = relationship("Module", back_populates="course", cascade="all, delete-orphan", lazy='selectin')
-    enrolls = relationship("Enroll", back_populates="courseenroll", cascade="all, delete-orphan", lazy='selectin')
+    modules = relationship("Module", back_populates="course", cascade="all, delete-orphan", lazy='select')
+    enrolls = relationship("Enroll", back_populates="courseenroll", cascade="all, delete-orphan", lazy='select')
     
     def __repr__(self):
         return f"<Course(id={self.id}, title={self.title})>"
 
 class Module(Base, TimestampMixin):
     __tablename__ = 'modules'
+    __table_args__ = (Index('ix_module_course_id_id', 'course_id', 'id'),)
     id = Column(Integer, primary_key=True)
     course_id = Column(Integer, ForeignKey('courses.id', ondelete='CASCADE'), nullable=False)
     title = Column(String, nullable=False)
     content = Column(Text, nullable=True)
+    video_key = Column(String, nullable=True)  # key of the module video in the media storage (see media.py)
     course = relationship("Course", back_populates="modules")
+    quizzes = relationship("Quiz", back_populates="module", cascade="all, delete-orphan", lazy='select')
     
     def __repr__(self):
         return f"<Module(id={self.id}, title={self.title})>"
 
 class Enroll(Base, TimestampMixin):
     __tablename__ = 'enrolls'
+    # A student can enroll to a course only once (also used by the bulk ON CONFLICT DO NOTHING insert)
+    __table_args__ = (Index('uq_enroll_course_user', 'course_id', 'user_id', unique=True),)
     id = Column(Integer, primary_key=True)
     course_id = Column(Integer, ForeignKey('courses.id', ondelete='CASCADE'), nullable=False)
     user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     courseenroll = relationship("Course", back_populates="enrolls")
     userenroll = relationship("User", back_populates="enroll")
+    certificate = relationship("Certificate", back_populates="enroll", uselist=False, cascade="all, delete-orphan", passive_deletes=True, lazy='select')
     
 
     def __repr__(self):
-        return f"<Module(id={self.id}, title={self.title})>"
\ No newline at end of file
+        return f"<Module(id={self.id}, title={self.title})>"
+
+# Completion certificate of an enrollment (see certificates.py), the PDF is in the media storage under its key
+class Certificate(Base, TimestampMixin):
+    __tablename__ = 'certificates'
+    __table_args__ = (Index('ix_certificate_course_id', 'course_id'),)
+    id = Column(Integer, primary_key=True)
+    enroll_id = Column(Integer, ForeignKey('enrolls.id', ondelete='CASCADE'), unique=True, nullable=False)
+    course_id = Column(Integer, ForeignKey('courses.id', ondelete='CASCADE'), nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    template_version = Column(Integer, nullable=False)
+    certificate_key = Column(String(64), nullable=False)  # sha256 of user, course and template version
+    issued_at = Column(DateTime, nullable=False)
+    enroll = relationship("Enroll", back_populates="certificate")
+
+    def __repr__(self):
+        return f"<Certificate(enroll_id={self.enroll_id}, key={self.certificate_key})>"
+
+class ModuleProgress(Base, TimestampMixin):
+    __tablename__ = 'module_progress'
+    # One row per student and module, written in batches by the progress flusher (progress.py)
+    __table_args__ = (
+        Index('uq_progress_user_module', 'user_id', 'module_id', unique=True),
+        Index('ix_progress_user_course', 'user_id', 'course_id'),
+    )
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    course_id = Column(Integer, ForeignKey('courses.id', ondelete='CASCADE'), nullable=False)
+    module_id = Column(Integer, ForeignKey('modules.id', ondelete='CASCADE'), nullable=False)
+    position = Column(Float, nullable=False, default=0)  # seconds into the module video at the last heartbeat
+    max_position = Column(Float, nullable=False, default=0)  # furthest point watched
+    completed = Column(Boolean, nullable=False, default=False)
+    last_heartbeat_at = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<ModuleProgress(user_id={self.user_id}, module_id={self.module_id}, position={self.position})>"
+
+
+# Quizzes (see quiz.py). The answer key is also kept as arrays (one byte / float per question) so a whole cohort
+# of submissions is graded with NumPy in one pass
+class Quiz(Base, TimestampMixin):
+    __tablename__ = 'quizzes'
+    __table_args__ = (Index('ix_quiz_module_id', 'module_id'),)
+    id = Column(Integer, primary_key=True)
+    module_id = Column(Integer, ForeignKey('modules.id', ondelete='CASCADE'), nullable=False)
+    title = Column(String, nullable=False)
+    question_count = Column(Integer, nullable=False)
+    answer_key = Column(LargeBinary, nullable=False)  # uint8 per question: index of the correct option
+    option_counts = Column(LargeBinary, nullable=False)  # uint8 per question: number of options
+    points = Column(LargeBinary, nullable=False)  # float32 per question
+    max_score = Column(Float, nullable=False)
+    module = relationship("Module", back_populates="quizzes")
+    questions = relationship("QuizQuestion", back_populates="quiz", cascade="all, delete-orphan", order_by="QuizQuestion.position", lazy='select')
+    # Submissions are removed by the database (ON DELETE CASCADE), a quiz delete doesn't load the whole cohort
+    submissions = relationship("QuizSubmission", back_populates="quiz", cascade="all, delete-orphan", passive_deletes=True, lazy='select')
+
+    def __repr__(self):
+        return f"<Quiz(id={self.id}, title={self.title})>"
+
+class QuizQuestion(Base, TimestampMixin):
+    __tablename__ = 'quiz_questions'
+    __table_args__ = (Index('uq_quiz_question_position', 'quiz_id', 'position', unique=True),)
+    id = Column(Integer, primary_key=True)
+    quiz_id = Column(Integer, ForeignKey('quizzes.id', ondelete='CASCADE'), nullable=False)
+    position = Column(Integer, nullable=False)
+    text = Column(Text, nullable=False)
+    options = Column(Text, nullable=False)  # JSON list of the option texts
+    answer = Column(Integer, nullable=False)
+    points = Column(Float, nullable=False, default=1)
+    quiz = relationship("Quiz", back_populates="questions")
+
+    def __repr__(self):
+        return f"<QuizQuestion(quiz_id={self.quiz_id}, position={self.position})>"
+
+# One submission per student and quiz, answers as uint8 per question (255 = not answered)
+class QuizSubmission(Base, TimestampMixin):
+    __tablename__ = 'quiz_submissions'
+    __table_args__ = (Index('uq_quiz_submission_quiz_user', 'quiz_id', 'user_id', unique=True),)
+    id = Column(Integer, primary_key=True)
+    quiz_id = Column(Integer, ForeignKey('quizzes.id', ondelete='CASCADE'), nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    answers = Column(LargeBinary, nullable=False)
+    correct_count = Column(Integer, nullable=True)
+    score = Column(Float, nullable=True)
+    graded_at = Column(DateTime, nullable=True)
+    quiz = relationship("Quiz", back_populates="submissions")
+
+    def __repr__(self):
+        return f"<QuizSubmission(quiz_id={self.quiz_id}, user_id={self.user_id}, score={self.score})>"
+
+
+# Counters per course for the stats route, changed in the same transaction as the enrollments and modules (see stats.py)
+class CourseStats(Base):
+    __tablename__ = 'course_stats'
+    course_id = Column(Integer, ForeignKey('courses.id', ondelete='CASCADE'), primary_key=True)
+    enrollment_count = Column(Integer, nullable=False, default=0)
+    module_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+
+    def __repr__(self):
+        return f"<CourseStats(course_id={self.course_id}, enrollments={self.enrollment_count}, modules={self.module_count})>"
+
+# New enrollments per course and day (UTC), only the last STATS_RECENT_DAYS days are kept
+class CourseEnrollmentDay(Base):
+    __tablename__ = 'course_enrollment_days'
+    course_id = Column(Integer, ForeignKey('courses.id', ondelete='CASCADE'), primary_key=True)
+    day = Column(Date, primary_key=True)
+    enrollment_count = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<CourseEnrollmentDay(course_id={self.course_id}, day={self.day}, enrollments={self.enrollment_count})>"
+
+
+# Full text search on PostgreSQL (see search.py): a generated tsvector column (title weighted above the text, kept
+# current by the database on every insert and update) and a GIN index on courses and modules. The columns are not
+# mapped so SQLite can use the same models, create_db.py runs the same statements for tables that already exist.
+SEARCH_DDL = {
+    Course.__table__: [
+        "ALTER TABLE courses ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+        "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(description, '')), 'B')) STORED",
+        "CREATE INDEX IF NOT EXISTS ix_course_search ON courses USING GIN (search_vector)",
+    ],
+    Module.__table__: [
+        "ALTER TABLE modules ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+        "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(content, '')), 'B')) STORED",
+        "CREATE INDEX IF NOT EXISTS ix_module_search ON modules USING GIN (search_vector)",
+    ],
+}
+for table, statements in SEARCH_DDL.items():
+    for statement in statements:
+        event.listen(table, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
@@ -0,0 +1,75 @@
+import json
+import logging
+import os
+import urllib.request
+from sqlalchemy import select
+try:
+    from .models import User, Course
+    from .db import Session
+except ImportError:
+    from models import User, Course
+    from db import Session
+
+
+######################################################## NOTIFICATIONS #########################################################################
+# Welcome and enrollment notifications, run by the job workers (see jobs.py): register and enroll only queue a job
+# with ids, the worker loads what the message needs and delivers it.
+#
+# Delivery (NOTIFY_BACKEND):
+#   log       write the message to the worker log (default, for local runs)
+#   webhook   POST the message as JSON to NOTIFY_WEBHOOK_URL (e.g. a mail/SMS service), a non 2xx answer or a timeout
+#             raises so the job is retried
+#
+# .env settings:
+# NOTIFY_BACKEND=log
+# NOTIFY_WEBHOOK_URL=
+# NOTIFY_TIMEOUT=10        seconds for one webhook call
+
+NOTIFY_BACKEND = os.getenv("NOTIFY_BACKEND", "log")
+NOTIFY_WEBHOOK_URL = os.getenv("NOTIFY_WEBHOOK_URL")
+NOTIFY_TIMEOUT = float(os.getenv("NOTIFY_TIMEOUT", 10))
+
+NOTIFICATIONS_QUEUE = "notifications"
+WELCOME_JOB = "notify.welcome"
+ENROLLED_JOB = "notify.enrolled"
+
+logger = logging.getLogger(__name__)
+
+
+def deliver(to, subject, body):
+    message = {"to": to, "subject": subject, "body": body}
+    if NOTIFY_BACKEND == 'webhook':
+        if not NOTIFY_WEBHOOK_URL:
+            raise RuntimeError("NOTIFY_WEBHOOK_URL is not set")
+        request = urllib.request.Request(NOTIFY_WEBHOOK_URL, data=json.dumps(message).encode(), method='POST',
+                                         headers={"Content-Type": "application/json"})
+        # urlopen raises HTTPError for 4xx/5xx
+        with urllib.request.urlopen(request, timeout=NOTIFY_TIMEOUT) as response:
+            return {"to": to, "status": response.status}
+    logger.info("Notification to %s: %s", to, subject)
+    return {"to": to, "status": "logged"}
+
+
+def send_welcome(payload):
+    # payload: {"user_id"}
+    with Session() as session:
+        user = session.execute(select(User.user_name, User.email).where(User.id == payload['user_id'])).first()
+    if user is None:
+        return {"skipped": "user deleted"}
+    return deliver(user.email, "Welcome to Studyo", f"Hi {user.user_name}, your account is ready.")
+
+
+def send_enrolled(payload):
+    # payload: {"user_id", "course_id"}
+    with Session() as session:
+        user = session.execute(select(User.user_name, User.email).where(User.id == payload['user_id'])).first()
+        title = session.execute(select(Course.title).where(Course.id == payload['course_id'])).scalar()
+    if user is None or title is None:
+        return {"skipped": "user or course deleted"}
+    return deliver(user.email, f"You are enrolled to {title}", f"Hi {user.user_name}, you can start {title} now.")
+
+
+NOTIFICATION_HANDLERS = {
+    WELCOME_JOB: send_welcome,
+    ENROLLED_JOB: send_enrolled,
+}
@@ -0,0 +1,78 @@
+import base64
+import binascii
+import json
+
+
+######################################################## PAGINATION ############################################################################
+# Keyset (cursor) pagination: instead of OFFSET we remember the last id that was sent and ask for "id > last_id",
+# this way every page is a short index range scan no matter how deep the client pages.
+
+DEFAULT_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _encode(payload):
+    payload = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def _decode(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if not isinstance(payload, dict):
+            raise ValueError("cursor must be an object")
+        return payload
+    except (binascii.Error, UnicodeError, ValueError):
+        raise InvalidCursor("Invalid cursor")
+
+
+def encode_cursor(last_id):
+    # Opaque token for the client, they should just send it back as ?cursor=
+    return _encode({"id": last_id})
+
+
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        return int(_decode(token)['id'])
+    except (ValueError, KeyError, TypeError):
+        raise InvalidCursor("Invalid cursor")
+
+
+def encode_rank_cursor(rank, kind, last_id):
+    # For ranked results (search): position is (rank, kind, id) in descending order
+    return _encode({"rank": rank, "kind": kind, "id": last_id})
+
+
+def decode_rank_cursor(token):
+    if not token:
+        return None
+    try:
+        payload = _decode(token)
+        return int(payload['rank']), str(payload['kind']), int(payload['id'])
+    except (ValueError, KeyError, TypeError):
+        raise InvalidCursor("Invalid cursor")
+
+
+def page_size(limit):
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def keyset_page(query, id_column, limit, cursor):
+    # Fetch one extra row to know if there is a next page without running a COUNT
+    if cursor is not None:
+        query = query.filter(id_column > cursor)
+    rows = query.order_by(id_column).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].id)
+    return rows, next_cursor
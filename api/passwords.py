@@ -0,0 +1,202 @@
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import bcrypt
+try:
+    from .metrics import timed
+except ImportError:
+    from metrics import timed
+
+
+######################################################## PASSWORD HASHING ######################################################################
+# bcrypt is slow on purpose, so it runs in a bounded process pool instead of on the request thread.
+# When too many hashes are already queued the request is rejected right away (503) instead of waiting.
+# A worker process that dies (e.g. killed for memory) breaks the whole pool, so the pool is replaced and the hash is
+# tried once more instead of failing every login until the web process restarts.
+#
+# .env settings:
+# BCRYPT_ROUNDS=12        work factor for new hashes, older hashes are upgraded on the next login
+# HASH_WORKERS=4          processes in the pool (0 hashes inline on the request thread)
+# HASH_QUEUE_LIMIT=16     max hashes running + waiting before new ones are shed
+# HASH_TIMEOUT=10         seconds a request waits for its hash before giving up
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", os.cpu_count() or 1))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", max(1, HASH_WORKERS) * 4))
+HASH_TIMEOUT = float(os.getenv("HASH_TIMEOUT", 10))
+
+logger = logging.getLogger(__name__)
+
+
+class HashPoolBusy(Exception):
+    pass
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(HASH_QUEUE_LIMIT)
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check(password, password_hash):
+    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # spawn so the workers don't inherit the web server threads and open connections
+                _executor = ProcessPoolExecutor(max_workers=HASH_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _executor
+
+
+def _replace_executor(broken):
+    # Only the thread that sees the broken pool first replaces it, the others already get the new one
+    global _executor
+    with _executor_lock:
+        if _executor is broken:
+            logger.warning("A bcrypt worker process died, starting a new hashing pool")
+            _executor = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def _with_pool(call):
+    # call(executor) submits to the pool and waits, once more on a new pool when the pool broke
+    executor = _get_executor()
+    try:
+        return call(executor)
+    except BrokenProcessPool:
+        _replace_executor(executor)
+    executor = _get_executor()
+    try:
+        return call(executor)
+    except BrokenProcessPool:
+        _replace_executor(executor)
+        raise HashPoolBusy()
+
+
+async def _with_pool_async(call):
+    executor = _get_executor()
+    try:
+        return await call(executor)
+    except BrokenProcessPool:
+        _replace_executor(executor)
+    executor = _get_executor()
+    try:
+        return await call(executor)
+    except BrokenProcessPool:
+        _replace_executor(executor)
+        raise HashPoolBusy()
+
+
+def _submit(executor, fn, *args, timeout=None):
+    # timeout=None sheds right away when the queue is full, bulk imports wait up to timeout seconds for a slot
+    if not (_slots.acquire(blocking=False) if timeout is None else _slots.acquire(timeout=timeout)):
+        raise HashPoolBusy()
+    try:
+        future = executor.submit(fn, *args)
+    except Exception:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    return future
+
+
+def _run(fn, *args):
+    with timed("hash_seconds"):
+        if HASH_WORKERS <= 0:
+            return fn(*args)
+        try:
+            return _with_pool(lambda executor: _submit(executor, fn, *args).result(timeout=HASH_TIMEOUT))
+        except FutureTimeoutError:
+            raise HashPoolBusy()
+
+
+async def _run_async(fn, *args):
+    # Same as _run but the event loop keeps serving other requests while the pool works
+    async def call(executor):
+        return await asyncio.wait_for(asyncio.wrap_future(_submit(executor, fn, *args)), HASH_TIMEOUT)
+
+    with timed("hash_seconds"):
+        if HASH_WORKERS <= 0:
+            return fn(*args)
+        try:
+            return await _with_pool_async(call)
+        except asyncio.TimeoutError:
+            raise HashPoolBusy()
+
+
+def hash_password(password):
+    return _run(_hash, password, BCRYPT_ROUNDS)
+
+
+def check_password(password, password_hash):
+    return _run(_check, password, password_hash)
+
+
+def hash_passwords(passwords):
+    # Bulk imports wait for free slots instead of being shed, and only use half of the queue so logins still get in
+    with timed("hash_seconds"):
+        return _hash_many(passwords)
+
+
+def _hash_many(passwords):
+    if HASH_WORKERS <= 0:
+        return [_hash(password, BCRYPT_ROUNDS) for password in passwords]
+    window = max(1, HASH_QUEUE_LIMIT // 2)
+
+    def hash_window(executor, batch):
+        futures = [_submit(executor, _hash, password, BCRYPT_ROUNDS, timeout=HASH_TIMEOUT) for password in batch]
+        return [future.result() for future in futures]
+
+    hashes = []
+    for start in range(0, len(passwords), window):
+        batch = passwords[start:start + window]
+        hashes.extend(_with_pool(lambda executor: hash_window(executor, batch)))
+    return hashes
+
+
+async def hash_password_async(password):
+    return await _run_async(_hash, password, BCRYPT_ROUNDS)
+
+
+async def check_password_async(password, password_hash):
+    return await _run_async(_check, password, password_hash)
+
+
+def _ping():
+    return True
+
+
+def warm_up():
+    # Starts every worker process now (spawn takes a while per process) instead of on the first logins
+    if HASH_WORKERS <= 0:
+        return
+    executor = _get_executor()
+    futures = [executor.submit(_ping) for _ in range(HASH_WORKERS)]
+    for future in futures:
+        future.result(timeout=HASH_TIMEOUT)
+
+
+def needs_rehash(password_hash):
+    # bcrypt hashes look like $2b$<cost>$<salt+hash>
+    try:
+        return int(password_hash.split('$')[2]) < BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,324 @@
+import logging
+import math
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+import redis
+from sqlalchemy import select, func, case, or_
+from sqlalchemy.exc import IntegrityError
+try:
+    from .models import User, Module, Enroll, ModuleProgress
+    from .db import env_bool
+    from .bulk import insert_ignore, chunks
+except ImportError:
+    from models import User, Module, Enroll, ModuleProgress
+    from db import env_bool
+    from bulk import insert_ignore, chunks
+
+
+######################################################## PROGRESS TRACKING #####################################################################
+# Video players send a heartbeat every few seconds, so progress is written behind instead of one UPDATE per heartbeat:
+#
+# 1. The heartbeat route checks access (cached in memory) and appends the event to the Redis stream "progress:events"
+#    (one XADD, nothing is written to the database).
+# 2. A flusher reads the stream through the consumer group "progress-flushers", keeps only the last state per
+#    (user, module) and writes it with one multi-row INSERT ... ON CONFLICT DO UPDATE per chunk.
+# 3. Events are acknowledged (XACK + XDEL) only after the commit. If a flusher dies its pending events are claimed by
+#    another flusher after PROGRESS_CLAIM_IDLE seconds and written again (the upsert is idempotent).
+#
+# What can be lost: events still in Redis memory when Redis itself crashes (up to 1 second with appendfsync everysec),
+# and the oldest events when no flusher runs long enough for the stream to pass PROGRESS_STREAM_MAXLEN.
+#
+# .env settings:
+# PROGRESS_STREAM_MAXLEN=1000000     events kept in the stream at most (approximate trim)
+# PROGRESS_BATCH_SIZE=20000          events read per flush at most
+# PROGRESS_FLUSH_INTERVAL=1          seconds between flushes
+# PROGRESS_CLAIM_IDLE=60             seconds before pending events of a dead flusher are taken over
+# PROGRESS_FLUSH_IN_PROCESS=true     run a flusher thread in the API process (false: run `python api/progress.py`)
+# PROGRESS_ACCESS_TTL=60             seconds a positive access check is cached
+
+PROGRESS_STREAM = "progress:events"
+PROGRESS_GROUP = "progress-flushers"
+PROGRESS_STREAM_MAXLEN = int(os.getenv("PROGRESS_STREAM_MAXLEN", 1000000))
+PROGRESS_BATCH_SIZE = int(os.getenv("PROGRESS_BATCH_SIZE", 20000))
+PROGRESS_FLUSH_INTERVAL = float(os.getenv("PROGRESS_FLUSH_INTERVAL", 1))
+PROGRESS_CLAIM_IDLE = float(os.getenv("PROGRESS_CLAIM_IDLE", 60))
+PROGRESS_FLUSH_IN_PROCESS = env_bool("PROGRESS_FLUSH_IN_PROCESS", True)
+PROGRESS_ACCESS_TTL = float(os.getenv("PROGRESS_ACCESS_TTL", 60))
+PROGRESS_ACCESS_MAX_ENTRIES = 100000
+
+logger = logging.getLogger(__name__)
+
+
+def progress_access_query(user_name, course_id, module_id):
+    # Id of the user if they are enrolled to the course and the module belongs to it, in one query
+    return (
+        select(User.id)
+        .join(Enroll, Enroll.user_id == User.id)
+        .join(Module, Module.course_id == Enroll.course_id)
+        .where(User.user_name == user_name, Enroll.course_id == course_id, Module.id == module_id)
+        .limit(1)
+    )
+
+
+class ProgressAccessCache:
+    # Remembers successful access checks for a while so a heartbeat does not need a database query.
+    # Only allowed (user, course, module) are cached, a denied check is asked again next time.
+    def __init__(self, ttl=PROGRESS_ACCESS_TTL, max_entries=PROGRESS_ACCESS_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (user_name, course_id, module_id) -> (user_id, expires)
+        self._lock = threading.Lock()
+
+    def get(self, user_name, course_id, module_id):
+        key = (user_name, course_id, module_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                del self._entries[key]
+                return None
+            return entry[0]
+
+    def put(self, user_name, course_id, module_id, user_id):
+        with self._lock:
+            self._entries[(user_name, course_id, module_id)] = (user_id, time.monotonic() + self.ttl)
+            self._entries.move_to_end((user_name, course_id, module_id))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def heartbeat_event(user_id, course_id, module_id, data):
+    # Body of the heartbeat route: {"position": seconds, "completed": false}, returns (stream fields, error message)
+    data = data or {}
+    position = data.get('position')
+    # NaN would pass position < 0, and greatest(max_position, NaN) is NaN on PostgreSQL for good
+    if not isinstance(position, (int, float)) or isinstance(position, bool) or not math.isfinite(position) or position < 0:
+        return None, "position must be a number of seconds (0 or more)."
+    completed = data.get('completed', False)
+    if not isinstance(completed, bool):
+        return None, "completed must be true or false."
+    return {
+        "u": user_id,
+        "c": course_id,
+        "m": module_id,
+        "p": float(position),
+        "done": int(completed),
+        "t": time.time(),
+    }, None
+
+
+class ProgressRecorder:
+    def __init__(self, redis_client, maxlen=PROGRESS_STREAM_MAXLEN):
+        self.redis = redis_client
+        self.maxlen = maxlen
+
+    def record(self, event):
+        return self.redis.xadd(PROGRESS_STREAM, event, maxlen=self.maxlen, approximate=True)
+
+
+class AsyncProgressRecorder(ProgressRecorder):
+    # Same as ProgressRecorder with a redis.asyncio client
+    async def record(self, event):
+        return await self.redis.xadd(PROGRESS_STREAM, event, maxlen=self.maxlen, approximate=True)
+
+
+def coalesce(events):
+    # Keeps one row per (user, module): position of the newest heartbeat, furthest position, completed if any said so
+    rows = {}
+    for fields in events:
+        key = (int(fields['u']), int(fields['m']))
+        position, sent_at, completed = float(fields['p']), float(fields['t']), fields['done'] == '1'
+        row = rows.get(key)
+        if row is None:
+            rows[key] = {"user_id": key[0], "module_id": key[1], "course_id": int(fields['c']), "position": position,
+                         "max_position": position, "completed": completed, "sent_at": sent_at}
+            continue
+        if sent_at >= row['sent_at']:
+            row['position'] = position
+            row['sent_at'] = sent_at
+        row['max_position'] = max(row['max_position'], position)
+        row['completed'] = row['completed'] or completed
+    return list(rows.values())
+
+
+def upsert_progress(session, rows):
+    # Multi-row INSERT ... ON CONFLICT DO UPDATE, safe to run twice with the same rows and with rows that arrive late
+    table = ModuleProgress.__table__
+    greatest = func.greatest if session.get_bind().dialect.name == 'postgresql' else func.max
+    now = datetime.now(timezone.utc)
+    for chunk in chunks(rows):
+        statement = insert_ignore(session, table).values([{
+            "user_id": row['user_id'],
+            "module_id": row['module_id'],
+            "course_id": row['course_id'],
+            "position": row['position'],
+            "max_position": row['max_position'],
+            "completed": row['completed'],
+            "last_heartbeat_at": datetime.fromtimestamp(row['sent_at'], timezone.utc),
+            "created_at": now,
+            "updated_at": now,
+        } for row in chunk])
+        excluded = statement.excluded
+        newer = excluded.last_heartbeat_at >= table.c.last_heartbeat_at
+        statement = statement.on_conflict_do_update(
+            index_elements=['user_id', 'module_id'],
+            set_={
+                "position": case((newer, excluded.position), else_=table.c.position),
+                "max_position": greatest(table.c.max_position, excluded.max_position),
+                "completed": or_(table.c.completed, excluded.completed),
+                "last_heartbeat_at": case((newer, excluded.last_heartbeat_at), else_=table.c.last_heartbeat_at),
+                "updated_at": now,
+            },
+        )
+        session.execute(statement)
+
+
+def drop_missing(session, rows):
+    # Rows whose user or module was deleted since the heartbeat (their foreign keys would fail the whole batch)
+    users, modules = set(), set()
+    for chunk in chunks(rows):
+        users.update(session.execute(select(User.id).where(User.id.in_({row['user_id'] for row in chunk}))).scalars())
+        modules.update(session.execute(select(Module.id).where(Module.id.in_({row['module_id'] for row in chunk}))).scalars())
+    return [row for row in rows if row['user_id'] in users and row['module_id'] in modules]
+
+
+class ProgressFlusher:
+    def __init__(self, redis_client, session_factory, batch_size=PROGRESS_BATCH_SIZE,
+                 flush_interval=PROGRESS_FLUSH_INTERVAL, claim_idle=PROGRESS_CLAIM_IDLE):
+        self.redis = redis_client
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.claim_idle = claim_idle
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._group_ready = False
+        self._stats = {"events": 0, "rows": 0, "flushes": 0, "claimed": 0, "errors": 0, "last_flush_ms": 0.0}
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def start(self):
+        # Started on the first heartbeat so importing the app does not open Redis connections
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self.run, name="progress-flusher", daemon=True)
+                    self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _ensure_group(self):
+        if self._group_ready:
+            return
+        try:
+            self.redis.xgroup_create(PROGRESS_STREAM, PROGRESS_GROUP, id='0', mkstream=True)
+        except redis.ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+        self._group_ready = True
+
+    def _read(self, stream_id, count, block=None):
+        response = self.redis.xreadgroup(PROGRESS_GROUP, self.consumer, {PROGRESS_STREAM: stream_id}, count=count, block=block)
+        return [entry for _, entries in response or [] for entry in entries]
+
+    def _claim(self):
+        # Pending events of flushers that stopped without acknowledging them
+        claimed = self.redis.xautoclaim(PROGRESS_STREAM, PROGRESS_GROUP, self.consumer,
+                                        min_idle_time=int(self.claim_idle * 1000), start_id='0-0', count=self.batch_size)
+        entries = [entry for entry in claimed[1] if entry[1]]
+        # Entries trimmed from the stream come back empty, acknowledge them so they do not stay pending
+        trimmed = [entry_id for entry_id, fields in claimed[1] if not fields]
+        if trimmed:
+            self.redis.xack(PROGRESS_STREAM, PROGRESS_GROUP, *trimmed)
+        return entries
+
+    def collect(self, wait=True):
+        # Own pending events first (left over from a failed flush), then claimed ones, then new ones until
+        # the batch is full or the flush interval is over
+        self._ensure_group()
+        entries = self._read('0', self.batch_size)
+        if len(entries) < self.batch_size:
+            claimed = self._claim()
+            if claimed:
+                with self._lock:
+                    self._stats["claimed"] += len(claimed)
+                entries.extend(claimed)
+        deadline = time.monotonic() + (self.flush_interval if wait else 0)
+        while len(entries) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            block = max(1, int(remaining * 1000)) if remaining > 0 else None
+            new_entries = self._read('>', self.batch_size - len(entries), block)
+            entries.extend(new_entries)
+            if not new_entries or remaining <= 0:
+                break
+        return entries
+
+    def write(self, rows):
+        session = self.session_factory()
+        try:
+            try:
+                upsert_progress(session, rows)
+                session.commit()
+            except IntegrityError:
+                session.rollback()
+                upsert_progress(session, drop_missing(session, rows))
+                session.commit()
+        finally:
+            session.close()
+
+    def acknowledge(self, entry_ids):
+        pipe = self.redis.pipeline(transaction=False)
+        for chunk in chunks(entry_ids):
+            pipe.xack(PROGRESS_STREAM, PROGRESS_GROUP, *chunk)
+            pipe.xdel(PROGRESS_STREAM, *chunk)
+        pipe.execute()
+
+    def flush_once(self, wait=True):
+        # Returns the number of events written
+        entries = self.collect(wait)
+        if not entries:
+            return 0
+        start = time.perf_counter()
+        rows = coalesce(fields for _, fields in entries)
+        self.write(rows)
+        self.acknowledge([entry_id for entry_id, _ in entries])
+        with self._lock:
+            self._stats["events"] += len(entries)
+            self._stats["rows"] += len(rows)
+            self._stats["flushes"] += 1
+            self._stats["last_flush_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        return len(entries)
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.flush_once()
+            except Exception as e:
+                # Nothing was acknowledged, the same events are read again from the pending list
+                logger.warning("Progress flush failed: %s", e)
+                with self._lock:
+                    self._stats["errors"] += 1
+                self._group_ready = False
+                self._stopped.wait(1)
+
+
+# Standalone flusher: python api/progress.py (set PROGRESS_FLUSH_IN_PROCESS=false in the API processes)
+if __name__ == '__main__':
+    try:
+        from .db import Session
+    except ImportError:
+        from db import Session
+    logging.basicConfig(level=logging.INFO)
+    flusher = ProgressFlusher(redis.StrictRedis(host='localhost', port=6379, db=0, decode_responses=True), Session)
+    logger.info("Progress flusher %s started", flusher.consumer)
+    flusher.run()
@@ -0,0 +1,307 @@
+import json
+import math
+from datetime import datetime, timezone
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+try:
+    from .models import Course, Module, Enroll, Quiz, QuizQuestion, QuizSubmission
+    from .bulk import insert_ignore, chunks, BULK_MAX_ROWS
+except ImportError:
+    from models import Course, Module, Enroll, Quiz, QuizQuestion, QuizSubmission
+    from bulk import insert_ignore, chunks, BULK_MAX_ROWS
+
+
+######################################################## QUIZZES ###############################################################################
+# Quizzes are attached to a module: multiple choice questions, one correct option each, points per question.
+#
+# Besides the question rows, a quiz keeps its answer key as arrays (uint8 correct option, uint8 option count and
+# float32 points per question) and a submission keeps its answers as one uint8 per question (NO_ANSWER when left
+# empty). Grading a cohort is then one NumPy pass: the submissions are stacked into an (n students x q questions)
+# matrix, compared with the key and multiplied with the points, instead of a Python loop per student and question.
+#
+# The bulk submit route takes the whole cohort after the exam ({"submissions": [{"user_id": 1, "answers": [2, 0,
+# null, ...]}, ...]}), validates and grades it in one pass and writes the results with multi-row upserts. Sending a
+# student again replaces the earlier submission.
+#
+# Needs numpy (pip install numpy).
+
+NO_ANSWER = 255
+QUIZ_MAX_QUESTIONS = 500
+QUIZ_MAX_OPTIONS = 26
+# Points are stored as float32, a quiz of only maximum points must still add up to a finite max_score
+QUIZ_MAX_POINTS = float(np.finfo(np.float32).max) / QUIZ_MAX_QUESTIONS
+
+
+class AnswerKey:
+    # The arrays of one quiz, read from its blobs without copying
+    def __init__(self, answers, option_counts, points):
+        self.answers = answers  # uint8 (q,)
+        self.option_counts = option_counts  # uint8 (q,)
+        self.points = points  # float32 (q,)
+
+    @classmethod
+    def from_quiz(cls, quiz):
+        return cls(np.frombuffer(quiz.answer_key, dtype=np.uint8), np.frombuffer(quiz.option_counts, dtype=np.uint8),
+                   np.frombuffer(quiz.points, dtype=np.float32))
+
+    @property
+    def question_count(self):
+        return len(self.answers)
+
+    @property
+    def max_score(self):
+        return float(self.points.sum())
+
+
+def grade(key, answers):
+    # answers: uint8 (n, q) matrix -> (correct answers per student, score per student)
+    correct = answers == key.answers
+    return correct.sum(axis=1), correct @ key.points
+
+
+def parse_quiz(data):
+    # Body of the create quiz route: {"title": "...", "questions": [{"text": "...", "options": ["a", "b"],
+    # "answer": 1, "points": 2}, ...]}, returns (title, questions, error message)
+    data = data or {}
+    title = data.get('title')
+    questions = data.get('questions')
+    if not isinstance(title, str) or not title.strip():
+        return None, None, "title is required!"
+    if not isinstance(questions, list) or not questions:
+        return None, None, "questions must be a non empty list."
+    if len(questions) > QUIZ_MAX_QUESTIONS:
+        return None, None, f"At most {QUIZ_MAX_QUESTIONS} questions per quiz."
+    for position, question in enumerate(questions):
+        if not isinstance(question, dict) or not isinstance(question.get('text'), str) or not question['text'].strip():
+            return None, None, f"Question {position}: text is required!"
+        options = question.get('options')
+        if not isinstance(options, list) or not 2 <= len(options) <= QUIZ_MAX_OPTIONS or not all(isinstance(option, str) for option in options):
+            return None, None, f"Question {position}: options must be a list of 2 to {QUIZ_MAX_OPTIONS} strings."
+        answer = question.get('answer')
+        if not isinstance(answer, int) or isinstance(answer, bool) or not 0 <= answer < len(options):
+            return None, None, f"Question {position}: answer must be the index of the correct option."
+        points = question.get('points', 1)
+        # json.loads accepts Infinity and NaN, they would make every score and percent NaN
+        if (not isinstance(points, (int, float)) or isinstance(points, bool) or not math.isfinite(points) or points < 0
+                or points > QUIZ_MAX_POINTS):
+            return None, None, f"Question {position}: points must be a number >= 0."
+    return title.strip(), questions, None
+
+
+def create_quiz(session, module_id, title, questions):
+    # questions are validated by parse_quiz
+    points = np.array([question.get('points', 1) for question in questions], dtype=np.float32)
+    quiz = Quiz(
+        module_id=module_id,
+        title=title,
+        question_count=len(questions),
+        answer_key=np.array([question['answer'] for question in questions], dtype=np.uint8).tobytes(),
+        option_counts=np.array([len(question['options']) for question in questions], dtype=np.uint8).tobytes(),
+        points=points.tobytes(),
+        max_score=float(points.sum()),
+    )
+    quiz.questions = [
+        QuizQuestion(position=position, text=question['text'].strip(), options=json.dumps(question['options']),
+                     answer=question['answer'], points=float(points[position]))
+        for position, question in enumerate(questions)
+    ]
+    session.add(quiz)
+    return quiz
+
+
+def load_quiz(session, course_id, module_id, quiz_id, with_questions=False):
+    # (quiz, course instructor id) if the quiz belongs to that module of that course, else None
+    statement = (
+        select(Quiz, Course.course_instructor_id)
+        .join(Module, Quiz.module_id == Module.id)
+        .join(Course, Module.course_id == Course.id)
+        .where(Quiz.id == quiz_id, Quiz.module_id == module_id, Module.course_id == course_id)
+    )
+    if with_questions:
+        statement = statement.options(selectinload(Quiz.questions))
+    return session.execute(statement).first()
+
+
+def quiz_details(quiz, include_answers=False):
+    return {
+        "quiz_id": quiz.id,
+        "module_id": quiz.module_id,
+        "title": quiz.title,
+        "max_score": quiz.max_score,
+        "questions": [{
+            "position": question.position,
+            "text": question.text,
+            "options": json.loads(question.options),
+            "points": question.points,
+            **({"answer": question.answer} if include_answers else {}),
+        } for question in quiz.questions],
+    }
+
+
+def parse_submissions(data, key):
+    # Body of the bulk submit route. Returns (user_ids, answers matrix, results, error message): results has one
+    # entry per input row, None for the rows in the matrix (user_ids[i] answered answers[i])
+    submissions = (data or {}).get('submissions')
+    if not isinstance(submissions, list) or not submissions:
+        return None, None, None, "submissions must be a non empty list."
+    if len(submissions) > BULK_MAX_ROWS:
+        return None, None, None, f"At most {BULK_MAX_ROWS} submissions per request."
+
+    results = [None] * len(submissions)
+    rows, user_ids, seen = [], [], set()
+    for index, submission in enumerate(submissions):
+        user_id = submission.get('user_id') if isinstance(submission, dict) else None
+        answers = submission.get('answers') if isinstance(submission, dict) else None
+        if not isinstance(user_id, int) or isinstance(user_id, bool):
+            results[index] = "invalid"
+        elif user_id in seen:
+            results[index] = "duplicate_in_request"
+        elif not isinstance(answers, list) or len(answers) != key.question_count:
+            results[index] = "invalid"
+        else:
+            seen.add(user_id)
+            rows.append(index)
+            user_ids.append(user_id)
+    if not rows:
+        return [], np.empty((0, key.question_count), dtype=np.uint8), results, None
+
+    # One int matrix for all rows (null -> -1), checked against the option counts in one pass. numpy picks an int
+    # dtype only when every answer is a number, anything else (null, floats, strings) goes through _plain_row.
+    # A bool mixed with ints also becomes an int (True -> option 1), so rows with a bool are never taken as they are,
+    # and only null means "no answer": a literal negative answer makes the row invalid.
+    answers = [submissions[index]['answers'] for index in rows]
+    matrix = None
+    if not any(_has_bool(row) for row in answers):
+        try:
+            matrix = np.array(answers)
+        except (ValueError, OverflowError):
+            pass
+    if matrix is not None and matrix.dtype.kind == 'i' and matrix.ndim == 2:
+        valid = ((matrix >= 0) & (matrix < key.option_counts)).all(axis=1)
+    else:
+        matrix = np.array([_plain_row(row) for row in answers], dtype=np.int64).reshape(len(rows), key.question_count)
+        valid = ((matrix >= -1) & (matrix < key.option_counts)).all(axis=1)
+    if not valid.all():
+        for position in np.flatnonzero(~valid):
+            results[rows[position]] = "invalid"
+        user_ids = [user_id for user_id, ok in zip(user_ids, valid) if ok]
+        matrix = matrix[valid]
+    matrix[matrix == -1] = NO_ANSWER
+    return user_ids, matrix.astype(np.uint8), results, None
+
+
+def _has_bool(row):
+    return bool in map(type, row)
+
+
+def _plain_answer(answer):
+    if answer is None:
+        return -1
+    if isinstance(answer, int) and not isinstance(answer, bool) and 0 <= answer < QUIZ_MAX_OPTIONS:
+        return answer
+    return QUIZ_MAX_OPTIONS  # not an option of any question, the row is invalid
+
+
+def _plain_row(row):
+    # Only rows with nulls (or values that are not option indexes) are converted answer by answer
+    if not _has_bool(row):
+        try:
+            array = np.array(row)
+            if array.dtype.kind == 'i' and array.ndim == 1:
+                return np.where(array < 0, QUIZ_MAX_OPTIONS, array)  # -1 here was sent, it is not a null
+        except (ValueError, OverflowError):
+            pass
+    return [_plain_answer(answer) for answer in row]
+
+
+def submit_and_grade(session, quiz, course_id, user_ids, answers):
+    # Grades the valid rows of parse_submissions in one pass and upserts them. Returns {user_id: status}
+    # and the summary (graded count, mean, lowest and highest score)
+    enrolled = set()
+    for chunk in chunks(user_ids):
+        enrolled.update(session.execute(
+            select(Enroll.user_id).where(Enroll.course_id == course_id, Enroll.user_id.in_(chunk))
+        ).scalars())
+    keep = np.array([user_id in enrolled for user_id in user_ids], dtype=bool)
+    statuses = {user_id: "not_enrolled" for user_id in user_ids if user_id not in enrolled}
+    user_ids = [user_id for user_id in user_ids if user_id in enrolled]
+    answers = answers[keep] if len(keep) else answers
+
+    key = AnswerKey.from_quiz(quiz)
+    correct_counts, scores = grade(key, answers)
+
+    now = datetime.now(timezone.utc)
+    table = QuizSubmission.__table__
+    rows = [{
+        "quiz_id": quiz.id,
+        "user_id": user_id,
+        "answers": answers[position].tobytes(),
+        "correct_count": int(correct_counts[position]),
+        "score": float(scores[position]),
+        "graded_at": now,
+        "created_at": now,
+        "updated_at": now,
+    } for position, user_id in enumerate(user_ids)]
+    # Rows as executemany parameters, not .values(rows): the statement is compiled once (and cached) and the driver
+    # gets it in batches of multi-row VALUES. Compiling a 1000 row VALUES clause per chunk took longer than the rest.
+    statement = insert_ignore(session, table)
+    excluded = statement.excluded
+    statement = statement.on_conflict_do_update(
+        index_elements=['quiz_id', 'user_id'],
+        set_={"answers": excluded.answers, "correct_count": excluded.correct_count, "score": excluded.score,
+              "graded_at": excluded.graded_at, "updated_at": excluded.updated_at},
+    )
+    for chunk in chunks(rows):
+        session.execute(statement, chunk)
+    statuses.update((user_id, "graded") for user_id in user_ids)
+
+    summary = {"graded": len(user_ids), "max_score": key.max_score}
+    if len(user_ids):
+        summary.update(mean_score=round(float(scores.mean()), 3), lowest_score=float(scores.min()),
+                       highest_score=float(scores.max()))
+    return statuses, summary
+
+
+def bulk_submit(session, quiz, course_id, data):
+    # Bulk submit route: returns (results, summary, error message), one result per input row like the bulk enroll
+    # route. The caller commits.
+    key = AnswerKey.from_quiz(quiz)
+    user_ids, answers, results, error = parse_submissions(data, key)
+    if error:
+        return None, None, error
+    statuses, summary = submit_and_grade(session, quiz, course_id, user_ids, answers)
+    submissions = data['submissions']
+    report = []
+    for index, status in enumerate(results):
+        user_id = submissions[index].get('user_id') if isinstance(submissions[index], dict) else None
+        report.append({"user_id": user_id, "status": status or statuses.get(user_id, "invalid")})
+    return report, summary, None
+
+
+def load_submission(session, quiz_id, user_id):
+    return session.execute(
+        select(QuizSubmission).where(QuizSubmission.quiz_id == quiz_id, QuizSubmission.user_id == user_id)
+    ).scalar()
+
+
+def submission_result(quiz, submission):
+    # One student's result, with the answer and whether it was right for every question
+    key = AnswerKey.from_quiz(quiz)
+    answers = np.frombuffer(submission.answers, dtype=np.uint8)
+    correct = answers == key.answers
+    return {
+        "quiz_id": quiz.id,
+        "user_id": submission.user_id,
+        "score": submission.score,
+        "max_score": quiz.max_score,
+        "percent": round(100 * submission.score / quiz.max_score, 2) if quiz.max_score else None,
+        "correct": submission.correct_count,
+        "question_count": quiz.question_count,
+        "graded_at": submission.graded_at.isoformat() if submission.graded_at else None,
+        "answers": [{
+            "position": position,
+            "answer": None if answer == NO_ANSWER else int(answer),
+            "correct": bool(is_correct),
+        } for position, (answer, is_correct) in enumerate(zip(answers, correct))],
+    }
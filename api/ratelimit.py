@@ -0,0 +1,222 @@
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+import redis
+try:
+    from .db import env_bool
+except ImportError:
+    from db import env_bool
+
+
+######################################################## RATE LIMITING #########################################################################
+# Admission control for the routes that run bcrypt (login, register), so one client can't use all the hashing CPU
+# and every other route keeps its latency.
+#
+# Token buckets in Redis, one per device (generate_device_fingerprint()) and one per account (user name / email) for
+# every route. A request takes one token from all of its buckets in one Lua script (atomic, clock from Redis TIME):
+# either all buckets have a token or nothing is taken and the caller gets 429 with Retry-After.
+#
+# Local pre-check, so clients well under their budget don't need a Redis call on every request:
+# - while all buckets are more than half full the script hands out a small lease (RATE_LIMIT_LEASE_FRACTION of the
+#   budget) that this process spends without Redis for RATE_LIMIT_LEASE_TTL seconds. Leased tokens are already taken
+#   from the buckets, so the budget holds across all processes; an unused lease is lost when it expires.
+# - a rejected client is rejected locally until its Retry-After has passed (a script hammering login costs no
+#   Redis calls at all).
+#
+# If Redis is down requests are let through (the hashing pool still sheds load with 503).
+#
+# .env settings (budgets are "<requests>/<seconds>", the bucket size and how long it takes to refill):
+# RATE_LIMIT_ENABLED=true
+# RATE_LIMIT_LOGIN_DEVICE=20/60         logins per device
+# RATE_LIMIT_LOGIN_ACCOUNT=10/60        logins per user name, from all devices
+# RATE_LIMIT_REGISTER_DEVICE=5/60       registrations per device
+# RATE_LIMIT_REGISTER_ACCOUNT=3/600     registrations per email
+# RATE_LIMIT_LEASE_FRACTION=0.25
+# RATE_LIMIT_LEASE_TTL=2
+
+RATE_LIMIT_ENABLED = env_bool("RATE_LIMIT_ENABLED", True)
+RATE_LIMIT_LEASE_FRACTION = float(os.getenv("RATE_LIMIT_LEASE_FRACTION", 0.25))
+RATE_LIMIT_LEASE_TTL = float(os.getenv("RATE_LIMIT_LEASE_TTL", 2))
+RATE_LIMIT_MAX_ENTRIES = 100000
+
+
+def parse_budget(value):
+    # "10/60" -> (10, 60.0)
+    requests, seconds = value.split('/')
+    return int(requests), float(seconds)
+
+
+RATE_LIMIT_BUDGETS = {
+    'login': {
+        'device': parse_budget(os.getenv("RATE_LIMIT_LOGIN_DEVICE", "20/60")),
+        'account': parse_budget(os.getenv("RATE_LIMIT_LOGIN_ACCOUNT", "10/60")),
+    },
+    'register': {
+        'device': parse_budget(os.getenv("RATE_LIMIT_REGISTER_DEVICE", "5/60")),
+        'account': parse_budget(os.getenv("RATE_LIMIT_REGISTER_ACCOUNT", "3/600")),
+    },
+}
+
+# KEYS = bucket hashes (t = tokens, ts = last refill in ms)
+# ARGV[1] = lease size, then per key: capacity, refill rate in tokens per ms
+# Returns {tokens granted (0 = rejected), retry after in ms}
+ADMIT_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+local grant = tonumber(ARGV[1])
+local retry = 0
+local tokens = {}
+for i = 1, #KEYS do
+    local capacity = tonumber(ARGV[i * 2])
+    local rate = tonumber(ARGV[i * 2 + 1])
+    local bucket = redis.call('HMGET', KEYS[i], 't', 'ts')
+    local t = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now
+    t = math.min(capacity, t + math.max(0, now - ts) * rate)
+    tokens[i] = t
+    if t < 1 then
+        retry = math.max(retry, math.ceil((1 - t) / rate))
+    else
+        -- extra tokens for a local lease only while the bucket stays more than half full
+        grant = math.min(grant, 1 + math.max(0, math.floor(t - 1 - capacity / 2)))
+    end
+end
+if retry > 0 then
+    return {0, retry}
+end
+for i = 1, #KEYS do
+    local capacity = tonumber(ARGV[i * 2])
+    local rate = tonumber(ARGV[i * 2 + 1])
+    redis.call('HSET', KEYS[i], 't', tostring(tokens[i] - grant), 'ts', tostring(now))
+    redis.call('PEXPIRE', KEYS[i], math.ceil(capacity / rate) + 1000)
+end
+return {grant, 0}
+"""
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(retry_after)
+        self.retry_after = retry_after  # seconds
+
+    def headers(self):
+        return {"Retry-After": str(max(1, math.ceil(self.retry_after)))}
+
+
+class RateLimiter:
+    def __init__(self, redis_client, budgets=RATE_LIMIT_BUDGETS, enabled=RATE_LIMIT_ENABLED,
+                 lease_fraction=RATE_LIMIT_LEASE_FRACTION, lease_ttl=RATE_LIMIT_LEASE_TTL,
+                 max_entries=RATE_LIMIT_MAX_ENTRIES):
+        self.redis = redis_client
+        self.budgets = budgets
+        self.enabled = enabled
+        self.lease_fraction = lease_fraction
+        self.lease_ttl = lease_ttl
+        self.max_entries = max_entries
+        self._admit = self.redis.register_script(ADMIT_SCRIPT)
+        # (route, device, account) -> [leased tokens left, lease expiry] or [0, rejected until] (monotonic)
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"local_allowed": 0, "local_rejected": 0, "redis_allowed": 0, "redis_rejected": 0, "redis_errors": 0}
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._local))
+
+    @staticmethod
+    def key(route, scope, value):
+        # Account names come from the request body, hashed so the key length doesn't depend on the input
+        return f"ratelimit:{route}:{scope}:{hashlib.sha256(value.encode()).hexdigest()[:32]}"
+
+    def _script_args(self, route, device, account):
+        budgets = self.budgets[route]
+        keys, args = [], []
+        for scope, value in (('device', device), ('account', account)):
+            capacity, seconds = budgets[scope]
+            keys.append(self.key(route, scope, value))
+            args.extend([capacity, repr(capacity / (seconds * 1000))])
+        lease = max(1, int(min(capacity for capacity, _ in budgets.values()) * self.lease_fraction))
+        return keys, [lease, *args]
+
+    def _check_local(self, local_key):
+        # True: allowed from the lease, RateLimited: still rejected, None: ask Redis
+        now = time.monotonic()
+        with self._lock:
+            entry = self._local.get(local_key)
+            if entry is None:
+                return None
+            tokens, until = entry
+            if until <= now:
+                del self._local[local_key]
+                return None
+            if tokens == 0:
+                self._stats["local_rejected"] += 1
+                return RateLimited(until - now)
+            entry[0] -= 1
+            if entry[0] == 0:
+                del self._local[local_key]
+            self._stats["local_allowed"] += 1
+            return True
+
+    def _remember(self, local_key, granted, retry_ms):
+        if granted:
+            entry = [granted - 1, time.monotonic() + self.lease_ttl] if granted > 1 else None
+        else:
+            entry = [0, time.monotonic() + retry_ms / 1000]
+        with self._lock:
+            self._stats["redis_allowed" if granted else "redis_rejected"] += 1
+            if entry is not None:
+                self._local[local_key] = entry
+                self._local.move_to_end(local_key)
+                while len(self._local) > self.max_entries:
+                    self._local.popitem(last=False)
+        if not granted:
+            raise RateLimited(retry_ms / 1000)
+
+    def _redis_error(self):
+        with self._lock:
+            self._stats["redis_errors"] += 1
+
+    def admit(self, route, device, account):
+        # Raises RateLimited when the device or the account is over the route's budget
+        if not self.enabled or route not in self.budgets:
+            return
+        account = str(account or "").strip().lower()
+        local_key = (route, device, account)
+        local = self._check_local(local_key)
+        if isinstance(local, RateLimited):
+            raise local
+        if local:
+            return
+        keys, args = self._script_args(route, device, account)
+        try:
+            granted, retry_ms = self._admit(keys=keys, args=args)
+        except redis.RedisError:
+            self._redis_error()
+            return
+        self._remember(local_key, int(granted), int(retry_ms))
+
+
+class AsyncRateLimiter(RateLimiter):
+    # Same limiter (same Redis buckets) on a redis.asyncio client, used by the ASGI app (asgi.py)
+
+    async def admit(self, route, device, account):
+        if not self.enabled or route not in self.budgets:
+            return
+        account = str(account or "").strip().lower()
+        local_key = (route, device, account)
+        local = self._check_local(local_key)
+        if isinstance(local, RateLimited):
+            raise local
+        if local:
+            return
+        keys, args = self._script_args(route, device, account)
+        try:
+            granted, retry_ms = await self._admit(keys=keys, args=args)
+        except redis.RedisError:
+            self._redis_error()
+            return
+        self._remember(local_key, int(granted), int(retry_ms))
@@ -0,0 +1,208 @@
+import itertools
+import logging
+import os
+import threading
+import redis
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+try:
+    from .db import create_db_engine
+except ImportError:
+    from db import create_db_engine
+
+
+######################################################## READ REPLICAS #########################################################################
+# GET requests read from a pool of read replicas, every other request (and every write) uses the primary.
+#
+# The routing is in the session (read_bind in db.py): a session asks for a replica on its first SELECT, sends its
+# SELECTs there and moves to the primary for good as soon as it writes, so a request always sees its own writes.
+# Replicas are picked round robin among the healthy ones, with no healthy replica the reads go to the primary.
+#
+# Read your writes across requests: after a request wrote to the database, the reads of that user stay on the primary
+# for REPLICA_STICKY_SECONDS (a Redis key per user, StickyReads, so every process knows). Only asked when replicas
+# are configured, once per GET request that reads the database. A replica can be up to REPLICA_MAX_LAG behind and
+# still be in the rotation, and lag more for up to REPLICA_CHECK_INTERVAL until the next check sees it, so the
+# sticky window is never shorter than the two together (a lower setting is raised with a warning).
+#
+# Health: a thread checks every replica every REPLICA_CHECK_INTERVAL seconds (SELECT 1, on PostgreSQL the replay lag
+# too) and takes it out of the rotation when the check fails or it lags more than REPLICA_MAX_LAG seconds. It is back
+# after the next passing check. A lost connection on a replica during a request takes it out right away (that request
+# still fails, the next ones use the other replicas or the primary).
+#
+# Locally two SQLite files can stand in for the primary and a replica (nothing copies the writes, copy the file).
+#
+# .env settings:
+# SQLALCHEMY_REPLICA_URIS=        comma separated replica URLs, empty: everything on the primary
+# REPLICA_CHECK_INTERVAL=5        seconds between health checks
+# REPLICA_MAX_LAG=10              seconds of replay lag before a replica is taken out (PostgreSQL)
+# REPLICA_STICKY_SECONDS=15       reads of a user on the primary after they wrote, at least REPLICA_MAX_LAG + REPLICA_CHECK_INTERVAL
+
+REPLICA_URIS = [url.strip() for url in os.getenv("SQLALCHEMY_REPLICA_URIS", "").split(',') if url.strip()]
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", 5))
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", 10))
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", REPLICA_MAX_LAG + REPLICA_CHECK_INTERVAL))
+
+# 0 when the replica replayed everything it received (an idle primary does not make it look behind)
+POSTGRES_LAG_QUERY = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+logger = logging.getLogger(__name__)
+
+
+class Replica:
+    def __init__(self, url):
+        self.url = url
+        self.name = make_url(url).render_as_string(hide_password=True)
+        self.engine = None  # created by the first health check
+        self.healthy = False  # until the first check passed
+        self.lag = None
+        self.error = None
+
+
+class ReplicaPool:
+    def __init__(self, urls=REPLICA_URIS, check_interval=REPLICA_CHECK_INTERVAL, max_lag=REPLICA_MAX_LAG,
+                 engine_factory=create_db_engine):
+        self.replicas = [Replica(url) for url in urls]
+        self.check_interval = check_interval
+        self.max_lag = max_lag
+        self.engine_factory = engine_factory
+        self._healthy = ()  # replaced as a whole, read without the lock
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        # Sessions whose reads went to a replica, to the primary because no replica was healthy or because the user just wrote
+        self._stats = {"replica_sessions": 0, "no_replica_sessions": 0, "sticky_sessions": 0, "checks_failed": 0, "disconnects": 0}
+
+    def __bool__(self):
+        return bool(self.replicas)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, replicas=len(self.replicas), healthy=len(self._healthy))
+
+    def status(self):
+        # For GET /ready: "ok" or why the replica is out of the rotation
+        return {replica.name: "ok" if replica.healthy else f"error: {replica.error or 'not checked yet'}"
+                for replica in self.replicas}
+
+    def pick(self):
+        # A healthy replica (round robin), None when there is none: the reads go to the primary
+        self.start()
+        healthy = self._healthy
+        with self._lock:
+            self._stats["replica_sessions" if healthy else "no_replica_sessions"] += 1
+        if not healthy:
+            return None
+        return healthy[next(self._next) % len(healthy)]
+
+    def sticky_read(self):
+        # A session kept on the primary because its user just wrote (StickyReads)
+        with self._lock:
+            self._stats["sticky_sessions"] += 1
+
+    def watch(self, engine, replica):
+        # A lost connection takes the replica out until the next passing check
+        @event.listens_for(engine, 'handle_error')
+        def replica_error(context):
+            if context.is_disconnect:
+                with self._lock:
+                    self._stats["disconnects"] += 1
+                self._set_health(replica, False, f"{type(context.original_exception).__name__} (disconnected)")
+
+    def _set_health(self, replica, healthy, error=None):
+        with self._lock:
+            if replica.healthy != healthy:
+                logger.warning("Read replica %s %s", replica.name, "is back" if healthy else f"is out: {error}")
+            replica.healthy = healthy
+            replica.error = error
+            self._healthy = tuple(r for r in self.replicas if r.healthy)
+
+    def check(self, replica):
+        try:
+            if replica.engine is None:
+                replica.engine = self.engine_factory(replica.url)
+                self.watch(replica.engine, replica)
+            with replica.engine.connect() as connection:
+                if connection.dialect.name == 'postgresql':
+                    replica.lag = float(connection.execute(POSTGRES_LAG_QUERY).scalar() or 0)
+                else:
+                    connection.execute(text("SELECT 1"))
+                    replica.lag = 0.0
+        except Exception as e:
+            with self._lock:
+                self._stats["checks_failed"] += 1
+            self._set_health(replica, False, type(e).__name__)
+            return False
+        if replica.lag > self.max_lag:
+            self._set_health(replica, False, f"lag {replica.lag:.1f}s")
+            return False
+        self._set_health(replica, True)
+        return True
+
+    def check_all(self):
+        return [self.check(replica) for replica in self.replicas]
+
+    def start(self):
+        # Started by GET /ready or the first read, checks right away and then every check_interval seconds
+        if self._thread is None and self.replicas:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self.run, name="replica-checks", daemon=True)
+                    self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            self.check_all()
+            self._stopped.wait(self.check_interval)
+
+
+class StickyReads:
+    # Users whose reads stay on the primary for a few seconds after they wrote. If Redis can't be asked the reads go
+    # to the primary (never stale, only slower).
+    def __init__(self, redis_client, seconds=REPLICA_STICKY_SECONDS, max_lag=REPLICA_MAX_LAG, check_interval=REPLICA_CHECK_INTERVAL):
+        self.redis = redis_client
+        # Shorter than the lag a replica in the rotation may have, the user could read from a replica without their write
+        minimum = max_lag + check_interval
+        if seconds < minimum:
+            logger.warning("REPLICA_STICKY_SECONDS=%s is shorter than REPLICA_MAX_LAG + REPLICA_CHECK_INTERVAL, using %s",
+                           seconds, minimum)
+            seconds = minimum
+        self.seconds = seconds
+
+    @staticmethod
+    def key(user_name):
+        return f"primary_reads:{user_name}"
+
+    def mark(self, user_name):
+        try:
+            self.redis.set(self.key(user_name), 1, px=int(self.seconds * 1000))
+        except redis.RedisError as e:
+            logger.warning("Could not keep the reads of %s on the primary: %s", user_name, e)
+
+    def is_sticky(self, user_name):
+        try:
+            return bool(self.redis.exists(self.key(user_name)))
+        except redis.RedisError:
+            return True
+
+
+class AsyncStickyReads(StickyReads):
+    # Same keys on a redis.asyncio client (asgi.py)
+
+    async def mark(self, user_name):
+        try:
+            await self.redis.set(self.key(user_name), 1, px=int(self.seconds * 1000))
+        except redis.RedisError as e:
+            logger.warning("Could not keep the reads of %s on the primary: %s", user_name, e)
+
+    async def is_sticky(self, user_name):
+        try:
+            return bool(await self.redis.exists(self.key(user_name)))
+        except redis.RedisError:
+            return True
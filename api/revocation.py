@@ -0,0 +1,158 @@
+import logging
+import os
+import threading
+import time
+import redis
+
+
+######################################################## REVOCATION FILTER #####################################################################
+# Local copy of the revoked token ids so that @jwt_required does not need a Redis round trip on every request.
+#
+# Every revoked jti is kept in the sorted set "revoked_jtis" (score = token expiry) and announced on the
+# "revoked_tokens" pub/sub channel. A background thread subscribes to the channel and, after every (re)connect,
+# reloads the sorted set. While it is connected the local set is complete, so "not in the local set" means
+# "not revoked" without asking Redis. While it is disconnected (or the set grew past the limit) every check
+# falls back to Redis, so a revocation is never missed, only delayed by the pub/sub delivery time.
+#
+# Entries are kept until the token would have expired anyway (token_registry.py stores the real expiry of every active
+# token). If the set still grows past REVOCATION_MAX_ENTRIES the filter stops answering locally and every request
+# asks Redis again: that is logged as a warning and counted in GET /metrics (revocation_filter_overflows, and
+# revocation_filter_synced drops to 0). Alert on entries getting close to max_entries and raise the limit before.
+#
+# .env settings:
+# REVOCATION_MAX_ENTRIES=200000   local set size limit, above it checks go to Redis
+# REVOCATION_RESYNC=300           seconds between full reloads of the sorted set
+
+REVOKED_JTIS_KEY = "revoked_jtis"
+REVOKED_CHANNEL = "revoked_tokens"
+REVOCATION_MAX_ENTRIES = int(os.getenv("REVOCATION_MAX_ENTRIES", 200000))
+REVOCATION_RESYNC = float(os.getenv("REVOCATION_RESYNC", 300))
+
+logger = logging.getLogger(__name__)
+
+
+class RevocationFilter:
+    def __init__(self, redis_client, max_entries=REVOCATION_MAX_ENTRIES, resync_interval=REVOCATION_RESYNC):
+        self.redis = redis_client
+        self.max_entries = max_entries
+        self.resync_interval = resync_interval
+        self._revoked = {}  # jti -> expiry timestamp
+        self._lock = threading.Lock()
+        self._synced = threading.Event()
+        self._overflowed = False
+        self._stopped = threading.Event()
+        self._thread = None
+        self._stats = {"local_hits": 0, "redis_calls_avoided": 0, "redis_calls": 0, "resyncs": 0, "reconnects": 0, "overflows": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._revoked), max_entries=self.max_entries, synced=self._synced.is_set())
+
+    def start(self):
+        # Started on first use so importing the app does not open Redis connections
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._listen, name="revocation-filter", daemon=True)
+                    self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def queue_revoke(self, pipe, jti, expires_at):
+        # expires_at is the unix time the token would expire anyway, after that it does not need to be kept
+        pipe.zadd(REVOKED_JTIS_KEY, {jti: expires_at})
+        pipe.publish(REVOKED_CHANNEL, f"{jti}:{expires_at}")
+
+    def revoke(self, jti, expires_at):
+        pipe = self.redis.pipeline()
+        self.queue_revoke(pipe, jti, expires_at)
+        pipe.execute()
+        self.remember(jti, expires_at)
+
+    def check_local(self, jti):
+        # True/False when the local set can answer, None when Redis has to be asked
+        self.start()
+        if self._synced.is_set():
+            with self._lock:
+                revoked = jti in self._revoked
+                self._stats["local_hits" if revoked else "redis_calls_avoided"] += 1
+            return revoked
+        self._count("redis_calls")
+        return None
+
+    def is_revoked(self, jti):
+        revoked = self.check_local(jti)
+        if revoked is None:
+            # Not in sync with Redis right now, ask Redis directly
+            return self.redis.zscore(REVOKED_JTIS_KEY, jti) is not None
+        return revoked
+
+    def remember(self, jti, expires_at):
+        # Add a revocation made by this process without waiting for it to come back over pub/sub
+        with self._lock:
+            self._revoked[jti] = float(expires_at)
+            if len(self._revoked) > self.max_entries:
+                self._overflow()
+
+    def _overflow(self):
+        # Called with the lock held: too many entries to answer locally, checks go to Redis until the set shrinks
+        self._synced.clear()
+        if not self._overflowed:
+            self._overflowed = True
+            self._stats["overflows"] += 1
+            logger.warning("Revocation filter has %d entries (REVOCATION_MAX_ENTRIES=%d), token checks go to Redis until "
+                           "it shrinks", len(self._revoked), self.max_entries)
+
+    def _on_message(self, data):
+        jti, _, expires_at = data.rpartition(':')
+        if jti:
+            self.remember(jti, expires_at)
+
+    def _rebuild(self):
+        now = time.time()
+        self.redis.zremrangebyscore(REVOKED_JTIS_KEY, '-inf', now)
+        entries = self.redis.zrangebyscore(REVOKED_JTIS_KEY, now, '+inf', withscores=True)
+        with self._lock:
+            # Merge instead of replace so revocations received while loading are kept, expired ones are dropped
+            revoked = {jti: expires_at for jti, expires_at in self._revoked.items() if expires_at > now}
+            revoked.update(entries)
+            self._revoked = revoked
+            self._stats["resyncs"] += 1
+            if len(revoked) <= self.max_entries:
+                self._overflowed = False
+                self._synced.set()
+            else:
+                self._overflow()
+
+    def _listen(self):
+        while not self._stopped.is_set():
+            pubsub = None
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(REVOKED_CHANNEL)
+                # Load the full set only after subscribing so nothing published in between is missed
+                self._rebuild()
+                next_resync = time.monotonic() + self.resync_interval
+                while not self._stopped.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message and message['type'] == 'message':
+                        self._on_message(message['data'])
+                    if time.monotonic() >= next_resync:
+                        self._rebuild()
+                        next_resync = time.monotonic() + self.resync_interval
+            except redis.RedisError as e:
+                logger.warning("Revocation filter lost Redis connection: %s", e)
+                self._synced.clear()
+                self._count("reconnects")
+                self._stopped.wait(1)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except redis.RedisError:
+                        pass
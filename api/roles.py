@@ -0,0 +1,141 @@
+import logging
+import os
+import threading
+import time
+import redis
+from sqlalchemy import select
+try:
+    from .models import Role
+except ImportError:
+    from models import Role
+
+
+######################################################## ROLE REGISTRY #########################################################################
+# The roles table has three rows that only change when create_db.py seeds them, so every process keeps them in
+# memory: RoleType -> id and id -> RoleType. Routes check and serialize roles through it instead of querying or
+# joining roles.
+#
+# The registry is loaded on first use (GET /ready does it before traffic) and swapped as a whole (a Roles object is
+# never changed after it is built). If roles ever change, whoever changes them increments the Redis key
+# "roles:version" (bump_roles_version, create_db.py does it): every process compares its version with that key at
+# most every ROLES_CHECK_INTERVAL seconds and loads the roles again when it moved.
+#
+# .env settings:
+# ROLES_CHECK_INTERVAL=30     seconds between checks of roles:version
+
+ROLES_VERSION_KEY = "roles:version"
+ROLES_CHECK_INTERVAL = float(os.getenv("ROLES_CHECK_INTERVAL", 30))
+
+logger = logging.getLogger(__name__)
+
+
+class Roles:
+    # One loaded copy of the roles table
+    def __init__(self, rows, version=None):
+        self.ids = {role_type: role_id for role_id, role_type in rows}
+        self.types = {role_id: role_type for role_id, role_type in rows}
+        self.version = version
+
+    def id_of(self, role_type):
+        return self.ids.get(role_type)
+
+    def type_of(self, role_id):
+        return self.types.get(role_id)
+
+    def name_of(self, role_id):
+        role_type = self.types.get(role_id)
+        return role_type.value if role_type is not None else None
+
+    def names(self):
+        return [role_type.value for _, role_type in sorted(self.types.items())]
+
+
+ROLES_QUERY = select(Role.id, Role.role_name).order_by(Role.id)
+
+
+def load_roles(session, version=None):
+    return Roles(session.execute(ROLES_QUERY).all(), version)
+
+
+def bump_roles_version(redis_client):
+    # Call after changing the roles table, every process loads them again within ROLES_CHECK_INTERVAL seconds
+    try:
+        redis_client.incr(ROLES_VERSION_KEY)
+    except redis.RedisError:
+        logger.warning("Could not bump %s, processes keep their roles until they restart", ROLES_VERSION_KEY)
+
+
+def _version(value):
+    return int(value) if value is not None else 0
+
+
+class RoleRegistry:
+    def __init__(self, redis_client, session_factory, check_interval=ROLES_CHECK_INTERVAL):
+        self.redis = redis_client
+        self.session_factory = session_factory
+        self.check_interval = check_interval
+        self._roles = None
+        self._next_check = 0
+        self._lock = threading.Lock()
+
+    def _read_version(self):
+        try:
+            return _version(self.redis.get(ROLES_VERSION_KEY))
+        except redis.RedisError:
+            return None
+
+    def load(self):
+        version = self._read_version()
+        with self.session_factory() as session:
+            roles = load_roles(session, version)
+        self._roles = roles
+        # Nothing seeded yet (create_db.py not run): try again on the next call
+        self._next_check = time.monotonic() + self.check_interval if roles.ids else 0
+        return roles
+
+    def current(self):
+        # The loaded roles, loads them on first use and when roles:version moved
+        roles = self._roles
+        if roles is not None and time.monotonic() < self._next_check:
+            return roles
+        with self._lock:
+            if self._roles is None:
+                return self.load()
+            if time.monotonic() >= self._next_check:
+                self._next_check = time.monotonic() + self.check_interval
+                version = self._read_version()
+                if version is not None and version != self._roles.version:
+                    return self.load()
+            return self._roles
+
+
+class AsyncRoleRegistry(RoleRegistry):
+    # Same registry for the ASGI app: redis.asyncio and an AsyncSession factory, loads run on the event loop
+
+    async def _read_version(self):
+        try:
+            return _version(await self.redis.get(ROLES_VERSION_KEY))
+        except redis.RedisError:
+            return None
+
+    async def load(self):
+        version = await self._read_version()
+        async with self.session_factory() as session:
+            roles = await session.run_sync(load_roles, version)
+        self._roles = roles
+        # Nothing seeded yet (create_db.py not run): try again on the next call
+        self._next_check = time.monotonic() + self.check_interval if roles.ids else 0
+        return roles
+
+    async def current(self):
+        # Only used from the event loop, so no lock is needed
+        roles = self._roles
+        if roles is not None and time.monotonic() < self._next_check:
+            return roles
+        if roles is None:
+            return await self.load()
+        self._next_check = time.monotonic() + self.check_interval
+        version = await self._read_version()
+        if version is not None and version != roles.version:
+            return await self.load()
+        return roles
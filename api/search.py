@@ -0,0 +1,271 @@
+import bisect
+import math
+import re
+import threading
+from collections import defaultdict, OrderedDict
+import redis
+from sqlalchemy import select, union_all, literal, literal_column, func, cast, tuple_, event, Integer
+try:
+    from .db import LazySession
+    from .models import Course, Module
+    from .pagination import encode_rank_cursor
+except ImportError:
+    from db import LazySession
+    from models import Course, Module
+    from pagination import encode_rank_cursor
+
+
+######################################################## SEARCH ################################################################################
+# Full text search over course title/description and module title/content, ranked, with cursor paging.
+#
+# PostgreSQL: generated tsvector columns with GIN indexes (see SEARCH_DDL in models.py), the query is
+# websearch_to_tsquery (all words must match, "quoted phrases" and -excluded words work) ranked with ts_rank.
+# Other databases (SQLite for local/test runs): an inverted index kept in memory, built from the database on the first
+# search and updated from the session events on every commit of the app's sessions (LazySession, see db.py) that
+# touches courses or modules.
+#
+# Every process (and every worker of it) has its own index, so a commit also bumps a version in Redis
+# (search:version). A search first compares it with the version its index was built at: when another process wrote
+# in the meantime, the index is built again from the database. A commit of this process that is the only change since
+# the index was built is applied to the index directly. Without Redis (share() not called, or Redis down) there is no
+# way to know about other processes: then the fallback is only correct with a single process.
+#
+# Results are ordered by (rank, kind, id) descending. Rank is an integer (ts_rank * 1000000) so the cursor can
+# compare it exactly.
+
+RANK_SCALE = 1000000
+SEARCH_MAX_QUERY_LENGTH = 200
+SEARCH_VERSION_KEY = "search:version"
+
+TOKEN_RE = re.compile(r"\w+")
+STOP_WORDS = frozenset(
+    "a an and are as at be but by for from has have in is it its of on or that the this to was were will with".split()
+)
+
+
+def search_rows(session, query, limit, cursor):
+    # Returns (rows, next_cursor), rows are dicts with kind ("course"/"module"), id, course_id, title and rank
+    if session.get_bind().dialect.name == 'postgresql':
+        rows = postgres_search(session, query, limit, cursor)
+    else:
+        rows = search_index.search(session, query, limit + 1, cursor)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_rank_cursor(last['rank'], last['kind'], last['id'])
+    for row in rows:
+        row['rank'] = row['rank'] / RANK_SCALE
+    return rows, next_cursor
+
+
+def postgres_search(session, query, limit, cursor):
+    tsquery = func.websearch_to_tsquery('english', query)
+
+    def matches(model, kind, course_id):
+        vector = literal_column(f"{model.__tablename__}.search_vector")
+        rank = cast(func.ts_rank(vector, tsquery) * RANK_SCALE, Integer)
+        return (
+            select(literal(kind).label('kind'), model.id.label('id'), course_id.label('course_id'),
+                   model.title.label('title'), rank.label('rank'))
+            .where(vector.op('@@')(tsquery))
+        )
+
+    hits = union_all(matches(Course, 'course', Course.id), matches(Module, 'module', Module.course_id)).subquery()
+    statement = select(hits)
+    if cursor is not None:
+        statement = statement.where(tuple_(hits.c.rank, hits.c.kind, hits.c.id) < tuple_(*cursor))
+    statement = statement.order_by(hits.c.rank.desc(), hits.c.kind.desc(), hits.c.id.desc()).limit(limit + 1)
+    return [dict(row._mapping) for row in session.execute(statement)]
+
+
+def tokenize(text):
+    terms = []
+    for token in TOKEN_RE.findall((text or "").lower()):
+        if token in STOP_WORDS:
+            continue
+        # Very small stemmer so "course" finds "courses"
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        terms.append(token)
+    return terms
+
+
+class SearchIndex:
+    # Inverted index: term -> {(kind, id): weight}. Title words weigh more than text words (like weights A/B).
+    TITLE_WEIGHT = 1.0
+    TEXT_WEIGHT = 0.4
+    CACHED_QUERIES = 256
+
+    def __init__(self, redis_client=None):
+        self.redis = redis_client
+        self._lock = threading.Lock()
+        self._postings = defaultdict(dict)
+        self._docs = {}  # (kind, id) -> (course_id, title, terms)
+        self._ranked = OrderedDict()  # query terms -> all matches as ascending (rank, kind, id), for the next pages
+        self._loaded = False
+        self._version = None  # search:version the index was built at (None: unknown)
+        self._stats = {"rebuilds": 0}
+
+    def share(self, redis_client):
+        # Version writes of all processes through this Redis (see above)
+        self.redis = redis_client
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, documents=len(self._docs), loaded=self._loaded)
+
+    def _shared_version(self):
+        # None when there is no Redis to ask
+        if self.redis is None:
+            return None
+        try:
+            return int(self.redis.get(SEARCH_VERSION_KEY) or 0)
+        except redis.RedisError:
+            return None
+
+    def load(self, session):
+        version = self._shared_version()
+        with self._lock:
+            if self._loaded and (version is None or version == self._version):
+                return
+            # First search, or another process changed courses/modules since the index was built
+            if self._loaded:
+                self._stats["rebuilds"] += 1
+            self._postings = defaultdict(dict)
+            self._docs = {}
+            self._ranked.clear()
+            # The version is read before the rows, a write in between bumps it again and the next search rebuilds
+            for course in session.execute(select(Course.id, Course.title, Course.description)):
+                self._put(('course', course.id), course.id, course.title, course.description)
+            for module in session.execute(select(Module.id, Module.course_id, Module.title, Module.content)):
+                self._put(('module', module.id), module.course_id, module.title, module.content)
+            self._version = version
+            self._loaded = True
+
+    def committed(self, changes):
+        # changes: {(kind, id): (course_id, title, text) or None when deleted}, made by a commit of this process
+        version = None
+        if self.redis is not None:
+            try:
+                version = int(self.redis.incr(SEARCH_VERSION_KEY))
+            except redis.RedisError:
+                pass
+        with self._lock:
+            if not self._loaded:
+                return  # the first search loads everything from the database anyway
+            if version is not None and self._version is not None and version != self._version + 1:
+                self._loaded = False  # other processes wrote too, the next search builds the index again
+                return
+            self._version = version
+            self._ranked.clear()
+            for key, document in changes.items():
+                self._remove(key)
+                if document is not None:
+                    self._put(key, *document)
+
+    def _put(self, key, course_id, title, text):
+        weights = defaultdict(float)
+        for term in tokenize(title):
+            weights[term] += self.TITLE_WEIGHT
+        for term in tokenize(text):
+            weights[term] += self.TEXT_WEIGHT
+        for term, weight in weights.items():
+            self._postings[term][key] = weight
+        self._docs[key] = (course_id, title, tuple(weights))
+
+    def _remove(self, key):
+        document = self._docs.pop(key, None)
+        if document is None:
+            return
+        for term in document[2]:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(key, None)
+                if not postings:
+                    del self._postings[term]
+
+    def _rank(self, terms):
+        postings = [self._postings.get(term, {}) for term in terms]
+        if not all(postings):
+            return []
+        # All words must match: intersect starting from the rarest word
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+        total = len(self._docs)
+        idfs = [math.log(1 + total / len(posting)) for posting in postings]
+        scale = RANK_SCALE / (len(terms) * math.log(1 + total) or 1)
+        ranked = []
+        for key in candidates:
+            score = 0.0
+            for idf, posting in zip(idfs, postings):
+                weight = posting[key]
+                score += idf * weight / (weight + 1)
+            ranked.append((int(score * scale), key[0], key[1]))
+        ranked.sort()
+        return ranked
+
+    def search(self, session, query, limit, cursor):
+        self.load(session)
+        terms = tuple(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        with self._lock:
+            ranked = self._ranked.get(terms)
+            if ranked is None:
+                ranked = self._rank(terms)
+                self._ranked[terms] = ranked
+                while len(self._ranked) > self.CACHED_QUERIES:
+                    self._ranked.popitem(last=False)
+            else:
+                self._ranked.move_to_end(terms)
+            # Positions are ascending, the page is the `limit` entries just before the cursor, read backwards
+            end = bisect.bisect_left(ranked, cursor) if cursor is not None else len(ranked)
+            page = ranked[max(0, end - limit):end][::-1]
+            rows = []
+            for rank, kind, id in page:
+                course_id, title, _ = self._docs[(kind, id)]
+                rows.append({"kind": kind, "id": id, "course_id": course_id, "title": title, "rank": rank})
+        return rows
+
+
+search_index = SearchIndex()
+
+
+def _document(obj):
+    if isinstance(obj, Course):
+        return ('course', obj.id), (obj.id, obj.title, obj.description)
+    if isinstance(obj, Module):
+        return ('module', obj.id), (obj.course_id, obj.title, obj.content)
+    return None, None
+
+
+# Keep the in-memory index current: remember what a flush wrote and apply it when the transaction commits.
+# Only on the app's sessions (LazySession), and not on PostgreSQL where the database has the search columns.
+@event.listens_for(LazySession, 'after_flush')
+def _collect_search_changes(session, flush_context):
+    changes = None
+    for obj in list(session.new) + list(session.dirty):
+        key, document = _document(obj)
+        if key is not None:
+            changes = changes if changes is not None else session.info.setdefault('search_changes', {})
+            changes[key] = document
+    for obj in session.deleted:
+        key, _ = _document(obj)
+        if key is not None:
+            changes = changes if changes is not None else session.info.setdefault('search_changes', {})
+            changes[key] = None
+
+
+@event.listens_for(LazySession, 'after_commit')
+def _apply_search_changes(session):
+    changes = session.info.pop('search_changes', None)
+    if changes and session.get_bind().dialect.name != 'postgresql':
+        search_index.committed(changes)
+
+
+@event.listens_for(LazySession, 'after_rollback')
+def _drop_search_changes(session):
+    session.info.pop('search_changes', None)
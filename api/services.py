@@ -0,0 +1,845 @@
+import os
+from urllib.parse import urlencode
+from sqlalchemy import or_
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from dotenv import load_dotenv
+try:
+    from .models import User, UserProfile, Course, Module, RoleType, Enroll, ModuleProgress
+    from .pagination import decode_cursor, decode_rank_cursor, keyset_page, page_size
+    from .search import search_rows, SEARCH_MAX_QUERY_LENGTH
+    from .stats import course_stats, count_enrollments
+    from .quiz import parse_quiz, create_quiz, load_quiz, quiz_details, bulk_submit, load_submission, submission_result
+    from .notifications import NOTIFICATIONS_QUEUE, WELCOME_JOB, ENROLLED_JOB
+    from .certificates import COURSE_CERTIFICATES_JOB, certificate_media_key
+    from .events import MODULE_ADDED, MODULE_UPDATED, COURSE_UPDATED, sign_stream_token
+    from .exports import EXPORT_FORMATS, export_statement
+    from .bulk import bulk_enroll, plan_bulk_register, bulk_register_job, parse_bulk_user_ids, parse_bulk_users, BULK_REGISTER_JOB
+    from .progress import progress_access_query
+    from .jobs import job_status
+    from .db import read_primary
+except ImportError:
+    from models import User, UserProfile, Course, Module, RoleType, Enroll, ModuleProgress
+    from pagination import decode_cursor, decode_rank_cursor, keyset_page, page_size
+    from search import search_rows, SEARCH_MAX_QUERY_LENGTH
+    from stats import course_stats, count_enrollments
+    from quiz import parse_quiz, create_quiz, load_quiz, quiz_details, bulk_submit, load_submission, submission_result
+    from notifications import NOTIFICATIONS_QUEUE, WELCOME_JOB, ENROLLED_JOB
+    from certificates import COURSE_CERTIFICATES_JOB, certificate_media_key
+    from events import MODULE_ADDED, MODULE_UPDATED, COURSE_UPDATED, sign_stream_token
+    from exports import EXPORT_FORMATS, export_statement
+    from bulk import bulk_enroll, plan_bulk_register, bulk_register_job, parse_bulk_user_ids, parse_bulk_users, BULK_REGISTER_JOB
+    from progress import progress_access_query
+    from jobs import job_status
+    from db import read_primary
+
+
+######################################################## SERVICES ##############################################################################
+# The route bodies of both apps: permission checks, queries and writes on a sync Session. api.py (Flask) calls them
+# with its request session, asgi.py (Quart) through AsyncSession.run_sync, so both apps run the same code and the same
+# SQL. The routes only read the request, call a service and do the Redis side of the reply with their own sync or
+# asyncio clients (cache, ETags, events, jobs, token revocation). A route that is changed here is changed in both apps.
+#
+# A service that writes returns a Reply: the JSON body and status, plus what the app does after the commit.
+# Cached reads (course list, course, modules, module) return (body, status) for CourseCache.get_or_load, they read
+# from the primary: a cache entry is shared by every user.
+# current_user is the JWT identity ({"user_name": ..., "role": ...}), roles the role registry's Roles (roles.py).
+
+# Load environment variables from .env file
+load_dotenv()
+
+ADMIN_INVITE_CODE = os.getenv("ADMIN_INVITE_CODE", "secret_code")
+
+REGISTER_REQUIRED_FIELDS = {'user_name', 'email', 'password', 'role', 'first_name', 'last_name'}
+REGISTER_OPTIONAL_FIELDS = {'bio', 'profile_picture', 'additional_info', 'invite_code'}
+
+
+class Reply:
+    def __init__(self, body, status=200, headers=None):
+        self.body = body
+        self.status = status
+        self.headers = headers or {}
+        self.courses = []  # course ids whose cache entries and ETag are stale after the commit
+        self.catalog = False  # the course list changed
+        self.entities = []  # other (kind, id) ETags to bump (see etags.py)
+        self.event = None  # (event type, course id, fields) for the event streams (see events.py)
+        self.job = None  # (job type, payload, queue, owner), the job id is added to the body as job_id
+        self.job_unavailable = None  # message of the 503 when the job could not be queued, None: answer anyway
+        self.revoke_token = False  # the token of the request is revoked (logout)
+
+
+def message(text, status=200):
+    return Reply({"message": text}, status)
+
+
+def get_user_id(session, user_name):
+    # Only the id column is needed for ownership checks, no need to load the whole user
+    return session.query(User.id).filter_by(user_name=user_name).scalar()
+
+
+def is_teacher(current_user):
+    return current_user['role'] in ('instructor', 'admin')
+
+
+def is_admin(current_user):
+    return current_user['role'].lower() == 'admin'
+
+
+def course_with_instructor(session, id):
+    return session.query(Course).options(joinedload(Course.instructor)).filter_by(id=id).first()
+
+
+def course_instructor_name(session, id):
+    # (course id, instructor user name) row, None when the course does not exist
+    return session.query(Course.id, User.user_name).join(User, Course.course_instructor_id == User.id).filter(Course.id == id).first()
+
+
+def can_read_course(session, current_user, id, instructor_id):
+    # Admins, the instructor of the course and its students
+    if current_user['role'] == 'admin':
+        return True
+    user_id = get_user_id(session, current_user['user_name'])
+    return instructor_id == user_id or session.query(Enroll.id).filter_by(course_id=id, user_id=user_id).first() is not None
+
+
+###############################################################################################################################################
+########################################################### AUTHENTICATION ####################################################################
+
+def check_registration(session, data, roles):
+    # Returns (error reply, role id): the checks of POST /auth/register before the password is hashed
+    # Check for unexpected fields in the incoming data
+    for key in data.keys():
+        if key not in REGISTER_REQUIRED_FIELDS and key not in REGISTER_OPTIONAL_FIELDS:
+            return message(f"Unexpected field: {key}", 400), None
+
+    # Check if all required fields are provided
+    for field in REGISTER_REQUIRED_FIELDS:
+        if field not in data or not data[field]:
+            return message(f"{field} is required!", 400), None
+
+    # Check if the user already exists
+    user_name = data.get('email').strip()
+    email = data.get('email').strip()
+    if session.query(User.id).filter(or_(User.user_name == user_name, User.email == email)).first():
+        return message("User already exists!", 400), None
+
+    # Validate and convert the role string to the RoleType enum
+    try:
+        role_type = RoleType(data['role'].lower())
+    except ValueError:
+        return message("Invalid role provided. Choose from 'admin', 'instructor', or 'student'.", 400), None
+    role_id = roles.id_of(role_type)
+    if role_id is None:
+        return message("Role does not exist!", 400), None
+
+    # Check if the current user is trying to register as an admin
+    if role_type == RoleType.ADMIN:
+        if 'invite_code' not in data or data['invite_code'] != ADMIN_INVITE_CODE:
+            return message("Invalid or missing admin invite code!", 403), None
+    return None, role_id
+
+
+def create_user(session, data, role_id, password_hash):
+    # User and profile of a checked registration, committed together
+    try:
+        new_user = User(
+            user_name=data['user_name'].strip(),
+            email=data['email'].strip(),
+            password_hash=password_hash,
+            role_id=role_id
+        )
+        session.add(new_user)
+        session.flush()  # This will generate new_user.id
+        new_user_id = new_user.id
+
+        # Now create the profile and link it to the user
+        session.add(UserProfile(
+            user_id=new_user_id,
+            first_name=data['first_name'].strip(),
+            last_name=data['last_name'].strip(),
+            bio=data.get('bio', '').strip(),  # Optional field, use default empty string
+            profile_picture=data.get('profile_picture', ''),  # Optional
+            additional_info=data.get('additional_info', '')  # Optional
+        ))
+        session.commit()
+    except SQLAlchemyError as e:
+        session.rollback()  # Rollback the transaction on error
+        return Reply({"message": "Error occurred while creating user or profile", "error": str(e)}, 500)
+
+    # The welcome message is sent by a job worker, not in the request
+    reply = message("User and profile created successfully!", 201)
+    reply.job = (WELCOME_JOB, {"user_id": new_user_id}, NOTIFICATIONS_QUEUE, data['user_name'].strip())
+    return reply
+
+
+def plan_user_import(session, current_user, data):
+    # POST /auth/register/bulk before the passwords are hashed. Returns (error reply, plan), the passwords to hash
+    # are plan['passwords']
+    if not is_admin(current_user):
+        return message("You do not have access to this resource", 403), None
+    users, errors, valid, error = parse_bulk_users(data)
+    if error:
+        return message(error, 400), None
+    rows = [users[index] for index in valid]
+    results, new_rows = plan_bulk_register(session, rows)
+    # Only the passwords of users that will be created are hashed
+    plan = {"users": users, "errors": errors, "valid": valid, "rows": rows, "results": results, "new_rows": new_rows,
+            "passwords": [rows[index]['password'] for index in new_rows]}
+    return None, plan
+
+
+def queue_user_import(current_user, plan, hashed_passwords):
+    # Once the passwords are hashed: the users are created by a job worker (bulk.register_users)
+    payload = bulk_register_job(plan['users'], plan['errors'], plan['valid'], plan['rows'], plan['results'],
+                                plan['new_rows'], hashed_passwords)
+    reply = Reply({"message": f"Import of {len(payload['rows'])} users queued.",
+                   "invalid": len(plan['users']) - len(plan['valid'])}, 202)
+    reply.job = (BULK_REGISTER_JOB, payload, "default", current_user['user_name'])
+    reply.job_unavailable = "Could not queue the import, please try again shortly."
+    return reply
+
+
+def login_user(session, user_name):
+    # Only the columns needed for the credentials check and the token
+    return session.query(User.id, User.user_name, User.password_hash, User.role_id).filter(User.user_name == user_name).first()
+
+
+def store_password_hash(session, user_id, password_hash):
+    session.query(User).filter(User.id == user_id).update({User.password_hash: password_hash})
+    session.commit()
+
+
+def role_info(current_user, roles):
+    # All roles and the id of the user's role (based on the name from the JWT) from the role registry
+    user_role = RoleType(current_user['role'])
+    return Reply({
+        "message": f"You have access to the protected route with role: {user_role.value}",
+        "roles_list": roles.names(),
+        "user_role": {"id": roles.id_of(user_role), "name": user_role.value}
+    })
+
+
+def user_profile(session, user_name, roles):
+    # Profile and user data in a single join (the role name comes from the role registry), returns (body, status)
+    user_data = (
+        session.query(User.id, User.email, User.role_id, UserProfile.bio, UserProfile.first_name, UserProfile.last_name)
+        .join(User, UserProfile.user_id == User.id)
+        .filter(User.user_name == user_name)
+        .first()
+    )
+    if not user_data:
+        return {"message": "User profile not found"}, 404
+    return {
+        "message": "You have access to your user profile information.",
+        "user_profile": {
+            "user_id": user_data.id,
+            "user_name": user_name,
+            "user_role": roles.name_of(user_data.role_id),
+            "email": user_data.email,
+            "bio": user_data.bio,
+            "first_name": user_data.first_name,
+            "last_name": user_data.last_name
+        }
+    }, 200
+
+
+###############################################################################################################################################
+############################################################## USERS ##########################################################################
+
+def list_users(session, current_user, args):
+    if not is_admin(current_user):
+        return message("You do not have access to this resource", 403)
+    # Get the 'limit' and 'cursor' query parameters from the request (default to 10 if not provided)
+    limit = page_size(args.get('limit', type=int))
+    cursor = decode_cursor(args.get('cursor'))
+    query = session.query(User.id, User.role_id, User.user_name, User.email)
+    users, next_cursor = keyset_page(query, User.id, limit, cursor)
+    user_list = [{"id": user.id, "role": user.role_id, "name": user.user_name, "email": user.email} for user in users]
+    if 'cursor' not in args:
+        # Clients that don't page get the plain list like before, the next page is in the X-Next-Cursor header.
+        # Send cursor (empty for the first page) to get {"users", "next_cursor"}
+        return Reply(user_list, headers={"X-Next-Cursor": next_cursor} if next_cursor else None)
+    return Reply({"users": user_list, "next_cursor": next_cursor})
+
+
+def user_details(session, id, roles):
+    # Returns (body, status)
+    user_data = (
+        session.query(UserProfile.user_id, User.user_name, User.email, UserProfile.bio, UserProfile.first_name, UserProfile.last_name, User.role_id)
+        .join(User, UserProfile.user_id == User.id)
+        .filter(User.id == id)
+        .first()
+    )
+    if not user_data:
+        return {"message": "User not found"}, 404
+    return {
+        "user_id": user_data.user_id,
+        "user_name": user_data.user_name,
+        "email": user_data.email,
+        "bio": user_data.bio,
+        "first_name": user_data.first_name,
+        "last_name": user_data.last_name,
+        "user_role": roles.name_of(user_data.role_id),
+    }, 200
+
+
+def update_user_role(session, current_user, id, data, roles):
+    user_name = current_user['user_name']
+    user = session.query(User).filter_by(id=id).first()
+    try:
+        new_role_id = roles.id_of(RoleType(str(data.get('role')).lower()))
+    except ValueError:
+        new_role_id = None
+    if new_role_id is None:
+        return message("Role does not exist!", 400)
+    if not user:
+        return message("User not found", 404)
+    if user.user_name != user_name and not is_admin(current_user):
+        return message("You do not have permission to change roles for other users", 403)
+    if user.user_name == user_name and data['role'].lower() == "admin" and not is_admin(current_user):
+        if 'invite_code' not in data or data['invite_code'] != ADMIN_INVITE_CODE:
+            return message("You do not have permission to change your role to admin", 403)
+
+    user.role_id = new_role_id
+    changed_user_name = user.user_name
+    session.commit()
+    if changed_user_name == user_name:
+        # The token has the old role, the user logs in again
+        reply = message("Your role updated successfully - Please login again")
+        reply.revoke_token = True
+    else:
+        reply = message("The user role updated successfully")
+    reply.entities = [('user', id), ('profile', changed_user_name)]
+    return reply
+
+
+def update_user_profile(session, current_user, id, data):
+    user_profile = session.query(UserProfile).filter_by(user_id=id).first()
+    user_id = get_user_id(session, current_user['user_name'])
+    if not user_profile:
+        return message("User profile not found", 404)
+    if user_id != user_profile.user_id and not is_admin(current_user):
+        return message("You do not have permission to change roles", 403)
+
+    # Check 'first_name' if provided and ensure it's not empty
+    if 'first_name' in data:
+        if data['first_name'].strip() == "":
+            return message("First name cannot be empty", 400)
+        user_profile.first_name = data['first_name'].strip()
+
+    # Check 'last_name' if provided and ensure it's not empty
+    if 'last_name' in data:
+        if data['last_name'].strip() == "":
+            return message("Last name cannot be empty", 400)
+        user_profile.last_name = data['last_name'].strip()
+
+    # Update 'bio' if provided; allow it to be empty if needed
+    if 'bio' in data:
+        user_profile.bio = data['bio'].strip()
+
+    profile_user_name = session.query(User.user_name).filter_by(id=user_profile.user_id).scalar()
+    session.commit()
+    reply = message("Profile updated successfully")
+    reply.entities = [('user', id), ('profile', profile_user_name)]
+    return reply
+
+
+def delete_user(session, current_user, id):
+    user_id = get_user_id(session, current_user['user_name'])
+    if not is_admin(current_user) and user_id != id:
+        return message("You do not have permission to delete users", 403)
+    user = session.query(User).filter_by(id=id).first()
+    if not user:
+        return message("User not found", 404)
+    # Courses of the user are deleted with it (cascade), drop them from the cache too
+    course_ids = [course_id for (course_id,) in session.query(Course.id).filter_by(course_instructor_id=id)]
+    deleted_user_name = user.user_name
+    session.delete(user)
+    session.commit()
+    reply = message("User deleted successfully")
+    reply.revoke_token = True
+    reply.courses = course_ids
+    reply.catalog = bool(course_ids)
+    reply.entities = [('user', id), ('profile', deleted_user_name)]
+    return reply
+
+
+###############################################################################################################################################
+############################################################## COURSES ########################################################################
+
+def create_course(session, current_user, data):
+    user_id = get_user_id(session, current_user['user_name'])
+    # Ensure only instructors can create courses
+    if not is_teacher(current_user):
+        return message("Only instructors can create courses.", 403)
+    title = data.get('title').strip()
+    description = data.get('description', '')
+    if not title:
+        return message("Title is required.", 400)
+    # Check if the course already exists
+    if session.query(Course.id).filter_by(title=title).first():
+        return message("Title alread exists for a different course, use a different name!", 400)
+    new_course = Course(title=title, description=description, course_instructor_id=user_id)
+    session.add(new_course)
+    session.flush()  # generates the id, read it before the commit expires the course
+    course_id = new_course.id
+    session.commit()
+    reply = Reply({"message": "Course created successfully!", "course_id": course_id}, 201)
+    reply.catalog = True
+    return reply
+
+
+def list_courses(session, limit, cursor):
+    # Returns (body, status). Cache fill, read from the primary (see read_primary in db.py)
+    read_primary(session)
+    query = session.query(Course.id, Course.title, Course.description)
+    courses, next_cursor = keyset_page(query, Course.id, limit, cursor)
+    course_list = [{"id": course.id, "title": course.title, "description": course.description} for course in courses]
+    return {"courses": course_list, "next_cursor": next_cursor}, 200
+
+
+def search_courses(session, args):
+    # Ranked full text search over courses and modules (tsvector + GIN on PostgreSQL, see search.py)
+    query = (args.get('q') or '').strip()
+    if not query:
+        return message("q is required!", 400)
+    if len(query) > SEARCH_MAX_QUERY_LENGTH:
+        return message(f"q can be at most {SEARCH_MAX_QUERY_LENGTH} characters.", 400)
+    limit = page_size(args.get('limit', type=int))
+    cursor = decode_rank_cursor(args.get('cursor'))
+    rows, next_cursor = search_rows(session, query, limit, cursor)
+    return Reply({"results": rows, "next_cursor": next_cursor})
+
+
+def course_detail(session, id):
+    # The response lists the modules so load them together with the course, returns (body, status)
+    read_primary(session)  # cache fill
+    course = session.query(Course).options(selectinload(Course.modules)).filter_by(id=id).first()
+    if not course:
+        return {"message": "Course not found."}, 404
+    modules = [{"id": module.id, "title": module.title, "content": module.content} for module in course.modules]
+    return {"id": course.id, "title": course.title, "description": course.description, "modules": modules}, 200
+
+
+def update_course(session, current_user, id, data):
+    # Get the course to update together with its instructor for the permission check
+    course = course_with_instructor(session, id)
+    if not course:
+        return message("Course not found.", 404)
+    # Ensure only the instructor who created the course or an admin can update it
+    if course.instructor.user_name != current_user['user_name'] and current_user['role'] != 'admin':
+        return message("You do not have permission to update this course.", 403)
+    title = data.get('title').strip()
+    if 'title' in data:
+        if data['title'].strip() == "":
+            return message("Title can not be empty", 400)
+        current_title = session.query(Course.id).filter_by(title=data['title']).first()
+        if current_title and current_title.id != id:
+            return message("Title alread exists in a different Course, use a different name!", 400)
+        course.title = title
+    course.description = data.get('description', course.description)
+    # Read before the commit, the commit expires the course and reading it after would reload it from the database
+    course_title = course.title
+    session.commit()
+    reply = message("Course updated successfully.")
+    reply.courses = [id]
+    reply.catalog = True
+    reply.event = (COURSE_UPDATED, id, {"title": course_title})
+    return reply
+
+
+def delete_course(session, current_user, id):
+    course = course_with_instructor(session, id)
+    if not course:
+        return message("Course not found.", 404)
+    # Ensure only the instructor who created the course or an admin can delete it
+    if course.instructor.user_name != current_user['user_name'] and current_user['role'] != 'admin':
+        return message("You do not have permission to delete this course.", 403)
+    session.delete(course)
+    session.commit()
+    reply = message("Course deleted successfully.")
+    reply.courses = [id]
+    reply.catalog = True
+    return reply
+
+
+###############################################################################################################################################
+############################################################## MODULE #########################################################################
+
+def add_module(session, current_user, id, data):
+    if not is_teacher(current_user):
+        return message("Only instructors can add modules.", 403)
+    course = course_with_instructor(session, id)
+    if not course:
+        return message("Course not found.", 404)
+    if course.instructor.user_name != current_user['user_name'] and current_user['role'] != 'admin':
+        return message("You are not the instructor of this course.", 403)
+    title = data.get('title').strip()
+    content = data.get('content', '')
+    if not title:
+        return message("Module title is required.", 400)
+    if session.query(Module.id).filter_by(title=data['title'], course_id=id).first():
+        return message("Title alread exists for a different module, use a different name!", 400)
+    new_module = Module(course_id=id, title=title, content=content)
+    session.add(new_module)
+    session.flush()  # generates the id, read it before the commit expires the module
+    module_id = new_module.id
+    session.commit()
+    reply = Reply({"message": "Module added successfully!", "module_id": module_id}, 201)
+    reply.courses = [id]
+    reply.event = (MODULE_ADDED, id, {"module_id": module_id, "title": title})
+    return reply
+
+
+def list_modules(session, id, limit, cursor):
+    # Only the requested page of modules that belong to the course, returns (body, status)
+    read_primary(session)  # cache fill
+    if not session.query(Course.id).filter_by(id=id).first():
+        return {"message": "Course not found."}, 404
+    query = session.query(Module.id, Module.title, Module.content).filter(Module.course_id == id)
+    modules, next_cursor = keyset_page(query, Module.id, limit, cursor)
+    if not modules and cursor is None:
+        return {"message": "Module not found in the specified course."}, 404
+    module_data = [{"id": module.id, "title": module.title, "content": module.content} for module in modules]
+    return {"modules": module_data, "next_cursor": next_cursor}, 200
+
+
+def module_detail(session, id, moduleId):
+    # Returns (body, status)
+    read_primary(session)  # cache fill
+    module = session.query(Module.id, Module.title, Module.content, Module.course_id).filter_by(id=moduleId, course_id=id).first()
+    if not module:
+        return {"message": "Module not found. make sure module id and course id exist"}, 404
+    return {"id": module.id, "title": module.title, "content": module.content, "course_id": module.course_id}, 200
+
+
+def module_with_instructor(session, id, moduleId):
+    return (
+        session.query(Module)
+        .options(joinedload(Module.course).joinedload(Course.instructor))
+        .filter_by(id=moduleId, course_id=id)
+        .first()
+    )
+
+
+def update_module(session, current_user, id, moduleId, data):
+    module = module_with_instructor(session, id, moduleId)
+    if not module:
+        return message("Module not found.", 404)
+    if module.course.instructor.user_name != current_user['user_name'] and current_user['role'] != 'admin':
+        return message("You do not have permission to delete this module.", 403)
+    title = data.get('title').strip()
+    if 'title' in data:
+        if data['title'].strip() == "":
+            return message("Title can not be empty", 400)
+        current_title = session.query(Module.id).filter_by(title=data['title'], course_id=id).first()
+        if current_title and current_title.id != moduleId:
+            return message("Title alread exists in a different Module, use a different name!", 400)
+        module.title = title
+    module.content = data.get('content', module.content)
+    module_title = module.title
+    session.commit()
+    reply = message("Module updated successfully.")
+    reply.courses = [id]
+    reply.event = (MODULE_UPDATED, id, {"module_id": moduleId, "title": module_title})
+    return reply
+
+
+def delete_module(session, current_user, id, moduleId):
+    module = session.query(Module).filter_by(id=moduleId, course_id=id).first()
+    if not module:
+        return message("Module not found.", 404)
+    course = course_with_instructor(session, id)
+    # Ensure only the instructor of the course or an admin can delete the module
+    if course.instructor.user_name != current_user['user_name'] and current_user['role'] != 'admin':
+        return message("You do not have permission to delete this module.", 403)
+    session.delete(module)
+    session.commit()
+    reply = message("Module deleted successfully.")
+    reply.courses = [id]
+    return reply
+
+
+###############################################################################################################################################
+############################################################## ENROLL #########################################################################
+
+def enroll(session, current_user, id):
+    user_name = current_user['user_name']
+    user_id = get_user_id(session, user_name)
+    if current_user['role'] != 'student':
+        return message("Only student can enroll.", 403)
+    if not session.query(Course.id).filter_by(id=id).first():
+        return message("Course not found.", 404)
+    session.add(Enroll(course_id=id, user_id=user_id))
+    try:
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        return message("You are already enrolled to this course.", 409)
+    reply = Reply({"message": "Enrolled to course successfuly!", "course id": id, "user": user_name}, 201)
+    reply.job = (ENROLLED_JOB, {"user_id": user_id, "course_id": id}, NOTIFICATIONS_QUEUE, user_name)
+    return reply
+
+
+def enroll_cohort(session, current_user, id, data, roles):
+    if not is_teacher(current_user):
+        return message("Only instructors can enroll students.", 403)
+    course = course_instructor_name(session, id)
+    if not course:
+        return message("Course not found.", 404)
+    if course.user_name != current_user['user_name'] and current_user['role'] != 'admin':
+        return message("You are not the instructor of this course.", 403)
+    user_ids, error = parse_bulk_user_ids(data)
+    if error:
+        return message(error, 400)
+
+    # One multi-row INSERT ... ON CONFLICT DO NOTHING per chunk, one commit for the whole cohort
+    results = bulk_enroll(session, id, user_ids, roles)
+    enrolled = sum(1 for result in results if result['status'] == 'enrolled')
+    count_enrollments(session, id, enrolled)  # the counters are not updated by Core inserts, same transaction
+    session.commit()
+    return Reply({"message": f"{enrolled} students enrolled to course.", "course id": id, "results": results})
+
+
+def enrollment_stats(session, current_user, id):
+    # Enrollment and module counts of a course for the instructor dashboard, read from the counters in stats.py
+    if not is_teacher(current_user):
+        return message("You do not have access to this resource", 403)
+    course = course_instructor_name(session, id)
+    if not course:
+        return message("Course not found.", 404)
+    if course.user_name != current_user['user_name'] and current_user['role'] != 'admin':
+        return message("You are not the instructor of this course.", 403)
+    return Reply({"course id": id, **course_stats(session, id)})
+
+
+###############################################################################################################################################
+############################################################## VIDEO ##########################################################################
+
+def video_module(session, current_user, id, moduleId, data):
+    # PUT .../video before the media storage is asked. Returns (error reply, module, video key)
+    module = module_with_instructor(session, id, moduleId)
+    if not module:
+        return message("Module not found.", 404), None, None
+    if module.course.instructor.user_name != current_user['user_name'] and current_user['role'] != 'admin':
+        return message("You do not have permission to change this module.", 403), None, None
+    video_key = (data or {}).get('video_key')
+    if not isinstance(video_key, str) or not video_key.strip():
+        return message("video_key is required!", 400), None, None
+    return None, module, video_key.strip()
+
+
+def attach_video(session, module, video_key, exists):
+    # exists: the file is in the media storage (the app asks it, S3 is a network call)
+    if not exists:
+        return message("Video not found in the media storage.", 400)
+    module.video_key = video_key
+    session.commit()
+    return Reply({"message": "Video attached to module.", "video_key": video_key})
+
+
+def module_video_url(session, current_user, id, moduleId, media_signer):
+    module = (
+        session.query(Module.video_key, Course.course_instructor_id)
+        .join(Course, Module.course_id == Course.id)
+        .filter(Module.id == moduleId, Module.course_id == id)
+        .first()
+    )
+    if not module:
+        return message("Module not found.", 404)
+    if not module.video_key:
+        return message("This module has no video.", 404)
+    # Access is checked here once, the signed URL is enough for the media route afterwards
+    if not can_read_course(session, current_user, id, module.course_instructor_id):
+        return message("You are not enrolled to this course.", 403)
+    url, expires_at = media_signer.sign(module.video_key)
+    return Reply({"url": url, "expires_at": expires_at})
+
+
+###############################################################################################################################################
+############################################################## PROGRESS #######################################################################
+
+def progress_user(session, user_name, id, moduleId):
+    # User id when the user is enrolled to the course of the module (or teaches it), else None
+    return session.execute(progress_access_query(user_name, id, moduleId)).scalar()
+
+
+def course_progress(session, user_name, id):
+    # Progress of the current user, can be behind the last heartbeats by the flush interval
+    user_id = get_user_id(session, user_name)
+    rows = (
+        session.query(ModuleProgress.module_id, ModuleProgress.position, ModuleProgress.max_position,
+                      ModuleProgress.completed, ModuleProgress.last_heartbeat_at)
+        .filter_by(user_id=user_id, course_id=id)
+        .order_by(ModuleProgress.module_id)
+        .all()
+    )
+    modules = [{
+        "module_id": row.module_id,
+        "position": row.position,
+        "max_position": row.max_position,
+        "completed": row.completed,
+        "last_heartbeat_at": row.last_heartbeat_at.isoformat(),
+    } for row in rows]
+    return Reply({"course id": id, "modules": modules})
+
+
+###############################################################################################################################################
+############################################################## QUIZZES ########################################################################
+
+def add_quiz(session, current_user, id, moduleId, data):
+    if not is_teacher(current_user):
+        return message("Only instructors can create quizzes.", 403)
+    module = (
+        session.query(Module.id, User.user_name)
+        .join(Course, Module.course_id == Course.id)
+        .join(User, Course.course_instructor_id == User.id)
+        .filter(Module.id == moduleId, Module.course_id == id)
+        .first()
+    )
+    if not module:
+        return message("Module not found.", 404)
+    if module.user_name != current_user['user_name'] and current_user['role'] != 'admin':
+        return message("You are not the instructor of this course.", 403)
+    title, questions, error = parse_quiz(data)
+    if error:
+        return message(error, 400)
+    quiz = create_quiz(session, moduleId, title, questions)
+    session.flush()
+    body = {"message": "Quiz created.", "quiz_id": quiz.id, "question_count": quiz.question_count, "max_score": quiz.max_score}
+    session.commit()
+    return Reply(body, 201)
+
+
+def quiz_for(session, current_user, id, moduleId, quizId):
+    found = load_quiz(session, id, moduleId, quizId, with_questions=True)
+    if not found:
+        return message("Quiz not found.", 404)
+    quiz, instructor_id = found
+    user_id = get_user_id(session, current_user['user_name'])
+    teacher = current_user['role'] == 'admin' or instructor_id == user_id
+    if not teacher and not session.query(Enroll.id).filter_by(course_id=id, user_id=user_id).first():
+        return message("You are not enrolled to this course.", 403)
+    # The correct answers are only shown to the instructor
+    return Reply(quiz_details(quiz, include_answers=teacher))
+
+
+def submit_quiz(session, current_user, id, moduleId, quizId, data):
+    if not is_teacher(current_user):
+        return message("Only instructors can submit quiz answers.", 403)
+    found = load_quiz(session, id, moduleId, quizId)
+    if not found:
+        return message("Quiz not found.", 404)
+    quiz, instructor_id = found
+    if instructor_id != get_user_id(session, current_user['user_name']) and current_user['role'] != 'admin':
+        return message("You are not the instructor of this course.", 403)
+
+    # Validated and graded as one matrix, upserted in chunks, one commit for the whole cohort
+    results, summary, error = bulk_submit(session, quiz, id, data)
+    if error:
+        return message(error, 400)
+    session.commit()
+    return Reply({"message": f"{summary['graded']} submissions graded.", "quiz_id": quizId, **summary, "results": results})
+
+
+def quiz_result(session, current_user, id, moduleId, quizId, user_id):
+    found = load_quiz(session, id, moduleId, quizId)
+    if not found:
+        return message("Quiz not found.", 404)
+    quiz, instructor_id = found
+    # Students see their own result, the instructor sees everyone's
+    current_id = get_user_id(session, current_user['user_name'])
+    if current_id != user_id and instructor_id != current_id and current_user['role'] != 'admin':
+        return message("You do not have access to this resource", 403)
+    submission = load_submission(session, quizId, user_id)
+    if not submission:
+        return message("No graded submission for this user.", 404)
+    return Reply(submission_result(quiz, submission))
+
+
+###############################################################################################################################################
+############################################################## CERTIFICATES ###################################################################
+
+def certificate_student(session, current_user):
+    # POST /courses/<id>/certificate: (error reply, user id of the student)
+    if current_user['role'] != 'student':
+        return message("Only students get certificates.", 403), None
+    return None, get_user_id(session, current_user['user_name'])
+
+
+def certificate_reply(id, certificates, summary, media_signer):
+    # Reply for what issue_certificates(_async) returned, the session is committed by the caller
+    if certificates is None:
+        return message("Course not found.", 404)
+    if not certificates:
+        return message("You are not enrolled to this course or did not complete every module.", 403)
+    certificate = certificates[0]
+    url, expires_at = media_signer.sign(certificate_media_key(certificate['key']))
+    return Reply({"course id": id, "certificate_key": certificate['key'], "issued_on": certificate['issued_on'],
+                  "cached": summary['cached'] == 1, "url": url, "expires_at": expires_at}, 201 if summary['issued'] else 200)
+
+
+def cohort_certificates(session, current_user, id):
+    # Certificates of every student that completed the course, issued by a job worker
+    if not is_teacher(current_user):
+        return message("Only instructors can issue certificates.", 403)
+    course = course_instructor_name(session, id)
+    if not course:
+        return message("Course not found.", 404)
+    if course.user_name != current_user['user_name'] and current_user['role'] != 'admin':
+        return message("You are not the instructor of this course.", 403)
+    reply = Reply({"message": "Certificates queued.", "course id": id}, 202)
+    reply.job = (COURSE_CERTIFICATES_JOB, {"course_id": id}, "default", current_user['user_name'])
+    reply.job_unavailable = "Could not queue the certificates, please try again shortly."
+    return reply
+
+
+###############################################################################################################################################
+############################################################## EVENTS / JOBS / EXPORTS ########################################################
+
+def course_stream_access(session, current_user, id):
+    # GET /courses/<id>/events: error reply or None when the user may follow the course
+    course = session.query(Course.course_instructor_id).filter(Course.id == id).first()
+    if not course:
+        return message("Course not found.", 404)
+    if not can_read_course(session, current_user, id, course.course_instructor_id):
+        return message("You are not enrolled to this course.", 403)
+    return None
+
+
+def event_stream_token(session, current_user, id, jwt, stream_signer):
+    # POST /courses/<id>/events/token: a stream token for EventSource (no Authorization header), see events.py
+    error = course_stream_access(session, current_user, id)
+    if error:
+        return error
+    token, expires = sign_stream_token(stream_signer, id, current_user, jwt['jti'], not_after=jwt['exp'])
+    return Reply({"token": token, "expires": expires, "url": f"/courses/{id}/events?{urlencode({'token': token})}"})
+
+
+def job_reply(current_user, job):
+    # Status of a background job for the user that queued it or an admin
+    if not job or (job.get('owner') != current_user['user_name'] and current_user['role'] != 'admin'):
+        return message("Job not found.", 404)
+    return Reply(job_status(job))
+
+
+def export_request(current_user, name, args):
+    # GET /admin/export/<name>: (error reply, format, columns, statement)
+    if not is_admin(current_user):
+        return message("You do not have access to this resource", 403), None, None, None
+    format = args.get('format', 'ndjson').lower()
+    if format not in EXPORT_FORMATS:
+        return message(f"Invalid format. Choose from {', '.join(EXPORT_FORMATS)}.", 400), None, None, None
+    export = export_statement(name, course_id=args.get('course_id', type=int))
+    if export is None:
+        return message("Export not found. Choose from 'users', 'courses' or 'enrollments'.", 404), None, None, None
+    columns, statement = export
+    return None, format, columns, statement
+
+
+def export_headers(name, format):
+    return {
+        "Content-Disposition": f'attachment; filename="{name}.{format}"',
+        "Cache-Control": "no-store",
+        "X-Accel-Buffering": "no",  # nginx: send the chunks as they come instead of buffering the whole body
+    }
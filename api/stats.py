@@ -0,0 +1,259 @@
+import argparse
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from sqlalchemy import select, update, delete, func, case, or_, tuple_, event
+from sqlalchemy.orm import Session as OrmSession
+try:
+    from .models import Course, Module, Enroll, CourseStats, CourseEnrollmentDay
+    from .bulk import insert_ignore, chunks
+except ImportError:
+    from models import Course, Module, Enroll, CourseStats, CourseEnrollmentDay
+    from bulk import insert_ignore, chunks
+
+
+######################################################## COURSE STATS ##########################################################################
+# Enrollment count, module count and recent enrollments per course without counting (or loading) the enrollments.
+#
+# course_stats has one row of counters per course, course_enrollment_days the new enrollments per course and day.
+# Both are changed in the same transaction as the write: an after_flush hook adds +1/-1 for every Enroll and Module
+# the ORM inserted or deleted (enroll, module CRUD, the cascades of course and user deletes). Bulk enrollments are
+# Core inserts the hook doesn't see, the route calls count_enrollments() for them.
+#
+# Rows deleted outside the ORM (ON DELETE CASCADE in the database, manual SQL) and courses created before the
+# tables existed are fixed by the reconciliation job, which recounts the courses and only rewrites rows that drifted:
+#   python api/stats.py            a pass every STATS_RECONCILE_INTERVAL seconds
+#   python api/stats.py --once     one pass (run it once after create_db.py added the tables)
+#
+# .env settings:
+# STATS_RECENT_DAYS=7                days counted as recent enrollments (older day rows are removed)
+# STATS_RECONCILE_INTERVAL=3600      seconds between reconciliation passes
+#
+# Every enrollment of a course updates the same counter row, so concurrent enrollments to one course wait for each
+# other's commit (the row lock). Rows are always updated in course_id order so two transactions can't deadlock.
+
+STATS_RECENT_DAYS = int(os.getenv("STATS_RECENT_DAYS", 7))
+STATS_RECONCILE_INTERVAL = float(os.getenv("STATS_RECONCILE_INTERVAL", 3600))
+STATS_RECONCILE_CHUNK = 1000
+
+logger = logging.getLogger(__name__)
+
+
+def _today():
+    return datetime.now(timezone.utc).date()
+
+
+def _day(value):
+    # created_at is stored in UTC, SQLite returns date() as text
+    if isinstance(value, datetime):
+        return value.date()
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _add(column, delta):
+    # Counters never go below 0 (a missing or drifted row is fixed by the reconciliation job)
+    return case((column + delta < 0, 0), else_=column + delta)
+
+
+def _by_delta(deltas):
+    # {key: delta} -> {delta: [keys]}, one UPDATE per distinct delta (a user delete is -1 for all of its courses)
+    groups = defaultdict(list)
+    for key in sorted(deltas):
+        if deltas[key]:
+            groups[deltas[key]].append(key)
+    return groups
+
+
+def _increment(execute, dialect_session, table, keys, rows, counters):
+    # rows: one dict per key with the deltas of the counters. Only additions (enroll, new module, the common case):
+    # one INSERT ... ON CONFLICT DO UPDATE SET counter = counter + delta. With a removal: create the missing rows,
+    # then one UPDATE per distinct delta
+    statement = insert_ignore(dialect_session, table).values(rows)
+    if all(row[counter] >= 0 for row in rows for counter in counters):
+        values = {counter: table.c[counter] + statement.excluded[counter] for counter in counters}
+        if "updated_at" in table.c:
+            values["updated_at"] = statement.excluded.updated_at
+        execute(statement.on_conflict_do_update(index_elements=keys, set_=values))
+        return
+    execute(insert_ignore(dialect_session, table).values([
+        {**row, **{counter: 0 for counter in counters}} for row in rows
+    ]).on_conflict_do_nothing(index_elements=keys))
+    for counter in counters:
+        deltas = {tuple(row[key] for key in keys): row[counter] for row in rows}
+        for delta, matching in _by_delta(deltas).items():
+            values = {counter: _add(table.c[counter], delta)}
+            if "updated_at" in table.c:
+                values["updated_at"] = rows[0]["updated_at"]
+            execute(update(table).where(tuple_(*(table.c[key] for key in keys)).in_(matching)).values(values))
+
+
+def add_course_counts(execute, dialect_session, enrollments=None, modules=None, days=None):
+    # enrollments/modules: {course_id: delta}, days: {(course_id, day): delta}
+    # execute is session.execute, or connection.execute inside a flush
+    now = datetime.now(timezone.utc)
+    enrollments, modules, days = enrollments or {}, modules or {}, days or {}
+
+    course_ids = sorted(set(enrollments) | set(modules))  # same lock order in every transaction
+    if course_ids:
+        _increment(execute, dialect_session, CourseStats.__table__, ['course_id'], [{
+            "course_id": course_id,
+            "enrollment_count": enrollments.get(course_id, 0),
+            "module_count": modules.get(course_id, 0),
+            "updated_at": now,
+        } for course_id in course_ids], ['enrollment_count', 'module_count'])
+
+    first_day = _today() - timedelta(days=STATS_RECENT_DAYS - 1)
+    days = sorted((key, delta) for key, delta in days.items() if key[1] >= first_day and delta)
+    if days:
+        _increment(execute, dialect_session, CourseEnrollmentDay.__table__, ['course_id', 'day'], [
+            {"course_id": course_id, "day": day, "enrollment_count": delta} for (course_id, day), delta in days
+        ], ['enrollment_count'])
+
+
+def count_enrollments(session, course_id, count):
+    # Enrollments inserted without the ORM (bulk enroll), in the caller's transaction
+    if count:
+        add_course_counts(session.execute, session, enrollments={course_id: count}, days={(course_id, _today()): count})
+
+
+@event.listens_for(OrmSession, 'after_flush')
+def _count_flushed_changes(session, flush_context):
+    enrollments, modules, days = defaultdict(int), defaultdict(int), defaultdict(int)
+    new_courses, deleted_courses = [], set()
+    for objects, sign in ((session.new, 1), (session.deleted, -1)):
+        for obj in objects:
+            if isinstance(obj, Enroll):
+                enrollments[obj.course_id] += sign
+                days[(obj.course_id, _day(obj.created_at))] += sign
+            elif isinstance(obj, Module):
+                modules[obj.course_id] += sign
+            elif isinstance(obj, Course):
+                if sign > 0:
+                    new_courses.append(obj.id)
+                else:
+                    deleted_courses.add(obj.id)
+    if not (enrollments or modules or new_courses or deleted_courses):
+        return
+
+    # The counters of deleted courses go away with them (ON DELETE CASCADE does it on PostgreSQL, not on SQLite)
+    connection = session.connection()
+    if deleted_courses:
+        connection.execute(delete(CourseStats.__table__).where(CourseStats.course_id.in_(deleted_courses)))
+        connection.execute(delete(CourseEnrollmentDay.__table__).where(CourseEnrollmentDay.course_id.in_(deleted_courses)))
+    for course_id in new_courses:
+        modules.setdefault(course_id, 0)  # creates the row with zeros
+    add_course_counts(
+        connection.execute, session,
+        enrollments={id: delta for id, delta in enrollments.items() if id not in deleted_courses},
+        modules={id: delta for id, delta in modules.items() if id not in deleted_courses},
+        days={key: delta for key, delta in days.items() if key[0] not in deleted_courses},
+    )
+
+
+def course_stats(session, course_id):
+    # Counters of one course (two primary key reads), counted once if the reconciliation job didn't create the row yet
+    first_day = _today() - timedelta(days=STATS_RECENT_DAYS - 1)
+    row = session.execute(
+        select(CourseStats.enrollment_count, CourseStats.module_count, CourseStats.updated_at)
+        .where(CourseStats.course_id == course_id)
+    ).first()
+    if row is None:
+        enrollment_count = session.execute(select(func.count()).where(Enroll.course_id == course_id)).scalar()
+        module_count = session.execute(select(func.count()).where(Module.course_id == course_id)).scalar()
+        recent = session.execute(
+            select(func.count()).where(Enroll.course_id == course_id,
+                                       Enroll.created_at >= datetime.combine(first_day, datetime.min.time()))
+        ).scalar()
+        updated_at = None
+    else:
+        enrollment_count, module_count, updated_at = row
+        recent = session.execute(
+            select(func.coalesce(func.sum(CourseEnrollmentDay.enrollment_count), 0))
+            .where(CourseEnrollmentDay.course_id == course_id, CourseEnrollmentDay.day >= first_day)
+        ).scalar()
+    return {
+        "enrollments": enrollment_count,
+        "modules": module_count,
+        "recent_enrollments": recent,
+        "recent_days": STATS_RECENT_DAYS,
+        "enrollments_per_day": round(recent / STATS_RECENT_DAYS, 2),
+        "updated_at": updated_at.isoformat() if updated_at is not None else None,
+    }
+
+
+def reconcile_course_stats(session_factory):
+    # One pass, STATS_RECONCILE_CHUNK courses per transaction. Returns how many rows were fixed.
+    fixed = {"courses": 0, "days": 0, "removed": 0}
+    now = datetime.now(timezone.utc)
+    first_day = _today() - timedelta(days=STATS_RECENT_DAYS - 1)
+
+    with session_factory() as session:
+        course_ids = list(session.execute(select(Course.id).order_by(Course.id)).scalars())
+        # Counters of courses that are gone (or day rows older than the window)
+        fixed["removed"] += session.execute(
+            delete(CourseStats.__table__).where(CourseStats.course_id.not_in(select(Course.id)))
+        ).rowcount
+        fixed["removed"] += session.execute(
+            delete(CourseEnrollmentDay.__table__).where(or_(CourseEnrollmentDay.day < first_day,
+                                                            CourseEnrollmentDay.course_id.not_in(select(Course.id))))
+        ).rowcount
+        session.commit()
+
+    for chunk in chunks(course_ids, STATS_RECONCILE_CHUNK):
+        with session_factory() as session:
+            session.execute(insert_ignore(session, CourseStats.__table__)
+                            .values([{"course_id": course_id, "enrollment_count": 0, "module_count": 0, "updated_at": now}
+                                     for course_id in chunk])
+                            .on_conflict_do_nothing(index_elements=['course_id']))
+            enrollments = select(func.count()).where(Enroll.course_id == CourseStats.course_id).scalar_subquery()
+            modules = select(func.count()).where(Module.course_id == CourseStats.course_id).scalar_subquery()
+            fixed["courses"] += session.execute(
+                update(CourseStats.__table__)
+                .where(CourseStats.course_id.in_(chunk),
+                       or_(CourseStats.enrollment_count != enrollments, CourseStats.module_count != modules))
+                .values(enrollment_count=enrollments, module_count=modules, updated_at=now)
+            ).rowcount
+
+            day = func.date(Enroll.created_at)
+            actual = {
+                (row.course_id, _day(row.day)): row.count
+                for row in session.execute(
+                    select(Enroll.course_id, day.label('day'), func.count().label('count'))
+                    .where(Enroll.course_id.in_(chunk), Enroll.created_at >= datetime.combine(first_day, datetime.min.time()))
+                    .group_by(Enroll.course_id, day)
+                )
+            }
+            stored = {
+                (row.course_id, row.day): row.enrollment_count
+                for row in session.execute(
+                    select(CourseEnrollmentDay.course_id, CourseEnrollmentDay.day, CourseEnrollmentDay.enrollment_count)
+                    .where(CourseEnrollmentDay.course_id.in_(chunk))
+                )
+            }
+            drifted = {key: actual.get(key, 0) - stored.get(key, 0)
+                       for key in set(actual) | set(stored) if actual.get(key, 0) != stored.get(key, 0)}
+            add_course_counts(session.execute, session, days=drifted)
+            fixed["days"] += len(drifted)
+            session.commit()
+    return fixed
+
+
+# Reconciliation job: python api/stats.py [--once]
+if __name__ == '__main__':
+    try:
+        from .db import Session
+    except ImportError:
+        from db import Session
+    parser = argparse.ArgumentParser(description="Recount the course stats counters and fix the rows that drifted")
+    parser.add_argument('--once', action='store_true', help="run one pass and exit")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    while True:
+        start = time.perf_counter()
+        fixed = reconcile_course_stats(Session)
+        logger.info("Course stats reconciled in %.1fs, fixed %s", time.perf_counter() - start, fixed)
+        if args.once:
+            break
+        time.sleep(STATS_RECONCILE_INTERVAL)
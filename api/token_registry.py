@@ -0,0 +1,122 @@
+import time
+
+try:
+    from .revocation import REVOKED_CHANNEL, REVOKED_JTIS_KEY
+except ImportError:
+    from revocation import REVOKED_CHANNEL, REVOKED_JTIS_KEY
+
+
+######################################################## TOKEN REGISTRY ########################################################################
+# Which token is active on which device: one Redis hash per user "sessions:<user_name>" with fingerprint -> "<jti>:<exp>".
+# The hash lives as long as an access token (its TTL is refreshed on every login), so users that stop logging in
+# don't leave keys behind. Login and logout are each a single round trip (Lua script / pipeline).
+# The expiry of the active token is kept next to its jti, so the token a new login replaces is revoked only until it
+# would have expired anyway (not for a full token lifetime from now) and an already expired one is not stored at all.
+# That keeps revoked_jtis (and the local revocation filter, see revocation.py) as small as it can be.
+
+# KEYS[1] = sessions:<user_name>, KEYS[2] = revoked jtis sorted set
+# ARGV[1] = fingerprint, ARGV[2] = new "<jti>:<exp>", ARGV[3] = ttl seconds, ARGV[4] = now, ARGV[5] = channel,
+# ARGV[6] = expiry for an old entry stored without one (jti only, written before the expiry was kept)
+ACTIVATE_SCRIPT = """
+local old = redis.call('HGET', KEYS[1], ARGV[1])
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+if old and old ~= ARGV[2] then
+    local jti, expires_at = string.match(old, '^(.+):(%d+)$')
+    if not jti then
+        jti, expires_at = old, ARGV[6]
+    end
+    if tonumber(expires_at) > tonumber(ARGV[4]) then
+        redis.call('ZADD', KEYS[2], expires_at, jti)
+        redis.call('PUBLISH', ARGV[5], jti .. ':' .. expires_at)
+        return {jti, expires_at}
+    end
+end
+return false
+"""
+
+
+class TokenRegistry:
+    def __init__(self, redis_client, revocation_filter, token_ttl):
+        self.redis = redis_client
+        self.revocation_filter = revocation_filter
+        self.ttl = int(token_ttl.total_seconds())
+        self._activate = self.redis.register_script(ACTIVATE_SCRIPT)
+
+    @staticmethod
+    def key(user_name):
+        return f"sessions:{user_name}"
+
+    def _activate_args(self, fingerprint, jti, expires_at):
+        now = int(time.time())
+        return [fingerprint, f"{jti}:{int(expires_at)}", self.ttl, now, REVOKED_CHANNEL, now + self.ttl]
+
+    def _remember(self, old):
+        # old: [jti, exp] of the token the login replaced, None when there was none (or it had expired)
+        if old:
+            old_jti, old_expires_at = old
+            self.revocation_filter.remember(old_jti, int(old_expires_at))
+            return old_jti
+        return None
+
+    def activate(self, user_name, fingerprint, jti, expires_at):
+        # Make jti (expiring at expires_at, unix time) the active token of this device and revoke the one it replaces
+        old = self._activate(keys=[self.key(user_name), REVOKED_JTIS_KEY], args=self._activate_args(fingerprint, jti, expires_at))
+        return self._remember(old)
+
+    def deactivate(self, user_name, fingerprint, jti, expires_at):
+        # Logout: revoke the token and forget the device
+        pipe = self.redis.pipeline()
+        pipe.hdel(self.key(user_name), fingerprint)
+        self.revocation_filter.queue_revoke(pipe, jti, expires_at)
+        pipe.execute()
+        self.revocation_filter.remember(jti, expires_at)
+
+
+def migrate_legacy_tokens(redis_client, token_ttl):
+    # One-off move from the keys used before this registry (create_db.py runs it, running it again does nothing):
+    # - "revoked_tokens:<user_name>" sets (no TTL) -> revoked_jtis. The sets don't know when a token expires, it is at
+    #   the latest now + token lifetime, so that is the score. They are also published so running filters have them.
+    # - "active_token:<user_name>:<fingerprint>" strings -> sessions:<user_name>, as jti only entries (the login
+    #   script revokes those until now + token lifetime too). A device that logged in since the deploy keeps its entry.
+    # The old keys are deleted. redis_client must decode responses. Returns (revoked jtis, active tokens) moved.
+    ttl = int(token_ttl.total_seconds())
+    expires_at = int(time.time()) + ttl
+    revoked = active = 0
+    for key in redis_client.scan_iter(match="revoked_tokens:*", count=1000):
+        jtis = redis_client.smembers(key)
+        pipe = redis_client.pipeline()
+        if jtis:
+            pipe.zadd(REVOKED_JTIS_KEY, {jti: expires_at for jti in jtis}, nx=True)
+            for jti in jtis:
+                pipe.publish(REVOKED_CHANNEL, f"{jti}:{expires_at}")
+        pipe.delete(key)
+        pipe.execute()
+        revoked += len(jtis)
+    for key in redis_client.scan_iter(match="active_token:*", count=1000):
+        # The fingerprint is a sha256 hex digest, so the last ':' ends the user name
+        user_name, _, fingerprint = key[len("active_token:"):].rpartition(':')
+        jti = redis_client.get(key)
+        pipe = redis_client.pipeline()
+        if user_name and jti:
+            pipe.hsetnx(TokenRegistry.key(user_name), fingerprint, jti)
+            pipe.expire(TokenRegistry.key(user_name), ttl)
+            active += 1
+        pipe.delete(key)
+        pipe.execute()
+    return revoked, active
+
+
+class AsyncTokenRegistry(TokenRegistry):
+    # Same registry on a redis.asyncio client, used by the ASGI app (asgi.py)
+
+    async def activate(self, user_name, fingerprint, jti, expires_at):
+        old = await self._activate(keys=[self.key(user_name), REVOKED_JTIS_KEY], args=self._activate_args(fingerprint, jti, expires_at))
+        return self._remember(old)
+
+    async def deactivate(self, user_name, fingerprint, jti, expires_at):
+        pipe = self.redis.pipeline()
+        pipe.hdel(self.key(user_name), fingerprint)
+        self.revocation_filter.queue_revoke(pipe, jti, expires_at)
+        await pipe.execute()
+        self.revocation_filter.remember(jti, expires_at)
@@ -0,0 +1,78 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api'))
+import certificates  # noqa: E402
+from certificates import certificate_key, certificate_media_key, render_certificates, missing_certificates, save_certificates  # noqa: E402
+from media import LocalStorage  # noqa: E402
+
+
+######################################################## CERTIFICATES ##########################################################################
+# Batch certificate throughput (what the batch job does after the database part) for a cohort:
+#   render: PDFs rendered inline (--workers 0) and in process pools of each --workers size, + written to a temporary
+#           media folder
+#   cached: the same cohort again, every file is already there (existence checks only, nothing rendered)
+#   python bench/certificates.py --cohort 500 --workers 0 1 2 4 8
+
+
+def make_cohort(count, course_id=1):
+    return [{
+        "key": certificate_key(user_id, course_id),
+        "user_id": user_id,
+        "student": f"Student Number {user_id}",
+        "course": "Introduction to Databases",
+        "instructor": "Ada Lovelace",
+        "issued_on": "2026-10-17",
+    } for user_id in range(1, count + 1)]
+
+
+def issue(storage, cohort, workers):
+    start = time.perf_counter()
+    missing = missing_certificates(storage, cohort)
+    save_certificates(storage, missing, render_certificates(missing, workers))
+    return time.perf_counter() - start, len(missing)
+
+
+def run(args):
+    cohort = make_cohort(args.cohort)
+    report = []
+    for workers in args.workers:
+        root = tempfile.mkdtemp(prefix="certificates-")
+        try:
+            certificates.CERT_WORKERS = workers
+            if workers > 0:
+                # Pool started (processes spawned) before the timing, like a warm API process or job worker
+                certificates._executor = None
+                render_certificates(cohort[:workers], workers)
+            storage = LocalStorage(root)
+            seconds, rendered = issue(storage, cohort, workers)
+            cached_seconds, cached_rendered = issue(storage, cohort, workers)
+            assert rendered == len(cohort) and cached_rendered == 0
+            assert os.path.getsize(storage.path(certificate_media_key(cohort[0]["key"]))) > 0
+            row = {
+                "cohort": args.cohort,
+                "workers": workers,
+                "render_s": round(seconds, 3),
+                "certificates_per_s": round(rendered / seconds, 1),
+                "cached_ms": round(cached_seconds * 1000, 2),
+            }
+            report.append(row)
+            print(json.dumps(row))
+        finally:
+            if certificates._executor is not None:
+                certificates._executor.shutdown()
+                certificates._executor = None
+            shutil.rmtree(root, ignore_errors=True)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark batch certificate rendering")
+    parser.add_argument('--cohort', type=int, default=500)
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4])
+    run(parser.parse_args())
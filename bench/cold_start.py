@@ -0,0 +1,134 @@
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+
+######################################################## COLD START BENCHMARK ##################################################################
+# How long a new worker takes from process start to its first response, the number autoscaling waits for.
+# Each run starts the server (gunicorn with the app factory by default), waits for GET /health (process booted),
+# calls GET /ready (pool connections, bcrypt workers, revocation filter warmed) and then times the first real request.
+# With --skip-ready the first request pays for the warm up itself, compare both to see what the probe saves.
+# It also times "import api.api" and create_app() in a fresh interpreter. Uses the database/Redis from the .env, e.g:
+#   python bench/cold_start.py --runs 5
+#   python bench/cold_start.py --runs 5 --skip-ready --user-name a@b.com --password pass
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_COMMAND = f'{sys.executable} -m gunicorn "api.api:create_app()" --bind 127.0.0.1:{{port}} --workers 1 --threads 4'
+
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import api.api
+imported = time.perf_counter()
+api.api.create_app()
+print(json.dumps({"import_ms": (imported - start) * 1000, "create_app_ms": (time.perf_counter() - imported) * 1000}))
+"""
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def request(url, body=None):
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=30) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def wait_for(url, deadline):
+    while time.perf_counter() < deadline:
+        try:
+            if request(url) == 200:
+                return True
+        except (urllib.error.URLError, ConnectionError):
+            pass
+        time.sleep(0.01)
+    return False
+
+
+def import_times():
+    output = subprocess.check_output([sys.executable, "-c", IMPORT_SCRIPT], cwd=ROOT, text=True)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def cold_start(args):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    server = subprocess.Popen(args.command.format(port=port), shell=True, cwd=ROOT,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_for(base_url + "/health", start + args.timeout):
+            raise SystemExit(f"server did not answer /health within {args.timeout}s: {args.command}")
+        booted = time.perf_counter()
+
+        ready_status = None
+        if not args.skip_ready:
+            ready_status = request(base_url + "/ready")
+        warmed = time.perf_counter()
+
+        if args.user_name:
+            status = request(base_url + "/auth/login", {"user_name": args.user_name, "password": args.password})
+        else:
+            status = request(base_url + args.path)
+        done = time.perf_counter()
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    return {
+        "boot_ms": (booted - start) * 1000,
+        "ready_ms": (warmed - booted) * 1000,
+        "first_request_ms": (done - warmed) * 1000,
+        "total_ms": (done - start) * 1000,
+        "ready_status": ready_status,
+        "first_request_status": status,
+    }
+
+
+def run(args):
+    imports = [import_times() for _ in range(args.runs)]
+    runs = [cold_start(args) for _ in range(args.runs)]
+
+    def median(values, key):
+        return round(statistics.median(value[key] for value in values), 1)
+
+    print(json.dumps({
+        "runs": args.runs,
+        "command": args.command,
+        "skip_ready": args.skip_ready,
+        "first_request": "POST /auth/login" if args.user_name else f"GET {args.path}",
+        "import_ms": median(imports, "import_ms"),
+        "create_app_ms": median(imports, "create_app_ms"),
+        "boot_ms": median(runs, "boot_ms"),
+        "ready_ms": median(runs, "ready_ms"),
+        "first_request_ms": median(runs, "first_request_ms"),
+        "total_ms": median(runs, "total_ms"),
+        "statuses": sorted({(run["ready_status"], run["first_request_status"]) for run in runs}, key=str),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time from server start to the first response")
+    parser.add_argument('--command', default=DEFAULT_COMMAND, help="server command, {port} is replaced")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=60, help="seconds to wait for /health")
+    parser.add_argument('--path', default="/courses", help="first request (GET) when no --user-name is given")
+    parser.add_argument('--user-name', help="make the first request a login (includes bcrypt)")
+    parser.add_argument('--password')
+    parser.add_argument('--skip-ready', action='store_true', help="don't call /ready before the first request")
+    run(parser.parse_args())
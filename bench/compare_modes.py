@@ -0,0 +1,121 @@
+import argparse
+import json
+import os
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+######################################################## COMPARE SERVING MODES #################################################################
+# Replays the requests of Studyo.postman_collection.json against two running servers (e.g. the Flask app on :5000
+# and the ASGI app on :5001) and compares status codes and response shapes. Bearer tokens saved in the collection
+# are replaced with a fresh token from each server. By default only GET requests are sent; use --include-writes to
+# replay everything (point the two servers at two copies of the same database for that).
+#   python bench/compare_modes.py --sync-url http://localhost:5000 --async-url http://localhost:5001 --user-name a@b.com --password pass
+
+COLLECTION = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Studyo.postman_collection.json')
+
+
+def collection_requests(path):
+    with open(path, encoding='utf-8') as f:
+        collection = json.load(f)
+
+    def walk(items):
+        for item in items:
+            if 'item' in item:
+                yield from walk(item['item'])
+            else:
+                yield item
+
+    for item in walk(collection['item']):
+        req = item['request']
+        url = urllib.parse.urlsplit(req['url']['raw'] if isinstance(req['url'], dict) else req['url'])
+        body = req.get('body', {}).get('raw') if req.get('body', {}).get('mode') == 'raw' else None
+        uses_token = req.get('auth', {}).get('type') == 'bearer' and any(b.get('value') for b in req['auth'].get('bearer', []))
+        yield {
+            "name": item['name'],
+            "method": req['method'],
+            "path": url.path + (f"?{url.query}" if url.query else ""),
+            "body": json.loads(body) if body and body.strip() else None,
+            "auth": uses_token,
+        }
+
+
+def send(base_url, method, path, body=None, token=None, agent="compare-modes"):
+    headers = {"Content-Type": "application/json", "User-Agent": agent}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    req = urllib.request.Request(base_url + path, data=data, headers=headers, method=method)
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=30) as response:
+            status, raw = response.status, response.read()
+    except urllib.error.HTTPError as e:
+        status, raw = e.code, e.read()
+    elapsed = (time.perf_counter() - start) * 1000
+    try:
+        payload = json.loads(raw) if raw else None
+    except ValueError:
+        payload = raw.decode('utf-8', 'replace')
+    return status, payload, elapsed
+
+
+def shape(value):
+    # Keys and value types without the values themselves, lists are described by their first element
+    if isinstance(value, dict):
+        return {key: shape(item) for key, item in sorted(value.items())}
+    if isinstance(value, list):
+        return [shape(value[0])] if value else []
+    return type(value).__name__
+
+
+def login(base_url, user_name, password, agent):
+    # Each mode logs in as its own "device", otherwise the second login would revoke the first token
+    status, payload, _ = send(base_url, 'POST', '/auth/login', {"user_name": user_name, "password": password}, agent=agent)
+    if status != 200:
+        raise SystemExit(f"login on {base_url} failed with {status}: {payload}")
+    return payload['access_token']
+
+
+def run(args):
+    tokens = {
+        "sync": login(args.sync_url, args.user_name, args.password, "compare-modes-sync"),
+        "async": login(args.async_url, args.user_name, args.password, "compare-modes-async"),
+    }
+    urls = {"sync": args.sync_url, "async": args.async_url}
+    results = []
+    for req in collection_requests(args.collection):
+        if req['path'].startswith('/auth/login') or req['path'].startswith('/auth/logout'):
+            continue  # these would replace/revoke the tokens used for the comparison
+        if req['method'] != 'GET' and not args.include_writes:
+            continue
+        row = {"method": req['method'], "path": req['path']}
+        for mode in ("sync", "async"):
+            status, payload, elapsed = send(urls[mode], req['method'], req['path'], req['body'],
+                                            tokens[mode] if req['auth'] else None, f"compare-modes-{mode}")
+            row[mode] = {"status": status, "ms": round(elapsed, 2), "shape": shape(payload)}
+        row["match"] = row["sync"]["status"] == row["async"]["status"] and row["sync"]["shape"] == row["async"]["shape"]
+        results.append(row)
+        print(f"{'OK  ' if row['match'] else 'DIFF'} {req['method']:6} {req['path']:45} "
+              f"sync {row['sync']['status']} {row['sync']['ms']:8.2f}ms | async {row['async']['status']} {row['async']['ms']:8.2f}ms")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    mismatches = [row for row in results if not row['match']]
+    print(f"{len(results) - len(mismatches)}/{len(results)} requests match")
+    raise SystemExit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare the Flask and ASGI serving modes with the Postman collection")
+    parser.add_argument('--sync-url', default='http://localhost:5000')
+    parser.add_argument('--async-url', default='http://localhost:5001')
+    parser.add_argument('--user-name', required=True)
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--collection', default=COLLECTION)
+    parser.add_argument('--include-writes', action='store_true', help="also replay POST/PUT/DELETE requests")
+    parser.add_argument('--output', help="write the comparison as JSON to this file")
+    run(parser.parse_args())
@@ -0,0 +1,101 @@
+import argparse
+import asyncio
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api'))
+from events import EventHub, AsyncCourseEvents, MODULE_ADDED  # noqa: E402
+
+
+######################################################## COURSE EVENTS #########################################################################
+# Idle event streams one process keeps and how fast one course event reaches all of them (events.py), through the
+# real pub/sub listener on fakeredis (default) or a redis-server (--redis-url). No HTTP: each connection is the
+# stream generator of GET /courses/<id>/events read by its own task, like the server does.
+#   memory: traced Python memory per idle connection (subscriber + stream generator + its task)
+#   fanout: publish one event to a course with every connection on it, until the last stream yielded it
+#   slow:   a stream nobody reads is closed after EVENTS_QUEUE_LIMIT events, the others keep theirs
+#   python bench/course_events.py --connections 1000 10000 50000
+
+
+async def make_client(url):
+    if url:
+        import redis.asyncio as aioredis
+        return aioredis.from_url(url)
+    import fakeredis
+    return fakeredis.FakeAsyncRedis()
+
+
+async def consume(hub, subscriber, received, expected, done):
+    async for frame in hub.stream(subscriber):
+        if b"event: connected" in frame:
+            continue
+        received[0] += 1
+        if received[0] == expected:
+            done.set_result(time.perf_counter())
+
+
+async def measure(url, connections, events, queue_limit):
+    redis_client = await make_client(url)
+    hub = EventHub(redis_client, queue_limit=queue_limit, keepalive=3600)
+    publisher = AsyncCourseEvents(redis_client)
+    received, done = [0], asyncio.get_running_loop().create_future()
+    await hub.subscribe(0)  # starts the listener outside of the measured memory
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tasks = []
+    for _ in range(connections):
+        subscriber = await hub.subscribe(1)
+        tasks.append(asyncio.create_task(consume(hub, subscriber, received, connections * events, done)))
+    # Every stream sent "connected" and waits for the next event
+    await asyncio.sleep(0)
+    while any(subscriber.waiter is None for subscriber in hub.subscribers[1]):
+        await asyncio.sleep(0.01)
+    gc.collect()
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for number in range(events):
+        await publisher.publish(MODULE_ADDED, 1, module_id=number, title=f"Module {number}")
+    finished = await asyncio.wait_for(done, 120)
+
+    # Slow client: queue_limit + 1 events on a course whose only stream is never read
+    slow = await hub.subscribe(2)
+    for number in range(queue_limit + 1):
+        await publisher.publish(MODULE_ADDED, 2, module_id=number, title=f"Module {number}")
+    while not slow.closed:
+        await asyncio.sleep(0.01)
+    stats = hub.stats()
+    await hub.stop()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await redis_client.aclose()
+    return {
+        "connections": connections,
+        "bytes_per_connection": round(memory / connections),
+        "fanout_ms": round((finished - start) * 1000, 2),
+        "deliveries_per_s": round(connections * events / (finished - start)),
+        "slow_closed": stats["slow_closed"],
+    }
+
+
+def run(args):
+    report = []
+    for connections in args.connections:
+        row = asyncio.run(measure(args.redis_url, connections, args.events, args.queue_limit))
+        report.append(row)
+        print(json.dumps(row))
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark course event fan out to idle streams")
+    parser.add_argument('--connections', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--events', type=int, default=1, help="events published to the course of every connection")
+    parser.add_argument('--queue-limit', type=int, default=64)
+    parser.add_argument('--redis-url', help="redis-server to use instead of fakeredis, e.g. redis://localhost:6379/15")
+    run(parser.parse_args())
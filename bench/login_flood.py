@@ -0,0 +1,88 @@
+import argparse
+import json
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+
+
+######################################################## LOGIN FLOOD BENCHMARK #################################################################
+# Measures the latency of a cheap read route (GET /courses) while many clients hammer /auth/login.
+# Run it against a running server, first without the flood and then with it, e.g:
+#   python bench/login_flood.py --base-url http://localhost:5000 --user-name a@b.com --password pass --flood 0
+#   python bench/login_flood.py --base-url http://localhost:5000 --user-name a@b.com --password pass --flood 64
+
+
+def request(url, body=None, headers=None):
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json", **(headers or {})})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=30) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except urllib.error.URLError:
+        status = 0
+    return status, time.perf_counter() - start
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def run(args):
+    stop = threading.Event()
+    login_statuses = {}
+    lock = threading.Lock()
+
+    def flood(worker):
+        while not stop.is_set():
+            status, _ = request(f"{args.base_url}/auth/login",
+                                {"user_name": args.user_name, "password": args.password},
+                                {"User-Agent": f"login-flood-{worker}"})
+            with lock:
+                login_statuses[status] = login_statuses.get(status, 0) + 1
+
+    flooders = [threading.Thread(target=flood, args=(i,), daemon=True) for i in range(args.flood)]
+    for thread in flooders:
+        thread.start()
+    time.sleep(args.warmup)
+
+    read_latencies = []
+    deadline = time.monotonic() + args.duration
+    while time.monotonic() < deadline:
+        status, elapsed = request(f"{args.base_url}/courses?limit=10")
+        if status == 200:
+            read_latencies.append(elapsed * 1000)
+
+    stop.set()
+    for thread in flooders:
+        thread.join(timeout=30)
+
+    report = {
+        "flood_clients": args.flood,
+        "reads": len(read_latencies),
+        "read_ms_p50": round(percentile(read_latencies, 50), 2),
+        "read_ms_p95": round(percentile(read_latencies, 95), 2),
+        "read_ms_p99": round(percentile(read_latencies, 99), 2),
+        "read_ms_mean": round(statistics.fmean(read_latencies), 2) if read_latencies else 0.0,
+        "login_statuses": login_statuses,
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Read latency while /auth/login is flooded")
+    parser.add_argument('--base-url', default='http://localhost:5000')
+    parser.add_argument('--user-name', required=True)
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--flood', type=int, default=32, help="concurrent login clients")
+    parser.add_argument('--duration', type=float, default=10, help="seconds of read measurements")
+    parser.add_argument('--warmup', type=float, default=1, help="seconds of flood before measuring")
+    run(parser.parse_args())
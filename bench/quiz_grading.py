@@ -0,0 +1,97 @@
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api'))
+from quiz import NO_ANSWER, AnswerKey, grade  # noqa: E402
+
+
+######################################################## QUIZ GRADING ##########################################################################
+# Grading throughput of quiz.py as questions and submissions grow, against grading one student and question at a
+# time in Python. No database: measures what the bulk submit route does between parsing and the upserts.
+#   stack: the stored answer blobs -> one (n x q) uint8 matrix (np.frombuffer, like results are read back)
+#   numpy: grade() on that matrix (compare with the key, counts, matrix product with the points)
+#   python: nested loops over the same answers as lists
+#   python bench/quiz_grading.py --questions 10 50 200 --submissions 1000 10000 100000
+
+
+def make_quiz(questions, rng):
+    option_counts = rng.integers(2, 6, size=questions).astype(np.uint8)
+    answers = (rng.random(questions) * option_counts).astype(np.uint8)
+    points = rng.choice([0.5, 1, 2], size=questions).astype(np.float32)
+    return AnswerKey(answers, option_counts, points)
+
+
+def make_submissions(key, count, rng):
+    # About 70% right, 5% left empty
+    matrix = (rng.random((count, key.question_count)) * key.option_counts).astype(np.uint8)
+    right = rng.random(matrix.shape) < 0.7
+    matrix[right] = np.broadcast_to(key.answers, matrix.shape)[right]
+    matrix[rng.random(matrix.shape) < 0.05] = NO_ANSWER
+    return matrix
+
+
+def grade_python(key, rows):
+    answers, points = key.answers.tolist(), key.points.tolist()
+    results = []
+    for row in rows:
+        correct, score = 0, 0.0
+        for position, answer in enumerate(row):
+            if answer == answers[position]:
+                correct += 1
+                score += points[position]
+        results.append((correct, score))
+    return results
+
+
+def best_of(repeat, fn):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run(args):
+    rng = np.random.default_rng(args.seed)
+    report = []
+    for questions in args.questions:
+        key = make_quiz(questions, rng)
+        for count in args.submissions:
+            matrix = make_submissions(key, count, rng)
+            blobs = [row.tobytes() for row in matrix]
+            stack_seconds, stacked = best_of(args.repeat, lambda: np.frombuffer(b"".join(blobs), dtype=np.uint8).reshape(count, questions))
+            numpy_seconds, (correct, scores) = best_of(args.repeat, lambda: grade(key, stacked))
+            row = {
+                "questions": questions,
+                "submissions": count,
+                "stack_ms": round(stack_seconds * 1000, 2),
+                "numpy_ms": round(numpy_seconds * 1000, 2),
+                "numpy_submissions_per_s": round(count / (stack_seconds + numpy_seconds)),
+            }
+            if count * questions <= args.python_limit:
+                rows = matrix.tolist()
+                python_seconds, expected = best_of(1, lambda: grade_python(key, rows))
+                # Same results both ways (scores as float32 sums, compared with a tolerance)
+                assert [c for c, _ in expected] == correct.tolist()
+                assert np.allclose([s for _, s in expected], scores, atol=1e-3)
+                row["python_ms"] = round(python_seconds * 1000, 2)
+                row["speedup"] = round(python_seconds / (stack_seconds + numpy_seconds), 1)
+            report.append(row)
+            print(json.dumps(row))
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark vectorized quiz grading")
+    parser.add_argument('--questions', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--submissions', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--python-limit', type=int, default=5000000, help="skip the Python loop above this many answers")
+    parser.add_argument('--seed', type=int, default=1)
+    run(parser.parse_args())
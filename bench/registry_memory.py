@@ -0,0 +1,81 @@
+import argparse
+import hashlib
+import json
+import time
+import uuid
+import redis
+
+
+######################################################## TOKEN REGISTRY MEMORY #################################################################
+# Compares Redis memory per active user for the old token layout and the sessions hash layout.
+#   old: active_token:<user>:<fingerprint> strings (no TTL) + revoked_tokens:<user> set
+#   new: sessions:<user> hash fingerprint -> "<jti>:<exp>" + shared revoked_jtis sorted set
+# Needs a real redis-server (uses MEMORY USAGE), run it against an empty db, e.g:
+#   python bench/registry_memory.py --db 15 --users 10000 --devices 3 --logins 5
+
+
+def fingerprint(user, device):
+    return hashlib.sha256(f"10.0.0.{device}:agent-{user}-{device}".encode()).hexdigest()
+
+
+def fill_old(r, users, devices, logins):
+    for user in range(users):
+        user_name = f"user{user}@example.com"
+        pipe = r.pipeline(transaction=False)
+        for device in range(devices):
+            for _ in range(logins):
+                jti = str(uuid.uuid4())
+                pipe.sadd(f"revoked_tokens:{user_name}", jti)
+                pipe.set(f"active_token:{user_name}:{fingerprint(user, device)}", jti)
+        pipe.execute()
+
+
+def fill_new(r, users, devices, logins, ttl):
+    expires_at = int(time.time()) + ttl
+    for user in range(users):
+        user_name = f"user{user}@example.com"
+        pipe = r.pipeline(transaction=False)
+        for device in range(devices):
+            for _ in range(logins):
+                jti = str(uuid.uuid4())
+                pipe.zadd("revoked_jtis", {jti: expires_at})
+                pipe.hset(f"sessions:{user_name}", fingerprint(user, device), f"{jti}:{expires_at}")
+        pipe.expire(f"sessions:{user_name}", ttl)
+        pipe.execute()
+
+
+def measure(r, users):
+    total = 0
+    keys = 0
+    for key in r.scan_iter(count=1000):
+        total += r.memory_usage(key, samples=0) or 0
+        keys += 1
+    return {"keys": keys, "bytes": total, "bytes_per_user": round(total / users, 1)}
+
+
+def run(args):
+    r = redis.StrictRedis(host=args.host, port=args.port, db=args.db, decode_responses=True)
+    if r.dbsize():
+        raise SystemExit(f"db {args.db} is not empty, use an empty database")
+    report = {"users": args.users, "devices": args.devices, "logins_per_device": args.logins}
+    try:
+        fill_old(r, args.users, args.devices, args.logins)
+        report["before"] = measure(r, args.users)
+        r.flushdb()
+        fill_new(r, args.users, args.devices, args.logins, args.ttl)
+        report["after"] = measure(r, args.users)
+    finally:
+        r.flushdb()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Redis memory per active user, old vs new token registry")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=6379)
+    parser.add_argument('--db', type=int, default=15)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--devices', type=int, default=3)
+    parser.add_argument('--logins', type=int, default=5, help="logins per device, each one revokes the previous token")
+    parser.add_argument('--ttl', type=int, default=60 * 24 * 3600, help="JWT_ACCESS_TOKEN_EXPIRES in seconds")
+    run(parser.parse_args())
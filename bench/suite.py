@@ -0,0 +1,357 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+from compare_modes import collection_requests, COLLECTION  # noqa: E402
+
+
+######################################################## BENCHMARK SUITE #######################################################################
+# Self contained load test of the routes in Studyo.postman_collection.json (plus a few hot routes added later).
+# It seeds a database (a temporary SQLite file by default, or --database-url), uses fakeredis (default) or the
+# redis-server on localhost:6379, and drives every route in-process through the Flask test client with
+# --concurrency threads. For every route it reports throughput, p50/p95/p99 latency and SQL statements per request.
+#
+#   python bench/suite.py --output results.json                           # run and save the results
+#   python bench/suite.py --save-baseline bench/baseline.json             # save a baseline
+#   python bench/suite.py --baseline bench/baseline.json                  # compare, exit code 1 on a regression
+#
+# A route regresses when its p95 or throughput is worse than the baseline by more than --threshold (default 25%)
+# or it runs more SQL statements per request. Compare runs made on the same machine with the same options, and use
+# enough --requests (a few hundred) so one slow request does not move p95 past the threshold.
+# Login and register may answer 503 when --concurrency is above HASH_QUEUE_LIMIT (bcrypt load shedding), those are
+# counted in "statuses" but not as errors.
+# Run it from a checkout (not against production data): it writes users, courses and modules to the database.
+
+PASSWORD = "bench-password"
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def template(path):
+    # /courses/10/modules?limit=2 -> /courses/<id>/modules
+    parts = path.split('?')[0].split('/')
+    return '/'.join('<id>' if part.isdigit() else part for part in parts)
+
+
+def setup_environment(args):
+    # Must run before the app is imported: the app reads its settings from the environment on import
+    if not args.database_url:
+        args.database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='studyo-bench-'), 'bench.db')
+    os.environ["SQLALCHEMY_DATABASE_URI"] = args.database_url
+    os.environ.setdefault("JWT_SECRET_KEY", uuid.uuid4().hex + uuid.uuid4().hex)
+    os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+    os.environ.setdefault("PROGRESS_FLUSH_IN_PROCESS", "false")
+    # The suite logs in and registers from one client far more often than the login/register budgets allow
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+    if args.redis == 'fake':
+        import fakeredis
+        import redis
+        server = fakeredis.FakeServer()
+
+        class FakeRedis(fakeredis.FakeStrictRedis):
+            def __init__(self, *a, **kw):
+                for key in ('host', 'port', 'db'):
+                    kw.pop(key, None)
+                super().__init__(*a, server=server, **kw)
+
+        redis.StrictRedis = redis.Redis = FakeRedis
+
+
+def seed(args):
+    from sqlalchemy import select
+    from api.models import Base, Role, RoleType, User, UserProfile, Course, Module, Enroll
+    from api.passwords import hash_passwords, HASH_WORKERS
+    from api.bulk import chunks
+    from api.db import get_engine, Session
+
+    # The app does not create tables (create_db.py does), the benchmark database is new so create them here
+    Base.metadata.create_all(get_engine())
+    session = Session()
+    roles = {role.role_name: role.id for role in session.execute(select(Role.id, Role.role_name))}
+    for role_type in RoleType:
+        if role_type not in roles:
+            role = Role(role_name=role_type)
+            session.add(role)
+            session.flush()
+            roles[role_type] = role.id
+
+    tag = uuid.uuid4().hex[:6]
+    # Hashing one password per worker also starts every bcrypt worker process before the login route is measured
+    password_hash = hash_passwords([PASSWORD] * max(1, HASH_WORKERS))[0]
+
+    def add_users(prefix, count, role):
+        rows = [{"user_name": f"bench-{tag}-{prefix}-{i}", "email": f"bench-{tag}-{prefix}-{i}@bench",
+                 "password_hash": password_hash, "role_id": roles[role]} for i in range(count)]
+        users = []
+        for chunk in chunks(rows):
+            result = session.execute(User.__table__.insert().returning(User.__table__.c.id, User.__table__.c.user_name), chunk)
+            users.extend((row.id, row.user_name) for row in result)
+        for chunk in chunks(users):
+            session.execute(UserProfile.__table__.insert(), [
+                {"user_id": user_id, "first_name": "Bench", "last_name": str(user_id), "bio": ""} for user_id, _ in chunk
+            ])
+        return users
+
+    admin = add_users('admin', 1, RoleType.ADMIN)[0]
+    instructor = add_users('instructor', 1, RoleType.INSTRUCTOR)[0]
+    students = add_users('student', args.users, RoleType.STUDENT)
+    scratch_users = add_users('scratch', args.requests, RoleType.STUDENT)
+
+    def add_courses(prefix, count):
+        rows = [{"title": f"bench-{tag}-{prefix}-{i}", "description": f"Benchmark course {i} about python and data",
+                 "course_instructor_id": instructor[0]} for i in range(count)]
+        ids = []
+        for chunk in chunks(rows):
+            ids.extend(session.execute(Course.__table__.insert().returning(Course.__table__.c.id), chunk).scalars())
+        return ids
+
+    courses = add_courses('course', args.courses)
+    scratch_courses = add_courses('scratch', args.requests + 1)
+    modules = {}
+    for course_id in courses:
+        rows = [{"course_id": course_id, "title": f"module-{i}", "content": f"Module {i} content about python loops"}
+                for i in range(args.modules)]
+        modules[course_id] = list(session.execute(Module.__table__.insert().returning(Module.__table__.c.id), rows).scalars())
+    # Modules for the DELETE module route live in the first scratch course
+    scratch_module_course = scratch_courses[0]
+    rows = [{"course_id": scratch_module_course, "title": f"scratch-{i}", "content": ""} for i in range(args.requests)]
+    scratch_modules = list(session.execute(Module.__table__.insert().returning(Module.__table__.c.id), rows).scalars())
+    for chunk in chunks(students):
+        session.execute(Enroll.__table__.insert(), [{"course_id": courses[0], "user_id": user_id} for user_id, _ in chunk])
+    session.commit()
+    session.close()
+
+    return {
+        "tag": tag, "admin": admin, "instructor": instructor, "students": students, "scratch_users": scratch_users,
+        "courses": courses, "modules": modules, "scratch_courses": scratch_courses[1:],
+        "scratch_module_course": scratch_module_course, "scratch_modules": scratch_modules,
+    }
+
+
+def token(app, user_name, role):
+    # Minted directly (no bcrypt) so the routes are measured, not the login
+    from flask_jwt_extended import create_access_token
+    with app.app_context():
+        return create_access_token(identity={"user_name": user_name, "role": role})
+
+
+def scenarios(app, data, args):
+    # route template -> (method, make(i) -> (path, body, headers), expected statuses). Reads first, deletes last.
+    admin_headers = {"Authorization": f"Bearer {token(app, data['admin'][1], 'admin')}"}
+    instructor_headers = {"Authorization": f"Bearer {token(app, data['instructor'][1], 'instructor')}"}
+    students = data['students']
+    student_headers = [{"Authorization": f"Bearer {token(app, name, 'student')}"} for _, name in students[:64]]
+    course, module = data['courses'][0], data['modules'][data['courses'][0]][0]
+    tag = data['tag']
+
+    def student(i):
+        return student_headers[i % len(student_headers)]
+
+    def course_at(i):
+        return data['courses'][i % len(data['courses'])]
+
+    # Tokens for the routes that revoke the caller's token (logout, delete user)
+    def fresh_tokens(name, role, count):
+        return [{"Authorization": f"Bearer {token(app, name, role)}"} for _ in range(count)]
+
+    logout_headers = fresh_tokens(students[0][1], 'student', args.requests)
+    delete_headers = fresh_tokens(data['admin'][1], 'admin', args.requests)
+
+    return [
+        ("GET", "/auth/role", lambda i: ("/auth/role", None, student(i)), {200}),
+        ("GET", "/auth/profile", lambda i: ("/auth/profile", None, student(i)), {200}),
+        ("GET", "/users", lambda i: ("/users?limit=7", None, admin_headers), {200}),
+        ("GET", "/users/<id>", lambda i: (f"/users/{students[i % len(students)][0]}", None, student(i)), {200}),
+        ("GET", "/courses", lambda i: ("/courses?limit=7", None, {}), {200}),
+        ("GET", "/courses/<id>", lambda i: (f"/courses/{course_at(i)}", None, student(i)), {200}),
+        ("GET", "/courses/<id>/modules", lambda i: (f"/courses/{course_at(i)}/modules?limit=2", None, student(i)), {200}),
+        ("GET", "/courses/<id>/modules/<id>",
+         lambda i: (f"/courses/{course}/modules/{data['modules'][course][i % len(data['modules'][course])]}", None, student(i)), {200}),
+        ("GET", "/courses/search", lambda i: ("/courses/search?q=python%20loops", None, {}), {200}),
+        ("POST", "/auth/login",
+         lambda i: ("/auth/login", {"user_name": students[i % len(students)][1], "password": PASSWORD}, {"User-Agent": f"bench-{i}"}), {200, 503}),
+        ("POST", "/auth/register", lambda i: ("/auth/register", {
+            "user_name": f"bench-{tag}-reg-{i}", "email": f"bench-{tag}-reg-{i}@bench", "password": PASSWORD,
+            "role": "student", "first_name": "Bench", "last_name": "Register"}, {}), {201, 503}),
+        ("POST", "/courses/<id>/modules/<id>/progress",
+         lambda i: (f"/courses/{course}/modules/{module}/progress", {"position": i}, student(i)), {202}),
+        ("POST", "/courses", lambda i: ("/courses", {"title": f"bench-{tag}-new-{i}", "description": "new"}, instructor_headers), {201}),
+        ("POST", "/courses/<id>/modules",
+         lambda i: (f"/courses/{course}/modules", {"title": f"bench-{tag}-new-{i}", "content": "new"}, instructor_headers), {201}),
+        ("PUT", "/users/<id>", lambda i: (f"/users/{students[i % len(students)][0]}", {"bio": f"bio {i}"}, admin_headers), {200}),
+        ("PUT", "/users/<id>/role",
+         lambda i: (f"/users/{data['scratch_users'][i][0]}/role", {"role": "Instructor"}, admin_headers), {200}),
+        ("PUT", "/courses/<id>",
+         lambda i: (f"/courses/{course_at(i)}", {"title": f"bench-{tag}-course-{course_at(i)}-v{i}", "description": "updated"}, instructor_headers), {200}),
+        ("PUT", "/courses/<id>/modules/<id>",
+         lambda i: (f"/courses/{course}/modules/{module}", {"title": f"module-0-v{i}", "content": "updated"}, instructor_headers), {200}),
+        ("POST", "/auth/logout", lambda i: ("/auth/logout", None, logout_headers[i]), {200}),
+        ("DELETE", "/courses/<id>/modules/<id>",
+         lambda i: (f"/courses/{data['scratch_module_course']}/modules/{data['scratch_modules'][i]}", None, instructor_headers), {200}),
+        ("DELETE", "/courses/<id>", lambda i: (f"/courses/{data['scratch_courses'][i]}", None, instructor_headers), {200}),
+        ("DELETE", "/users/<id>", lambda i: (f"/users/{data['scratch_users'][i][0]}", None, delete_headers[i]), {200}),
+    ]
+
+
+def run_scenario(app, method, make, expected, count, concurrency, statements):
+    local = threading.local()
+
+    def call(i):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.test_client(use_cookies=False)
+        path, body, headers = make(i)
+        statements.count = 0
+        start = time.perf_counter()
+        response = client.open(path, method=method, json=body, headers=headers)
+        elapsed = (time.perf_counter() - start) * 1000
+        return response.status_code, elapsed, statements.count
+
+    began = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, range(count)))
+    wall = time.perf_counter() - began
+    latencies = [elapsed for _, elapsed, _ in results]
+    statuses = {}
+    for status, _, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "requests": len(results),
+        "errors": sum(1 for status, _, _ in results if status not in expected),
+        "statuses": statuses,
+        "throughput_rps": round(len(results) / wall, 1),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "sql_per_request": round(sum(count for _, _, count in results) / len(results), 2),
+    }
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, result in results["routes"].items():
+        before = baseline.get("routes", {}).get(name)
+        if before is None:
+            continue
+        reasons = []
+        if result["p95_ms"] > before["p95_ms"] * (1 + threshold):
+            reasons.append(f"p95 {before['p95_ms']}ms -> {result['p95_ms']}ms")
+        if result["throughput_rps"] < before["throughput_rps"] * (1 - threshold):
+            reasons.append(f"throughput {before['throughput_rps']} -> {result['throughput_rps']} req/s")
+        if result["sql_per_request"] > before["sql_per_request"] + 0.5:
+            reasons.append(f"SQL statements {before['sql_per_request']} -> {result['sql_per_request']} per request")
+        if result["errors"] > before.get("errors", 0):
+            reasons.append(f"errors {before.get('errors', 0)} -> {result['errors']}")
+        if reasons:
+            regressions.append((name, reasons))
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    setup_environment(args)
+    import logging
+    logging.disable(logging.INFO)  # quiet, even with DB_ECHO=true
+    from sqlalchemy import event
+    import api.api as app_module
+    from api.db import get_engine
+
+    app = app_module.create_app()
+    data = seed(args)
+    statements = threading.local()
+
+    @event.listens_for(get_engine(), 'before_cursor_execute')
+    def count_statement(*_):
+        statements.count = getattr(statements, 'count', 0) + 1
+
+    collection = {(req['method'], template(req['path'])) for req in collection_requests(args.collection)}
+    plan = scenarios(app, data, args)
+    covered = {(method, path) for method, path, _, _ in plan}
+    missing = sorted(collection - covered)
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "database": get_engine().dialect.name,
+            "redis": args.redis,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "users": args.users,
+            "courses": args.courses,
+            "modules": args.modules,
+            "bcrypt_rounds": args.bcrypt_rounds,
+        },
+        "routes": {},
+    }
+    for method, path, make, expected in plan:
+        if args.only and args.only not in f"{method} {path}":
+            continue
+        if method == 'GET' and args.warmup:
+            # Reads only (writes use up their seeded rows): fills the caches and the connection pool first
+            run_scenario(app, method, make, expected, args.warmup, args.concurrency, statements)
+        result = run_scenario(app, method, make, expected, args.requests, args.concurrency, statements)
+        name = f"{method} {path}"
+        results["routes"][name] = result
+        print(f"{name:45} {result['throughput_rps']:9.1f} req/s  p50 {result['p50_ms']:8.2f}  p95 {result['p95_ms']:8.2f}  "
+              f"p99 {result['p99_ms']:8.2f} ms  sql {result['sql_per_request']:5.2f}  errors {result['errors']}")
+    if missing:
+        print(f"Routes in the collection without a scenario: {', '.join(f'{m} {p}' for m, p in missing)}")
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for name, reasons in regressions:
+            print(f"REGRESSION {name}: {'; '.join(reasons)}")
+        print(f"{len(regressions)} regressions against {args.baseline} (commit {baseline['meta'].get('commit')})")
+        raise SystemExit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test the API routes of the Postman collection")
+    parser.add_argument('--database-url', help="default: a new SQLite file in a temporary folder")
+    parser.add_argument('--redis', choices=('fake', 'local'), default='fake', help="fakeredis or redis-server on localhost:6379")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help="requests per route")
+    parser.add_argument('--warmup', type=int, default=20, help="unmeasured requests per read route first")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--courses', type=int, default=100)
+    parser.add_argument('--modules', type=int, default=20, help="modules per course")
+    parser.add_argument('--bcrypt-rounds', type=int, default=4, help="low by default so login/register measure the app")
+    parser.add_argument('--collection', default=COLLECTION)
+    parser.add_argument('--only', help="run only the routes whose name contains this text")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--save-baseline', help="write the results as the new baseline to this file")
+    parser.add_argument('--baseline', help="compare with this baseline, exit code 1 on a regression")
+    parser.add_argument('--threshold', type=float, default=0.25)
+    run(parser.parse_args())
@@ -0,0 +1,69 @@
+import argparse
+import json
+import random
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+######################################################## VIDEO RANGE BENCHMARK #################################################################
+# Many players reading the same video in parallel: each client requests consecutive Range chunks from a signed media
+# URL (what a <video> tag does while playing) and the script reports throughput and latency per chunk.
+# Get a URL first with GET /courses/<id>/modules/<moduleId>/video, e.g:
+#   python bench/video_ranges.py --url "http://localhost:5000/media/videos/intro.mp4?expires=...&sig=..." --clients 64
+
+
+def content_length(url):
+    req = urllib.request.Request(url, method='HEAD')
+    with urllib.request.urlopen(req, timeout=30) as response:
+        return int(response.headers['Content-Length'])
+
+
+def play(url, size, chunk_size, chunks):
+    # Starts at a random point and reads `chunks` consecutive ranges, returns (bytes, latency per chunk in ms)
+    start = random.randrange(0, max(1, size - chunk_size))
+    received, latencies = 0, []
+    for _ in range(chunks):
+        stop = min(size, start + chunk_size) - 1
+        req = urllib.request.Request(url, headers={"Range": f"bytes={start}-{stop}"})
+        began = time.perf_counter()
+        with urllib.request.urlopen(req, timeout=30) as response:
+            if response.status != 206:
+                raise SystemExit(f"expected 206, got {response.status}")
+            received += len(response.read())
+        latencies.append((time.perf_counter() - began) * 1000)
+        start = stop + 1 if stop + 1 < size else 0
+    return received, latencies
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(args):
+    size = content_length(args.url)
+    began = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        results = list(pool.map(lambda _: play(args.url, size, args.chunk_size, args.chunks), range(args.clients)))
+    elapsed = time.perf_counter() - began
+    received = sum(result[0] for result in results)
+    latencies = [latency for result in results for latency in result[1]]
+    print(json.dumps({
+        "clients": args.clients,
+        "requests": len(latencies),
+        "seconds": round(elapsed, 3),
+        "megabytes_per_second": round(received / elapsed / 1024 / 1024, 1),
+        "requests_per_second": round(len(latencies) / elapsed),
+        "p50_ms": round(percentile(latencies, 0.5), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Concurrent Range requests against a signed media URL")
+    parser.add_argument('--url', required=True)
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--chunks', type=int, default=20, help="Range requests per client")
+    parser.add_argument('--chunk-size', type=int, default=1024 * 1024)
+    run(parser.parse_args())
@@ -0,0 +1,227 @@
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+
+######################################################## TEST SETUP ############################################################################
+# The tests run both apps (api.py on Flask, asgi.py on Quart) in-process against a temporary SQLite file and fakeredis,
+# like bench/suite.py does. The settings are read on import, so they are set here before anything from api/ is imported.
+#   python -m pytest -q                 all tests
+#   python -m pytest -q -k flask        only the Flask app (every route test runs once per app)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_DIR = tempfile.mkdtemp(prefix='studyo-tests-')
+
+os.environ["SQLALCHEMY_DATABASE_URI"] = 'sqlite:///' + os.path.join(TEST_DIR, 'test.db')
+os.environ["JWT_SECRET_KEY"] = "test-secret-key-that-is-long-enough-for-hs256"
+os.environ["MEDIA_ROOT"] = os.path.join(TEST_DIR, 'media')
+os.environ["BCRYPT_ROUNDS"] = "4"
+os.environ["HASH_WORKERS"] = "0"  # hash in the request thread, no process pool to start for every test run
+os.environ["CERT_WORKERS"] = "0"
+os.environ["PROGRESS_FLUSH_IN_PROCESS"] = "false"  # the tests flush when they need to
+os.environ["RATE_LIMIT_ENABLED"] = "false"  # tests/test_ratelimit.py uses its own limiter
+os.environ["ADMIN_INVITE_CODE"] = "test-invite"
+
+sys.path.insert(0, ROOT)
+
+import fakeredis  # noqa: E402
+import redis  # noqa: E402
+import redis.asyncio  # noqa: E402
+
+# One fake Redis server for every client both apps create (sync and asyncio), like one redis-server
+redis_server = fakeredis.FakeServer()
+
+
+class FakeRedis(fakeredis.FakeStrictRedis):
+    def __init__(self, *args, **kwargs):
+        for key in ('host', 'port', 'db'):
+            kwargs.pop(key, None)
+        super().__init__(*args, server=redis_server, **kwargs)
+
+
+class FakeAsyncRedis(fakeredis.FakeAsyncRedis):
+    def __init__(self, *args, **kwargs):
+        for key in ('host', 'port', 'db'):
+            kwargs.pop(key, None)
+        super().__init__(*args, server=redis_server, **kwargs)
+
+
+redis.StrictRedis = redis.Redis = FakeRedis
+redis.asyncio.Redis = FakeAsyncRedis
+
+
+def offline_redis(client_class=fakeredis.FakeStrictRedis):
+    # A client whose every command fails with ConnectionError, like a Redis that is down
+    server = fakeredis.FakeServer()
+    server.connected = False
+    return client_class(server=server, decode_responses=True)
+
+from api import api as flask_api  # noqa: E402
+from api import asgi as quart_api  # noqa: E402
+from api.db import get_engine  # noqa: E402
+from api.models import Base, Role, RoleType  # noqa: E402
+from api.search import search_index, SearchIndex  # noqa: E402
+
+ADMIN_INVITE_CODE = os.environ["ADMIN_INVITE_CODE"]
+PASSWORD = "test-password"
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(TEST_DIR, ignore_errors=True)
+
+
+@pytest.fixture(scope='session')
+def database():
+    # The app does not create tables (create_db.py does), the test database is new so create them here
+    engine = get_engine()
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(Role.__table__.insert(), [{"role_name": role_type} for role_type in RoleType])
+    return engine
+
+
+@pytest.fixture(autouse=True)
+def clean_state(database):
+    # Every test starts with only the roles rows, an empty Redis and empty in-process caches
+    yield
+    with database.begin() as connection:
+        for table in reversed(Base.metadata.sorted_tables):
+            if table.name != Role.__tablename__:
+                connection.execute(table.delete())
+    FakeRedis().flushall()
+    for module in (flask_api, quart_api):
+        module.progress_access._entries.clear()
+    SearchIndex.__init__(search_index, search_index.redis)
+
+
+class Reply:
+    # Response of either app with the same attributes: status_code, headers, data and json
+    def __init__(self, status_code, headers, data):
+        self.status_code = status_code
+        self.headers = headers
+        self.data = data
+
+    @property
+    def json(self):
+        return json.loads(self.data) if self.data else None
+
+
+class AppClient:
+    # Test client of one app with helpers for the usual register / login steps
+    def __init__(self, name):
+        self.name = name
+
+    def open(self, method, path, json=None, headers=None, query_string=None):
+        raise NotImplementedError
+
+    def get(self, path, **kwargs):
+        return self.open('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.open('POST', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.open('PUT', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.open('DELETE', path, **kwargs)
+
+    def register(self, user_name, role='student', **fields):
+        data = {"user_name": user_name, "email": user_name, "password": PASSWORD, "role": role,
+                "first_name": "Test", "last_name": user_name}
+        if role == 'admin':
+            data["invite_code"] = ADMIN_INVITE_CODE
+        data.update(fields)
+        reply = self.post('/auth/register', json=data)
+        assert reply.status_code == 201, reply.json
+        return reply
+
+    def login(self, user_name, device=None):
+        # Headers for the next requests of this user, device is the User-Agent (one token per device)
+        headers = {"User-Agent": device or user_name}
+        reply = self.post('/auth/login', json={"user_name": user_name, "password": PASSWORD}, headers=headers)
+        assert reply.status_code == 200, reply.json
+        return {**headers, "Authorization": "Bearer " + reply.json['access_token']}
+
+    def user(self, user_name, role='student'):
+        self.register(user_name, role)
+        return self.login(user_name)
+
+    def course(self, headers, title, description="About testing", modules=()):
+        reply = self.post('/courses', json={"title": title, "description": description}, headers=headers)
+        assert reply.status_code == 201, reply.json
+        course_id = reply.json['course_id']
+        module_ids = []
+        for module_title in modules:
+            reply = self.post(f'/courses/{course_id}/modules', json={"title": module_title, "content": module_title + " content"},
+                              headers=headers)
+            assert reply.status_code == 201, reply.json
+            module_ids.append(reply.json['module_id'])
+        return course_id, module_ids
+
+
+class FlaskClient(AppClient):
+    def __init__(self, app):
+        super().__init__('flask')
+        self.app = app
+        self.client = app.test_client()
+
+    def open(self, method, path, json=None, headers=None, query_string=None):
+        response = self.client.open(path, method=method, json=json, headers=headers, query_string=query_string)
+        return Reply(response.status_code, response.headers, response.get_data())
+
+
+class QuartClient(AppClient):
+    # Quart's test client is async, every call runs on the one event loop of the test session (the async engine and
+    # Redis connections belong to it)
+    def __init__(self, app, loop):
+        super().__init__('asgi')
+        self.app = app
+        self.loop = loop
+        self.client = app.test_client()
+
+    def run(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def open(self, method, path, json=None, headers=None, query_string=None):
+        async def call():
+            kwargs = {"json": json} if json is not None else {}
+            response = await self.client.open(path, method=method, headers=headers, query_string=query_string, **kwargs)
+            return Reply(response.status_code, response.headers, await response.get_data())
+        return self.run(call())
+
+
+@pytest.fixture(scope='session')
+def flask_app(database):
+    return flask_api.create_app({"TESTING": True})
+
+
+@pytest.fixture(scope='session')
+def event_loop_runner(database):
+    loop = asyncio.new_event_loop()
+    test_app = quart_api.app.test_app()
+    loop.run_until_complete(test_app.__aenter__())
+    yield loop
+    loop.run_until_complete(test_app.__aexit__(None, None, None))
+    loop.close()
+
+
+@pytest.fixture
+def flask_client(flask_app):
+    return FlaskClient(flask_app)
+
+
+@pytest.fixture
+def quart_client(event_loop_runner):
+    return QuartClient(quart_api.app, event_loop_runner)
+
+
+@pytest.fixture(params=['flask', 'asgi'])
+def client(request):
+    # Route tests run once against each app, they must answer the same
+    return request.getfixturevalue({'flask': 'flask_client', 'asgi': 'quart_client'}[request.param])
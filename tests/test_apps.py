@@ -0,0 +1,70 @@
+import time
+
+import pytest
+
+
+@pytest.fixture
+def both(flask_client, quart_client):
+    return flask_client, quart_client
+
+
+def test_token_of_one_app_works_in_the_other(both):
+    flask_client, quart_client = both
+    flask_headers = flask_client.user('from-flask')
+    quart_client.register('from-asgi')
+    quart_headers = quart_client.login('from-asgi')
+    assert quart_client.get('/auth/profile', headers=flask_headers).json['user_profile']['user_name'] == 'from-flask'
+    assert flask_client.get('/auth/profile', headers=quart_headers).json['user_profile']['user_name'] == 'from-asgi'
+
+
+@pytest.mark.parametrize('logout_in', ['flask', 'asgi'])
+def test_logout_in_one_app_revokes_in_the_other(both, logout_in):
+    flask_client, quart_client = both
+    headers = flask_client.user('leaving')
+    logout_client, other_client = (flask_client, quart_client) if logout_in == 'flask' else (quart_client, flask_client)
+    assert logout_client.post('/auth/logout', headers=headers).status_code == 200
+    # The other app's revocation filter hears about it over pub/sub, give the message a moment to arrive
+    deadline = time.monotonic() + 5
+    reply = other_client.get('/auth/profile', headers=headers)
+    while reply.status_code != 401 and time.monotonic() < deadline:
+        time.sleep(0.05)
+        reply = other_client.get('/auth/profile', headers=headers)
+    assert reply.status_code == 401
+    assert reply.json['message'] == "Your token has been revoked. Please login again."
+
+
+def test_both_apps_answer_the_same(both):
+    # The route bodies are shared (services.py), so the same requests get the same status and body from both apps
+    flask_client, quart_client = both
+    teacher = flask_client.user('teacher', 'instructor')
+    student = flask_client.user('student')
+    admin = flask_client.user('admin', 'admin')
+    course_id, (module_id,) = flask_client.course(teacher, 'Same', modules=['Only'])
+    flask_client.post(f'/courses/{course_id}/enroll', headers=student)
+    student_id = flask_client.get('/auth/profile', headers=student).json['user_profile']['user_id']
+    requests = [
+        ('GET', '/auth/role', student, None),
+        ('GET', '/users', admin, None),
+        ('GET', '/users', student, None),
+        ('GET', f'/users/{student_id}', student, None),
+        ('GET', '/users/999999', student, None),
+        ('GET', '/courses', None, None),
+        ('GET', f'/courses/{course_id}', student, None),
+        ('GET', '/courses/999999', student, None),
+        ('GET', f'/courses/{course_id}/modules', student, None),
+        ('GET', f'/courses/{course_id}/modules/{module_id}', student, None),
+        ('GET', f'/courses/{course_id}/stats', teacher, None),
+        ('GET', f'/courses/{course_id}/stats', student, None),
+        ('GET', f'/courses/{course_id}/progress', student, None),
+        ('POST', '/courses', student, {"title": "Not allowed"}),
+        ('POST', '/courses', teacher, {"title": "Same"}),
+        ('POST', f'/courses/{course_id}/enroll', student, None),
+        ('PUT', f'/courses/{course_id}', student, {"title": "Taken over"}),
+        ('PUT', f'/users/{student_id}/role', student, {"role": "admin"}),
+        ('POST', '/auth/register', None, {"user_name": "x", "email": "x", "role": "student"}),
+        ('POST', '/auth/register', None, {"user_name": "x", "unknown": 1}),
+    ]
+    for method, path, headers, body in requests:
+        flask_reply = flask_client.open(method, path, json=body, headers=headers)
+        quart_reply = quart_client.open(method, path, json=body, headers=headers)
+        assert (flask_reply.status_code, flask_reply.json) == (quart_reply.status_code, quart_reply.json), (method, path)
@@ -0,0 +1,61 @@
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+
+from tests.conftest import ROOT
+
+SUITE = os.path.join(ROOT, 'bench', 'suite.py')
+
+
+def load_suite():
+    spec = importlib.util.spec_from_file_location('bench_suite', SUITE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_suite(tmp_path, *args):
+    # A small run in its own process (the suite sets up its own SQLite file and fakeredis)
+    return subprocess.run([sys.executable, SUITE, '--requests', '3', '--warmup', '1', '--users', '20', '--courses', '5',
+                           '--modules', '3', '--concurrency', '2', *args],
+                          cwd=ROOT, capture_output=True, text=True, timeout=300)
+
+
+def test_suite_covers_the_collection_without_errors(tmp_path):
+    output = tmp_path / 'results.json'
+    process = run_suite(tmp_path, '--output', str(output))
+    assert process.returncode == 0, process.stderr
+    assert 'without a scenario' not in process.stdout
+    results = json.loads(output.read_text())
+    assert len(results['routes']) >= 20
+    for name, result in results['routes'].items():
+        assert result['errors'] == 0, (name, result)
+        assert result['sql_per_request'] >= 0
+    # Against itself as the baseline nothing regressed
+    process = run_suite(tmp_path, '--baseline', str(output), '--threshold', '100')
+    assert process.returncode == 0, process.stdout
+    assert '0 regressions' in process.stdout
+
+
+def test_compare_reports_regressions():
+    suite = load_suite()
+    before = {"p95_ms": 10.0, "throughput_rps": 100.0, "sql_per_request": 2.0, "errors": 0}
+    baseline = {"routes": {"GET /courses": before, "GET /users": before}}
+    results = {"routes": {
+        "GET /courses": {**before, "p95_ms": 11.0, "throughput_rps": 90.0},  # within 25%
+        "GET /users": {**before, "p95_ms": 20.0, "sql_per_request": 3.0},
+        "GET /new": {**before, "errors": 5},  # not in the baseline
+    }}
+    regressions = dict(suite.compare(results, baseline, 0.25))
+    assert list(regressions) == ["GET /users"]
+    assert len(regressions["GET /users"]) == 2
+
+
+def test_route_templates_and_percentiles():
+    suite = load_suite()
+    assert suite.template('/courses/10/modules?limit=2') == '/courses/<id>/modules'
+    assert suite.percentile([], 95) == 0.0
+    assert suite.percentile(list(range(1, 101)), 50) == 51
+    assert suite.percentile([5.0], 99) == 5.0
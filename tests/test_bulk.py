@@ -0,0 +1,151 @@
+import pytest
+
+from api.bulk import validate_register_row, plan_bulk_register, bulk_register, BULK_HANDLERS, BULK_REGISTER_MAX_ROWS
+from api.db import Session
+from api.jobs import Worker, job_key
+from tests.conftest import FakeRedis
+
+
+def new_user(name, **fields):
+    return {"user_name": name, "email": name + "@example.com", "password": "pw", "role": "student",
+            "first_name": "Bulk", "last_name": name, **fields}
+
+
+def run_import(client, headers, rows):
+    # Queues the import, runs it like a job worker would and returns the finished job
+    reply = client.post('/auth/register/bulk', headers=headers, json={"users": rows})
+    assert reply.status_code == 202, reply.json
+    Worker(FakeRedis(decode_responses=True), BULK_HANDLERS, queues=['default']).run(drain=True)
+    job = client.get(f"/jobs/{reply.json['job_id']}", headers=headers)
+    assert job.status_code == 200, job.json
+    assert job.json['status'] == 'done', job.json
+    return reply.json['job_id'], job.json['result']
+
+
+def profile_id(client, headers):
+    return client.get('/auth/profile', headers=headers).json['user_profile']['user_id']
+
+
+def test_bulk_enroll_reports_every_row(client):
+    teacher = client.user('teacher', 'instructor')
+    course_id, _ = client.course(teacher, 'Cohort')
+    students = [profile_id(client, client.user(f'student-{number}')) for number in range(3)]
+    teacher_id = profile_id(client, teacher)
+    assert client.post(f'/courses/{course_id}/enroll', headers=client.login('student-0')).status_code == 201
+
+    reply = client.post(f'/courses/{course_id}/enroll/bulk', headers=teacher,
+                        json={"user_ids": students + [students[1], teacher_id, 999999]})
+    assert reply.status_code == 200
+    assert [row['status'] for row in reply.json['results']] == [
+        'already_enrolled', 'enrolled', 'enrolled', 'duplicate_in_request', 'not_student', 'not_found']
+    assert client.get(f'/courses/{course_id}/stats', headers=teacher).json['enrollments'] == 3
+
+
+@pytest.mark.parametrize('user_ids', [[], "1,2", [1, "2"], [True]])
+def test_bulk_enroll_rejects_bad_ids(client, user_ids):
+    teacher = client.user('teacher', 'instructor')
+    course_id, _ = client.course(teacher, 'Cohort')
+    assert client.post(f'/courses/{course_id}/enroll/bulk', headers=teacher, json={"user_ids": user_ids}).status_code == 400
+
+
+def test_bulk_enroll_needs_the_course_instructor(client):
+    teacher = client.user('teacher', 'instructor')
+    course_id, _ = client.course(teacher, 'Cohort')
+    other = client.user('other', 'instructor')
+    student = client.user('student')
+    for headers, status in ((other, 403), (student, 403)):
+        assert client.post(f'/courses/{course_id}/enroll/bulk', headers=headers, json={"user_ids": [1]}).status_code == status
+
+
+def test_bulk_register_reports_every_row(client):
+    admin = client.user('admin', 'admin')
+    client.register('taken')
+    rows = [new_user('first'), new_user('taken', email='taken'), new_user('first'), {"user_name": "missing"}, new_user('second')]
+    _, result = run_import(client, admin, rows)
+    assert [row['status'] for row in result['results']] == ['created', 'already_exists', 'duplicate_in_request', 'invalid', 'created']
+    # The created users can log in with their own password
+    login = client.post('/auth/login', json={"user_name": "second", "password": "pw"})
+    assert login.status_code == 200
+
+
+def test_bulk_register_does_not_create_users_in_the_request(client):
+    admin = client.user('admin', 'admin')
+    reply = client.post('/auth/register/bulk', headers=admin, json={"users": [new_user('later'), {"user_name": "bad"}]})
+    assert reply.status_code == 202, reply.json
+    assert reply.json['invalid'] == 1
+    assert client.post('/auth/login', json={"user_name": "later", "password": "pw"}).status_code == 401
+
+
+def test_queued_import_has_no_passwords(client):
+    admin = client.user('admin', 'admin')
+    reply = client.post('/auth/register/bulk', headers=admin, json={"users": [new_user('secret', password="hunter22")]})
+    job = FakeRedis(decode_responses=True).hgetall(job_key(reply.json['job_id']))
+    assert job['status'] == 'queued'
+    assert 'hunter22' not in job['payload'] and '"password"' not in job['payload']
+    assert FakeRedis().ttl(job_key(reply.json['job_id'])) > 0
+    # Once done the payload (with the password hashes) is gone too
+    Worker(FakeRedis(decode_responses=True), BULK_HANDLERS, queues=['default']).run(drain=True)
+    assert FakeRedis(decode_responses=True).hget(job_key(reply.json['job_id']), 'payload') is None
+    assert client.post('/auth/login', json={"user_name": "secret", "password": "hunter22"}).status_code == 200
+
+
+def test_user_registered_before_the_job_ran(client):
+    admin = client.user('admin', 'admin')
+    reply = client.post('/auth/register/bulk', headers=admin, json={"users": [new_user('racer'), new_user('other')]})
+    client.register('racer')
+    Worker(FakeRedis(decode_responses=True), BULK_HANDLERS, queues=['default']).run(drain=True)
+    result = client.get(f"/jobs/{reply.json['job_id']}", headers=admin).json['result']
+    assert [row['status'] for row in result['results']] == ['already_exists', 'created']
+
+
+def test_user_names_and_emails_are_checked_apart(client):
+    admin = client.user('admin', 'admin')
+    client.register('alice', email='alice-mail')
+    # A user_name that is someone's email (and the other way round) is still free
+    _, result = run_import(client, admin, [new_user('alice-mail'), new_user('other', email='alice')])
+    assert [row['status'] for row in result['results']] == ['created', 'created']
+
+
+def test_user_name_taken_during_the_insert(flask_client):
+    rows = [new_user('racer'), new_user('calm')]
+    with Session() as session:
+        results, new_rows = plan_bulk_register(session, rows)
+    # Registered with another email between the check and the insert: only that row is skipped
+    flask_client.register('racer', email='racer-elsewhere')
+    with Session() as session:
+        bulk_register(session, rows, results, new_rows, ['not-a-hash'] * len(new_rows))
+        session.commit()
+    assert results == ['already_exists', 'created']
+
+
+def test_bulk_register_row_cap(client):
+    admin = client.user('admin', 'admin')
+    rows = [new_user(f'user-{number}') for number in range(BULK_REGISTER_MAX_ROWS + 1)]
+    assert client.post('/auth/register/bulk', headers=admin, json={"users": rows}).status_code == 400
+
+
+def test_bulk_register_marks_rows_with_wrong_types_invalid(client):
+    admin = client.user('admin', 'admin')
+    rows = [new_user('good'), new_user('number', user_name=5), new_user('list', email=['a']), new_user('role', role=1),
+            new_user('password', password={"x": 1}), new_user('bio', bio=3)]
+    _, result = run_import(client, admin, rows)
+    results = result['results']
+    assert results[0]['status'] == 'created'
+    assert [row['status'] for row in results[1:]] == ['invalid'] * 5
+    assert results[1]['message'] == "user_name must be a string!"
+
+
+def test_bulk_register_is_admin_only(client):
+    headers = client.user('teacher', 'instructor')
+    assert client.post('/auth/register/bulk', headers=headers, json={"users": [new_user('a')]}).status_code == 403
+
+
+@pytest.mark.parametrize('row, error', [
+    ("not a row", "Row must be an object"),
+    ({**new_user('a'), "extra": "x"}, "Unexpected field: extra"),
+    ({**new_user('a'), "role": "teacher"}, "Invalid role provided. Choose from 'admin', 'instructor', or 'student'."),
+    ({**new_user('a'), "first_name": 7}, "first_name must be a string!"),
+    (new_user('a'), None),
+])
+def test_validate_register_row(row, error):
+    assert validate_register_row(row) == error
@@ -0,0 +1,97 @@
+import threading
+import time
+
+import fakeredis
+import pytest
+
+from api.cache import CourseCache
+from tests.conftest import FakeRedis, offline_redis
+
+
+@pytest.fixture
+def course(client):
+    teacher = client.user('teacher', 'instructor')
+    student = client.user('student')
+    course_id, module_ids = client.course(teacher, 'Cached', modules=['First', 'Second'])
+    return teacher, student, course_id, module_ids
+
+
+def app_cache(client):
+    from api import api as flask_api, asgi as quart_api
+    return (flask_api if client.name == 'flask' else quart_api).course_cache
+
+
+def test_course_reads_are_served_from_the_cache(client, course):
+    teacher, student, course_id, module_ids = course
+    cache = app_cache(client)
+    paths = ['/courses', f'/courses/{course_id}', f'/courses/{course_id}/modules', f'/courses/{course_id}/modules/{module_ids[0]}']
+    before = cache.stats()
+    first = [client.get(path, headers=student).json for path in paths]
+    second = [client.get(path, headers=student).json for path in paths]
+    after = cache.stats()
+    assert first == second
+    assert after['misses'] - before['misses'] == 4
+    assert after['hits'] - before['hits'] == 4
+
+
+@pytest.mark.parametrize('write', ['update_course', 'add_module', 'update_module', 'delete_module'])
+def test_course_writes_invalidate_the_cached_content(client, course, write):
+    teacher, student, course_id, module_ids = course
+    assert len(client.get(f'/courses/{course_id}', headers=student).json['modules']) == 2
+    client.get(f'/courses/{course_id}/modules', headers=student)
+    if write == 'update_course':
+        assert client.put(f'/courses/{course_id}', json={"title": "Renamed"}, headers=teacher).status_code == 200
+        assert client.get(f'/courses/{course_id}', headers=student).json['title'] == 'Renamed'
+        assert client.get('/courses').json['courses'][0]['title'] == 'Renamed'
+    elif write == 'add_module':
+        client.post(f'/courses/{course_id}/modules', json={"title": "Third"}, headers=teacher)
+        assert [m['title'] for m in client.get(f'/courses/{course_id}/modules', headers=student).json['modules']] == ['First', 'Second', 'Third']
+    elif write == 'update_module':
+        client.put(f'/courses/{course_id}/modules/{module_ids[0]}', json={"title": "Changed"}, headers=teacher)
+        assert client.get(f'/courses/{course_id}/modules/{module_ids[0]}', headers=student).json['title'] == 'Changed'
+        assert client.get(f'/courses/{course_id}', headers=student).json['modules'][0]['title'] == 'Changed'
+    else:
+        client.delete(f'/courses/{course_id}/modules/{module_ids[1]}', headers=teacher)
+        assert len(client.get(f'/courses/{course_id}', headers=student).json['modules']) == 1
+
+
+def test_deleted_course_is_not_served_from_the_cache(client, course):
+    teacher, student, course_id, _ = course
+    assert client.get(f'/courses/{course_id}', headers=student).status_code == 200
+    assert client.get('/courses').json['courses']
+    assert client.delete(f'/courses/{course_id}', headers=teacher).status_code == 200
+    assert client.get(f'/courses/{course_id}', headers=student).status_code == 404
+    assert client.get('/courses').json['courses'] == []
+
+
+def test_not_found_is_not_cached(client, course):
+    teacher, student, course_id, _ = course
+    assert client.get(f'/courses/{course_id + 100}', headers=student).status_code == 404
+    assert not [key for key in FakeRedis(decode_responses=True).keys('cache:course:*') if ':detail' in key]
+
+
+def test_single_flight_loads_once_for_concurrent_misses():
+    cache = CourseCache(fakeredis.FakeStrictRedis(decode_responses=True), lock_wait=0.01)
+    loads = []
+
+    def loader():
+        loads.append(1)
+        time.sleep(0.2)
+        return {"title": "Slow"}, 200
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load(lambda: cache.course_key(1, 'detail'), loader)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(loads) == 1
+    assert results == [({"title": "Slow"}, 200)] * 8
+    assert cache.stats()['lock_waits'] == 7
+
+
+def test_redis_down_serves_from_the_database():
+    cache = CourseCache(offline_redis())
+    assert cache.get_or_load(lambda: cache.catalog_key('list'), lambda: ({"courses": []}, 200)) == ({"courses": []}, 200)
+    assert cache.stats()['errors'] == 1
@@ -0,0 +1,147 @@
+import asyncio
+import os
+import shutil
+import signal
+import time
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from api import certificates
+from api.certificates import (certificate_key, render_certificate, render_certificates, render_certificates_async,
+                              CertificatesBusy, CERTIFICATE_HANDLERS)
+from api.db import Session
+from api.jobs import Worker
+from api.media import MEDIA_ROOT
+from api.progress import ProgressFlusher
+from tests.conftest import FakeRedis
+
+FIELDS = {"key": certificate_key(1, 2), "student": "Ann Lee", "course": "Café (basics)", "instructor": "Bob",
+          "issued_on": "2026-01-31"}
+
+
+def test_render_is_deterministic():
+    pdf = render_certificate(FIELDS)
+    assert pdf.startswith(b"%PDF-1.4") and pdf.endswith(b"%%EOF\n")
+    assert render_certificate(dict(FIELDS)) == pdf
+    assert render_certificate({**FIELDS, "student": "Someone Else"}) != pdf
+
+
+def test_key_depends_on_the_template_version():
+    assert certificate_key(1, 2) == certificate_key(1, 2, certificates.CERTIFICATE_TEMPLATE_VERSION)
+    assert certificate_key(1, 2, 99) != certificate_key(1, 2)
+    assert certificate_key(1, 2) != certificate_key(2, 1)
+
+
+@pytest.fixture
+def completed(client):
+    # Ids start over after every test, so do the stored files
+    shutil.rmtree(os.path.join(MEDIA_ROOT, 'certificates'), ignore_errors=True)
+    teacher = client.user('teacher', 'instructor')
+    course_id, module_ids = client.course(teacher, 'Finished', modules=['One', 'Two'])
+    students = [client.user(name) for name in ('ann', 'bob')]
+    for headers in students:
+        assert client.post(f'/courses/{course_id}/enroll', headers=headers).status_code == 201
+    # ann completes both modules, bob only the first one
+    for headers, modules in ((students[0], module_ids), (students[1], module_ids[:1])):
+        for module_id in modules:
+            reply = client.post(f'/courses/{course_id}/modules/{module_id}/progress', headers=headers,
+                                json={"position": 100, "completed": True})
+            assert reply.status_code == 202
+    ProgressFlusher(FakeRedis(decode_responses=True), Session).flush_once(wait=False)
+    return teacher, course_id, students
+
+
+def test_student_certificate_is_issued_once(client, completed):
+    teacher, course_id, (ann, bob) = completed
+    reply = client.post(f'/courses/{course_id}/certificate', headers=ann)
+    assert reply.status_code == 201, reply.json
+    assert reply.json['cached'] is False
+    first_key = reply.json['certificate_key']
+    pdf = client.get(reply.json['url'])
+    assert pdf.status_code == 200
+    assert pdf.data.startswith(b"%PDF")
+    # Asking again is a cache hit on the stored file
+    again = client.post(f'/courses/{course_id}/certificate', headers=ann)
+    assert again.status_code == 200
+    assert (again.json['cached'], again.json['certificate_key'], again.json['issued_on']) == (
+        True, first_key, reply.json['issued_on'])
+
+
+def test_certificate_checks(client, completed):
+    teacher, course_id, (ann, bob) = completed
+    assert client.post(f'/courses/{course_id}/certificate', headers=bob).status_code == 403
+    assert client.post(f'/courses/{course_id}/certificate', headers=teacher).status_code == 403
+    assert client.post('/courses/999999/certificate', headers=ann).status_code == 404
+    assert client.post(f'/courses/{course_id}/certificates/batch', headers=ann).status_code == 403
+    other = client.user('other', 'instructor')
+    assert client.post(f'/courses/{course_id}/certificates/batch', headers=other).status_code == 403
+
+
+def test_batch_job(client, completed):
+    teacher, course_id, (ann, _) = completed
+    reply = client.post(f'/courses/{course_id}/certificates/batch', headers=teacher)
+    assert reply.status_code == 202, reply.json
+    Worker(FakeRedis(decode_responses=True), CERTIFICATE_HANDLERS, queues=['default']).run(drain=True)
+    job = client.get(f"/jobs/{reply.json['job_id']}", headers=teacher).json
+    assert job['status'] == 'done', job
+    assert (job['result']['completed'], job['result']['issued'], job['result']['rendered']) == (1, 1, 1)
+    # The student's certificate was issued by the batch
+    assert client.post(f'/courses/{course_id}/certificate', headers=ann).json['cached'] is True
+
+
+class FakePool:
+    # Stands in for the ProcessPoolExecutor, renders in this process or acts like a pool whose worker died
+    def __init__(self, max_workers=None, mp_context=None, broken=False):
+        self.broken = broken
+        self.shut_down = False
+
+    def submit(self, function, *args):
+        if self.broken:
+            raise BrokenProcessPool("A process in the process pool was terminated abruptly")
+        future = Future()
+        future.set_result(function(*args))
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shut_down = True
+
+
+def kill_workers(executor):
+    for process in list(executor._processes.values()):
+        os.kill(process.pid, signal.SIGKILL)
+        process.join()
+
+
+def test_broken_pool_is_replaced(monkeypatch):
+    broken = FakePool(broken=True)
+    monkeypatch.setattr(certificates, '_executor', broken)
+    monkeypatch.setattr(certificates, 'ProcessPoolExecutor', FakePool)
+    assert render_certificates([FIELDS], workers=2) == [render_certificate(FIELDS)]
+    assert broken.shut_down
+    assert isinstance(certificates._executor, FakePool) and certificates._executor is not broken
+
+
+def test_pool_that_keeps_breaking_is_busy(monkeypatch):
+    monkeypatch.setattr(certificates, '_executor', None)
+    monkeypatch.setattr(certificates, 'ProcessPoolExecutor', lambda **kwargs: FakePool(broken=True))
+    with pytest.raises(CertificatesBusy):
+        render_certificates([FIELDS], workers=2)
+
+
+def test_dead_certificate_worker_gets_a_new_pool(monkeypatch):
+    monkeypatch.setattr(certificates, 'CERT_WORKERS', 1)
+    try:
+        assert render_certificates([FIELDS]) == [render_certificate(FIELDS)]
+        broken = certificates._executor
+        kill_workers(broken)
+        time.sleep(0.1)
+        assert render_certificates([FIELDS]) == [render_certificate(FIELDS)]
+        assert certificates._executor is not broken
+        kill_workers(certificates._executor)
+        assert asyncio.run(render_certificates_async([FIELDS])) == [render_certificate(FIELDS)]
+    finally:
+        if certificates._executor is not None:
+            certificates._executor.shutdown(wait=False, cancel_futures=True)
+            certificates._executor = None
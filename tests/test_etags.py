@@ -0,0 +1,82 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+from werkzeug.http import http_date
+
+from api import etags
+from tests.conftest import FakeRedis
+
+
+@pytest.fixture
+def course(client):
+    teacher = client.user('teacher', 'instructor')
+    student = client.user('student')
+    course_id, module_ids = client.course(teacher, 'Validated', modules=['First'])
+    return teacher, student, course_id, module_ids[0]
+
+
+def settle(kind, id):
+    # Move the last write of an entity to an earlier second, like a read a few seconds after the write
+    FakeRedis().hset(f'etag:{kind}:{id}', 'm', int((time.time() - 5) * 1000000))
+
+
+def test_unchanged_reads_get_304(client, course):
+    teacher, student, course_id, module_id = course
+    for path in (f'/courses/{course_id}', f'/courses/{course_id}/modules', f'/courses/{course_id}/modules/{module_id}',
+                 '/auth/profile'):
+        first = client.get(path, headers=student)
+        assert first.status_code == 200
+        etag = first.headers['ETag']
+        assert etag.startswith('W/"')
+        assert first.headers['Cache-Control'] == 'private, no-cache'
+        again = client.get(path, headers={**student, "If-None-Match": etag})
+        assert again.status_code == 304
+        assert again.data == b''
+        assert again.headers['ETag'] == etag
+
+
+def test_writes_change_the_etag(client, course):
+    teacher, student, course_id, module_id = course
+    etag = client.get(f'/courses/{course_id}', headers=student).headers['ETag']
+    client.put(f'/courses/{course_id}/modules/{module_id}', json={"title": "Changed"}, headers=teacher)
+    reply = client.get(f'/courses/{course_id}', headers={**student, "If-None-Match": etag})
+    assert reply.status_code == 200
+    assert reply.json['modules'][0]['title'] == 'Changed'
+    assert reply.headers['ETag'] != etag
+
+
+def test_no_last_modified_in_the_second_of_a_write(client, course, monkeypatch):
+    teacher, student, course_id, _ = course
+    # The write and the reads happen in the same second (a slow run could cross into the next one)
+    now = time.time()
+    monkeypatch.setattr(etags, 'time', SimpleNamespace(time=lambda: now))
+    client.put(f'/courses/{course_id}', json={"title": "Changed"}, headers=teacher)
+    reply = client.get(f'/courses/{course_id}', headers=student)
+    assert 'Last-Modified' not in reply.headers
+    # A date from the client's clock in the same second is not enough for a 304, another write may still follow
+    reply = client.get(f'/courses/{course_id}', headers={**student, "If-Modified-Since": http_date(time.time() + 1)})
+    assert reply.status_code == 200
+
+
+def test_if_modified_since_once_the_write_is_settled(client, course):
+    teacher, student, course_id, _ = course
+    client.get(f'/courses/{course_id}', headers=student)
+    settle('course', course_id)
+    reply = client.get(f'/courses/{course_id}', headers=student)
+    last_modified = reply.headers['Last-Modified']
+    assert client.get(f'/courses/{course_id}', headers={**student, "If-Modified-Since": last_modified}).status_code == 304
+    client.put(f'/courses/{course_id}', json={"title": "Changed"}, headers=teacher)
+    reply = client.get(f'/courses/{course_id}', headers={**student, "If-Modified-Since": last_modified})
+    assert reply.status_code == 200
+    assert reply.json['title'] == 'Changed'
+
+
+def test_profile_update_changes_the_user_etags(client):
+    headers = client.user('student')
+    user_id = client.get('/auth/profile', headers=headers).json['user_profile']['user_id']
+    profile_etag = client.get('/auth/profile', headers=headers).headers['ETag']
+    user_etag = client.get(f'/users/{user_id}', headers=headers).headers['ETag']
+    assert client.put(f'/users/{user_id}', json={"bio": "New bio"}, headers=headers).status_code == 200
+    assert client.get('/auth/profile', headers={**headers, "If-None-Match": profile_etag}).json['user_profile']['bio'] == 'New bio'
+    assert client.get(f'/users/{user_id}', headers={**headers, "If-None-Match": user_etag}).status_code == 200
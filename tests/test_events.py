@@ -0,0 +1,122 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from api import asgi as quart_api
+from api.events import EventHub, Subscriber, sign_stream_token, read_stream_token
+from api.media import MediaSigner
+from tests.conftest import FakeAsyncRedis
+
+signer = MediaSigner("stream-test-key")
+IDENTITY = {"user_name": "student", "role": "student"}
+
+
+def frames(body):
+    # SSE bytes -> list of events (the JSON in data), keepalive comments are skipped
+    events = []
+    for block in body.decode().split('\n\n'):
+        for line in block.split('\n'):
+            if line.startswith('data: '):
+                events.append(json.loads(line[len('data: '):]))
+    return events
+
+
+def test_stream_token_round_trip():
+    token, expires = sign_stream_token(signer, 7, IDENTITY, 'jti-1')
+    claims = read_stream_token(signer, token, 7)
+    assert claims == {"course_id": 7, "sub": IDENTITY, "jti": 'jti-1', "exp": expires}
+    # Not for another course, not with another key, not changed
+    assert read_stream_token(signer, token, 8) is None
+    assert read_stream_token(MediaSigner("other-key"), token, 7) is None
+    claims_part, signature = token.split('.')
+    assert read_stream_token(signer, claims_part + '.' + '0' * len(signature), 7) is None
+    for bad in ('', 'x', 'x.y', '!!!.sig'):
+        assert read_stream_token(signer, bad, 7) is None
+
+
+def test_stream_token_expires():
+    token, expires = sign_stream_token(signer, 7, IDENTITY, 'jti-1', now=time.time() - 3600)
+    assert expires < time.time()
+    assert read_stream_token(signer, token, 7) is None
+    # Never longer than the access token it came from
+    _, expires = sign_stream_token(signer, 7, IDENTITY, 'jti-1', not_after=time.time() + 5)
+    assert expires <= time.time() + 5
+
+
+def test_token_route_checks_the_course(client):
+    teacher = client.user('teacher', 'instructor')
+    course_id, _ = client.course(teacher, 'Live')
+    student = client.user('student')
+    assert client.post(f'/courses/{course_id}/events/token', headers=student).status_code == 403
+    assert client.post('/courses/999999/events/token', headers=teacher).status_code == 404
+    assert client.post(f'/courses/{course_id}/enroll', headers=student).status_code == 201
+    reply = client.post(f'/courses/{course_id}/events/token', headers=student)
+    assert reply.status_code == 200, reply.json
+    claims = read_stream_token(quart_api.stream_signer, reply.json['token'], course_id)
+    assert claims['sub']['user_name'] == 'student'
+    assert reply.json['url'].startswith(f'/courses/{course_id}/events?token=')
+
+
+def stream_status(quart_client, path, **kwargs):
+    async def call():
+        async with quart_client.client.request(path, **kwargs) as connection:
+            await connection.send_complete()
+            first = await asyncio.wait_for(connection.receive(), 5)
+            await connection.disconnect()
+        return connection.status_code, first
+    return quart_client.run(call())
+
+
+def test_stream_opens_with_a_token(flask_client, quart_client):
+    # Token from either app, the stream is served by asgi.py
+    teacher = flask_client.user('teacher', 'instructor')
+    course_id, _ = flask_client.course(teacher, 'Live')
+    token = flask_client.post(f'/courses/{course_id}/events/token', headers=teacher).json['token']
+    status, first = stream_status(quart_client, f'/courses/{course_id}/events', query_string={"token": token})
+    assert status == 200
+    assert frames(first)[0]['type'] == 'connected'
+
+
+def test_stream_rejects_bad_and_revoked_tokens(quart_client):
+    teacher = quart_client.user('teacher', 'instructor')
+    course_id, _ = quart_client.course(teacher, 'Live')
+    path = f'/courses/{course_id}/events'
+    token = quart_client.post(f'{path}/token', headers=teacher).json['token']
+    assert quart_client.get(path).status_code == 401
+    assert quart_client.get(path, query_string={"token": token + 'x'}).status_code == 401
+    other_id, _ = quart_client.course(teacher, 'Other')
+    assert quart_client.get(f'/courses/{other_id}/events', query_string={"token": token}).status_code == 401
+    # Logging out revokes the access token and the stream tokens made from it
+    assert quart_client.post('/auth/logout', headers=teacher).status_code == 200
+    assert quart_client.get(path, query_string={"token": token}).status_code == 401
+
+
+def read_stream(quart_client, **kwargs):
+    async def call():
+        hub = EventHub(FakeAsyncRedis(decode_responses=True), keepalive=0.05)
+        subscriber = Subscriber(1)
+        return [event async for frame in hub.stream(subscriber, **kwargs) for event in frames(frame)], hub.stats()
+    return quart_client.run(call())
+
+
+def test_stream_closes_when_the_token_expires(quart_client):
+    events, stats = read_stream(quart_client, expires=time.time() + 0.1)
+    assert [event['type'] for event in events] == ['connected', 'closed']
+    assert events[-1]['reason'] == 'expired'
+    assert stats['closed'] == 1
+
+
+@pytest.mark.parametrize('reason', ['revoked', 'forbidden'])
+def test_stream_closes_when_the_check_fails(quart_client, reason):
+    checks = []
+
+    async def check():
+        checks.append(1)
+        return reason if len(checks) > 1 else None
+
+    events, _ = read_stream(quart_client, check=check, check_every=0.05)
+    assert [event['type'] for event in events] == ['connected', 'closed']
+    assert events[-1]['reason'] == reason
+    assert len(checks) == 2
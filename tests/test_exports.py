@@ -0,0 +1,72 @@
+import csv
+import io
+import json
+
+import pytest
+
+from api.db import Session
+from api.exports import export_chunks, export_statement
+
+
+@pytest.fixture
+def school(client):
+    admin = client.user('admin', 'admin')
+    teacher = client.user('teacher', 'instructor')
+    first, _ = client.course(teacher, 'First')
+    second, _ = client.course(teacher, 'Second, with "quotes"')
+    for name, courses in (('ann', (first, second)), ('bob', (second,))):
+        headers = client.user(name)
+        for course_id in courses:
+            assert client.post(f'/courses/{course_id}/enroll', headers=headers).status_code == 201
+    return admin, first, second
+
+
+def ndjson(reply):
+    return [json.loads(line) for line in reply.data.decode().splitlines()]
+
+
+def test_ndjson_exports(client, school):
+    admin, first, second = school
+    reply = client.get('/admin/export/users', headers=admin)
+    assert reply.status_code == 200
+    assert reply.headers['Content-Type'].startswith('application/x-ndjson')
+    assert reply.headers['Content-Disposition'] == 'attachment; filename="users.ndjson"'
+    users = ndjson(reply)
+    assert [(user['user_name'], user['role']) for user in users] == [
+        ('admin', 'admin'), ('teacher', 'instructor'), ('ann', 'student'), ('bob', 'student')]
+    assert set(users[0]) == {'id', 'user_name', 'email', 'role', 'created_at'}
+
+    courses = ndjson(client.get('/admin/export/courses', headers=admin))
+    assert [course['title'] for course in courses] == ['First', 'Second, with "quotes"']
+
+    enrollments = ndjson(client.get('/admin/export/enrollments', headers=admin))
+    assert [(row['user_name'], row['course_id']) for row in enrollments] == [('ann', first), ('ann', second), ('bob', second)]
+    only_second = ndjson(client.get('/admin/export/enrollments', headers=admin, query_string={"course_id": second}))
+    assert [row['user_name'] for row in only_second] == ['ann', 'bob']
+
+
+def test_csv_export(client, school):
+    admin, _, _ = school
+    reply = client.get('/admin/export/courses', headers=admin, query_string={"format": "csv"})
+    assert reply.status_code == 200
+    assert reply.headers['Content-Type'].startswith('text/csv')
+    rows = list(csv.reader(io.StringIO(reply.data.decode())))
+    assert rows[0] == ['id', 'title', 'instructor_id', 'created_at', 'updated_at']
+    assert [row[1] for row in rows[1:]] == ['First', 'Second, with "quotes"']
+
+
+def test_export_checks(client, school):
+    admin, _, _ = school
+    assert client.get('/admin/export/users', headers=client.login('ann')).status_code == 403
+    assert client.get('/admin/export/grades', headers=admin).status_code == 404
+    assert client.get('/admin/export/users', headers=admin, query_string={"format": "xml"}).status_code == 400
+
+
+def test_rows_come_in_batches(client, school):
+    # One chunk per batch of rows (after the CSV header), not the whole table in one string
+    columns, statement = export_statement('enrollments')
+    with Session() as session:
+        chunks = list(export_chunks(session, 'csv', columns, statement, batch_size=2))
+    assert len(chunks) == 3
+    assert chunks[0].startswith('id,course_id')
+    assert [len(chunk.splitlines()) for chunk in chunks[1:]] == [2, 1]
@@ -0,0 +1,133 @@
+import fakeredis
+import pytest
+
+from api import api as flask_api
+from api import asgi as quart_api
+from api.jobs import JobQueue, AsyncJobQueue, Worker, job_key, delayed_key, retry_delay
+from tests.conftest import FakeRedis, offline_redis
+
+TEST_JOB = "test.job"
+
+
+class Flaky:
+    # Handler that fails the first `failures` times
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self, payload):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise RuntimeError(f"attempt {self.calls}")
+        return {"echo": payload["value"]}
+
+
+def make_due(redis_client, queue, job_id):
+    # The retry is due now instead of in a few seconds
+    redis_client.zadd(delayed_key(queue), {job_id: 0})
+
+
+def test_retry_delay_doubles_up_to_the_maximum():
+    for attempt, expected in ((1, 5), (2, 10), (3, 20)):
+        assert expected * 0.8 <= retry_delay(attempt, base=5, maximum=3600) <= expected * 1.2
+    assert retry_delay(30, base=5, maximum=60) <= 72
+
+
+def test_job_is_retried_then_done():
+    redis_client = FakeRedis(decode_responses=True)
+    job_id = JobQueue(redis_client).enqueue(TEST_JOB, {"value": 7}, owner='ann')
+    handler = Flaky(failures=1)
+    worker = Worker(redis_client, {TEST_JOB: handler}, queues=['default'])
+    assert worker.run_once(None) == 'retrying'
+    job = redis_client.hgetall(job_key(job_id))
+    assert (job['status'], job['attempts'], job['error']) == ('retrying', '1', 'RuntimeError: attempt 1')
+    assert job['run_at']
+    # Not due yet: nothing to run
+    assert worker.run_once(None) is None
+    make_due(redis_client, 'default', job_id)
+    assert worker.run_once(None) == 'done'
+    job = redis_client.hgetall(job_key(job_id))
+    assert (job['status'], job['attempts'], job['result']) == ('done', '2', '{"echo":7}')
+    assert 'payload' not in job
+    assert redis_client.ttl(job_key(job_id)) > 0
+    assert worker.stats == {"done": 1, "retried": 1, "failed": 0, "claimed": 0}
+
+
+def test_job_fails_after_max_attempts():
+    redis_client = FakeRedis(decode_responses=True)
+    job_id = JobQueue(redis_client, max_attempts=2).enqueue(TEST_JOB, {"value": 1})
+    worker = Worker(redis_client, {TEST_JOB: Flaky(failures=5)}, queues=['default'])
+    assert worker.run_once(None) == 'retrying'
+    make_due(redis_client, 'default', job_id)
+    assert worker.run_once(None) == 'failed'
+    job = redis_client.hgetall(job_key(job_id))
+    assert (job['status'], job['error']) == ('failed', 'RuntimeError: attempt 2')
+    assert 'payload' not in job
+    assert redis_client.zcard(delayed_key('default')) == 0
+
+
+def test_job_that_never_runs_expires():
+    redis_client = FakeRedis(decode_responses=True)
+    job_id = JobQueue(redis_client, result_ttl=60).enqueue(TEST_JOB, {"value": 2})
+    assert 0 < redis_client.ttl(job_key(job_id)) <= 60
+
+
+def test_unknown_job_type_fails_at_once():
+    redis_client = FakeRedis(decode_responses=True)
+    job_id = JobQueue(redis_client).enqueue("test.unknown", {})
+    assert Worker(redis_client, {}, queues=['default']).run_once(None) == 'failed'
+    assert redis_client.hget(job_key(job_id), 'error').startswith('LookupError')
+
+
+def test_silent_worker_job_is_claimed_by_another():
+    redis_client = FakeRedis(decode_responses=True)
+    job_id = JobQueue(redis_client).enqueue(TEST_JOB, {"value": 3})
+    # The first worker reads the job and dies before running it
+    first = Worker(redis_client, {TEST_JOB: Flaky(0)}, queues=['default'])
+    assert first.next_job(None)[2] == job_id
+    second = Worker(redis_client, {TEST_JOB: Flaky(0)}, queues=['default'], visibility_timeout=3600)
+    second.consumer = 'second'
+    assert second.run_once(None) is None
+    # Past the visibility timeout it is given to the second worker
+    second.visibility_timeout = 0
+    assert second.run_once(None) == 'done'
+    assert second.stats['claimed'] == 1
+    assert redis_client.hget(job_key(job_id), 'worker') == 'second'
+
+
+def test_enqueue_without_redis_returns_none():
+    job_queue = JobQueue(offline_redis())
+    assert job_queue.enqueue(TEST_JOB, {}) is None
+    assert job_queue.stats() == {"enqueued": 0, "enqueue_errors": 1}
+
+
+def test_job_status_route(client):
+    ann = client.user('ann')
+    reply = client.register('bob')
+    job_id = reply.json['job_id']
+    bob = client.login('bob')
+    status = client.get(f'/jobs/{job_id}', headers=bob)
+    assert status.status_code == 200
+    assert (status.json['type'], status.json['status'], status.json['attempts']) == ('notify.welcome', 'queued', 0)
+    assert 'payload' not in status.json
+    # Only the owner and admins see a job
+    assert client.get(f'/jobs/{job_id}', headers=ann).status_code == 404
+    assert client.get(f'/jobs/{job_id}', headers=client.user('admin', 'admin')).status_code == 200
+    assert client.get('/jobs/not-a-job', headers=bob).status_code == 404
+
+
+@pytest.fixture
+def queue_down(client, monkeypatch):
+    if client.name == 'asgi':
+        monkeypatch.setattr(quart_api, 'job_queue', AsyncJobQueue(offline_redis(fakeredis.FakeAsyncRedis)))
+    else:
+        monkeypatch.setattr(flask_api, 'job_queue', JobQueue(offline_redis()))
+
+
+def test_queue_down(client, queue_down):
+    # Registering still works (the welcome message is a side effect), the certificates can't be issued without a job
+    assert client.register('cid').json['job_id'] is None
+    teacher = client.user('teacher', 'instructor')
+    course_id, _ = client.course(teacher, 'Queued')
+    reply = client.post(f'/courses/{course_id}/certificates/batch', headers=teacher)
+    assert reply.status_code == 503
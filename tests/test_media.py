@@ -0,0 +1,101 @@
+import os
+import time
+from urllib.parse import urlsplit, parse_qs
+
+import pytest
+
+from api.media import MediaSigner, LocalStorage, MEDIA_ROOT
+
+VIDEO = bytes(range(256)) * 40  # 10240 bytes
+
+
+@pytest.fixture
+def video(client):
+    # A module with an attached video file and an enrolled student
+    os.makedirs(MEDIA_ROOT, exist_ok=True)
+    with open(os.path.join(MEDIA_ROOT, 'intro.mp4'), 'wb') as f:
+        f.write(VIDEO)
+    teacher = client.user('teacher', 'instructor')
+    course_id, (module_id,) = client.course(teacher, 'Videos', modules=['Intro'])
+    path = f'/courses/{course_id}/modules/{module_id}/video'
+    assert client.put(path, headers=teacher, json={"video_key": "missing.mp4"}).status_code == 400
+    assert client.put(path, headers=teacher, json={"video_key": "intro.mp4"}).status_code == 200
+    student = client.user('student')
+    assert client.post(f'/courses/{course_id}/enroll', headers=student).status_code == 201
+    return path, student
+
+
+def signed_url(client, path, headers):
+    reply = client.get(path, headers=headers)
+    assert reply.status_code == 200, reply.json
+    return reply.json['url']
+
+
+def media(client, url, headers=None):
+    parts = urlsplit(url)
+    query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+    return client.get(parts.path, query_string=query, headers=headers)
+
+
+def test_video_url_needs_the_course(client, video):
+    path, _ = video
+    assert client.get(path, headers=client.user('other')).status_code == 403
+    assert client.get(path.replace('/video', '') + '0/video', headers=client.login('student')).status_code == 404
+
+
+def test_signed_url_serves_the_file_and_ranges(client, video):
+    path, student = video
+    url = signed_url(client, path, student)
+    reply = media(client, url)
+    assert reply.status_code == 200
+    assert reply.data == VIDEO
+    assert reply.headers['Accept-Ranges'] == 'bytes'
+    assert reply.headers['Cache-Control'].startswith('private, max-age=')
+
+    reply = media(client, url, headers={"Range": "bytes=100-199"})
+    assert reply.status_code == 206
+    assert reply.data == VIDEO[100:200]
+    assert reply.headers['Content-Range'] == f'bytes 100-199/{len(VIDEO)}'
+    # Open ended range, what players send first
+    reply = media(client, url, headers={"Range": "bytes=10000-"})
+    assert reply.status_code == 206
+    assert reply.data == VIDEO[10000:]
+
+
+def test_range_past_the_end(client, video):
+    path, student = video
+    reply = media(client, signed_url(client, path, student), headers={"Range": f"bytes={len(VIDEO) + 10}-"})
+    assert reply.status_code == 416
+
+
+def test_tampered_or_expired_urls_are_refused(client, video):
+    path, student = video
+    url = signed_url(client, path, student)
+    parts = urlsplit(url)
+    query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+    # Other file, other expiry, other signature
+    assert client.get('/media/other.mp4', query_string=query).status_code == 403
+    assert client.get(parts.path, query_string={**query, "expires": int(query['expires']) + 3600}).status_code == 403
+    assert client.get(parts.path, query_string={**query, "sig": '0' * 64}).status_code == 403
+    assert client.get(parts.path).status_code == 403
+
+
+def test_signer():
+    signer = MediaSigner("test-key", ttl=60)
+    url, expires = signer.sign("a b.mp4", now=1000)
+    assert expires == 1060
+    assert url.startswith('/media/a%20b.mp4?expires=1060&sig=')
+    now = int(time.time())
+    signature = signer.signature("a.mp4", now + 60)
+    assert signer.verify("a.mp4", now + 60, signature)
+    assert not signer.verify("a.mp4", now - 1, signer.signature("a.mp4", now - 1))
+    assert not signer.verify("a.mp4", "soon", signature)
+    assert not MediaSigner("other-key").verify("a.mp4", now + 60, signature)
+    with pytest.raises(RuntimeError):
+        MediaSigner(None).sign("a.mp4")
+
+
+def test_keys_outside_the_media_folder():
+    storage = LocalStorage()
+    assert storage.path('../secret') is None
+    assert not storage.exists('../../etc/passwd')
@@ -0,0 +1,87 @@
+import logging
+
+from api import metrics
+from api.metrics import MetricsRegistry, RequestStats, METRIC_PREFIX
+
+
+def sample(text, name, **labels):
+    # Value of one series in the Prometheus text, 0 when it is not there yet
+    wanted = ','.join(f'{key}="{value}"' for key, value in labels.items())
+    prefix = f"{METRIC_PREFIX}_{name}{{{wanted}}} " if labels else f"{METRIC_PREFIX}_{name} "
+    for line in text.splitlines():
+        if line.startswith(prefix):
+            return float(line[len(prefix):])
+    return 0.0
+
+
+def scrape(client):
+    reply = client.get('/metrics')
+    assert reply.status_code == 200
+    assert reply.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    return reply.data.decode()
+
+
+def test_requests_are_counted_per_route(client):
+    teacher = client.user('teacher', 'instructor')
+    course_id, _ = client.course(teacher, 'Counted')
+    route = dict(method='GET', route='/courses/<int:id>')
+    before = scrape(client)
+    for _ in range(3):
+        assert client.get(f'/courses/{course_id}', headers=teacher).status_code == 200
+    assert client.get('/courses/999999', headers=teacher).status_code == 404
+    after = scrape(client)
+    assert sample(after, 'http_requests_total', **route, status=200) - sample(before, 'http_requests_total', **route, status=200) == 3
+    assert sample(after, 'http_requests_total', **route, status=404) - sample(before, 'http_requests_total', **route, status=404) == 1
+    assert (sample(after, 'http_request_duration_seconds_count', **route)
+            - sample(before, 'http_request_duration_seconds_count', **route)) == 4
+    # The first read fills the cache from the database, the 404 asks the database too
+    assert sample(after, 'request_statements_total', **route) > sample(before, 'request_statements_total', **route)
+    assert sample(after, 'request_redis_calls_total', **route) > sample(before, 'request_redis_calls_total', **route)
+
+
+def test_login_counts_bcrypt_time(client):
+    client.register('student')
+    route = dict(method='POST', route='/auth/login')
+    before = sample(scrape(client), 'request_hash_seconds_total', **route)
+    client.login('student')
+    assert sample(scrape(client), 'request_hash_seconds_total', **route) > before
+
+
+def test_unmatched_paths_share_one_series(client):
+    before = sample(scrape(client), 'http_requests_total', method='GET', route='unmatched', status=404)
+    client.get('/no/such/path/1')
+    client.get('/no/such/path/2')
+    assert sample(scrape(client), 'http_requests_total', method='GET', route='unmatched', status=404) - before == 2
+
+
+def test_metrics_token(client, monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_TOKEN', 'scrape-token')
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={"Authorization": "Bearer wrong"}).status_code == 401
+    assert client.get('/metrics', headers={"Authorization": "Bearer scrape-token"}).status_code == 200
+
+
+def test_slow_requests_are_logged_with_their_sql(client, monkeypatch, caplog):
+    monkeypatch.setattr(metrics, 'SLOW_REQUEST_MS', 0.001)
+    with caplog.at_level(logging.WARNING, logger=metrics.__name__):
+        client.get('/courses')
+    messages = [record.getMessage() for record in caplog.records if record.getMessage().startswith('Slow request GET /courses')]
+    assert messages and 'SELECT' in messages[0]
+
+
+def test_histogram_and_collectors():
+    registry = MetricsRegistry(buckets=(0.1, 1.0))
+    stats = RequestStats()
+    stats.statements = 2
+    for seconds in (0.05, 0.5, 5.0):
+        registry.observe('GET', '/x', 200, stats, seconds)
+    registry.register_collector('good', lambda: {"hits": 3, "name": "skipped"})
+    registry.register_collector('broken', lambda: 1 / 0)
+    text = registry.render()
+    labels = dict(method='GET', route='/x')
+    assert sample(text, 'http_request_duration_seconds_bucket', **labels, le='0.1') == 1
+    assert sample(text, 'http_request_duration_seconds_bucket', **labels, le='1.0') == 2
+    assert sample(text, 'http_request_duration_seconds_bucket', **labels, le='+Inf') == 3
+    assert sample(text, 'request_statements_total', **labels) == 6
+    assert sample(text, 'good_hits') == 3
+    assert f'{METRIC_PREFIX}_good_name' not in text
@@ -0,0 +1,51 @@
+import pytest
+
+
+def test_users_keep_the_plain_list_by_default(client):
+    admin = client.user('admin', 'admin')
+    for number in range(3):
+        client.register(f'student-{number}')
+    reply = client.get('/users', headers=admin, query_string={"limit": 2})
+    assert reply.status_code == 200
+    assert [user['name'] for user in reply.json] == ['admin', 'student-0']
+    # The rest of the plain list
+    cursor = reply.headers['X-Next-Cursor']
+    reply = client.get('/users', headers=admin, query_string={"limit": 2, "cursor": cursor})
+    assert [user['name'] for user in reply.json['users']] == ['student-1', 'student-2']
+    assert reply.json['next_cursor'] is None
+
+
+def test_users_pages_with_an_empty_cursor(client):
+    admin = client.user('admin', 'admin')
+    client.register('student')
+    reply = client.get('/users', headers=admin, query_string={"limit": 1, "cursor": ""})
+    assert [user['name'] for user in reply.json['users']] == ['admin']
+    reply = client.get('/users', headers=admin, query_string={"limit": 1, "cursor": reply.json['next_cursor']})
+    assert [user['name'] for user in reply.json['users']] == ['student']
+    assert reply.json['next_cursor'] is None
+    # The last page of the plain list has no header
+    assert 'X-Next-Cursor' not in client.get('/users', headers=admin).headers
+
+
+def test_courses_and_modules_pages(client):
+    teacher = client.user('teacher', 'instructor')
+    course_id, _ = client.course(teacher, 'First', modules=['One', 'Two', 'Three'])
+    client.course(teacher, 'Second')
+    first = client.get('/courses', query_string={"limit": 1}).json
+    second = client.get('/courses', query_string={"limit": 1, "cursor": first['next_cursor']}).json
+    assert [course['title'] for course in first['courses'] + second['courses']] == ['First', 'Second']
+    assert second['next_cursor'] is None
+
+    path = f'/courses/{course_id}/modules'
+    titles, cursor = [], ''
+    while cursor is not None:
+        page = client.get(path, headers=teacher, query_string={"limit": 2, "cursor": cursor}).json
+        titles += [module['title'] for module in page['modules']]
+        cursor = page['next_cursor']
+    assert titles == ['One', 'Two', 'Three']
+
+
+@pytest.mark.parametrize('path', ['/users', '/courses'])
+def test_bad_cursor(client, path):
+    admin = client.user('admin', 'admin')
+    assert client.get(path, headers=admin, query_string={"cursor": "not-a-cursor"}).status_code == 400
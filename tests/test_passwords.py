@@ -0,0 +1,92 @@
+import asyncio
+import os
+import signal
+import threading
+
+import bcrypt
+import pytest
+from sqlalchemy import select
+
+from api import passwords
+from api.db import Session
+from api.models import User
+
+
+@pytest.fixture
+def hash_pool(monkeypatch):
+    # A real one process pool for these tests (the suite hashes inline otherwise)
+    monkeypatch.setattr(passwords, 'HASH_WORKERS', 1)
+    monkeypatch.setattr(passwords, '_slots', threading.BoundedSemaphore(4))
+    yield
+    passwords.shutdown()
+
+
+def kill_workers(executor):
+    for process in list(executor._processes.values()):
+        os.kill(process.pid, signal.SIGKILL)
+        process.join()
+
+
+def stored_hash(user_name):
+    with Session() as session:
+        return session.scalar(select(User.password_hash).filter_by(user_name=user_name))
+
+
+def test_hashes_run_in_the_pool(hash_pool):
+    password_hash = passwords.hash_password('secret')
+    assert passwords.check_password('secret', password_hash)
+    assert not passwords.check_password('wrong', password_hash)
+    assert passwords._executor is not None
+    assert len(passwords.hash_passwords(['a', 'b', 'c'])) == 3
+
+
+def test_dead_worker_gets_a_new_pool(hash_pool):
+    passwords.warm_up()
+    broken = passwords._executor
+    kill_workers(broken)
+    # The next hash sees the broken pool, replaces it and succeeds
+    assert passwords.check_password('secret', passwords.hash_password('secret'))
+    assert passwords._executor is not broken
+    kill_workers(passwords._executor)
+    assert len(passwords.hash_passwords(['a', 'b'])) == 2
+    kill_workers(passwords._executor)
+    assert asyncio.run(passwords.check_password_async('secret', passwords.hash_password('secret')))
+
+
+def test_dead_worker_does_not_break_logins(client, hash_pool):
+    client.register('student')
+    passwords.warm_up()
+    kill_workers(passwords._executor)
+    client.login('student')
+    client.login('student', device='phone')
+
+
+def test_full_queue_sheds_logins_with_503(client, hash_pool, monkeypatch):
+    client.register('student')
+    slots = threading.BoundedSemaphore(1)
+    slots.acquire()
+    monkeypatch.setattr(passwords, '_slots', slots)
+    reply = client.post('/auth/login', json={"user_name": "student", "password": "test-password"})
+    assert reply.status_code == 503
+    assert reply.headers['Retry-After'] == '1'
+
+
+def test_login_upgrades_weaker_hashes(client, monkeypatch):
+    client.register('student')
+    assert stored_hash('student').startswith('$2b$04$')
+    monkeypatch.setattr(passwords, 'BCRYPT_ROUNDS', 5)
+    client.login('student')
+    upgraded = stored_hash('student')
+    assert upgraded.startswith('$2b$05$')
+    assert bcrypt.checkpw(b'test-password', upgraded.encode())
+    # Already at the current cost: not hashed again
+    client.login('student')
+    assert stored_hash('student') == upgraded
+
+
+def test_needs_rehash(monkeypatch):
+    monkeypatch.setattr(passwords, 'BCRYPT_ROUNDS', 12)
+    assert passwords.needs_rehash('$2b$10$' + 'a' * 53)
+    assert not passwords.needs_rehash('$2b$12$' + 'a' * 53)
+    assert passwords.needs_rehash('not a bcrypt hash')
+
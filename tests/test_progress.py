@@ -0,0 +1,103 @@
+import pytest
+
+from api.db import Session
+from api.models import ModuleProgress
+from api.progress import ProgressFlusher, coalesce, drop_missing, PROGRESS_STREAM
+from tests.conftest import FakeRedis
+
+
+@pytest.fixture
+def enrolled(client):
+    teacher = client.user('teacher', 'instructor')
+    course_id, (module_id, other_module_id) = client.course(teacher, 'Videos', modules=['One', 'Two'])
+    student = client.user('student')
+    assert client.post(f'/courses/{course_id}/enroll', headers=student).status_code == 201
+    return student, course_id, module_id, other_module_id
+
+
+def heartbeat(client, headers, course_id, module_id, **data):
+    return client.post(f'/courses/{course_id}/modules/{module_id}/progress', headers=headers, json=data)
+
+
+def flusher():
+    # Both apps write to the same stream, one flusher like the one started by the first heartbeat (a new one per
+    # test, the app's flusher remembers the consumer group of a Redis that was flushed since)
+    return ProgressFlusher(FakeRedis(decode_responses=True), Session)
+
+
+def flush():
+    return flusher().flush_once(wait=False)
+
+
+def test_heartbeats_are_written_behind(client, enrolled):
+    student, course_id, module_id, other_module_id = enrolled
+    for position, completed in ((10, False), (30, True), (20, False)):
+        assert heartbeat(client, student, course_id, module_id, position=position, completed=completed).status_code == 202
+    assert heartbeat(client, student, course_id, other_module_id, position=5).status_code == 202
+    # Nothing in the database until the flusher ran
+    assert client.get(f'/courses/{course_id}/progress', headers=student).json['modules'] == []
+    assert flush() == 4
+    modules = client.get(f'/courses/{course_id}/progress', headers=student).json['modules']
+    assert [(row['module_id'], row['position'], row['max_position'], row['completed']) for row in modules] == [
+        (module_id, 20, 30, True), (other_module_id, 5, 5, False)]
+    # Acknowledged and removed from the stream
+    assert FakeRedis().xlen(PROGRESS_STREAM) == 0
+    assert flush() == 0
+
+
+def test_heartbeat_checks(client, enrolled):
+    student, course_id, module_id, _ = enrolled
+    assert heartbeat(client, student, course_id, 999999, position=1).status_code == 404
+    other = client.user('other')
+    assert heartbeat(client, other, course_id, module_id, position=1).status_code == 404
+    for data in ({}, {"position": -1}, {"position": True}, {"position": "10"}, {"position": float('nan')},
+                 {"position": float('inf')}, {"position": 1, "completed": "yes"}):
+        assert heartbeat(client, student, course_id, module_id, **data).status_code == 400
+
+
+def test_coalesce_keeps_the_newest_position():
+    events = [
+        {"u": "1", "c": "1", "m": "2", "p": "50", "done": "0", "t": "200"},
+        {"u": "1", "c": "1", "m": "2", "p": "70", "done": "1", "t": "100"},  # arrived late
+        {"u": "1", "c": "1", "m": "3", "p": "5", "done": "0", "t": "150"},
+    ]
+    rows = {row['module_id']: row for row in coalesce(events)}
+    assert (rows[2]['position'], rows[2]['max_position'], rows[2]['completed'], rows[2]['sent_at']) == (50, 70, True, 200)
+    assert rows[3]['position'] == 5
+
+
+def test_a_late_batch_does_not_move_the_position_back(client, enrolled):
+    student, course_id, module_id, _ = enrolled
+    user_id = client.get('/auth/profile', headers=student).json['user_profile']['user_id']
+    row = {"user_id": user_id, "module_id": module_id, "course_id": course_id, "completed": False}
+    flusher().write([{**row, "position": 40.0, "max_position": 40.0, "sent_at": 2000.0}])
+    flusher().write([{**row, "position": 10.0, "max_position": 60.0, "sent_at": 1000.0, "completed": True}])
+    with Session() as session:
+        progress = session.query(ModuleProgress).filter_by(user_id=user_id, module_id=module_id).one()
+        assert (progress.position, progress.max_position, progress.completed) == (40, 60, True)
+
+
+def test_rows_of_deleted_users_or_modules_are_dropped(client, enrolled):
+    # What the flusher writes after a foreign key error (SQLite here does not check foreign keys)
+    student, course_id, module_id, _ = enrolled
+    user_id = client.get('/auth/profile', headers=student).json['user_profile']['user_id']
+    rows = [{"user_id": user_id, "module_id": module_id}, {"user_id": 999999, "module_id": module_id},
+            {"user_id": user_id, "module_id": 999999}]
+    with Session() as session:
+        assert drop_missing(session, rows) == rows[:1]
+
+
+def test_a_failed_flush_is_written_again(client, enrolled, monkeypatch):
+    student, course_id, module_id, _ = enrolled
+    heartbeat(client, student, course_id, module_id, position=12)
+    failing = flusher()
+
+    def broken(rows):
+        raise RuntimeError("database down")
+    monkeypatch.setattr(failing, 'write', broken)
+    with pytest.raises(RuntimeError):
+        failing.flush_once(wait=False)
+    monkeypatch.undo()
+    # The events stayed pending for this flusher and are read again
+    assert failing.flush_once(wait=False) == 1
+    assert client.get(f'/courses/{course_id}/progress', headers=student).json['modules'][0]['position'] == 12
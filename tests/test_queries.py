@@ -0,0 +1,86 @@
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from api import asgi as quart_api
+from api.db import get_engine
+
+# Most SQL statements each route may run (cold cache, role registry loaded). List and auth lookups are column
+# projections and eager loads are opt-in, so none of these grow with the number of modules, enrollments or courses.
+# When a route needs more, raise its limit here in the same change and say why.
+ROUTE_STATEMENTS = [
+    ('GET', '/users', 'admin', None, 1),
+    ('GET', '/users/{student_id}', 'student', None, 1),
+    ('GET', '/auth/profile', 'student', None, 1),
+    ('GET', '/auth/role', 'student', None, 0),
+    ('POST', '/auth/login', None, {"user_name": "student", "password": "test-password"}, 1),
+    ('POST', '/auth/register', None, {"user_name": "new", "email": "new", "password": "pw", "role": "student",
+                                      "first_name": "A", "last_name": "B"}, 3),
+    # user id, title check, INSERT and the counter row of stats.py (the course is not read again after the commit)
+    ('POST', '/courses', 'teacher', {"title": "Fresh", "description": "New"}, 4),
+    ('GET', '/courses', None, None, 1),
+    ('GET', '/courses/search?q=module', None, None, 2),
+    ('GET', '/courses/{course_id}', 'student', None, 2),
+    ('PUT', '/courses/{course_id}', 'teacher', {"title": "Counted", "description": "New text"}, 3),
+    ('GET', '/courses/{course_id}/modules', 'student', None, 2),
+    ('POST', '/courses/{course_id}/modules', 'teacher', {"title": "Another", "content": "More"}, 4),
+    ('GET', '/courses/{course_id}/modules/{module_id}', 'student', None, 1),
+    ('PUT', '/courses/{course_id}/modules/{module_id}', 'teacher', {"title": "Renamed"}, 3),
+    # user id, course check, INSERT and the two counter upserts of stats.py
+    ('POST', '/courses/{course_id}/enroll', 'other', None, 5),
+    ('GET', '/courses/{course_id}/stats', 'teacher', None, 3),
+    ('GET', '/courses/{course_id}/progress', 'student', None, 2),
+]
+
+
+def route_engine(client):
+    return get_engine() if client.name == 'flask' else quart_api.get_engine().sync_engine
+
+
+@contextmanager
+def count_statements(engine):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+@pytest.fixture
+def catalog(client):
+    # A course with enough modules and enrollments that a fan-out (one query per row) would show in the counts
+    users = {"admin": client.user('admin', 'admin'), "teacher": client.user('teacher', 'instructor'),
+             "student": client.user('student'), "other": client.user('other')}
+    course_id, module_ids = client.course(users['teacher'], 'Counting', modules=[f'Module {number}' for number in range(5)])
+    for number in range(5):
+        client.course(users['teacher'], f'Filler {number}', modules=['Filler module'])
+        headers = client.user(f'enrolled-{number}')
+        assert client.post(f'/courses/{course_id}/enroll', headers=headers).status_code == 201
+    assert client.post(f'/courses/{course_id}/enroll', headers=users['student']).status_code == 201
+    student_id = client.get('/auth/profile', headers=users['student']).json['user_profile']['user_id']
+    return users, {"course_id": course_id, "module_id": module_ids[0], "student_id": student_id}
+
+
+@pytest.mark.parametrize('method, path, who, body, limit', ROUTE_STATEMENTS, ids=[f'{r[0]} {r[1]}' for r in ROUTE_STATEMENTS])
+def test_route_statement_count(client, catalog, method, path, who, body, limit):
+    users, ids = catalog
+    with count_statements(route_engine(client)) as statements:
+        reply = client.open(method, path.format(**ids), json=body, headers=users.get(who))
+    assert reply.status_code < 300, reply.json
+    assert len(statements) <= limit, "\n".join(statements)
+
+
+def test_list_statements_do_not_grow_with_rows(client, catalog):
+    # Same page size, ten times the rows: still one statement for the course list
+    users, _ = catalog
+    for number in range(10):
+        client.course(users['teacher'], f'More {number}', modules=['A', 'B'])
+    with count_statements(route_engine(client)) as statements:
+        assert client.get('/courses?limit=20').status_code == 200
+    assert len(statements) == 1
@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+from api.quiz import NO_ANSWER, AnswerKey, grade, parse_submissions, parse_quiz
+
+QUESTIONS = [
+    {"text": "One", "options": ["a", "b", "c"], "answer": 0, "points": 1},
+    {"text": "Two", "options": ["a", "b"], "answer": 1, "points": 2},
+    {"text": "Three", "options": ["a", "b", "c", "d"], "answer": 3, "points": 3},
+]
+
+
+@pytest.fixture
+def key():
+    return AnswerKey(np.array([0, 1, 3], dtype=np.uint8), np.array([3, 2, 4], dtype=np.uint8),
+                     np.array([1, 2, 3], dtype=np.float32))
+
+
+def parse(key, *answer_rows):
+    return parse_submissions({"submissions": [{"user_id": user_id, "answers": answers}
+                                              for user_id, answers in enumerate(answer_rows, start=1)]}, key)
+
+
+@pytest.mark.parametrize('points', [-1, True, "2", float('inf'), float('nan'), 1e300])
+def test_parse_quiz_rejects_bad_points(points):
+    title, questions, error = parse_quiz({"title": "Quiz", "questions": [{**QUESTIONS[0], "points": points}]})
+    assert error == "Question 0: points must be a number >= 0."
+    assert parse_quiz({"title": "Quiz", "questions": QUESTIONS})[2] is None
+
+
+def test_grades_the_whole_matrix(key):
+    user_ids, matrix, results, error = parse(key, [0, 1, 3], [1, 1, 0], [0, None, 3])
+    assert error is None and results == [None, None, None]
+    assert user_ids == [1, 2, 3]
+    assert matrix.tolist() == [[0, 1, 3], [1, 1, 0], [0, NO_ANSWER, 3]]
+    correct, scores = grade(key, matrix)
+    assert correct.tolist() == [3, 1, 2]
+    assert scores.tolist() == [6, 2, 4]
+
+
+@pytest.mark.parametrize('answers', [
+    [True, 0, 3],  # a bool is not option 1
+    [0, False, 3],
+    [-1, 1, 3],  # only null means "no answer"
+    [0, 2, 3],  # question two has two options
+    [0, 1.0, 3],
+    ["0", 1, 3],
+    [0, 1],
+])
+def test_rejects_answers_that_are_not_options(key, answers):
+    _, matrix, results, _ = parse(key, [0, 1, 3], answers)
+    assert results == [None, "invalid"]
+    assert len(matrix) == 1
+
+
+@pytest.mark.parametrize('answers', [[True, None, 3], [-1, None, 3]])
+def test_rejects_bad_answers_next_to_nulls(key, answers):
+    _, _, results, _ = parse(key, [0, None, 3], answers)
+    assert results == [None, "invalid"]
+
+
+def test_duplicate_and_bad_rows(key):
+    data = {"submissions": [{"user_id": 1, "answers": [0, 1, 3]}, {"user_id": 1, "answers": [0, 1, 3]},
+                            {"user_id": True, "answers": [0, 1, 3]}, "not a row"]}
+    user_ids, _, results, _ = parse_submissions(data, key)
+    assert user_ids == [1]
+    assert results == [None, "duplicate_in_request", "invalid", "invalid"]
+
+
+def test_bulk_submit_and_results(client):
+    teacher = client.user('teacher', 'instructor')
+    course_id, (module_id,) = client.course(teacher, 'Quizzes', modules=['Quiz module'])
+    students = {}
+    for name in ('first', 'second', 'outside'):
+        students[name] = client.user(name)
+        students[name + '_id'] = client.get('/auth/profile', headers=students[name]).json['user_profile']['user_id']
+    for name in ('first', 'second'):
+        assert client.post(f'/courses/{course_id}/enroll', headers=students[name]).status_code == 201
+
+    path = f'/courses/{course_id}/modules/{module_id}/quizzes'
+    reply = client.post(path, headers=teacher, json={"title": "Check", "questions": QUESTIONS})
+    assert reply.status_code == 201, reply.json
+    quiz_id = reply.json['quiz_id']
+    # Students do not see the answer key
+    assert 'answer' not in client.get(f'{path}/{quiz_id}', headers=students['first']).json['questions'][0]
+
+    submissions = [{"user_id": students['first_id'], "answers": [0, 1, 3]},
+                   {"user_id": students['second_id'], "answers": [True, None, 3]},
+                   {"user_id": students['outside_id'], "answers": [0, 1, 3]}]
+    reply = client.post(f'{path}/{quiz_id}/submissions/bulk', headers=teacher, json={"submissions": submissions})
+    assert reply.status_code == 200, reply.json
+    assert [row['status'] for row in reply.json['results']] == ['graded', 'invalid', 'not_enrolled']
+
+    submissions[1]['answers'] = [1, None, 3]
+    reply = client.post(f'{path}/{quiz_id}/submissions/bulk', headers=teacher, json={"submissions": submissions[1:2]})
+    assert reply.json['results'] == [{"user_id": students['second_id'], "status": "graded"}]
+
+    result = client.get(f"{path}/{quiz_id}/results/{students['second_id']}", headers=students['second']).json
+    assert result['score'] == 3 and result['correct'] == 1
+    assert [answer['answer'] for answer in result['answers']] == [1, None, 3]
+    # Another student's result is not visible
+    reply = client.get(f"{path}/{quiz_id}/results/{students['second_id']}", headers=students['first'])
+    assert reply.status_code == 403
@@ -0,0 +1,99 @@
+import time
+
+import fakeredis
+import pytest
+
+from api import api as flask_api
+from api import asgi as quart_api
+from api.ratelimit import RateLimiter, AsyncRateLimiter, RateLimited
+from tests.conftest import FakeRedis, FakeAsyncRedis, offline_redis, PASSWORD
+
+
+def budgets(device, account, seconds=60):
+    return {'login': {'device': (device, seconds), 'account': (account, seconds)}}
+
+
+def limiter(device=100, account=100, seconds=60, lease_fraction=0, **kwargs):
+    # Its own limiter (the apps run with RATE_LIMIT_ENABLED=false), lease_fraction 0: every request asks Redis
+    return RateLimiter(FakeRedis(decode_responses=True), budgets(device, account, seconds), enabled=True,
+                       lease_fraction=lease_fraction, **kwargs)
+
+
+def admitted(rate_limiter, device, account, times):
+    count = 0
+    for _ in range(times):
+        try:
+            rate_limiter.admit('login', device, account)
+            count += 1
+        except RateLimited:
+            pass
+    return count
+
+
+def test_device_budget():
+    rate_limiter = limiter(device=3)
+    assert admitted(rate_limiter, 'laptop', 'ann', 5) == 3
+    with pytest.raises(RateLimited) as error:
+        rate_limiter.admit('login', 'laptop', 'bob')
+    assert 0 < error.value.retry_after <= 20
+    assert int(error.value.headers()['Retry-After']) >= 1
+    # Other devices have their own bucket
+    assert admitted(rate_limiter, 'phone', 'ann', 1) == 1
+
+
+def test_account_budget_across_devices_and_processes():
+    first, second = limiter(account=2), limiter(account=2)
+    assert admitted(first, 'laptop', 'Ann', 1) == 1
+    # Same bucket for the same account name, from another process
+    assert admitted(second, 'phone', ' ann ', 1) == 1
+    assert admitted(first, 'tablet', 'ANN', 1) == 0
+    assert admitted(second, 'tablet', 'bob', 1) == 1
+
+
+def test_rejected_clients_are_rejected_locally():
+    rate_limiter = limiter(device=1)
+    admitted(rate_limiter, 'laptop', 'ann', 5)
+    stats = rate_limiter.stats()
+    assert (stats['redis_allowed'], stats['redis_rejected'], stats['local_rejected']) == (1, 1, 3)
+
+
+def test_buckets_refill():
+    rate_limiter = limiter(device=2, seconds=0.2)
+    assert admitted(rate_limiter, 'laptop', 'ann', 3) == 2
+    time.sleep(0.25)
+    assert admitted(rate_limiter, 'laptop', 'ann', 1) == 1
+
+
+def test_leases_spend_tokens_without_redis():
+    rate_limiter = limiter(device=20, account=20, lease_fraction=0.25)
+    assert admitted(rate_limiter, 'laptop', 'ann', 5) == 5
+    stats = rate_limiter.stats()
+    assert (stats['redis_allowed'], stats['local_allowed']) == (1, 4)
+    # The lease was taken from the shared bucket: another process sees 15 tokens left
+    other = limiter(device=20, account=20)
+    assert admitted(other, 'laptop', 'ann', 20) == 15
+
+
+def test_requests_pass_when_redis_is_down():
+    rate_limiter = RateLimiter(offline_redis(), budgets(1, 1), enabled=True)
+    assert admitted(rate_limiter, 'laptop', 'ann', 3) == 3
+    assert rate_limiter.stats()['redis_errors'] == 3
+
+
+def test_login_answers_429(client, monkeypatch):
+    client.register('ann')
+    if client.name == 'asgi':
+        rate_limiter = AsyncRateLimiter(FakeAsyncRedis(decode_responses=True), budgets(100, 2), enabled=True, lease_fraction=0)
+        monkeypatch.setattr(quart_api, 'rate_limiter', rate_limiter)
+    else:
+        monkeypatch.setattr(flask_api, 'rate_limiter', limiter(account=2))
+    statuses = [client.post('/auth/login', json={"user_name": "ann", "password": PASSWORD}).status_code for _ in range(3)]
+    assert statuses == [200, 200, 429]
+    reply = client.post('/auth/login', json={"user_name": "ann", "password": PASSWORD})
+    assert reply.status_code == 429
+    assert int(reply.headers['Retry-After']) >= 1
+
+
+def test_disabled_limiter_allows_everything():
+    rate_limiter = RateLimiter(fakeredis.FakeStrictRedis(decode_responses=True), budgets(1, 1), enabled=False)
+    assert admitted(rate_limiter, 'laptop', 'ann', 5) == 5
@@ -0,0 +1,109 @@
+import logging
+import os
+import shutil
+
+import fakeredis
+import pytest
+
+from api import api as flask_api, asgi as quart_api
+from api.db import get_engine
+from api.replicas import ReplicaPool, StickyReads, REPLICA_MAX_LAG, REPLICA_CHECK_INTERVAL
+from tests.conftest import TEST_DIR
+
+
+@pytest.fixture
+def replica(client, monkeypatch):
+    # A copy of the SQLite file as the replica: nothing copies the writes made after the fixture, like a lagging replica
+    def make():
+        path = os.path.join(TEST_DIR, 'replica.db')
+        get_engine().dispose()
+        shutil.copyfile(get_engine().url.database, path)
+        pool = ReplicaPool(['sqlite:///' + path], check_interval=60)
+        assert pool.check_all() == [True]
+        module = flask_api if client.name == 'flask' else quart_api
+        monkeypatch.setattr(module, 'replica_pool', pool)
+        cleanup.append(pool)
+        return pool
+
+    cleanup = []
+    yield make
+    for pool in cleanup:
+        pool.stop()
+        for replica in pool.replicas:
+            replica.engine.dispose()
+    for async_engine in quart_api.replica_engines.values():
+        async_engine.sync_engine.dispose()
+    quart_api.replica_engines.clear()
+
+
+def test_sticky_window_covers_the_allowed_lag():
+    sticky_reads = StickyReads(fakeredis.FakeStrictRedis())
+    assert sticky_reads.seconds >= REPLICA_MAX_LAG + REPLICA_CHECK_INTERVAL
+
+
+def test_short_sticky_window_is_raised(caplog):
+    with caplog.at_level(logging.WARNING, logger='api.replicas'):
+        sticky_reads = StickyReads(fakeredis.FakeStrictRedis(), seconds=5, max_lag=10, check_interval=5)
+    assert sticky_reads.seconds == 15
+    assert 'REPLICA_STICKY_SECONDS' in caplog.text
+    assert StickyReads(fakeredis.FakeStrictRedis(), seconds=30, max_lag=10, check_interval=5).seconds == 30
+
+
+def test_sticky_key_expires_after_the_window():
+    redis_client = fakeredis.FakeStrictRedis()
+    sticky_reads = StickyReads(redis_client, seconds=20, max_lag=10, check_interval=5)
+    sticky_reads.mark('teacher')
+    assert sticky_reads.is_sticky('teacher')
+    assert not sticky_reads.is_sticky('student')
+    assert 19000 < redis_client.pttl(StickyReads.key('teacher')) <= 20000
+
+
+def test_failing_replica_is_taken_out():
+    pool = ReplicaPool(['sqlite:////nonexistent/directory/replica.db'], check_interval=60)
+    assert pool.check_all() == [False]
+    assert pool.pick() is None
+    assert pool.stats()['no_replica_sessions'] == 1
+    assert pool.status() != {}
+    pool.stop()
+
+
+def test_writer_reads_from_the_primary_others_from_the_replica(client, replica):
+    teacher = client.user('teacher', 'instructor')
+    student = client.user('student')
+    teacher_id = client.get('/auth/profile', headers=teacher).json['user_profile']['user_id']
+    pool = replica()
+    assert client.put(f'/users/{teacher_id}', json={"bio": "Written"}, headers=teacher).status_code == 200
+    # The writer sees the write, the replica (a copy from before the write) does not have it
+    assert client.get('/auth/profile', headers=teacher).json['user_profile']['bio'] == 'Written'
+    assert pool.stats()['sticky_sessions'] == 1
+    assert client.get(f'/users/{teacher_id}', headers=student).json['bio'] != 'Written'
+    assert pool.stats()['replica_sessions'] == 1
+
+
+def test_cache_is_filled_from_the_primary(client, replica):
+    teacher = client.user('teacher', 'instructor')
+    student = client.user('student')
+    course_id, _ = client.course(teacher, 'Old')
+    replica()
+    assert client.put(f'/courses/{course_id}', json={"title": "New"}, headers=teacher).status_code == 200
+    # The student is not sticky, the replica still has "Old": the cache entry everyone gets must not come from there
+    reply = client.get(f'/courses/{course_id}', headers=student)
+    assert reply.json['title'] == 'New'
+    reply = client.get(f'/courses/{course_id}', headers=teacher)
+    assert reply.json['title'] == 'New'
+    assert client.get(f'/courses/{course_id}', headers={**teacher, "If-None-Match": reply.headers['ETag']}).status_code == 304
+    assert client.get('/courses', headers=student).json['courses'][0]['title'] == 'New'
+
+
+def test_replica_reads_get_no_etag(client, replica):
+    teacher = client.user('teacher', 'instructor')
+    student = client.user('student')
+    teacher_id = client.get('/auth/profile', headers=teacher).json['user_profile']['user_id']
+    replica()
+    assert client.put(f'/users/{teacher_id}', json={"bio": "Written"}, headers=teacher).status_code == 200
+    reply = client.get(f'/users/{teacher_id}', headers=student)
+    assert reply.json['bio'] != 'Written'
+    # The old copy would be kept with 304s until the next write
+    assert 'ETag' not in reply.headers and 'Last-Modified' not in reply.headers
+    # The writer reads the primary (sticky) and gets the validator
+    assert 'ETag' in client.get(f'/users/{teacher_id}', headers=teacher).headers
@@ -0,0 +1,128 @@
+import logging
+import time
+from datetime import timedelta
+
+import fakeredis
+import pytest
+
+from api.revocation import RevocationFilter, REVOKED_JTIS_KEY
+from api.token_registry import TokenRegistry
+from tests.conftest import FakeRedis
+
+TOKEN_TTL = timedelta(days=60)
+
+
+@pytest.fixture
+def redis_client():
+    return fakeredis.FakeStrictRedis(decode_responses=True)
+
+
+@pytest.fixture
+def revocation_filter(redis_client):
+    revocation_filter = RevocationFilter(redis_client)
+    yield revocation_filter
+    revocation_filter.stop()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_logout_revokes_the_token(client):
+    headers = client.user('student')
+    assert client.get('/auth/profile', headers=headers).status_code == 200
+    assert client.post('/auth/logout', headers=headers).status_code == 200
+    reply = client.get('/auth/profile', headers=headers)
+    assert reply.status_code == 401
+    assert reply.json['message'] == "Your token has been revoked. Please login again."
+
+
+def test_revocations_reach_other_processes_over_pubsub(redis_client):
+    # Two filters on one Redis are two API processes: a logout on one is seen locally by the other
+    first, second = RevocationFilter(redis_client), RevocationFilter(redis_client)
+    try:
+        first.start()
+        second.start()
+        assert wait_for(lambda: first.stats()['synced'] and second.stats()['synced'])
+        first.revoke('jti-1', time.time() + 60)
+        assert wait_for(lambda: second.check_local('jti-1') is True)
+        assert second.check_local('jti-2') is False
+        assert second.stats()['local_hits'] >= 1
+    finally:
+        first.stop()
+        second.stop()
+
+
+def test_not_synced_asks_redis(redis_client, revocation_filter):
+    revocation_filter.start = lambda: None  # never synced
+    redis_client.zadd(REVOKED_JTIS_KEY, {"jti-1": time.time() + 60})
+    assert revocation_filter.is_revoked('jti-1')
+    assert not revocation_filter.is_revoked('jti-2')
+    assert revocation_filter.stats()['redis_calls'] == 2
+
+
+def test_replaced_token_is_revoked_until_its_own_expiry(redis_client, revocation_filter):
+    registry = TokenRegistry(redis_client, revocation_filter, TOKEN_TTL)
+    now = int(time.time())
+    assert registry.activate('student', 'phone', 'first', now + 100) is None
+    assert registry.activate('student', 'phone', 'second', now + 200) == 'first'
+    # Kept until the first token would have expired, not for another 60 days
+    assert redis_client.zscore(REVOKED_JTIS_KEY, 'first') == now + 100
+    assert revocation_filter._revoked['first'] == now + 100
+    assert redis_client.hget('sessions:student', 'phone') == f'second:{now + 200}'
+
+
+def test_expired_replaced_token_is_not_stored(redis_client, revocation_filter):
+    registry = TokenRegistry(redis_client, revocation_filter, TOKEN_TTL)
+    now = int(time.time())
+    registry.activate('student', 'phone', 'first', now - 1)
+    assert registry.activate('student', 'phone', 'second', now + 200) is None
+    assert redis_client.zcard(REVOKED_JTIS_KEY) == 0
+    assert 'first' not in revocation_filter._revoked
+
+
+def test_entry_without_expiry_is_revoked_for_a_token_lifetime(redis_client, revocation_filter):
+    # Hash entries written before the expiry was kept next to the jti
+    registry = TokenRegistry(redis_client, revocation_filter, TOKEN_TTL)
+    redis_client.hset('sessions:student', 'phone', 'legacy-jti')
+    now = int(time.time())
+    assert registry.activate('student', 'phone', 'second', now + 200) == 'legacy-jti'
+    assert redis_client.zscore(REVOKED_JTIS_KEY, 'legacy-jti') == pytest.approx(now + TOKEN_TTL.total_seconds(), abs=5)
+
+
+def test_relogins_revoke_with_the_real_token_expiry(client):
+    client.register('student')
+    first = client.login('student')
+    client.login('student')
+    entries = FakeRedis(decode_responses=True).zrange(REVOKED_JTIS_KEY, 0, -1, withscores=True)
+    assert len(entries) == 1
+    # The replaced token expires 60 days after its own login, a moment ago
+    assert entries[0][1] == pytest.approx(time.time() + TOKEN_TTL.total_seconds(), abs=10)
+    assert client.get('/auth/profile', headers=first).status_code == 401
+
+
+def test_overflow_is_counted_and_logged(redis_client, caplog):
+    revocation_filter = RevocationFilter(redis_client, max_entries=2)
+    revocation_filter._synced.set()
+    with caplog.at_level(logging.WARNING, logger='api.revocation'):
+        for number in range(4):
+            revocation_filter.remember(f'jti-{number}', time.time() + 60)
+    stats = revocation_filter.stats()
+    assert stats['synced'] is False
+    assert stats['overflows'] == 1
+    assert stats['max_entries'] == 2
+    assert len([record for record in caplog.records if 'REVOCATION_MAX_ENTRIES' in record.getMessage()]) == 1
+    # Out of sync: the checks are answered by Redis
+    assert revocation_filter.check_local('jti-0') is None
+    revocation_filter.stop()
+
+
+def test_overflow_metric_is_exported(flask_client):
+    metrics = flask_client.get('/metrics').data.decode()
+    assert 'studyproj_revocation_filter_overflows ' in metrics
+    assert 'studyproj_revocation_filter_max_entries ' in metrics
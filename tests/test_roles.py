@@ -0,0 +1,95 @@
+import pytest
+from sqlalchemy import event
+
+from api import asgi as quart_api
+from api.db import Session, get_engine
+from api.models import RoleType
+from api.roles import RoleRegistry, Roles, load_roles, bump_roles_version
+from tests.conftest import FakeRedis, offline_redis
+
+
+class CountingSessions:
+    # Session factory that counts the loads of a registry
+    def __init__(self):
+        self.opened = 0
+
+    def __call__(self):
+        self.opened += 1
+        return Session()
+
+
+def test_roles_mapping():
+    with Session() as session:
+        roles = load_roles(session, version=3)
+    assert roles.names() == ['admin', 'instructor', 'student']
+    assert roles.type_of(roles.id_of(RoleType.INSTRUCTOR)) == RoleType.INSTRUCTOR
+    assert roles.name_of(roles.id_of(RoleType.STUDENT)) == 'student'
+    assert roles.name_of(999) is None
+    assert roles.version == 3
+
+
+def test_registry_loads_once_until_the_version_moves():
+    sessions = CountingSessions()
+    registry = RoleRegistry(FakeRedis(), sessions, check_interval=0)
+    first = registry.current()
+    assert registry.current() is first
+    assert sessions.opened == 1
+    bump_roles_version(FakeRedis())
+    second = registry.current()
+    assert second is not first and second.version == 1
+    assert sessions.opened == 2
+
+
+def test_registry_waits_for_the_check_interval():
+    sessions = CountingSessions()
+    registry = RoleRegistry(FakeRedis(), sessions, check_interval=3600)
+    registry.current()
+    bump_roles_version(FakeRedis())
+    registry.current()
+    assert sessions.opened == 1
+
+
+def test_registry_keeps_its_roles_without_redis():
+    sessions = CountingSessions()
+    registry = RoleRegistry(offline_redis(), sessions, check_interval=0)
+    roles = registry.current()
+    assert roles.id_of(RoleType.ADMIN) is not None
+    assert registry.current() is roles
+    assert sessions.opened == 1
+
+
+def test_empty_roles_table_is_loaded_again():
+    class EmptyRegistry(RoleRegistry):
+        def load(self):
+            self.loads = getattr(self, 'loads', 0) + 1
+            self._roles = Roles([])
+            self._next_check = 0
+            return self._roles
+    registry = EmptyRegistry(FakeRedis(), CountingSessions(), check_interval=3600)
+    registry.current()
+    registry.current()
+    assert registry.loads == 2
+
+
+@pytest.fixture
+def roles_queries(client):
+    # Statements of the app's engine that read the roles table
+    engine = quart_api.get_engine().sync_engine if client.name == 'asgi' else get_engine()
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        if 'roles' in statement.lower():
+            statements.append(statement)
+    event.listen(engine, 'before_cursor_execute', count)
+    yield statements
+    event.remove(engine, 'before_cursor_execute', count)
+
+
+def test_routes_do_not_query_roles(client, roles_queries):
+    teacher = client.user('teacher', 'instructor')
+    # The first request of the process may load the registry, the next ones use it
+    del roles_queries[:]
+    profile = client.get('/auth/profile', headers=teacher).json['user_profile']
+    assert client.get(f"/users/{profile['user_id']}", headers=teacher).json['user_role'] == 'instructor'
+    client.course(teacher, 'No roles join')
+    assert roles_queries == []
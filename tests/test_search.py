@@ -0,0 +1,75 @@
+import pytest
+from sqlalchemy.orm import Session as OrmSession
+
+from api.db import get_engine
+from api.models import Course
+from api.search import search_index, SEARCH_VERSION_KEY
+from tests.conftest import FakeRedis
+
+
+@pytest.fixture
+def catalog(client):
+    teacher = client.user('teacher', 'instructor')
+    client.course(teacher, 'Python basics', description="Variables and loops", modules=['Python functions'])
+    client.course(teacher, 'Cooking', description="Bread with python flour", modules=['Knives'])
+    return teacher
+
+
+def titles(client, query, **params):
+    reply = client.get('/courses/search', query_string={"q": query, **params})
+    assert reply.status_code == 200, reply.json
+    return [row['title'] for row in reply.json['results']], reply.json['next_cursor']
+
+
+def test_ranked_results_with_paging(client, catalog):
+    found, _ = titles(client, 'python')
+    # Title matches rank above description matches
+    assert set(found[:2]) == {'Python basics', 'Python functions'}
+    assert found[2] == 'Cooking'
+    first, cursor = titles(client, 'python', limit=2)
+    second, last_cursor = titles(client, 'python', limit=2, cursor=cursor)
+    assert first + second == found
+    assert last_cursor is None
+    assert titles(client, 'python loops')[0] == ['Python basics']
+    assert titles(client, 'missing')[0] == []
+
+
+@pytest.mark.parametrize('query', ['', 'x' * 201])
+def test_bad_queries(client, query):
+    assert client.get('/courses/search', query_string={"q": query}).status_code == 400
+
+
+def test_writes_of_this_process_are_found(client, catalog):
+    assert titles(client, 'sourdough')[0] == []
+    reply = client.post('/courses', json={"title": "Sourdough", "description": "Slow bread"}, headers=catalog)
+    assert titles(client, 'sourdough')[0] == ['Sourdough']
+    assert client.put(f"/courses/{reply.json['course_id']}", json={"title": "Baking"}, headers=catalog).status_code == 200
+    assert titles(client, 'sourdough')[0] == []
+    assert titles(client, 'baking')[0] == ['Baking']
+    assert search_index.stats()['rebuilds'] == 0
+
+
+def test_writes_of_other_processes_rebuild_the_index(client, catalog):
+    assert titles(client, 'pottery')[0] == []
+    teacher_id = client.get('/auth/profile', headers=catalog).json['user_profile']['user_id']
+    # Another worker: writes the database and bumps the version, this process never saw the commit
+    with get_engine().begin() as connection:
+        connection.execute(Course.__table__.insert(), {"title": "Pottery", "description": "Clay",
+                                                       "course_instructor_id": teacher_id})
+    FakeRedis().incr(SEARCH_VERSION_KEY)
+    assert titles(client, 'pottery')[0] == ['Pottery']
+    assert search_index.stats()['rebuilds'] == 1
+    # A local commit after the other process's one is not applied on top of an index that missed it
+    client.post('/courses', json={"title": "Glazing", "description": "Clay"}, headers=catalog)
+    assert set(titles(client, 'clay')[0]) == {'Pottery', 'Glazing'}
+
+
+def test_only_the_app_sessions_update_the_index(client, catalog):
+    titles(client, 'python')
+    teacher_id = client.get('/auth/profile', headers=catalog).json['user_profile']['user_id']
+    version = int(FakeRedis().get(SEARCH_VERSION_KEY) or 0)
+    # A plain session (a script, another tool) does not go through the app's listeners
+    with OrmSession(get_engine()) as session:
+        session.add(Course(title="Outside", description="Not the app", course_instructor_id=teacher_id))
+        session.commit()
+    assert int(FakeRedis().get(SEARCH_VERSION_KEY) or 0) == version
@@ -0,0 +1,74 @@
+import json
+import os
+import subprocess
+import sys
+
+import fakeredis
+import pytest
+
+from api import api as flask_api
+from api import asgi as quart_api
+from tests.conftest import ROOT, TEST_DIR, offline_redis
+
+LAZY_SCRIPT = """
+import json
+import api.api
+from api import db
+app = api.api.create_app({"TESTING": True})
+other = api.api.create_app({"JWT_ACCESS_TOKEN_EXPIRES": False})
+print(json.dumps({"engine": db._engine is not None, "testing": app.config["TESTING"],
+                  "separate": app is not other and other.config.get("TESTING") is False}))
+"""
+
+
+def test_import_and_create_app_connect_to_nothing():
+    # A database that can't be opened and no Redis: importing the app and building it must still work
+    database = os.path.join(TEST_DIR, 'missing-folder', 'never.db')
+    env = {**os.environ, "SQLALCHEMY_DATABASE_URI": 'sqlite:///' + database}
+    process = subprocess.run([sys.executable, '-c', LAZY_SCRIPT], cwd=ROOT, env=env, capture_output=True, text=True, timeout=120)
+    assert process.returncode == 0, process.stderr
+    assert json.loads(process.stdout.strip().splitlines()[-1]) == {"engine": False, "testing": True, "separate": True}
+    assert not os.path.exists(database)
+
+
+def test_health(client):
+    reply = client.get('/health')
+    assert reply.status_code == 200
+    assert reply.json == {"status": "ok"}
+
+
+@pytest.fixture
+def warm_up(client, monkeypatch):
+    # Records what the first /ready starts instead of starting the background threads of the test process
+    module = {'flask': flask_api, 'asgi': quart_api}[client.name]
+    started = []
+    for target, name in ((module.revocation_filter, 'start'), (module.replica_pool, 'start'), (module.progress_flusher, 'start')):
+        monkeypatch.setattr(target, name, lambda target=target: started.append(type(target).__name__))
+    monkeypatch.setattr(module, 'warm_up_hashing', lambda: started.append('hashing'))
+    module.warmed.clear()
+    yield module, started
+    module.warmed.clear()
+
+
+def test_ready_warms_once(client, warm_up):
+    module, started = warm_up
+    reply = client.get('/ready')
+    assert reply.status_code == 200, reply.json
+    assert reply.json['status'] == 'ready'
+    assert reply.json['checks'] == {"database": "ok", "redis": "ok"}
+    assert reply.json['warmed'] is True
+    assert 'hashing' in started and 'RevocationFilter' in started
+    count = len(started)
+    reply = client.get('/ready')
+    assert reply.json['warmed'] is False
+    assert len(started) == count
+
+
+def test_not_ready_without_redis(client, warm_up, monkeypatch):
+    module, started = warm_up
+    monkeypatch.setattr(module, 'redis_client', offline_redis(fakeredis.FakeAsyncRedis if client.name == 'asgi' else fakeredis.FakeStrictRedis))
+    reply = client.get('/ready')
+    assert reply.status_code == 503
+    assert reply.json['checks']['redis'].startswith('error')
+    assert started == []
+    assert not module.warmed.is_set()
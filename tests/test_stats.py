@@ -0,0 +1,75 @@
+import pytest
+
+from api.db import Session, get_engine
+from api.models import CourseStats, Enroll
+from api.stats import reconcile_course_stats, course_stats
+
+
+@pytest.fixture
+def course(client):
+    teacher = client.user('teacher', 'instructor')
+    course_id, module_ids = client.course(teacher, 'Counted', modules=['One', 'Two'])
+    return teacher, course_id, module_ids
+
+
+def stats(client, headers, course_id):
+    reply = client.get(f'/courses/{course_id}/stats', headers=headers)
+    assert reply.status_code == 200, reply.json
+    return reply.json
+
+
+def profile_id(client, headers):
+    return client.get('/auth/profile', headers=headers).json['user_profile']['user_id']
+
+
+def test_counters_follow_the_writes(client, course):
+    teacher, course_id, module_ids = course
+    assert stats(client, teacher, course_id)['enrollments'] == 0
+    students = [client.user(f'student-{number}') for number in range(3)]
+    for headers in students[:2]:
+        assert client.post(f'/courses/{course_id}/enroll', headers=headers).status_code == 201
+    # Bulk enroll is a Core insert, counted by the route
+    assert client.post(f'/courses/{course_id}/enroll/bulk', headers=teacher,
+                       json={"user_ids": [profile_id(client, students[2])]}).status_code == 200
+    client.post(f'/courses/{course_id}/modules', headers=teacher, json={"title": "Three", "content": "x"})
+    assert client.delete(f'/courses/{course_id}/modules/{module_ids[0]}', headers=teacher).status_code == 200
+    counters = stats(client, teacher, course_id)
+    assert (counters['enrollments'], counters['modules'], counters['recent_enrollments']) == (3, 2, 3)
+    assert counters['updated_at'] is not None
+
+    # Deleting a student removes their enrollments and the counters follow
+    student_id = profile_id(client, students[0])
+    assert client.delete(f'/users/{student_id}', headers=students[0]).status_code == 200
+    assert stats(client, teacher, course_id)['enrollments'] == 2
+
+
+def test_stats_access(client, course):
+    teacher, course_id, _ = course
+    assert client.get(f'/courses/{course_id}/stats', headers=client.user('student')).status_code == 403
+    assert client.get(f'/courses/{course_id}/stats', headers=client.user('other', 'instructor')).status_code == 403
+    assert client.get('/courses/999999/stats', headers=teacher).status_code == 404
+
+
+def test_reconcile_fixes_drift(client, course):
+    teacher, course_id, _ = course
+    student_id = profile_id(client, client.user('student'))
+    # Written without the ORM, the counters don't see it
+    with get_engine().begin() as connection:
+        connection.execute(Enroll.__table__.insert(), {"course_id": course_id, "user_id": student_id})
+    assert stats(client, teacher, course_id)['enrollments'] == 0
+    fixed = reconcile_course_stats(Session)
+    assert fixed['courses'] == 1 and fixed['days'] == 1
+    counters = stats(client, teacher, course_id)
+    assert (counters['enrollments'], counters['recent_enrollments']) == (1, 1)
+    # Nothing drifted any more
+    assert reconcile_course_stats(Session) == {"courses": 0, "days": 0, "removed": 0}
+
+
+def test_courses_without_a_counter_row_are_counted(client, course):
+    teacher, course_id, _ = course
+    assert client.post(f'/courses/{course_id}/enroll', headers=client.user('student')).status_code == 201
+    with get_engine().begin() as connection:
+        connection.execute(CourseStats.__table__.delete())
+    with Session() as session:
+        counters = course_stats(session, course_id)
+    assert (counters['enrollments'], counters['modules'], counters['recent_enrollments'], counters['updated_at']) == (1, 2, 1, None)
@@ -0,0 +1,110 @@
+import time
+from datetime import timedelta
+
+import fakeredis
+import pytest
+
+from api.revocation import RevocationFilter, REVOKED_JTIS_KEY
+from api.token_registry import TokenRegistry, migrate_legacy_tokens
+from tests.conftest import FakeRedis
+
+TOKEN_TTL = timedelta(days=60)
+
+
+@pytest.fixture
+def redis_client():
+    return fakeredis.FakeStrictRedis(decode_responses=True)
+
+
+@pytest.fixture
+def registry(redis_client):
+    revocation_filter = RevocationFilter(redis_client)
+    yield TokenRegistry(redis_client, revocation_filter, TOKEN_TTL)
+    revocation_filter.stop()
+
+
+def count_commands(redis_client, monkeypatch):
+    # Every command (or whole pipeline) sent to Redis is one round trip
+    calls = []
+    execute_command = redis_client.execute_command
+
+    def counting(*args, **kwargs):
+        calls.append(args[0])
+        return execute_command(*args, **kwargs)
+
+    monkeypatch.setattr(redis_client, 'execute_command', counting)
+    return calls
+
+
+def test_one_hash_per_user_that_expires_with_the_tokens(client):
+    client.register('student')
+    client.login('student', device='phone')
+    client.login('student', device='laptop')
+    redis_client = FakeRedis(decode_responses=True)
+    assert redis_client.keys('sessions:*') == ['sessions:student']
+    assert len(redis_client.hgetall('sessions:student')) == 2
+    assert redis_client.ttl('sessions:student') == pytest.approx(TOKEN_TTL.total_seconds(), abs=5)
+
+
+def test_login_on_the_same_device_revokes_the_old_token(client):
+    client.register('student')
+    first = client.login('student', device='phone')
+    second = client.login('student', device='phone')
+    assert client.get('/auth/profile', headers=first).status_code == 401
+    assert client.get('/auth/profile', headers=second).status_code == 200
+
+
+def test_each_device_keeps_its_own_token(client):
+    client.register('student')
+    phone = client.login('student', device='phone')
+    laptop = client.login('student', device='laptop')
+    assert client.get('/auth/profile', headers=phone).status_code == 200
+    assert client.get('/auth/profile', headers=laptop).status_code == 200
+    # Logging out on one device leaves the other one logged in
+    assert client.post('/auth/logout', headers=phone).status_code == 200
+    assert client.get('/auth/profile', headers=phone).status_code == 401
+    assert client.get('/auth/profile', headers=laptop).status_code == 200
+    assert len(FakeRedis(decode_responses=True).hgetall('sessions:student')) == 1
+
+
+def test_login_and_logout_are_one_round_trip_each(redis_client, registry, monkeypatch):
+    now = int(time.time())
+    registry.activate('student', 'phone', 'first', now + 100)  # loads the script
+    calls = count_commands(redis_client, monkeypatch)
+    registry.activate('student', 'phone', 'second', now + 200)
+    assert calls == ['EVALSHA']
+    del calls[:]
+    pipeline_calls = []
+    pipeline = redis_client.pipeline
+
+    def counting_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        pipeline_calls.append(pipe)
+        return pipe
+
+    monkeypatch.setattr(redis_client, 'pipeline', counting_pipeline)
+    registry.deactivate('student', 'phone', 'second', now + 200)
+    assert calls == [] and len(pipeline_calls) == 1
+    assert redis_client.hgetall('sessions:student') == {}
+    assert redis_client.zscore(REVOKED_JTIS_KEY, 'second') == now + 200
+
+
+def test_legacy_keys_are_migrated(redis_client, registry):
+    # Keys of the layout before the registry: a logged out token and the active tokens of two devices, the laptop
+    # logged in again since the deploy
+    redis_client.sadd('revoked_tokens:student', 'logged-out')
+    redis_client.set('active_token:student:phone', 'old-phone')
+    redis_client.set('active_token:student:laptop', 'old-laptop')
+    now = int(time.time())
+    registry.activate('student', 'laptop', 'new-laptop', now + 100)
+    assert migrate_legacy_tokens(redis_client, TOKEN_TTL) == (1, 2)
+    assert redis_client.keys('revoked_tokens:*') == [] and redis_client.keys('active_token:*') == []
+    assert redis_client.zscore(REVOKED_JTIS_KEY, 'logged-out') == pytest.approx(now + TOKEN_TTL.total_seconds(), abs=5)
+    assert registry.revocation_filter.is_revoked('logged-out')
+    sessions = redis_client.hgetall('sessions:student')
+    assert sessions == {'phone': 'old-phone', 'laptop': f'new-laptop:{now + 100}'}
+    # A new login on the phone revokes the token it had before the upgrade
+    assert registry.activate('student', 'phone', 'new-phone', now + 100) == 'old-phone'
+    assert registry.revocation_filter.is_revoked('old-phone')
+    # Nothing left to move the second time
+    assert migrate_legacy_tokens(redis_client, TOKEN_TTL) == (0, 0)